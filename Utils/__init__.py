@@ -2,6 +2,6 @@
 This package provides utilities for the Sports Equipment System.
 """
 
-from Utils.clearance_integration import get_clearance_status
+from Utils.clearance_integration import get_clearance_status, get_clearance_statuses
 
-__all__ = ['get_clearance_status']
\ No newline at end of file
+__all__ = ['get_clearance_status', 'get_clearance_statuses']
\ No newline at end of file
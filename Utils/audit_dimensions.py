@@ -0,0 +1,209 @@
+"""
+Compact access log storage: intern repeated strings into access_log_dimensions.
+
+User agents, endpoints, module names, host names, the app name and protocol
+take a handful of distinct values but were stored in full on every row.
+With ``AUDIT_COMPACT_STORAGE`` enabled the audit sink stores each of them as
+an integer id into ``access_log_dimensions`` and leaves the text column NULL.
+``AccessLog`` resolves the ids transparently (see ``_interned`` in models.py),
+so ``to_dict()``, templates and queries on e.g. ``AccessLog.endpoint`` see the
+same values in both modes, and keep working if the setting is turned off
+after rows were compacted. Comparing such an attribute with literal values
+looks their ids up here (``dimension_ids()``) and filters on the text column
+or the id column, without a subquery per row.
+
+Both directions go through in-process LRU caches, so after warm-up neither
+writing nor reading a log costs an extra round trip.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import bindparam, or_, tuple_
+
+from extensions import db
+from models import AccessLog, AccessLogDimension
+
+DIMENSION_FIELDS = ('user_agent', 'endpoint', 'module', 'server_hostname', 'app_name', 'protocol')
+
+
+class LRUCache:
+    """Small thread-safe least-recently-used mapping."""
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+                return self._data[key]
+            except KeyError:
+                return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def _caches():
+    # One pair per app (and so per database): (kind, value) -> id and id -> value
+    caches = current_app.extensions.get('audit_dimension_cache')
+    if caches is None:
+        caches = current_app.extensions['audit_dimension_cache'] = (LRUCache(), LRUCache())
+    return caches
+
+
+def _value_hash(value):
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+
+def dimension_value(dimension_id):
+    """Return the string an interned id stands for."""
+    values = _caches()[1]
+    value = values.get(dimension_id)
+    if value is None:
+        dimension = db.session.get(AccessLogDimension, dimension_id)
+        if dimension is None:
+            return None
+        value = dimension.value
+        values.put(dimension_id, value)
+    return value
+
+
+def dimension_ids(kind, values):
+    """Return ``{value: id}`` for the ``values`` of ``kind`` that are interned; nothing is inserted."""
+    ids = _caches()[0]
+    found = {}
+    missing = set()
+    for value in values:
+        dimension_id = ids.get((kind, value))
+        if dimension_id is None:
+            missing.add((kind, value))
+        else:
+            found[value] = dimension_id
+    if missing:
+        interned = _lookup(missing)
+        remember(interned)
+        found.update({value: dimension_id for (_, value), dimension_id in interned.items()})
+    return found
+
+
+def _lookup(keys):
+    hashed = {(kind, _value_hash(value)): (kind, value) for kind, value in keys}
+    rows = db.session.query(AccessLogDimension.id, AccessLogDimension.kind, AccessLogDimension.value_hash).filter(
+        tuple_(AccessLogDimension.kind, AccessLogDimension.value_hash).in_(list(hashed))
+    )
+    return {hashed[(kind, value_hash)]: dimension_id for dimension_id, kind, value_hash in rows}
+
+
+def intern_values(keys):
+    """Return ``{(kind, value): id}`` for ``keys``, inserting the values not interned yet.
+
+    Runs in the caller's transaction. Newly created ids are not cached here:
+    pass the result to ``remember()`` once the transaction has committed.
+    """
+    ids = _caches()[0]
+    found = {}
+    missing = set()
+    for key in keys:
+        dimension_id = ids.get(key)
+        if dimension_id is None:
+            missing.add(key)
+        else:
+            found[key] = dimension_id
+    if not missing:
+        return found
+
+    found.update(_lookup(missing))
+    new = [key for key in missing if key not in found]
+    if new:
+        rows = [{'kind': kind, 'value': value, 'value_hash': _value_hash(value)} for kind, value in new]
+        table = AccessLogDimension.__table__
+        dialect = db.session.get_bind().dialect.name
+        # Another process may intern the same value concurrently: ignore the duplicate and re-read
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+            stmt = insert(table).on_conflict_do_nothing(index_elements=['kind', 'value_hash'])
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+            stmt = insert(table).on_conflict_do_nothing(index_elements=['kind', 'value_hash'])
+        elif dialect == 'mysql':
+            stmt = table.insert().prefix_with('IGNORE')
+        else:
+            stmt = table.insert()
+        db.session.execute(stmt, rows)
+        found.update(_lookup(new))
+    return found
+
+
+def remember(interned):
+    """Cache ``{(kind, value): id}`` pairs from ``intern_values`` after their transaction committed."""
+    ids, values = _caches()
+    for (kind, value), dimension_id in interned.items():
+        ids.put((kind, value), dimension_id)
+        values.put(dimension_id, value)
+
+
+def compact_records(records):
+    """Replace the dimension strings in ``records`` with interned ids, in place.
+
+    Returns the ``{(kind, value): id}`` mapping to ``remember()`` after commit.
+    """
+    defaults = {}
+    for field in DIMENSION_FIELDS:
+        default = AccessLog.__table__.c[field].default
+        if default is not None and default.is_scalar:
+            defaults[field] = default.arg
+
+    keys = set()
+    for record in records:
+        for field in DIMENSION_FIELDS:
+            value = record.get(field, defaults.get(field))
+            if value is not None:
+                keys.add((field, value))
+    interned = intern_values(keys)
+
+    for record in records:
+        for field in DIMENSION_FIELDS:
+            value = record.get(field, defaults.get(field))
+            record[field + '_id'] = interned[(field, value)] if value is not None else None
+            record[field] = None
+    return interned
+
+
+def compact_existing(chunk_size=1000):
+    """Convert logs written in full into compact form, committing per chunk. Returns rows converted."""
+    inline = [AccessLog.__table__.c[field] for field in DIMENSION_FIELDS]
+    converted = 0
+    while True:
+        rows = (db.session.query(AccessLog.__table__.c.id, *inline)
+                .filter(or_(*[column.isnot(None) for column in inline]))
+                .order_by(AccessLog.__table__.c.id)
+                .limit(chunk_size).all())
+        if not rows:
+            return converted
+        records = [dict(zip(DIMENSION_FIELDS, row[1:])) for row in rows]
+        interned = compact_records(records)
+        table = AccessLog.__table__
+        columns = list(DIMENSION_FIELDS) + [field + '_id' for field in DIMENSION_FIELDS]
+        stmt = table.update().where(table.c.id == bindparam('row_id')).values(
+            {column: bindparam('new_' + column) for column in columns}
+        )
+        db.session.execute(stmt, [
+            dict({'new_' + column: record[column] for column in columns}, row_id=row[0])
+            for row, record in zip(rows, records)
+        ])
+        db.session.commit()
+        remember(interned)
+        converted += len(records)
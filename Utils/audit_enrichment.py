@@ -0,0 +1,154 @@
+"""
+Enrichment of access log records: GeoIP location and parsed user agent.
+
+``enrich_records()`` runs inside ``write_access_logs``, i.e. on the buffered
+audit sink's background thread, once per batch, so requests never wait for
+it. It fills:
+
+- ``geolocation`` ("City, Country") from a local MaxMind-format database
+  (``GEOIP_DATABASE``, e.g. GeoLite2-City.mmdb) read with the optional
+  ``maxminddb`` package; private/loopback addresses are labelled as such;
+- ``browser``, ``os_name`` and ``device_type`` parsed from the user agent.
+
+Both lookups sit behind LRU caches, so repeated IPs and user agents (the
+common case) cost a dictionary hit.
+"""
+import ipaddress
+import re
+import threading
+from functools import lru_cache
+
+from flask import current_app
+
+# Optional MaxMind database reader
+try:
+    import maxminddb
+    MAXMIND_AVAILABLE = True
+except Exception:
+    maxminddb = None
+    MAXMIND_AVAILABLE = False
+
+CACHE_SIZE = 4096
+
+# (pattern, name) in priority order: several browsers also claim to be Chrome/Safari
+_BROWSERS = (
+    (re.compile(r'Edg(?:e|A|iOS)?/(\d+)'), 'Edge'),
+    (re.compile(r'OPR/(\d+)'), 'Opera'),
+    (re.compile(r'SamsungBrowser/(\d+)'), 'Samsung Internet'),
+    (re.compile(r'Firefox/(\d+)'), 'Firefox'),
+    (re.compile(r'FxiOS/(\d+)'), 'Firefox'),
+    (re.compile(r'CriOS/(\d+)'), 'Chrome'),
+    (re.compile(r'Chrome/(\d+)'), 'Chrome'),
+    (re.compile(r'Version/(\d+)[\d.]* .*Safari/'), 'Safari'),
+    (re.compile(r'(?:MSIE |Trident/.*rv:)(\d+)'), 'Internet Explorer'),
+    (re.compile(r'curl/(\d+)'), 'curl'),
+    (re.compile(r'python-requests/(\d+)'), 'python-requests'),
+)
+_WINDOWS_VERSIONS = {'10.0': '10/11', '6.3': '8.1', '6.2': '8', '6.1': '7'}
+_BOT = re.compile(r'bot|crawl|spider|slurp|monitor', re.IGNORECASE)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_user_agent(user_agent):
+    """Return ``{'browser', 'os_name', 'device_type'}`` for a User-Agent header."""
+    if not user_agent:
+        return {'browser': None, 'os_name': None, 'device_type': None}
+
+    browser = None
+    for pattern, name in _BROWSERS:
+        match = pattern.search(user_agent)
+        if match:
+            browser = f'{name} {match.group(1)}'
+            break
+
+    os_name = None
+    windows = re.search(r'Windows NT ([\d.]+)', user_agent)
+    android = re.search(r'Android ([\d]+)', user_agent)
+    ios = re.search(r'(?:iPhone|CPU) OS (\d+)', user_agent)
+    if windows:
+        os_name = f"Windows {_WINDOWS_VERSIONS.get(windows.group(1), windows.group(1))}"
+    elif android:
+        os_name = f'Android {android.group(1)}'
+    elif ios or 'iPad' in user_agent or 'iPhone' in user_agent:
+        os_name = f'iOS {ios.group(1)}' if ios else 'iOS'
+    elif 'Mac OS X' in user_agent:
+        os_name = 'macOS'
+    elif 'CrOS' in user_agent:
+        os_name = 'ChromeOS'
+    elif 'Linux' in user_agent:
+        os_name = 'Linux'
+
+    if _BOT.search(user_agent):
+        device_type = 'bot'
+    elif 'iPad' in user_agent or (android and 'Mobile' not in user_agent):
+        device_type = 'tablet'
+    elif 'Mobile' in user_agent or 'iPhone' in user_agent:
+        device_type = 'mobile'
+    elif browser and browser.split(' ')[0] in ('curl', 'python-requests'):
+        device_type = 'script'
+    else:
+        device_type = 'desktop'
+    return {'browser': browser, 'os_name': os_name, 'device_type': device_type}
+
+
+class GeoIPResolver:
+    """Resolve IP addresses to "City, Country" using a MaxMind-format reader."""
+
+    def __init__(self, reader, cache_size=CACHE_SIZE):
+        self.reader = reader
+        self._lock = threading.Lock()
+        self.lookup = lru_cache(maxsize=cache_size)(self._resolve)
+
+    @classmethod
+    def open(cls, path, cache_size=CACHE_SIZE):
+        return cls(maxminddb.open_database(path), cache_size=cache_size)
+
+    def _resolve(self, ip):
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        if address.is_loopback:
+            return 'Localhost'
+        if address.is_private or address.is_link_local:
+            return 'Private network'
+        with self._lock:
+            try:
+                data = self.reader.get(ip)
+            except Exception:
+                return None
+        if not data:
+            return None
+        city = (data.get('city') or {}).get('names', {}).get('en')
+        country = (data.get('country') or {}).get('names', {}).get('en')
+        return ', '.join(part for part in (city, country) if part) or None
+
+
+def get_geoip_resolver():
+    """Return the app's GeoIP resolver, or None when no database is configured or readable."""
+    extensions = current_app.extensions
+    if 'geoip_resolver' not in extensions:
+        resolver = None
+        path = current_app.config.get('GEOIP_DATABASE')
+        if path:
+            if not MAXMIND_AVAILABLE:
+                current_app.logger.warning('GEOIP_DATABASE is set but the maxminddb package is not installed')
+            else:
+                try:
+                    resolver = GeoIPResolver.open(path, cache_size=current_app.config.get('AUDIT_ENRICHMENT_CACHE_SIZE', CACHE_SIZE))
+                except Exception as e:
+                    current_app.logger.warning('Could not open GeoIP database %s: %s', path, e)
+        extensions['geoip_resolver'] = resolver
+    return extensions['geoip_resolver']
+
+
+def enrich_records(records):
+    """Fill geolocation and user agent details on a batch of access log records, in place."""
+    if not current_app.config.get('AUDIT_ENRICHMENT', True):
+        return
+    resolver = get_geoip_resolver()
+    for record in records:
+        if record.get('user_agent') and 'device_type' not in record:
+            record.update(parse_user_agent(record['user_agent']))
+        if resolver is not None and record.get('ip_address') and not record.get('geolocation'):
+            record['geolocation'] = resolver.lookup(record['ip_address'])
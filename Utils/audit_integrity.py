@@ -0,0 +1,279 @@
+"""
+Tamper evidence for access logs: Merkle-sealed batches in a hash chain.
+
+Every batch the audit sink writes is sealed in the same transaction:
+
+- each row gets ``log_hash`` (``AccessLog.compute_log_hash``), its
+  ``batch_id`` and its leaf position ``batch_seq``;
+- an ``AccessLogBatch`` stores the Merkle root of the batch's log hashes and
+  ``batch_hash = sha256(prev_hash | merkle_root | log_count)``, chaining it
+  to the batch written before it.
+
+Editing a row changes its log hash and its batch root, deleting or adding a
+row changes the batch's count and root, and removing or rewriting a whole
+batch breaks the chain. ``verify_chain()`` checks all of that in one
+streaming pass holding only O(log batch size) hashes, and
+``prove_entry()`` returns an O(log n) Merkle inclusion proof for one log.
+
+Retention pruning drops whole months, so ``seal_batches()`` never lets a
+batch span two months (or two retention periods): a batch is always pruned
+whole. Dropping a month seals a prune record into the chain in the same
+transaction (``seal_prune()``): a batch with no logs whose root commits to
+the ids of the batches that drop emptied. The verifier accepts an empty
+batch only when a prune record later in the chain lists it, so deleting a
+batch's logs by hand is still reported, and so is editing a prune record.
+"""
+import hashlib
+import json
+from datetime import datetime
+
+from sqlalchemy import text
+
+from extensions import db
+from models import AccessLog, AccessLogBatch
+
+# Arbitrary key for pg_advisory_xact_lock: serialises sealing across processes
+_CHAIN_LOCK_KEY = 0x41554454
+
+
+def _leaf(log_hash):
+    return hashlib.sha256(b'\x00' + bytes.fromhex(log_hash)).digest()
+
+
+def _node(left, right):
+    return hashlib.sha256(b'\x01' + left + right).digest()
+
+
+class MerkleAccumulator:
+    """Streaming Merkle root: feed leaves in order, keep at most one subtree hash per level.
+
+    An odd node at the end of a level is promoted unchanged, which gives the
+    same root as ``merkle_levels`` builds level by level.
+    """
+
+    def __init__(self):
+        self._stack = []  # (height, digest)
+        self.count = 0
+
+    def add(self, log_hash):
+        height, digest = 0, _leaf(log_hash)
+        while self._stack and self._stack[-1][0] == height:
+            _, left = self._stack.pop()
+            digest = _node(left, digest)
+            height += 1
+        self._stack.append((height, digest))
+        self.count += 1
+
+    def root(self):
+        if not self._stack:
+            return None
+        digest = self._stack[-1][1]
+        for _, left in reversed(self._stack[:-1]):
+            digest = _node(left, digest)
+        return digest.hex()
+
+
+def merkle_root(log_hashes):
+    accumulator = MerkleAccumulator()
+    for log_hash in log_hashes:
+        accumulator.add(log_hash)
+    return accumulator.root()
+
+
+def merkle_levels(log_hashes):
+    """Every level of the tree, leaves first."""
+    level = [_leaf(h) for h in log_hashes]
+    levels = [level]
+    while len(level) > 1:
+        level = [_node(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+                 for i in range(0, len(level), 2)]
+        levels.append(level)
+    return levels
+
+
+def chain_hash(prev_hash, root, count):
+    return hashlib.sha256(f"{prev_hash or ''}|{root}|{count}".encode()).hexdigest()
+
+
+def prune_root(batch_ids):
+    """The root a prune record seals: it commits to the ids of the batches the prune emptied."""
+    return hashlib.sha256(('prune|' + ','.join(str(i) for i in sorted(batch_ids))).encode()).hexdigest()
+
+
+def _pruned_ids(batch):
+    try:
+        return [int(i) for i in json.loads(batch.pruned_batch_ids)]
+    except (TypeError, ValueError):
+        return []
+
+
+def _append_batch(log_count, root, **fields):
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': _CHAIN_LOCK_KEY})
+    previous = db.session.query(AccessLogBatch.batch_hash).order_by(AccessLogBatch.id.desc()).limit(1).scalar()
+    batch = AccessLogBatch(
+        log_count=log_count,
+        merkle_root=root,
+        prev_hash=previous,
+        batch_hash=chain_hash(previous, root, log_count),
+        **fields,
+    )
+    db.session.add(batch)
+    db.session.flush()
+    return batch
+
+
+def seal_batch(records):
+    """Hash ``records``, create their ``AccessLogBatch`` and link it to the chain.
+
+    Must run inside the transaction that inserts the records (the audit
+    sink's ``write_access_logs`` does this), in the order they are inserted.
+    """
+    # Hash what will be stored: fill in the column defaults the INSERT would apply
+    defaults = {}
+    for field in AccessLog.HASHED_FIELDS:
+        default = AccessLog.__table__.c[field].default
+        if default is not None and default.is_scalar:
+            defaults[field] = default.arg
+
+    accumulator = MerkleAccumulator()
+    for seq, record in enumerate(records):
+        for field, value in defaults.items():
+            record.setdefault(field, value)
+        record['log_hash'] = AccessLog.compute_log_hash(record)
+        record['batch_seq'] = seq
+        accumulator.add(record['log_hash'])
+
+    batch = _append_batch(len(records), accumulator.root())
+    for record in records:
+        record['batch_id'] = batch.id
+    return batch
+
+
+def seal_prune(batch_ids):
+    """Seal a prune record for the batches whose logs retention pruning just deleted; returns it.
+
+    Must run inside the transaction that deletes the logs. Returns None when
+    no batch was emptied.
+    """
+    batch_ids = sorted(set(batch_ids))
+    if not batch_ids:
+        return None
+    return _append_batch(0, prune_root(batch_ids), pruned_batch_ids=json.dumps(batch_ids))
+
+
+def seal_batches(records):
+    """Seal ``records`` as one batch per (month, retention_days) they fall in; returns the batches.
+
+    Records keep their relative order inside each batch.
+    """
+    groups = {}
+    for record in records:
+        timestamp = record.get('timestamp') or datetime.utcnow()
+        key = (timestamp.year, timestamp.month, record.get('retention_days'))
+        groups.setdefault(key, []).append(record)
+    return [seal_batch(group) for group in groups.values()]
+
+
+def verify_chain(chunk_size=1000):
+    """Check every sealed batch and yield a problem description for each failure.
+
+    Streams the logs in (batch_id, batch_seq) order, so memory stays
+    constant whatever the size of the audit trail.
+    """
+    # Batches emptied by retention pruning, from the prune records that match their own root
+    pruned = set()
+    for record in db.session.query(AccessLogBatch).filter(AccessLogBatch.pruned_batch_ids.isnot(None)):
+        batch_ids = _pruned_ids(record)
+        if prune_root(batch_ids) == record.merkle_root:
+            pruned.update(batch_id for batch_id in batch_ids if batch_id < record.id)
+
+    batches = db.session.query(AccessLogBatch).order_by(AccessLogBatch.id).yield_per(chunk_size)
+    rows = (db.session.query(AccessLog)
+            .filter(AccessLog.batch_id.isnot(None))
+            .order_by(AccessLog.batch_id, AccessLog.batch_seq)
+            .yield_per(chunk_size))
+    rows = iter(rows)
+    pending = next(rows, None)
+
+    previous = None
+    first = True
+    for batch in batches:
+        if not first and batch.prev_hash != previous:
+            yield f'batch {batch.id}: chain broken (prev_hash does not match batch before it)'
+        first = False
+        if chain_hash(batch.prev_hash, batch.merkle_root, batch.log_count) != batch.batch_hash:
+            yield f'batch {batch.id}: batch_hash does not match its contents'
+        previous = batch.batch_hash
+
+        while pending is not None and pending.batch_id < batch.id:
+            yield f'log {pending.id}: refers to missing batch {pending.batch_id}'
+            pending = next(rows, None)
+
+        accumulator = MerkleAccumulator()
+        while pending is not None and pending.batch_id == batch.id:
+            if pending.batch_seq != accumulator.count:
+                yield f'batch {batch.id}: expected leaf {accumulator.count}, found {pending.batch_seq} (log {pending.id})'
+            if pending.generate_log_hash() != pending.log_hash:
+                yield f'log {pending.id}: contents do not match log_hash'
+            accumulator.add(pending.log_hash)
+            pending = next(rows, None)
+
+        if batch.pruned_batch_ids is not None:
+            if accumulator.count:
+                yield f'batch {batch.id}: prune record has {accumulator.count} logs'
+            elif prune_root(_pruned_ids(batch)) != batch.merkle_root:
+                yield f'batch {batch.id}: prune record does not match the batches it lists'
+        elif batch.id in pruned and not accumulator.count:
+            continue
+        elif accumulator.count != batch.log_count:
+            yield f'batch {batch.id}: {accumulator.count} of {batch.log_count} logs present'
+        elif accumulator.root() != batch.merkle_root:
+            yield f'batch {batch.id}: Merkle root mismatch'
+
+    while pending is not None:
+        yield f'log {pending.id}: refers to missing batch {pending.batch_id}'
+        pending = next(rows, None)
+
+
+def prove_entry(log_id):
+    """Return an inclusion proof for one log entry, or None if it isn't sealed.
+
+    The proof holds the log hash, the sibling hashes on the path to the
+    batch root (``['L'|'R', hex]`` pairs) and the batch's chain fields.
+    """
+    log = db.session.get(AccessLog, log_id)
+    if log is None or log.batch_id is None:
+        return None
+    batch = db.session.get(AccessLogBatch, log.batch_id)
+    hashes = [h for (h,) in db.session.query(AccessLog.log_hash)
+              .filter(AccessLog.batch_id == log.batch_id)
+              .order_by(AccessLog.batch_seq)]
+
+    path = []
+    index = log.batch_seq
+    for level in merkle_levels(hashes)[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            path.append(['L' if sibling < index else 'R', level[sibling].hex()])
+        index //= 2
+    return {
+        'log_id': log.id,
+        'log_hash': log.log_hash,
+        'batch_id': batch.id,
+        'path': path,
+        'merkle_root': batch.merkle_root,
+        'prev_hash': batch.prev_hash,
+        'log_count': batch.log_count,
+        'batch_hash': batch.batch_hash,
+    }
+
+
+def verify_proof(proof, log_hash=None):
+    """Check a proof from ``prove_entry``; pass ``log_hash`` to check it against a recomputed hash."""
+    digest = _leaf(log_hash or proof['log_hash'])
+    for side, sibling in proof['path']:
+        sibling = bytes.fromhex(sibling)
+        digest = _node(sibling, digest) if side == 'L' else _node(digest, sibling)
+    return (digest.hex() == proof['merkle_root']
+            and chain_hash(proof['prev_hash'], proof['merkle_root'], proof['log_count']) == proof['batch_hash'])
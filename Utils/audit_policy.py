@@ -0,0 +1,115 @@
+"""
+Tiered audit policy: decide how much of each request ends up in access_logs.
+
+Every endpoint (or whole blueprint) is assigned one of three modes:
+
+- ``full``: one AccessLog row per request (the default).
+- ``sample``: only a random ``AUDIT_SAMPLE_RATE`` fraction of requests is
+  logged; kept rows are marked ``audit_mode='sampled'``.
+- ``coalesce``: requests by the same user to the same endpoint within
+  ``AUDIT_COALESCE_WINDOW`` seconds collapse into one row (the first
+  request's details) whose ``hit_count`` says how many requests it covers.
+
+Mutating requests (POST/PUT/PATCH/DELETE) and failed requests are always
+logged in full, whatever the endpoint's mode. Rules are looked up by exact
+endpoint name first, then by blueprint name, e.g.::
+
+    AUDIT_POLICIES = {'admin.api_issues_timeseries': 'coalesce', 'reports': 'sample'}
+"""
+import random
+import threading
+import time
+
+AUDIT_MODES = ('full', 'sample', 'coalesce')
+MUTATING_METHODS = frozenset({'POST', 'PUT', 'PATCH', 'DELETE'})
+
+
+class Coalescer:
+    """Fold repeated hits into one pending record per (user, endpoint, method) window."""
+
+    def __init__(self, window):
+        self.window = window
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def add(self, record, now=None):
+        """Count ``record`` into its window; return records of windows it closed."""
+        now = time.monotonic() if now is None else now
+        key = (record.get('user_type'), record.get('user_id'), record.get('endpoint'), record.get('method'))
+        closed = []
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is not None and entry[0] <= now:
+                closed.append(self._pending.pop(key)[1])
+                entry = None
+            if entry is None:
+                record = dict(record, hit_count=1, audit_mode='coalesced')
+                self._pending[key] = (now + self.window, record)
+            else:
+                entry[1]['hit_count'] += 1
+        return closed
+
+    def drain(self, now=None, force=False):
+        """Return (and forget) the records of windows that have ended, or of all windows with ``force``."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            keys = [key for key, (ends, _) in self._pending.items() if force or ends <= now]
+            return [self._pending.pop(key)[1] for key in keys]
+
+    def __len__(self):
+        return len(self._pending)
+
+
+class AuditPolicy:
+    """Route access log records according to the configured per-endpoint modes."""
+
+    def __init__(self, default='full', rules=None, sample_rate=0.1, coalesce_window=60.0):
+        for mode in [default, *(rules or {}).values()]:
+            if mode not in AUDIT_MODES:
+                raise ValueError(f'Unknown audit mode: {mode}')
+        self.default = default
+        self.rules = dict(rules or {})
+        self.sample_rate = float(sample_rate)
+        self.coalescer = Coalescer(float(coalesce_window))
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            default=config.get('AUDIT_DEFAULT_POLICY', 'full'),
+            rules=config.get('AUDIT_POLICIES'),
+            sample_rate=config.get('AUDIT_SAMPLE_RATE', 0.1),
+            coalesce_window=config.get('AUDIT_COALESCE_WINDOW', 60.0),
+        )
+
+    def mode_for(self, record):
+        """Return the audit mode that applies to ``record``."""
+        if (record.get('method') or 'GET').upper() in MUTATING_METHODS:
+            return 'full'
+        if record.get('action_status') == 'Failure':
+            return 'full'
+        endpoint = record.get('endpoint') or ''
+        if endpoint in self.rules:
+            return self.rules[endpoint]
+        return self.rules.get(endpoint.split('.', 1)[0], self.default)
+
+    def admit(self, record, now=None):
+        """Return the records that should be written now as a result of ``record``.
+
+        That is the record itself (full, or sampled and kept), nothing
+        (sampled out, or absorbed into an open coalescing window), and/or
+        the records of coalescing windows that have just closed.
+        """
+        mode = self.mode_for(record)
+        if mode == 'coalesce':
+            return self.coalescer.add(record, now=now)
+        ready = self.coalescer.drain(now=now) if len(self.coalescer) else []
+        if mode == 'sample':
+            if random.random() >= self.sample_rate:
+                return ready
+            record['audit_mode'] = 'sampled'
+        ready.append(record)
+        return ready
+
+    def drain(self, now=None, force=False):
+        """Return coalesced records whose window has ended (all of them with ``force``)."""
+        return self.coalescer.drain(now=now, force=force)
@@ -0,0 +1,226 @@
+"""
+Monthly partitions and retention enforcement for access_logs.
+
+On PostgreSQL ``access_logs`` is range-partitioned by month on ``timestamp``
+(see the ``access_log_partitions`` migration), one child table per month
+named ``access_logs_yYYYYmMM`` plus a default partition. Pruning a month
+detaches and drops its child table, which costs the same no matter how many
+rows it holds. Rows that landed in the default partition (months without a
+child table yet) are pruned by month too, with a range DELETE.
+
+Other databases have no native partitioning, so a month is emulated as the
+range ``[month start, next month start)`` of the (timestamp, id) index and
+pruning it is one range DELETE on that index.
+
+A month is expired once every row in it is past its own ``retention_days``.
+Expired months can be exported to gzipped JSONL before they are dropped. The
+per-user rollup loses the dropped logs in the same transaction
+(``remove_from_summaries()``), without a full rebuild.
+"""
+import gzip
+import json
+import os
+import re
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, text
+
+from extensions import db
+from models import AccessLog
+from Utils.audit_integrity import seal_prune
+from Utils.audit_summary import remove_from_summaries
+from Utils.clearance_integration import _CHUNK_SIZE
+
+DEFAULT_RETENTION_DAYS = 365
+PARTITION_PREFIX = 'access_logs_y'
+DEFAULT_PARTITION = 'access_logs_default'
+_PARTITION_NAME = re.compile(r'^access_logs_y(\d{4})m(\d{2})$')
+
+
+def month_start(value):
+    """Return midnight on the first day of ``value``'s month."""
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(value, months):
+    """Return the first day of the month ``months`` after ``value``'s month."""
+    index = value.year * 12 + (value.month - 1) + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(start):
+    return f'{PARTITION_PREFIX}{start.year:04d}m{start.month:02d}'
+
+
+class Partition:
+    """A month of access logs: a child table (``native``) on PostgreSQL, an index range otherwise."""
+
+    def __init__(self, start, name=None, native=False):
+        self.start = month_start(start)
+        self.end = add_months(self.start, 1)
+        self.name = name or partition_name(self.start)
+        self.native = native
+
+    def __repr__(self):
+        return f'<Partition {self.name} [{self.start:%Y-%m-%d}, {self.end:%Y-%m-%d})>'
+
+    def rows(self):
+        return AccessLog.query.filter(AccessLog.timestamp >= self.start, AccessLog.timestamp < self.end)
+
+
+def is_partitioned():
+    """True when access_logs is a natively partitioned PostgreSQL table."""
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return False
+    return bool(db.session.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = 'access_logs'"
+    )).scalar())
+
+
+def list_partitions():
+    """Return the monthly partitions holding access logs, oldest first."""
+    if is_partitioned():
+        names = db.session.execute(text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = 'access_logs'"
+        )).scalars()
+        partitions = []
+        for name in names:
+            match = _PARTITION_NAME.match(name)
+            if match:
+                partitions.append(Partition(datetime(int(match.group(1)), int(match.group(2)), 1), name=name,
+                                            native=True))
+        # Months stranded in the default partition have no table of their own: prune them as ranges
+        if db.session.execute(text(f"SELECT to_regclass('{DEFAULT_PARTITION}') IS NOT NULL")).scalar():
+            months = db.session.execute(text(
+                f"SELECT DISTINCT date_trunc('month', timestamp) FROM {DEFAULT_PARTITION}"
+            )).scalars()
+            partitions.extend(Partition(start, name=f'{DEFAULT_PARTITION}_y{start.year:04d}m{start.month:02d}')
+                              for start in months)
+        return sorted(partitions, key=lambda p: p.start)
+
+    oldest, newest = db.session.query(func.min(AccessLog.timestamp), func.max(AccessLog.timestamp)).one()
+    if oldest is None:
+        return []
+    partitions = []
+    start = month_start(oldest)
+    while start <= newest:
+        partition = Partition(start)
+        if partition.rows().limit(1).count():
+            partitions.append(partition)
+        start = partition.end
+    return partitions
+
+
+def ensure_partitions(months_ahead=3, now=None):
+    """Create the PostgreSQL partitions for the current month and ``months_ahead`` after it.
+
+    Rows outside every monthly range land in the default partition, so run
+    this (the prune script does) before the month starts. If it runs late and
+    the default partition already holds rows of a new month, those rows are
+    moved into the month's partition. Returns the names of the partitions
+    created; a no-op when access_logs isn't partitioned.
+    """
+    if not is_partitioned():
+        return []
+    existing = {p.name for p in list_partitions()}
+    has_default = db.session.execute(text(f"SELECT to_regclass('{DEFAULT_PARTITION}') IS NOT NULL")).scalar()
+    created = []
+    start = month_start(now or datetime.utcnow())
+    for _ in range(months_ahead + 1):
+        partition = Partition(start)
+        if partition.name not in existing:
+            _create_partition(partition, has_default)
+            created.append(partition.name)
+        start = partition.end
+    db.session.commit()
+    return created
+
+
+def _create_partition(partition, has_default):
+    bounds = {'start': partition.start, 'end': partition.end}
+    in_range = 'timestamp >= :start AND timestamp < :end'
+    stranded = has_default and db.session.execute(text(
+        f'SELECT 1 FROM {DEFAULT_PARTITION} WHERE {in_range} LIMIT 1'
+    ), bounds).scalar()
+    if stranded:
+        # PostgreSQL refuses a new partition whose range has rows in the default
+        # one: take the default out, create the month and move its rows over
+        db.session.execute(text(f'ALTER TABLE access_logs DETACH PARTITION {DEFAULT_PARTITION}'))
+    db.session.execute(text(
+        f'CREATE TABLE IF NOT EXISTS {partition.name} PARTITION OF access_logs '
+        f"FOR VALUES FROM ('{partition.start:%Y-%m-%d}') TO ('{partition.end:%Y-%m-%d}')"
+    ))
+    if stranded:
+        db.session.execute(text(f'INSERT INTO access_logs SELECT * FROM {DEFAULT_PARTITION} WHERE {in_range}'), bounds)
+        db.session.execute(text(f'DELETE FROM {DEFAULT_PARTITION} WHERE {in_range}'), bounds)
+        db.session.execute(text(f'ALTER TABLE access_logs ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT'))
+
+
+def expired_partitions(now=None):
+    """Return the partitions whose every row is past its retention_days."""
+    now = now or datetime.utcnow()
+    current = month_start(now)
+    expired = []
+    for partition in list_partitions():
+        if partition.start >= current:
+            break
+        longest = partition.rows().with_entities(func.max(AccessLog.retention_days)).scalar()
+        if partition.end + timedelta(days=longest or DEFAULT_RETENTION_DAYS) <= now:
+            expired.append(partition)
+    return expired
+
+
+def archive_partition(partition, archive_dir):
+    """Export a partition to ``archive_dir/<name>.jsonl.gz``, one log per line. Returns (path, rows)."""
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f'{partition.name}.jsonl.gz')
+    count = 0
+    with gzip.open(path, 'wt', encoding='utf-8') as fh:
+        for log in partition.rows().order_by(AccessLog.timestamp, AccessLog.id).yield_per(1000):
+            fh.write(json.dumps(log.to_dict(), default=str))
+            fh.write('\n')
+            count += 1
+    return path, count
+
+
+def drop_partition(partition):
+    """Remove a partition and every log in it, sealing a prune record for the batches it empties."""
+    batch_ids = [batch_id for (batch_id,) in partition.rows().with_entities(AccessLog.batch_id)
+                 .filter(AccessLog.batch_id.isnot(None)).distinct()]
+    counts = {(user_type, user_id): count for user_type, user_id, count in partition.rows().with_entities(
+        AccessLog.user_type, AccessLog.user_id, func.count(AccessLog.id)).group_by(AccessLog.user_type, AccessLog.user_id)}
+    if partition.native:
+        db.session.execute(text(f'ALTER TABLE access_logs DETACH PARTITION {partition.name}'))
+        db.session.execute(text(f'DROP TABLE {partition.name}'))
+    else:
+        partition.rows().delete(synchronize_session=False)
+    # Only batches of this partition with no logs left elsewhere count as pruned
+    live = set()
+    for start in range(0, len(batch_ids), _CHUNK_SIZE):
+        live.update(batch_id for (batch_id,) in db.session.query(AccessLog.batch_id).filter(
+            AccessLog.batch_id.in_(batch_ids[start:start + _CHUNK_SIZE])).distinct())
+    seal_prune([batch_id for batch_id in batch_ids if batch_id not in live])
+    # Dropped logs no longer count towards the per-user rollup
+    remove_from_summaries(counts, partition.end)
+    db.session.commit()
+
+
+def prune_expired(archive_dir=None, dry_run=False, now=None):
+    """Archive (optionally) and drop every expired partition.
+
+    Returns a list of ``{'partition', 'archive', 'rows'}`` dicts describing
+    what was (or, with ``dry_run``, would be) removed.
+    """
+    pruned = []
+    for partition in expired_partitions(now=now):
+        entry = {'partition': partition.name, 'archive': None, 'rows': None}
+        if not dry_run:
+            if archive_dir:
+                entry['archive'], entry['rows'] = archive_partition(partition, archive_dir)
+            drop_partition(partition)
+        pruned.append(entry)
+    return pruned
@@ -0,0 +1,150 @@
+"""
+Full-text search over access logs.
+
+Every log row carries a ``search_index`` document (action, endpoint, username,
+full name, IP address and user agent) filled when the audit sink writes it.
+Once enrichment has run the document also holds the GeoIP location. The
+document is indexed by the database:
+
+- PostgreSQL: a GIN index on ``to_tsvector('simple', search_index)``; queries
+  use ``websearch_to_tsquery`` and are ranked with ``ts_rank``.
+- SQLite: an external-content FTS5 table ``access_logs_fts`` kept in step by
+  triggers; queries use ``MATCH`` and are ranked with ``bm25``.
+- Anything else falls back to ILIKE on ``search_index`` ordered by time.
+
+Both are created with the table (``db.create_all``) and by the
+``access_log_search`` migration for existing databases.
+"""
+import re
+
+from markupsafe import Markup, escape
+from sqlalchemy import DDL, column, event, func, literal_column, table
+
+from extensions import db
+from models import AccessLog
+
+SEARCH_FIELDS = ('action', 'endpoint', 'username', 'full_name', 'ip_address', 'user_agent', 'geolocation')
+
+FTS_TABLE = 'access_logs_fts'
+TS_CONFIG = "'simple'"
+
+# SQLite FTS5 index and the triggers that keep it in step with access_logs
+SQLITE_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "search_index, content='access_logs', content_rowid='id')",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON access_logs BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, search_index) VALUES (new.id, new.search_index); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON access_logs BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_index) VALUES ('delete', old.id, old.search_index); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF search_index ON access_logs BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_index) VALUES ('delete', old.id, old.search_index); "
+    f"INSERT INTO {FTS_TABLE}(rowid, search_index) VALUES (new.id, new.search_index); END",
+)
+
+# PostgreSQL GIN index; queries must use the same expression to hit it
+POSTGRES_DDL = (
+    "CREATE INDEX IF NOT EXISTS ix_access_logs_search_tsv ON access_logs "
+    f"USING gin (to_tsvector({TS_CONFIG}, coalesce(search_index, '')))",
+)
+
+for _statement in SQLITE_DDL:
+    event.listen(AccessLog.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+for _statement in POSTGRES_DDL:
+    event.listen(AccessLog.__table__, 'after_create', DDL(_statement).execute_if(dialect='postgresql'))
+
+_fts = table(FTS_TABLE, column('rowid'))
+
+
+def build_search_document(record):
+    """Return the text indexed for an access log record dict."""
+    return ' '.join(str(record[field]) for field in SEARCH_FIELDS if record.get(field))
+
+
+def _terms(query_text):
+    return re.findall(r'\w+', query_text or '')
+
+
+def _fts5_query(query_text):
+    # Quote every whitespace-separated term so user input can't inject FTS5 syntax;
+    # the trailing * makes each term a prefix match and terms are ANDed together
+    parts = (query_text or '').split()
+    return ' '.join('"{}"*'.format(part.replace('"', '""')) for part in parts)
+
+
+def highlight(text, query_text, width=160):
+    """Return an HTML-safe snippet of ``text`` around the first matched term, with matches in <mark>."""
+    if not text:
+        return Markup('')
+    terms = _terms(query_text)
+    if not terms:
+        return escape(text[:width])
+    pattern = re.compile('|'.join(re.escape(term) for term in terms), re.IGNORECASE)
+    first = pattern.search(text)
+    start = max(0, first.start() - width // 4) if first else 0
+    excerpt = text[start:start + width]
+
+    pieces = []
+    last = 0
+    for match in pattern.finditer(excerpt):
+        pieces.append(escape(excerpt[last:match.start()]))
+        pieces.append(Markup('<mark>') + escape(match.group()) + Markup('</mark>'))
+        last = match.end()
+    pieces.append(escape(excerpt[last:]))
+    snippet = Markup('').join(pieces)
+    if start > 0:
+        snippet = Markup('&hellip;') + snippet
+    if start + width < len(text):
+        snippet = snippet + Markup('&hellip;')
+    return snippet
+
+
+def search_access_logs(query_text, user_type=None, user_id=None, date_from=None, date_to=None,
+                       page=1, per_page=25):
+    """Run a ranked full-text search over access logs.
+
+    Returns ``(results, has_next)`` where results is a list of
+    ``{'log', 'rank', 'snippet'}`` dicts, best match first.
+    """
+    if not _terms(query_text):
+        return [], False
+
+    query = AccessLog.query
+    if user_type:
+        query = query.filter(AccessLog.user_type == user_type)
+    if user_id:
+        query = query.filter(AccessLog.user_id == user_id)
+    if date_from:
+        query = query.filter(AccessLog.timestamp >= date_from)
+    if date_to:
+        query = query.filter(AccessLog.timestamp < date_to)
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        vector = func.to_tsvector(literal_column(TS_CONFIG), func.coalesce(AccessLog.search_index, ''))
+        ts_query = func.websearch_to_tsquery(literal_column(TS_CONFIG), query_text)
+        rank = func.ts_rank(vector, ts_query)
+        query = query.filter(vector.op('@@')(ts_query))
+        ordering = (rank.desc(), AccessLog.timestamp.desc())
+    elif dialect == 'sqlite':
+        fts = literal_column(FTS_TABLE)
+        # bm25() is lower-is-better; negate so higher rank means a better match
+        rank = -func.bm25(fts)
+        query = query.join(_fts, _fts.c.rowid == AccessLog.id).filter(fts.op('MATCH')(_fts5_query(query_text)))
+        ordering = (rank.desc(), AccessLog.timestamp.desc())
+    else:
+        rank = literal_column('NULL')
+        for term in _terms(query_text):
+            query = query.filter(AccessLog.search_index.ilike(f'%{term}%'))
+        ordering = (AccessLog.timestamp.desc(),)
+
+    page = max(1, page)
+    rows = (query.add_columns(rank.label('rank'))
+            .order_by(*ordering)
+            .offset((page - 1) * per_page)
+            .limit(per_page + 1)
+            .all())
+    results = [
+        {'log': log, 'rank': score, 'snippet': highlight(log.search_index, query_text)}
+        for log, score in rows[:per_page]
+    ]
+    return results, len(rows) > per_page
@@ -0,0 +1,335 @@
+"""
+Audit sinks for AccessLog records.
+
+The blueprint ``before_request`` hooks used to build an ``AccessLog`` row and
+commit it inline, so every page view paid an extra INSERT + COMMIT before the
+handler ran. Hooks now build a plain dict with ``build_access_record()`` and
+hand it to the sink configured for the app:
+
+- ``SyncAuditSink`` writes each record immediately (used under TESTING).
+- ``BufferedAuditSink`` enqueues records in a bounded in-memory queue and a
+  background thread writes them as one multi-row INSERT when either
+  ``AUDIT_BATCH_SIZE`` records are waiting or ``AUDIT_FLUSH_INTERVAL`` seconds
+  have passed. The queue is drained on shutdown.
+
+Both sinks first pass each record through the app's ``AuditPolicy``
+(Utils/audit_policy.py), which may sample it out or coalesce it with other
+hits on the same endpoint.
+"""
+import abc
+import atexit
+import os
+import queue
+import socket
+import threading
+import time
+import weakref
+from datetime import datetime
+
+from flask import current_app, request, session
+
+from extensions import db
+from models import AccessLog
+from Utils.audit_dimensions import compact_records, remember
+from Utils.audit_enrichment import enrich_records
+from Utils.audit_integrity import seal_batches
+from Utils.audit_policy import AuditPolicy
+from Utils.audit_search import build_search_document
+from Utils.audit_summary import update_access_summaries
+
+# Resolved once per process instead of on every request
+SERVER_HOSTNAME = socket.gethostname()
+
+BACKPRESSURE_POLICIES = ('block', 'drop')
+
+# Sinks still to be closed at interpreter exit, behind a single atexit handler
+_open_sinks = weakref.WeakSet()
+_atexit_registered = False
+
+
+def build_access_record(user_type, user_id, username, full_name):
+    """Build the column values for an AccessLog row describing the current request."""
+    record = {
+        # 1. USER IDENTIFICATION
+        'user_id': user_id,
+        'user_type': user_type,
+        'username': username,
+        'full_name': full_name,
+
+        # 2. TIMESTAMP (taken now, not when the batch is flushed)
+        'timestamp': datetime.utcnow(),
+        'timezone': 'UTC',
+
+        # 3. SOURCE INFORMATION
+        'ip_address': request.remote_addr,
+        'user_agent': request.headers.get('User-Agent', ''),
+
+        # 4. ACTION PERFORMED
+        'action': f"Accessed {request.endpoint or 'unknown'}",
+        'endpoint': request.endpoint,
+        'method': request.method,
+        'action_status': 'Success',
+
+        # 5. AUTHENTICATION DETAILS
+        'auth_method': 'password',
+        'session_id': session.get('session_id', session.sid if hasattr(session, 'sid') else None),
+        'mfa_used': False,
+
+        # 6. SYSTEM/APPLICATION DETAILS
+        'app_name': 'SportEquipmentSystem',
+        'module': request.endpoint.split('.')[-1] if request.endpoint else 'unknown',
+        'server_hostname': SERVER_HOSTNAME,
+        'protocol': 'HTTPS' if request.is_secure else 'HTTP',
+
+        # 9. ADDITIONAL METADATA
+        'referrer_url': request.referrer,
+
+        # 10. AUDIT TRAIL
+        'is_tamper_proof': True,
+    }
+    # log_hash is filled when the record is sealed into a batch (see write_access_logs)
+    return record
+
+
+def write_access_logs(records):
+    """Seal a list of record dicts into a hash-chained batch and insert them with executemany, then commit.
+
+    This commits ``db.session``: the sinks call it in an app context of their
+    own (``AuditSink._write_now``) so a request's session is never committed.
+    """
+    if not records:
+        return
+    # executemany needs every parameter set to share the same keys
+    enrich_records(records)
+    groups = {}
+    for record in records:
+        record.setdefault('search_index', build_search_document(record))
+        groups.setdefault(frozenset(record), []).append(record)
+    interned = None
+    try:
+        # Leaves are numbered in insertion order
+        ordered = [record for group in groups.values() for record in group]
+        seal_batches(ordered)
+        if current_app.config.get('AUDIT_COMPACT_STORAGE'):
+            # Hashed above on the full strings; stored as dimension ids
+            interned = compact_records(ordered)
+        for group in groups.values():
+            db.session.execute(AccessLog.__table__.insert(), group)
+        # Keep the per-user rollup in step, in the same transaction
+        update_access_summaries(records)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if interned:
+        remember(interned)
+
+
+class AuditSink(abc.ABC):
+    """Base sink: subclasses decide when submitted records reach the database."""
+
+    def __init__(self, app, policy=None):
+        self.app = app
+        self.policy = policy or AuditPolicy()
+
+    @abc.abstractmethod
+    def submit(self, record):
+        """Accept one record built by ``build_access_record()``."""
+
+    def flush(self, timeout=None):
+        """Block until every record submitted so far has been written."""
+
+    def close(self):
+        """Write any open coalescing windows, flush and release resources held by the sink."""
+        self._write_now(self.policy.drain(force=True))
+
+    def _write_now(self, records):
+        # A fresh app context gets its own db.session, leaving the request's session alone
+        if records:
+            with self.app.app_context():
+                write_access_logs(records)
+
+
+class SyncAuditSink(AuditSink):
+    """Write every record as soon as it is submitted (one INSERT + COMMIT per request)."""
+
+    def submit(self, record):
+        self._write_now(self.policy.admit(record))
+
+
+class BufferedAuditSink(AuditSink):
+    """Queue records in memory and write them in batches from a background thread.
+
+    ``backpressure`` decides what happens when the queue is full:
+    ``'block'`` waits up to ``block_timeout`` seconds for space and then writes
+    the record inline so nothing is lost; ``'drop'`` discards the record and
+    counts it in ``dropped``.
+    """
+
+    _STOP = object()
+
+    def __init__(self, app, batch_size=200, flush_interval=2.0, max_queue=10000,
+                 backpressure='block', block_timeout=1.0, policy=None):
+        super().__init__(app, policy=policy)
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f'Unknown audit backpressure policy: {backpressure}')
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = max(0.01, float(flush_interval))
+        self.backpressure = backpressure
+        self.block_timeout = block_timeout
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+
+    def _ensure_worker(self):
+        # Started lazily so forked workers (e.g. gunicorn --preload) get their own thread
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, record):
+        for ready in self.policy.admit(record):
+            self._enqueue(ready)
+
+    def _enqueue(self, record):
+        if self._closed:
+            self._write_now([record])
+            return
+        self._ensure_worker()
+        if self.backpressure == 'drop':
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+            return
+        try:
+            self._queue.put(record, timeout=self.block_timeout)
+        except queue.Full:
+            # Writer is falling behind: write this record ourselves rather than lose it
+            self._write_now([record])
+
+    def flush(self, timeout=None):
+        if self._thread is None or not self._thread.is_alive():
+            return
+        deadline = None if timeout is None else time.monotonic() + timeout
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return
+        done.wait(None if deadline is None else max(0.0, deadline - time.monotonic()))
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            self._queue.put(self._STOP)
+            self._thread.join()
+        else:
+            super().close()
+
+    def _run(self):
+        while True:
+            batch = []
+            waiters = []
+            stopping = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stopping = True
+                    break
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break
+                batch.append(item)
+
+            if stopping:
+                # Drain whatever is still queued before exiting
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if isinstance(item, threading.Event):
+                        waiters.append(item)
+                    elif item is not self._STOP:
+                        batch.append(item)
+
+            # Coalescing windows that have ended (all of them on shutdown)
+            batch.extend(self.policy.drain(force=stopping))
+            self._write(batch)
+            for waiter in waiters:
+                waiter.set()
+            if stopping:
+                return
+
+    def _write(self, batch):
+        for start in range(0, len(batch), self.batch_size):
+            chunk = batch[start:start + self.batch_size]
+            try:
+                with self.app.app_context():
+                    write_access_logs(chunk)
+            except Exception as e:
+                # Don't let logging errors kill the writer thread
+                self.app.logger.error('Audit log batch of %d records failed: %s', len(chunk), e)
+
+
+def init_app(app):
+    """Create the audit sink configured for ``app`` and register it on ``app.extensions``."""
+    kind = app.config.get('AUDIT_SINK') or ('sync' if app.testing else 'buffered')
+    policy = AuditPolicy.from_config(app.config)
+    if kind == 'sync':
+        sink = SyncAuditSink(app, policy=policy)
+    elif kind == 'buffered':
+        sink = BufferedAuditSink(
+            app,
+            batch_size=app.config.get('AUDIT_BATCH_SIZE', 200),
+            flush_interval=app.config.get('AUDIT_FLUSH_INTERVAL', 2.0),
+            max_queue=app.config.get('AUDIT_QUEUE_SIZE', 10000),
+            backpressure=app.config.get('AUDIT_BACKPRESSURE', 'block'),
+            policy=policy,
+        )
+    else:
+        raise ValueError(f'Unknown AUDIT_SINK: {kind}')
+    previous = app.extensions.get('audit_sink')
+    if previous is not None:
+        # Replaced: write what it still holds now rather than at exit
+        _open_sinks.discard(previous)
+        previous.close()
+    app.extensions['audit_sink'] = sink
+    _open_sinks.add(sink)
+    global _atexit_registered
+    if not _atexit_registered:
+        # Guarantee queued records are written when the worker process exits
+        atexit.register(_close_open_sinks)
+        _atexit_registered = True
+    return sink
+
+
+def _close_open_sinks():
+    for sink in list(_open_sinks):
+        try:
+            sink.close()
+        except Exception as e:
+            sink.app.logger.error('Closing the audit sink failed: %s', e)
+
+
+def get_audit_sink():
+    """Return the audit sink of the current app."""
+    return current_app.extensions['audit_sink']
@@ -0,0 +1,173 @@
+"""
+Per-user access log rollup (``access_log_summaries``).
+
+The access_logs page used to GROUP BY the whole audit table on every visit.
+The rollup is now updated incrementally each time the audit sink writes a
+batch, retention pruning takes the logs it drops back out with
+``remove_from_summaries()``, and ``rebuild_access_summaries()`` recomputes it
+from scratch (run it periodically with scripts/rebuild_access_log_summary.py
+or after bulk deletes/imports).
+"""
+from sqlalchemy import bindparam, case, func, select, tuple_
+
+from extensions import db
+from models import AccessLog, AccessLogSummary
+from Utils.clearance_integration import _CHUNK_SIZE
+
+
+def _aggregate(records):
+    """Collapse a batch of access log records into one summary delta per user."""
+    deltas = {}
+    for record in records:
+        key = (record['user_type'], record['user_id'])
+        ts = record.get('timestamp')
+        delta = deltas.get(key)
+        if delta is None:
+            deltas[key] = {
+                'user_type': record['user_type'],
+                'user_id': record['user_id'],
+                'username': record['username'],
+                'full_name': record.get('full_name'),
+                'log_count': 1,
+                'first_seen': ts,
+                'last_seen': ts,
+                'last_action': record.get('action'),
+            }
+            continue
+        delta['log_count'] += 1
+        if ts is not None and (delta['first_seen'] is None or ts < delta['first_seen']):
+            delta['first_seen'] = ts
+        if ts is not None and (delta['last_seen'] is None or ts >= delta['last_seen']):
+            delta['last_seen'] = ts
+            delta['last_action'] = record.get('action')
+            delta['username'] = record['username']
+            delta['full_name'] = record.get('full_name')
+    return list(deltas.values())
+
+
+def update_access_summaries(records):
+    """Fold a batch of newly written access log records into the rollup.
+
+    Runs inside the caller's transaction so the rollup commits together with
+    the log rows. Uses INSERT ... ON CONFLICT DO UPDATE where the dialect
+    supports it, otherwise a read-modify-write per user.
+    """
+    deltas = _aggregate(records)
+    if not deltas:
+        return
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        table = AccessLogSummary.__table__
+        stmt = insert(table)
+        newer = stmt.excluded.last_seen >= func.coalesce(table.c.last_seen, stmt.excluded.last_seen)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.user_type, table.c.user_id],
+            set_={
+                'log_count': table.c.log_count + stmt.excluded.log_count,
+                'first_seen': case(
+                    (table.c.first_seen.is_(None), stmt.excluded.first_seen),
+                    (stmt.excluded.first_seen < table.c.first_seen, stmt.excluded.first_seen),
+                    else_=table.c.first_seen,
+                ),
+                'last_seen': case((newer, stmt.excluded.last_seen), else_=table.c.last_seen),
+                'last_action': case((newer, stmt.excluded.last_action), else_=table.c.last_action),
+                'username': case((newer, stmt.excluded.username), else_=table.c.username),
+                'full_name': case((newer, stmt.excluded.full_name), else_=table.c.full_name),
+            },
+        )
+        db.session.execute(stmt, deltas)
+        return
+
+    for delta in deltas:
+        summary = db.session.get(AccessLogSummary, (delta['user_type'], delta['user_id']))
+        if summary is None:
+            db.session.add(AccessLogSummary(**delta))
+            continue
+        summary.log_count = (summary.log_count or 0) + delta['log_count']
+        if summary.first_seen is None or (delta['first_seen'] and delta['first_seen'] < summary.first_seen):
+            summary.first_seen = delta['first_seen']
+        if summary.last_seen is None or (delta['last_seen'] and delta['last_seen'] >= summary.last_seen):
+            summary.last_seen = delta['last_seen']
+            summary.last_action = delta['last_action']
+            summary.username = delta['username']
+            summary.full_name = delta['full_name']
+
+
+def remove_from_summaries(counts, before):
+    """Take deleted logs out of the rollup, in the caller's transaction.
+
+    ``counts`` maps ``(user_type, user_id)`` to the number of that user's logs
+    deleted, all of them older than ``before``. Users left without logs are
+    dropped; the others get first_seen (and last_seen/last_action, if their
+    latest log was deleted) re-read from their remaining logs.
+    """
+    if not counts:
+        return
+    summary = AccessLogSummary.__table__
+    key = tuple_(summary.c.user_type, summary.c.user_id)
+    db.session.execute(
+        summary.update()
+        .where(summary.c.user_type == bindparam('b_user_type'), summary.c.user_id == bindparam('b_user_id'))
+        .values(log_count=summary.c.log_count - bindparam('b_count')),
+        [{'b_user_type': user_type, 'b_user_id': user_id, 'b_count': count}
+         for (user_type, user_id), count in counts.items()],
+    )
+
+    logs = AccessLog.__table__.alias('logs')
+    own = (logs.c.user_type == summary.c.user_type, logs.c.user_id == summary.c.user_id)
+    first_seen = select(func.min(logs.c.timestamp)).where(*own).scalar_subquery()
+    last_seen = select(func.max(logs.c.timestamp)).where(*own).scalar_subquery()
+    last_action = (select(logs.c.action).where(*own)
+                   .order_by(logs.c.timestamp.desc(), logs.c.id.desc()).limit(1).scalar_subquery())
+    keys = list(counts)
+    # Two parameters per key
+    for start in range(0, len(keys), _CHUNK_SIZE // 2):
+        chunk = key.in_(keys[start:start + _CHUNK_SIZE // 2])
+        db.session.execute(summary.delete().where(chunk, summary.c.log_count <= 0))
+        db.session.execute(summary.update().where(chunk).values(first_seen=first_seen))
+        db.session.execute(summary.update().where(chunk, summary.c.last_seen < before)
+                           .values(last_seen=last_seen, last_action=last_action))
+
+
+def rebuild_access_summaries():
+    """Recompute the whole rollup from access_logs. Returns the number of users summarised."""
+    latest = AccessLog.__table__.alias('latest')
+    rows = db.session.query(
+        AccessLog.user_type,
+        AccessLog.user_id,
+        func.max(AccessLog.username),
+        func.max(AccessLog.full_name),
+        func.count(AccessLog.id),
+        func.min(AccessLog.timestamp),
+        func.max(AccessLog.timestamp),
+    ).group_by(AccessLog.user_type, AccessLog.user_id).all()
+
+    db.session.query(AccessLogSummary).delete()
+    for user_type, user_id, username, full_name, count, first_seen, last_seen in rows:
+        db.session.add(AccessLogSummary(
+            user_type=user_type,
+            user_id=user_id,
+            username=username,
+            full_name=full_name,
+            log_count=count,
+            first_seen=first_seen,
+            last_seen=last_seen,
+        ))
+    db.session.flush()
+    # Fill last_action with a single correlated UPDATE rather than one query per user
+    summary = AccessLogSummary.__table__
+    correlated = (
+        select(latest.c.action)
+        .where(latest.c.user_type == summary.c.user_type, latest.c.user_id == summary.c.user_id)
+        .order_by(latest.c.timestamp.desc(), latest.c.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    db.session.execute(summary.update().values(last_action=correlated))
+    db.session.commit()
+    return len(rows)
@@ -0,0 +1,225 @@
+"""
+Bulk clearance checks, e.g. for the registry's lists of graduating students.
+
+``check_recipients()`` evaluates the clearance rules for any number of
+recipient IDs in batches of ``BATCH_SIZE``. Each batch costs a fixed number
+of queries whatever its contents: ``compute_clearance()`` for the status
+and counts (the live rules, not the projection, so a list checked right
+after a return is exact), one query for names and one listing the items
+that block clearance, each split into IN lists of ``_CHUNK_SIZE``.
+
+The admin upload page runs checks on a background thread. The job
+(``BulkClearanceJob``) and its result, one ``BulkClearanceChunk`` of CSV text
+per batch, are stored in the database and committed together as batches
+complete, so whichever worker serves the progress poll or the download sees
+the same job. scripts/bulk_clearance_check.py runs the same check from the
+command line.
+"""
+import csv
+import io
+import threading
+import uuid
+from datetime import datetime
+
+from sqlalchemy import exists, func, or_
+
+from extensions import db
+from models import BulkClearanceChunk, BulkClearanceJob, Equipment, IssuedEquipment, ReturnLine, Staff, Student
+from Utils.clearance_integration import (
+    _CHUNK_SIZE, _id_filters, _midnight_utc, _recipient_column, compute_clearance, conditions_block_clearance,
+)
+from Utils.return_lines import unresolved_damage_filter
+
+# Recipients per batch: three IN lists, so a batch is a dozen queries at most
+BATCH_SIZE = 3 * _CHUNK_SIZE
+
+CSV_HEADER = [
+    'recipient_id', 'name', 'status', 'outstanding_count', 'overdue_count', 'unresolved_damage_count',
+    'outstanding_items', 'overdue_items', 'damaged_items', 'note',
+]
+
+# Header cells recognised as the ID column of an uploaded list
+_ID_HEADERS = {'id', 'recipient_id', 'student_id', 'student id', 'payroll_number', 'payroll number', 'staff_payroll', 'reg_no'}
+
+_MAX_JOBS = 20
+
+
+def read_recipient_ids(lines):
+    """Recipient IDs from CSV text lines, in order and without duplicates.
+
+    Uses the column headed like an ID column (``student_id``, ``recipient_id``,
+    ``payroll_number``, ...) if the first row is a header, otherwise the first
+    column. Blank cells are skipped.
+    """
+    reader = csv.reader(lines)
+    column = 0
+    ids = []
+    for index, row in enumerate(reader):
+        if index == 0:
+            headers = [cell.strip().lower() for cell in row]
+            matches = [i for i, header in enumerate(headers) if header in _ID_HEADERS]
+            if matches:
+                column = matches[0]
+                continue
+        if len(row) > column and row[column].strip():
+            ids.append(row[column].strip())
+    return list(dict.fromkeys(ids))
+
+
+def _names(recipient_ids, recipient_type):
+    model, key = (Student, Student.id) if recipient_type == 'student' else (Staff, Staff.payroll_number)
+    names = {}
+    for condition in _id_filters(key, recipient_ids):
+        names.update(db.session.query(key, model.name).filter(condition))
+    return names
+
+
+def _blocking_items(recipient_ids, recipient_type):
+    """``{recipient_id: {'outstanding': [...], 'overdue': [...], 'damaged': [...]}}`` item descriptions."""
+    column = _recipient_column(recipient_type)
+    midnight = _midnight_utc()
+    outstanding = or_(IssuedEquipment.status.is_(None), IssuedEquipment.status != 'Returned')
+    damaged = unresolved_damage_filter()
+    lowered = func.lower(IssuedEquipment.return_conditions)
+    legacy_damage = ~exists().where(ReturnLine.issue_id == IssuedEquipment.id) & or_(
+        lowered.like('%damaged%'), lowered.like('%lost%'))
+
+    items = {}
+    for condition in _id_filters(column, recipient_ids):
+        rows = db.session.query(
+            column, Equipment.name, IssuedEquipment.quantity, IssuedEquipment.status,
+            IssuedEquipment.expected_return, IssuedEquipment.return_conditions,
+            outstanding.label('outstanding'), damaged.label('damaged'), legacy_damage.label('legacy_damage'),
+        ).outerjoin(Equipment, Equipment.id == IssuedEquipment.equipment_id).filter(
+            condition, or_(outstanding, damaged, legacy_damage),
+        ).order_by(column, IssuedEquipment.date_issued)
+        for row in rows:
+            entry = items.setdefault(row[0], {'outstanding': [], 'overdue': [], 'damaged': []})
+            label = f"{row.name or 'Unknown equipment'} x{row.quantity}"
+            if row.outstanding:
+                due = f" (due {row.expected_return:%Y-%m-%d})" if row.expected_return else ''
+                entry['outstanding'].append(label + due)
+                if row.status == 'Issued' and row.expected_return is not None and row.expected_return < midnight:
+                    entry['overdue'].append(label + due)
+            if row.damaged or (row.legacy_damage and conditions_block_clearance(row.return_conditions)):
+                entry['damaged'].append(label)
+    return items
+
+
+def check_batch(recipient_ids, recipient_type='student'):
+    """CSV rows (see ``CSV_HEADER``) for one batch of recipient IDs, in the given order."""
+    results = compute_clearance(recipient_ids, recipient_type)
+    names = _names(recipient_ids, recipient_type)
+    items = _blocking_items([recipient_id for recipient_id in recipient_ids if recipient_id in results], recipient_type)
+    missing_note = 'No such student' if recipient_type == 'student' else 'No such staff member'
+    rows = []
+    for recipient_id in recipient_ids:
+        result = results.get(recipient_id)
+        entry = items.get(recipient_id, {'outstanding': [], 'overdue': [], 'damaged': []})
+        rows.append([
+            recipient_id,
+            names.get(recipient_id, ''),
+            result['status'] if result else 'Cleared',  # No items issued = cleared
+            result['outstanding_count'] if result else 0,
+            result['overdue_count'] if result else 0,
+            result['unresolved_damage_count'] if result else 0,
+            '; '.join(entry['outstanding']),
+            '; '.join(entry['overdue']),
+            '; '.join(entry['damaged']),
+            '' if recipient_id in names or result else missing_note,
+        ])
+    return rows
+
+
+def check_recipients(recipient_ids, writer, recipient_type='student', batch_size=BATCH_SIZE, progress=None):
+    """Check ``recipient_ids`` batch by batch, writing the header and rows to csv ``writer``.
+
+    The session's transaction is ended after every batch, then
+    ``progress(done, total)`` is called. Returns the number of rows written.
+    """
+    recipient_ids = list(recipient_ids)
+    writer.writerow(CSV_HEADER)
+    done = 0
+    for start in range(0, len(recipient_ids), batch_size):
+        batch = recipient_ids[start:start + batch_size]
+        writer.writerows(check_batch(batch, recipient_type))
+        done += len(batch)
+        # Batches only read; end the transaction so a long check holds no snapshot
+        db.session.rollback()
+        if progress:
+            progress(done, len(recipient_ids))
+    return done
+
+
+def _save_progress(job_id, seq, buffer, **fields):
+    """Store the rows written to ``buffer`` as result chunk ``seq`` and update the job, in one commit."""
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    if data:
+        db.session.add(BulkClearanceChunk(job_id=job_id, seq=seq, data=data))
+    BulkClearanceJob.query.filter_by(id=job_id).update(fields)
+    db.session.commit()
+    return seq + 1 if data else seq
+
+
+def _run_bulk_check(app, job_id, recipient_ids, recipient_type):
+    with app.app_context():
+        try:
+            BulkClearanceJob.query.filter_by(id=job_id).update({'state': 'running'})
+            db.session.commit()
+            buffer = io.StringIO()
+            seq = 0
+
+            def progress(done, total):
+                nonlocal seq
+                seq = _save_progress(job_id, seq, buffer, processed=done)
+
+            check_recipients(recipient_ids, csv.writer(buffer), recipient_type, progress=progress)
+            _save_progress(job_id, seq, buffer, state='done', finished_at=datetime.utcnow())
+        except Exception as e:
+            db.session.rollback()
+            BulkClearanceJob.query.filter_by(id=job_id).update(
+                {'state': 'failed', 'error': str(e), 'finished_at': datetime.utcnow()})
+            db.session.commit()
+        finally:
+            db.session.remove()
+
+
+def start_bulk_check(app, recipient_ids, recipient_type='student', created_by=None):
+    """Record a ``BulkClearanceJob`` for ``recipient_ids``, start it on a background thread and return it."""
+    recipient_ids = list(recipient_ids)
+    job = BulkClearanceJob(id=uuid.uuid4().hex, recipient_type=recipient_type, created_by=created_by,
+                           total=len(recipient_ids))
+    db.session.add(job)
+    # Keep the most recent jobs; drop the oldest finished ones and their results
+    old = [job_id for job_id, in db.session.query(BulkClearanceJob.id)
+           .filter(BulkClearanceJob.finished_at.isnot(None))
+           .order_by(BulkClearanceJob.created_at.desc()).offset(_MAX_JOBS - 1)]
+    if old:
+        BulkClearanceChunk.query.filter(BulkClearanceChunk.job_id.in_(old)).delete(synchronize_session=False)
+        BulkClearanceJob.query.filter(BulkClearanceJob.id.in_(old)).delete(synchronize_session=False)
+    db.session.commit()
+    threading.Thread(target=_run_bulk_check, args=(app, job.id, recipient_ids, recipient_type),
+                     name=f'clearance-check-{job.id[:8]}', daemon=True).start()
+    return job
+
+
+def get_bulk_check(job_id):
+    return db.session.get(BulkClearanceJob, job_id)
+
+
+def recent_bulk_checks():
+    """The most recent jobs, newest first."""
+    return BulkClearanceJob.query.order_by(BulkClearanceJob.created_at.desc()).limit(_MAX_JOBS).all()
+
+
+def stream_bulk_check(job_id):
+    """Yield the result CSV of a finished job, one stored batch at a time."""
+    seq = 0
+    while True:
+        data = db.session.query(BulkClearanceChunk.data).filter_by(job_id=job_id, seq=seq).scalar()
+        if data is None:
+            return
+        yield data
+        seq += 1
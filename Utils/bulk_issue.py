@@ -0,0 +1,208 @@
+"""
+Issuing many equipment lines to one recipient at once.
+
+Kitting out a team meant one issue form per item: each POST repeated the
+validation, the recipient upsert, the serial check and a commit. The bulk
+issue APIs (``POST /admin/api/issue/bulk``, ``POST /storekeeper/api/issue/bulk``)
+take the recipient once and any number of lines, and ``issue_lines()``:
+
+- loads every line's equipment (and, for a storekeeper, campus stock) with
+  one query and checks the stock each piece of equipment needs in total;
+- checks all serials of all lines with one registry query;
+- upserts the recipient once, inserts every ``IssuedEquipment`` row in one
+  flush and takes the stock with conditional UPDATEs, in equipment order so
+  concurrent bulk issues lock rows in the same order;
+- commits once (``commit_with_retry()``).
+
+Every problem found before writing is reported together as a
+``BulkIssueError``. The issues share one recipient and date, so the
+existing combined receipt (``issue_receipt`` by recipient) shows them all.
+"""
+import json
+import re
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from models import CampusStock, Equipment, IssuedEquipment, Staff, Student
+from Utils.campus_stock import claim_campus_units
+from Utils.serial_registry import serials_in_use
+from Utils.stock import InsufficientStock, commit_with_retry, take_equipment_units
+from Utils.student_checks import has_unreturned_items
+
+MAX_LINES = 200
+
+
+class BulkIssueError(Exception):
+    """The request can't be issued; ``errors`` lists every reason, ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, errors, status=400):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+        self.status = status
+
+
+def parse_recipient(data):
+    """``(person_type, fields)`` of the recipient in ``data``, validated as the issue forms do."""
+    person_type = data.get('person_type')
+    if person_type == 'student':
+        fields = {key: str(data.get(key) or '').strip() for key in ('student_id', 'student_name', 'student_email', 'student_phone')}
+        if not all(fields.values()):
+            raise BulkIssueError(['Missing required student fields.'])
+        if '@' not in fields['student_email'] or '.' not in fields['student_email']:
+            raise BulkIssueError(['Invalid student email address.'])
+        if not re.fullmatch(r'0\d{9}', fields['student_phone']):
+            raise BulkIssueError(['Invalid phone number. Expected format: 0712345678'])
+    elif person_type == 'staff':
+        fields = {key: str(data.get(key) or '').strip() for key in ('staff_payroll', 'staff_name', 'staff_email')}
+        if not all(fields.values()):
+            raise BulkIssueError(['Missing required staff fields.'])
+        if '@' not in fields['staff_email'] or '.' not in fields['staff_email']:
+            raise BulkIssueError(['Invalid staff email address.'])
+    else:
+        raise BulkIssueError(['Please select who to issue to.'])
+    return person_type, fields
+
+
+def parse_expected_return(value, required=True):
+    """The expected return date (YYYY-MM-DD) as a datetime; None when optional and missing."""
+    if not value:
+        if required:
+            raise BulkIssueError(['Expected return date is required.'])
+        return None
+    try:
+        expected_return = datetime.strptime(value, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        raise BulkIssueError(['Invalid expected return date format.'])
+    if expected_return.date() < datetime.now().date():
+        raise BulkIssueError(['Expected return date cannot be in the past. Please select today or a future date.'])
+    return expected_return
+
+
+def parse_lines(raw_lines):
+    """``[{'equipment_id', 'quantity', 'serial_numbers'}]`` from the request's ``lines``."""
+    if not isinstance(raw_lines, list) or not raw_lines:
+        raise BulkIssueError(['Add at least one equipment line.'])
+    if len(raw_lines) > MAX_LINES:
+        raise BulkIssueError([f'At most {MAX_LINES} lines can be issued at once.'])
+    lines, errors = [], []
+    for number, raw in enumerate(raw_lines, start=1):
+        try:
+            equipment_id = int(raw['equipment_id'])
+            quantity = int(raw.get('quantity', 1))
+            if quantity <= 0:
+                raise ValueError
+        except (KeyError, TypeError, ValueError, AttributeError):
+            errors.append(f'Line {number}: equipment_id and a positive quantity are required.')
+            continue
+        serials = [str(serial).strip() for serial in raw.get('serial_numbers') or [] if str(serial).strip()]
+        if serials and len(serials) != quantity:
+            errors.append(f'Line {number}: {quantity} unit(s) but {len(serials)} serial number(s).')
+        lines.append({'equipment_id': equipment_id, 'quantity': quantity, 'serial_numbers': serials})
+    if errors:
+        raise BulkIssueError(errors)
+    return lines
+
+
+def _check(lines, campus_id):
+    """Every reason the lines can't be issued as things stand, with one query per kind of check."""
+    errors = []
+    needed = {}
+    for line in lines:
+        needed[line['equipment_id']] = needed.get(line['equipment_id'], 0) + line['quantity']
+
+    equipment = {item.id: item for item in Equipment.query.filter(Equipment.id.in_(list(needed)))}
+    stock = {}
+    if campus_id is not None:
+        stock = {row.equipment_id: row for row in CampusStock.query.filter(
+            CampusStock.campus_id == campus_id, CampusStock.equipment_id.in_(list(needed)))}
+    for equipment_id, units in needed.items():
+        item = equipment.get(equipment_id)
+        if item is None or not item.is_active:
+            errors.append(f'Equipment {equipment_id} not found.')
+        elif campus_id is None:
+            if (item.quantity or 0) < units:
+                errors.append(f'Not enough {item.name} available. Available: {item.quantity or 0}, Requested: {units}')
+        elif equipment_id not in stock or stock[equipment_id].distributed <= 0:
+            errors.append(f'{item.name} is not distributed to your campus.')
+        elif stock[equipment_id].available < units:
+            errors.append(f'Not enough {item.name} available. Available: {stock[equipment_id].available}, Requested: {units}')
+
+    serials = [serial for line in lines for serial in line['serial_numbers']]
+    repeated = sorted({serial for serial in serials if serials.count(serial) > 1})
+    if repeated:
+        errors.append(f'Serial numbers entered more than once: {", ".join(repeated)}')
+    in_use = serials_in_use(serials)
+    if in_use:
+        errors.append(f'Serial numbers already in use: {", ".join(sorted(in_use))}')
+    return errors
+
+
+def _upsert_recipient(person_type, fields):
+    if person_type == 'student':
+        student = db.session.get(Student, fields['student_id'])
+        if student is None:
+            student = Student(id=fields['student_id'])
+            db.session.add(student)
+        student.name = fields['student_name']
+        student.email = fields['student_email']
+        student.phone = fields['student_phone']
+    else:
+        staff = db.session.get(Staff, fields['staff_payroll'])
+        if staff is None:
+            staff = Staff(payroll_number=fields['staff_payroll'])
+            db.session.add(staff)
+        staff.name = fields['staff_name']
+        staff.email = fields['staff_email']
+
+
+def issue_lines(person_type, fields, lines, expected_return, issued_by, campus_id=None, confirm_unreturned=False):
+    """Issue ``lines`` to one recipient in one transaction and commit; returns the new issue ids.
+
+    ``campus_id`` issues from that campus's stock, as a storekeeper does;
+    without it the units come from the central equipment quantity. Students
+    with unreturned items need ``confirm_unreturned``. Raises ``BulkIssueError``
+    (nothing written) when anything can't be issued.
+    """
+    if person_type == 'student' and not confirm_unreturned:
+        has_unreturned, unreturned = has_unreturned_items(fields['student_id'])
+        if has_unreturned:
+            items = ', '.join(sorted({item.equipment.name for item in unreturned if item.equipment}))
+            raise BulkIssueError([f'Student has unreturned items: {items}. Confirm to issue anyway.'], status=409)
+    errors = _check(lines, campus_id)
+    if errors:
+        raise BulkIssueError(errors, status=409)
+
+    ordered = sorted(lines, key=lambda line: line['equipment_id'])
+
+    def record_issues():
+        if campus_id is not None:
+            for line in ordered:
+                claim_campus_units(campus_id, line['equipment_id'], line['quantity'])
+        _upsert_recipient(person_type, fields)
+        issues = [IssuedEquipment(
+            student_id=fields['student_id'] if person_type == 'student' else None,
+            staff_payroll=fields['staff_payroll'] if person_type == 'staff' else None,
+            equipment_id=line['equipment_id'],
+            quantity=line['quantity'],
+            expected_return=expected_return,
+            serial_numbers=json.dumps(line['serial_numbers']) if line['serial_numbers'] else None,
+            issued_by=issued_by,
+        ) for line in ordered]
+        db.session.add_all(issues)
+        db.session.flush()
+        for issue in issues:
+            take_equipment_units(issue.equipment_id, issue.quantity, 'issue', check=campus_id is None, issue_id=issue.id)
+        return [issue.id for issue in issues]
+
+    # Another request may take the stock or serials between the checks and the writes
+    try:
+        return commit_with_retry(record_issues)
+    except InsufficientStock as e:
+        raise BulkIssueError([str(e)], status=409)
+    except IntegrityError:
+        in_use = serials_in_use([serial for line in lines for serial in line['serial_numbers']])
+        if not in_use:
+            raise
+        raise BulkIssueError([f'Serial numbers already in use: {", ".join(sorted(in_use))}'], status=409)
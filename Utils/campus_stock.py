@@ -0,0 +1,226 @@
+"""
+Per-campus stock ledger: the ``campus_stock`` table.
+
+Storekeepers may only issue what the admin has distributed to their campus.
+Their pages used to load every ``CampusDistribution`` row of the campus and
+then run a ``SUM(quantity)`` of issued items per equipment, several times per
+request. ``campus_stock`` keeps one row per (campus, equipment) instead:
+
+- ``distributed``: units distributed to the campus;
+- ``issued_out``: units issued by the campus's storekeepers and not returned;
+- ``returned_good``/``damaged``/``lost``: units returned in each condition.
+
+Session hooks fold every new ``CampusDistribution``, every new
+``IssuedEquipment`` issued by a storekeeper and every ``ReturnLine`` of such
+an issue into its row as a relative ``UPDATE`` in the same transaction, so
+distribute_to_campus and every issue/return path keep the ledger current
+and concurrent transactions add up. An issue counts for the campus of the
+storekeeper in its ``issued_by``. Storekeeper issues claim their units first
+with ``claim_campus_units()``, a conditional UPDATE that can't oversell. ``rebuild_campus_stock()``
+(scripts/rebuild_campus_stock.py) recomputes the table from those records.
+"""
+from sqlalchemy import event, func
+from sqlalchemy.orm import contains_eager
+from sqlalchemy.orm.util import identity_key
+
+from extensions import db
+from models import CampusDistribution, CampusStock, Equipment, IssuedEquipment, ReturnLine, StoreKeeper
+from Utils.stock import InsufficientStock
+
+OUTSTANDING_STATUSES = ('Issued', 'Partial Return')
+_CONDITION_COLUMNS = {'Good': 'returned_good', 'Damaged': 'damaged', 'Lost': 'lost'}
+_COLUMNS = ('distributed', 'issued_out', 'returned_good', 'damaged', 'lost')
+_CHANGED_KEY = 'campus_stock_changed'
+_CLAIMED_KEY = 'campus_stock_claimed'
+
+_listeners_installed = False
+
+
+def _add(deltas, campus_id, equipment_id, column, units):
+    if campus_id is None or equipment_id is None or not units:
+        return
+    row = deltas.setdefault((campus_id, equipment_id), dict.fromkeys(_COLUMNS, 0))
+    row[column] += units
+
+
+def _apply_deltas(session, flush_context):
+    distributions, issues, lines = [], [], []
+    for obj in session.new:
+        if isinstance(obj, CampusDistribution):
+            distributions.append(obj)
+        elif isinstance(obj, IssuedEquipment) and obj.issued_by:
+            issues.append(obj)
+        elif isinstance(obj, ReturnLine):
+            lines.append(obj)
+    if not (distributions or issues or lines):
+        return
+
+    deltas = {}
+    for distribution in distributions:
+        _add(deltas, distribution.campus_id, distribution.equipment_id, 'distributed', distribution.quantity)
+
+    # Lines are usually created with issue_id only, so look the issue up (an identity map hit)
+    returned = [(line, session.get(IssuedEquipment, line.issue_id)) for line in lines]
+    returned = [(line, issue) for line, issue in returned if issue is not None and issue.issued_by]
+    payrolls = {issue.issued_by for issue in issues} | {issue.issued_by for _, issue in returned}
+    campuses = {}
+    if payrolls:
+        campuses = dict(session.query(StoreKeeper.payroll_number, StoreKeeper.campus_id).filter(
+            StoreKeeper.payroll_number.in_(payrolls)))
+    claimed = session.info.get(_CLAIMED_KEY) or {}
+    for issue in issues:
+        campus_id, units = campuses.get(issue.issued_by), issue.quantity or 0
+        # Units claimed up front with claim_campus_units() are already counted
+        taken = min(claimed.get((campus_id, issue.equipment_id), 0), units)
+        if taken:
+            claimed[(campus_id, issue.equipment_id)] -= taken
+        _add(deltas, campus_id, issue.equipment_id, 'issued_out', units - taken)
+    for line, issue in returned:
+        campus_id = campuses.get(issue.issued_by)
+        units = line.quantity or 0
+        _add(deltas, campus_id, issue.equipment_id, 'issued_out', -units)
+        if line.condition in _CONDITION_COLUMNS:
+            _add(deltas, campus_id, issue.equipment_id, _CONDITION_COLUMNS[line.condition], units)
+
+    table = CampusStock.__table__
+    connection = session.connection()
+    for (campus_id, equipment_id), values in deltas.items():
+        result = connection.execute(table.update().where(
+            table.c.campus_id == campus_id, table.c.equipment_id == equipment_id
+        ).values({column: table.c[column] + units for column, units in values.items() if units}))
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(campus_id=campus_id, equipment_id=equipment_id, **values))
+    session.info.setdefault(_CHANGED_KEY, []).extend(deltas)
+
+
+def _expire_changed(session, flush_context):
+    # Loaded CampusStock objects re-read their totals after the relative UPDATE
+    for key in session.info.pop(_CHANGED_KEY, ()):
+        row = session.identity_map.get(identity_key(CampusStock, key))
+        if row is not None:
+            session.expire(row)
+
+
+def _discard_changed(session):
+    session.info.pop(_CHANGED_KEY, None)
+    session.info.pop(_CLAIMED_KEY, None)
+
+
+def _discard_claims(session):
+    session.info.pop(_CLAIMED_KEY, None)
+
+
+def install_listeners():
+    global _listeners_installed
+    if _listeners_installed:
+        return
+    event.listen(db.session, 'after_flush', _apply_deltas)
+    event.listen(db.session, 'after_flush_postexec', _expire_changed)
+    event.listen(db.session, 'after_rollback', _discard_changed)
+    event.listen(db.session, 'after_commit', _discard_claims)
+    _listeners_installed = True
+
+
+def init_app(app):
+    """Keep ``campus_stock`` in step with distributions, issues and returns for ``app``'s sessions."""
+    install_listeners()
+
+
+def campus_stock(campus_id, active_only=False):
+    """Stock rows of the equipment distributed to ``campus_id``, with their equipment, in one query."""
+    query = CampusStock.query.join(CampusStock.equipment).options(contains_eager(CampusStock.equipment)).filter(
+        CampusStock.campus_id == campus_id, CampusStock.distributed > 0
+    )
+    if active_only:
+        query = query.filter(Equipment.is_active.is_(True))
+    return query.order_by(Equipment.category, Equipment.name).all()
+
+
+def distributed_equipment_ids(campus_id):
+    """IDs of the equipment distributed to ``campus_id``."""
+    return [equipment_id for (equipment_id,) in db.session.query(CampusStock.equipment_id).filter(
+        CampusStock.campus_id == campus_id, CampusStock.distributed > 0)]
+
+
+def stock_of(campus_id, equipment_id):
+    """The campus's stock row of one equipment, or None when it was never distributed there."""
+    row = db.session.get(CampusStock, (campus_id, equipment_id))
+    return row if row is not None and row.distributed > 0 else None
+
+
+def claim_campus_units(campus_id, equipment_id, units):
+    """Count ``units`` as issued out of the campus's stock, if it has that many left.
+
+    One conditional UPDATE checks and takes them, so concurrent issues can't
+    oversell; raises ``InsufficientStock`` otherwise. Call it before adding the
+    ``IssuedEquipment``, in the same transaction: the flush then skips the
+    units already claimed.
+    """
+    table = CampusStock.__table__
+    key = (campus_id, equipment_id)
+    result = db.session.execute(table.update().where(
+        table.c.campus_id == campus_id, table.c.equipment_id == equipment_id,
+        table.c.distributed - table.c.issued_out >= units,
+    ).values(issued_out=table.c.issued_out + units))
+    if result.rowcount == 0:
+        available = db.session.query(CampusStock.distributed - CampusStock.issued_out).filter(
+            CampusStock.campus_id == campus_id, CampusStock.equipment_id == equipment_id).scalar()
+        raise InsufficientStock(available or 0, units)
+
+    claimed = db.session.info.setdefault(_CLAIMED_KEY, {})
+    claimed[key] = claimed.get(key, 0) + units
+    row = db.session.identity_map.get(identity_key(CampusStock, key))
+    if row is not None:
+        db.session.expire(row)
+
+
+def rebuild_campus_stock():
+    """Recompute ``campus_stock`` from distributions, storekeeper issues and return lines. Commits.
+
+    Returns the number of rows that changed.
+    """
+    totals = {}
+    for campus_id, equipment_id, units in db.session.query(
+        CampusDistribution.campus_id, CampusDistribution.equipment_id, func.sum(CampusDistribution.quantity)
+    ).group_by(CampusDistribution.campus_id, CampusDistribution.equipment_id):
+        _add(totals, campus_id, equipment_id, 'distributed', int(units or 0))
+
+    campus = StoreKeeper.campus_id
+    by_storekeeper = (StoreKeeper, StoreKeeper.payroll_number == IssuedEquipment.issued_by)
+    # Units still out: non-serial partial returns lower the issue's quantity, serial returns don't
+    serial_returned = db.session.query(
+        ReturnLine.issue_id, func.sum(ReturnLine.quantity).label('units')
+    ).filter(ReturnLine.serial.isnot(None)).group_by(ReturnLine.issue_id).subquery()
+    for campus_id, equipment_id, units in db.session.query(
+        campus, IssuedEquipment.equipment_id,
+        func.sum(IssuedEquipment.quantity - func.coalesce(serial_returned.c.units, 0)),
+    ).join(*by_storekeeper).outerjoin(serial_returned, serial_returned.c.issue_id == IssuedEquipment.id).filter(
+        IssuedEquipment.status.in_(OUTSTANDING_STATUSES)
+    ).group_by(campus, IssuedEquipment.equipment_id):
+        _add(totals, campus_id, equipment_id, 'issued_out', int(units or 0))
+
+    for campus_id, equipment_id, condition, units in db.session.query(
+        campus, IssuedEquipment.equipment_id, ReturnLine.condition, func.sum(ReturnLine.quantity)
+    ).select_from(ReturnLine).join(IssuedEquipment, IssuedEquipment.id == ReturnLine.issue_id).join(*by_storekeeper).group_by(
+        campus, IssuedEquipment.equipment_id, ReturnLine.condition
+    ):
+        if condition in _CONDITION_COLUMNS:
+            _add(totals, campus_id, equipment_id, _CONDITION_COLUMNS[condition], int(units or 0))
+
+    changed = 0
+    existing = {(row.campus_id, row.equipment_id): row for row in CampusStock.query}
+    for key, values in totals.items():
+        row = existing.pop(key, None)
+        if row is None:
+            row = CampusStock(campus_id=key[0], equipment_id=key[1])
+            db.session.add(row)
+        elif all(getattr(row, column) == values[column] for column in _COLUMNS):
+            continue
+        for column in _COLUMNS:
+            setattr(row, column, values[column])
+        changed += 1
+    for row in existing.values():
+        db.session.delete(row)
+        changed += 1
+    db.session.commit()
+    return changed
@@ -0,0 +1,213 @@
+"""
+Clearance actions applied to many issued items at once.
+
+``apply_clearance_action()`` settles damage/loss (``replaced``, ``repaired``,
+``waiver``) or marks items for review (``rollback``) for any number of issues
+across any number of recipients. Whatever the number of items, it uses a
+handful of set-based statements per IN list of ``_CHUNK_SIZE`` issue ids
+(plus one UPDATE per equipment type for replacements), not a query and an
+update per item:
+
+- one SELECT picks the issues the action applies to (returned issues with
+  unresolved damage/loss; returned issues for a rollback);
+- ``replaced`` sums the unresolved damaged/lost units per equipment and puts
+  them back into stock, as the single-item routes do;
+- one UPDATE resolves the return lines, one writes the action into
+  ``return_conditions`` (the same blob for every item);
+- a rollback appends the note to ``damage_clearance_notes`` and moves the
+  students' ``Clearance`` records back to Pending.
+
+Core UPDATEs bypass the ORM, so the recipients are queued for the
+``recipient_clearance`` projection with ``mark_recipients()`` and restocked
+units are written to the inventory ledger with ``record_movements()``. Nothing is
+committed: the caller commits, so a batch is one transaction. A request that
+applies several actions combines their summaries with ``merge_summaries()``
+for its single audit entry.
+"""
+import json
+from datetime import datetime, UTC
+
+from sqlalchemy import and_, case, func, or_
+
+from extensions import db
+from models import Clearance, Equipment, IssuedEquipment, ReturnLine, Student
+from Utils.clearance_integration import _CHUNK_SIZE
+from Utils.clearance_projection import mark_recipients
+from Utils.inventory_ledger import record_movements
+from Utils.return_lines import DAMAGE_CONDITIONS, RESOLUTIONS, unresolved_damage_filter
+
+BATCH_ACTIONS = RESOLUTIONS + ('rollback',)
+
+
+def _chunks(values):
+    values = list(values)
+    for start in range(0, len(values), _CHUNK_SIZE):
+        yield values[start:start + _CHUNK_SIZE]
+
+
+def _eligible_issues(action, issue_ids=(), recipient_ids=()):
+    """``[(id, student_id, staff_payroll)]`` of the selected issues the action applies to."""
+    conditions = [IssuedEquipment.status == 'Returned']
+    if action in RESOLUTIONS:
+        conditions.append(unresolved_damage_filter())
+    selections = [IssuedEquipment.id.in_(chunk) for chunk in _chunks(issue_ids)]
+    for chunk in _chunks(recipient_ids):
+        selections.append(or_(IssuedEquipment.student_id.in_(chunk), IssuedEquipment.staff_payroll.in_(chunk)))
+    rows = {}
+    for selection in selections:
+        query = db.session.query(IssuedEquipment.id, IssuedEquipment.student_id, IssuedEquipment.staff_payroll)
+        rows.update((row.id, tuple(row)) for row in query.filter(selection, *conditions))
+    return [rows[issue_id] for issue_id in sorted(rows)]
+
+
+def _unresolved_lines(chunk):
+    return and_(
+        ReturnLine.issue_id.in_(chunk),
+        ReturnLine.condition.in_(DAMAGE_CONDITIONS),
+        ReturnLine.resolution.is_(None),
+    )
+
+
+def _restock(ids):
+    """Put the unresolved damaged/lost units of issues ``ids`` back into stock; returns units per condition."""
+    per_equipment = {}
+    units = {condition: 0 for condition in DAMAGE_CONDITIONS}
+    for chunk in _chunks(ids):
+        rows = db.session.query(
+            IssuedEquipment.equipment_id, ReturnLine.condition, func.sum(ReturnLine.quantity)
+        ).join(IssuedEquipment, IssuedEquipment.id == ReturnLine.issue_id).filter(
+            _unresolved_lines(chunk)
+        ).group_by(IssuedEquipment.equipment_id, ReturnLine.condition)
+        for equipment_id, condition, quantity in rows:
+            counts = per_equipment.setdefault(equipment_id, {'Damaged': 0, 'Lost': 0})
+            counts[condition] += int(quantity or 0)
+            units[condition] += int(quantity or 0)
+
+    per_equipment.pop(None, None)
+    table = Equipment.__table__
+    # The UPDATE floors the counts at 0, so read them to record what it actually moves
+    current = {}
+    if per_equipment:
+        current = {row.id: row for row in db.session.execute(
+            table.select().with_only_columns(table.c.id, table.c.damaged_count, table.c.lost_count).where(
+                table.c.id.in_(list(per_equipment))))}
+    movements = []
+    for equipment_id, counts in per_equipment.items():
+        row = current.get(equipment_id)
+        if row is not None:
+            damaged_moved = min(counts['Damaged'], max(row.damaged_count or 0, 0))
+            lost_moved = min(counts['Lost'], max(row.lost_count or 0, 0))
+            movements.append({'equipment_id': equipment_id, 'kind': 'restock',
+                              'quantity_delta': counts['Damaged'] + counts['Lost'],
+                              'damaged_delta': -damaged_moved, 'lost_delta': -lost_moved})
+        damaged = func.coalesce(table.c.damaged_count, 0) - counts['Damaged']
+        lost = func.coalesce(table.c.lost_count, 0) - counts['Lost']
+        db.session.execute(table.update().where(table.c.id == equipment_id).values(
+            damaged_count=case((damaged < 0, 0), else_=damaged),
+            lost_count=case((lost < 0, 0), else_=lost),
+            quantity=func.coalesce(table.c.quantity, 0) + counts['Damaged'] + counts['Lost'],
+        ))
+    record_movements(movements)
+    return units
+
+
+def _resolve(ids, action, actor, now):
+    issues = IssuedEquipment.__table__
+    lines = ReturnLine.__table__
+    blob = json.dumps({'action': action, 'action_date': now.isoformat(), 'action_by': actor})
+    for chunk in _chunks(ids):
+        db.session.execute(lines.update().where(
+            lines.c.issue_id.in_(chunk),
+            lines.c.condition.in_(DAMAGE_CONDITIONS),
+            lines.c.resolution.is_(None),
+        ).values(resolution=action, resolved_at=now.replace(tzinfo=None)))
+        db.session.execute(issues.update().where(issues.c.id.in_(chunk)).values(return_conditions=blob))
+
+
+def _rollback(ids, student_ids, note, now):
+    issues = IssuedEquipment.__table__
+    note = f"[Admin Rollback] {note}" if note else '[Admin Rollback] Marked for review'
+    for chunk in _chunks(ids):
+        db.session.execute(issues.update().where(issues.c.id.in_(chunk)).values(
+            damage_clearance_status='Needs Review',
+            damage_clearance_notes=func.coalesce(issues.c.damage_clearance_notes, '') + '\n' + note,
+        ))
+
+    # Students' clearance records go back to Pending; students without one get one
+    clearance = Clearance.__table__
+    existing = set()
+    for chunk in _chunks(student_ids):
+        db.session.execute(clearance.update().where(clearance.c.student_id.in_(chunk)).values(
+            status='Pending', last_updated=now))
+        existing.update(db.session.scalars(db.select(Clearance.student_id).where(Clearance.student_id.in_(chunk))))
+    missing = []
+    for chunk in _chunks(sorted(set(student_ids) - existing)):
+        missing.extend(db.session.scalars(db.select(Student.id).where(Student.id.in_(chunk))))
+    if missing:
+        db.session.execute(clearance.insert(), [
+            {'student_id': student_id, 'status': 'Pending', 'last_updated': now} for student_id in missing
+        ])
+
+
+def apply_clearance_action(action, issue_ids=(), recipient_ids=(), actor=None, note=None):
+    """Apply ``action`` (replaced, repaired, waiver or rollback) to the selected issued items. Does not commit.
+
+    Items are selected by ``issue_ids`` and/or by ``recipient_ids`` (student
+    IDs or staff payroll numbers: all of their items); selected items the
+    action does not apply to are skipped. Returns a summary dict.
+    """
+    if action not in BATCH_ACTIONS:
+        raise ValueError(f'Unknown clearance action: {action}')
+    issue_ids = list(dict.fromkeys(int(issue_id) for issue_id in issue_ids))
+    recipient_ids = list(dict.fromkeys(recipient_ids))
+    now = datetime.now(UTC)
+
+    eligible = _eligible_issues(action, issue_ids, recipient_ids)
+    ids = [issue_id for issue_id, _, _ in eligible]
+    students = sorted({student_id for _, student_id, _ in eligible if student_id})
+    staff = sorted({payroll for _, _, payroll in eligible if payroll})
+
+    units = {condition: 0 for condition in DAMAGE_CONDITIONS}
+    if ids:
+        if action == 'replaced':
+            units = _restock(ids)
+        if action == 'rollback':
+            _rollback(ids, students, note, now)
+        else:
+            _resolve(ids, action, actor or 'System', now)
+        mark_recipients([('student', student_id) for student_id in students] +
+                        [('staff', payroll) for payroll in staff])
+
+    return {
+        'action': action,
+        'applied': len(ids),
+        'skipped': len(set(issue_ids) - set(ids)),
+        'issue_ids': ids,
+        'recipients': len(students) + len(staff),
+        'student_ids': students,
+        'staff_payrolls': staff,
+        'restocked_units': units,
+    }
+
+
+def merge_summaries(summaries):
+    """Combine the summaries of several ``apply_clearance_action()`` calls made in one transaction.
+
+    ``action`` lists the actions applied (e.g. ``replaced+waiver``) and
+    ``actions`` the items applied per action; counts, ids and restocked
+    units cover all of them.
+    """
+    students = sorted({student_id for summary in summaries for student_id in summary['student_ids']})
+    staff = sorted({payroll for summary in summaries for payroll in summary['staff_payrolls']})
+    return {
+        'action': '+'.join(summary['action'] for summary in summaries),
+        'actions': {summary['action']: summary['applied'] for summary in summaries},
+        'applied': sum(summary['applied'] for summary in summaries),
+        'skipped': sum(summary['skipped'] for summary in summaries),
+        'issue_ids': [issue_id for summary in summaries for issue_id in summary['issue_ids']],
+        'recipients': len(students) + len(staff),
+        'student_ids': students,
+        'staff_payrolls': staff,
+        'restocked_units': {condition: sum(summary['restocked_units'][condition] for summary in summaries)
+                            for condition in DAMAGE_CONDITIONS},
+    }
@@ -0,0 +1,258 @@
+"""
+Cached clearance statuses, keyed by a per-recipient version stamp.
+
+``get_clearance_statuses()`` is called for the same recipients over and over
+(dashboard reloads, report refreshes, receipts, the integration API) while
+their equipment rarely changes. Statuses are cached under
+``(recipient_type, recipient_id, version, day)``:
+
+- the version stamp of a recipient is bumped after every commit that
+  changed its ``recipient_clearance`` row, i.e. by every issue, return,
+  clearance and rollback path (see Utils/clearance_projection.py), so a
+  write never leaves an old status reachable: lookups read the current
+  stamp first and simply miss on entries of older versions;
+- the day is part of the key because items become Overdue with the date
+  alone.
+
+Tiers, nearest first:
+
+1. a per-request memo (always on), so one page asking for the same
+   recipient twice does the lookup once;
+2. with a shared tier (Redis, ``CLEARANCE_CACHE`` set to a ``redis://``
+   URL, needs the optional ``redis`` package), an in-process LRU of
+   ``CLEARANCE_CACHE_SIZE`` entries in front of it;
+3. the shared tier itself, holding the version stamps and statuses for
+   every worker process.
+
+The stamps must live where every worker's writes bump them, so there is no
+cross-request cache without the shared tier: ``CLEARANCE_CACHE`` unset keeps
+the per-request memo only.
+
+Statuses read while the session holds uncommitted equipment changes are
+never cached, since they may be rolled back.
+"""
+import threading
+import uuid
+from collections import OrderedDict
+
+from flask import current_app, g, has_app_context, has_request_context
+from sqlalchemy import event
+
+from extensions import db
+from Utils.clearance_integration import _midnight_utc
+from Utils.clearance_projection import CHANGED_KEY, has_pending_changes
+
+# Optional shared tier client
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except Exception:
+    redis = None
+    REDIS_AVAILABLE = False
+
+DEFAULT_SIZE = 4096
+DEFAULT_TTL = 3600  # seconds a status is kept in the shared tier
+
+_listeners_installed = False
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class SharedTier:
+    """Version stamps and statuses in a Redis-compatible store shared by every worker process.
+
+    Stamps are never expired; statuses expire after ``ttl`` seconds. The
+    epoch key changes if the store is flushed, so in-process entries cached
+    against the old stamps can't be mistaken for current ones.
+    """
+
+    def __init__(self, client, ttl=DEFAULT_TTL, prefix='clearance'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, ttl=DEFAULT_TTL):
+        return cls(redis.Redis.from_url(url), ttl=ttl)
+
+    def _stamp_key(self, key):
+        return f'{self.prefix}:v:{key[0]}:{key[1]}'
+
+    def _status_key(self, cache_key):
+        return f'{self.prefix}:s:' + ':'.join(str(part) for part in cache_key)
+
+    def read(self, keys):
+        epoch_key = f'{self.prefix}:epoch'
+        values = self.client.mget([epoch_key] + [self._stamp_key(key) for key in keys])
+        epoch = values[0]
+        if epoch is None:
+            self.client.set(epoch_key, uuid.uuid4().hex, nx=True)
+            epoch = self.client.get(epoch_key)
+        return _text(epoch), [int(value or 0) for value in values[1:]]
+
+    def bump(self, keys):
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.incr(self._stamp_key(key))
+        pipe.execute()
+
+    def get_many(self, cache_keys):
+        return [_text(value) for value in self.client.mget([self._status_key(key) for key in cache_keys])]
+
+    def set_many(self, items):
+        pipe = self.client.pipeline(transaction=False)
+        for cache_key, status in items:
+            pipe.set(self._status_key(cache_key), status, ex=self.ttl)
+        pipe.execute()
+
+
+class ClearanceCache:
+    """In-process LRU of statuses, backed by an optional ``SharedTier``, keyed by version stamp."""
+
+    def __init__(self, stamps, shared=None, size=DEFAULT_SIZE):
+        self.stamps = stamps
+        self.shared = shared
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, cache_key):
+        with self._lock:
+            status = self._entries.get(cache_key)
+            if status is not None:
+                self._entries.move_to_end(cache_key)
+            return status
+
+    def _put(self, cache_key, status):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._entries[cache_key] = status
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def statuses(self, recipient_ids, recipient_type, day, load):
+        """Statuses of ``recipient_ids``, calling ``load(missing_ids)`` for those cached at no current version."""
+        try:
+            epoch, stamps = self.stamps.read([(recipient_type, recipient_id) for recipient_id in recipient_ids])
+        except Exception as e:
+            current_app.logger.warning('Clearance cache unavailable: %s', e)
+            return load(recipient_ids)
+        cache_keys = {
+            recipient_id: (epoch, recipient_type, recipient_id, stamp, day)
+            for recipient_id, stamp in zip(recipient_ids, stamps)
+        }
+
+        found = {}
+        for recipient_id, cache_key in cache_keys.items():
+            status = self._get(cache_key)
+            if status is not None:
+                found[recipient_id] = status
+        missing = [recipient_id for recipient_id in recipient_ids if recipient_id not in found]
+        if missing and self.shared is not None:
+            try:
+                shared = self.shared.get_many([cache_keys[recipient_id] for recipient_id in missing])
+            except Exception as e:
+                current_app.logger.warning('Clearance cache unavailable: %s', e)
+                shared = [None] * len(missing)
+            for recipient_id, status in zip(missing, shared):
+                if status is not None:
+                    found[recipient_id] = status
+                    self._put(cache_keys[recipient_id], status)
+            missing = [recipient_id for recipient_id in missing if recipient_id not in found]
+
+        if missing:
+            loaded = load(missing)
+            found.update(loaded)
+            if not has_pending_changes(db.session()):
+                for recipient_id, status in loaded.items():
+                    self._put(cache_keys[recipient_id], status)
+                if self.shared is not None:
+                    try:
+                        self.shared.set_many([(cache_keys[recipient_id], status) for recipient_id, status in loaded.items()])
+                    except Exception as e:
+                        current_app.logger.warning('Clearance cache unavailable: %s', e)
+        return found
+
+    def bump(self, keys):
+        """Move ``(recipient_type, recipient_id)`` pairs to a new version; their cached statuses are never read again."""
+        self.stamps.bump(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def get_clearance_cache():
+    """Return the app's ``ClearanceCache``, or None when only the per-request memo is used."""
+    return current_app.extensions.get('clearance_cache') if has_app_context() else None
+
+
+def cached_statuses(recipient_ids, recipient_type, load):
+    """``{recipient_id: status}`` for ``recipient_ids`` through the cache tiers; ``load(ids)`` reads the rest."""
+    day = _midnight_utc().date().isoformat()
+    memo = g.setdefault('_clearance_memo', {}) if has_request_context() else {}
+    found = {}
+    for recipient_id in recipient_ids:
+        status = memo.get((recipient_type, recipient_id, day))
+        if status is not None:
+            found[recipient_id] = status
+    missing = [recipient_id for recipient_id in recipient_ids if recipient_id not in found]
+    if missing:
+        cache = get_clearance_cache()
+        loaded = cache.statuses(missing, recipient_type, day, load) if cache is not None else load(missing)
+        found.update(loaded)
+        if not has_pending_changes(db.session()):
+            memo.update(((recipient_type, recipient_id, day), status) for recipient_id, status in loaded.items())
+    return found
+
+
+def _bump_changed(session):
+    keys = session.info.pop(CHANGED_KEY, None)
+    if not keys:
+        return
+    if has_request_context() and '_clearance_memo' in g:
+        memo = g._clearance_memo
+        for memo_key in [memo_key for memo_key in memo if memo_key[:2] in keys]:
+            del memo[memo_key]
+    cache = get_clearance_cache()
+    if cache is not None:
+        try:
+            cache.bump(keys)
+        except Exception as e:
+            # Cached statuses of these recipients stay readable until the shared tier's TTL
+            current_app.logger.error('Could not bump clearance cache versions of %d recipients: %s', len(keys), e)
+
+
+def _discard_changed(session):
+    session.info.pop(CHANGED_KEY, None)
+
+
+def install_listeners():
+    global _listeners_installed
+    if _listeners_installed:
+        return
+    event.listen(db.session, 'after_commit', _bump_changed)
+    event.listen(db.session, 'after_rollback', _discard_changed)
+    _listeners_installed = True
+
+
+def init_app(app):
+    """Create the clearance status cache configured for ``app`` (``CLEARANCE_CACHE``)."""
+    mode = app.config.get('CLEARANCE_CACHE')
+    size = app.config.get('CLEARANCE_CACHE_SIZE', DEFAULT_SIZE)
+    cache = None
+    if mode == 'local':
+        # Stamps held in one process miss the writes of every other worker
+        raise ValueError("CLEARANCE_CACHE = 'local' is not supported; use a redis:// URL or leave it unset")
+    if mode and mode != 'request':
+        if not REDIS_AVAILABLE:
+            raise ValueError('CLEARANCE_CACHE is a shared cache URL but the redis package is not installed')
+        shared = SharedTier.from_url(mode, ttl=app.config.get('CLEARANCE_CACHE_TTL', DEFAULT_TTL))
+        cache = ClearanceCache(shared, shared=shared, size=size)
+    app.extensions['clearance_cache'] = cache
+    install_listeners()
+    return cache
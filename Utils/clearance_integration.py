@@ -1,7 +1,193 @@
-from models import IssuedEquipment
+from models import IssuedEquipment, ReturnLine
 from datetime import datetime, UTC
 import json
 
+from sqlalchemy import case, exists, func, or_
+
+from extensions import db
+from Utils.return_lines import unresolved_damage_filter
+
+# Recipients per IN (...) list, well below every backend's bound-parameter limit
+_CHUNK_SIZE = 900
+
+
+def _recipient_column(recipient_type):
+    return IssuedEquipment.student_id if recipient_type == 'student' else IssuedEquipment.staff_payroll
+
+
+def conditions_block_clearance(return_conditions):
+    """True when a returned item's return_conditions leave damage/loss unhandled.
+
+    Handled means the conditions record a 'replaced'/'repaired'/'waiver'
+    action (or the old 'replaced' flag); see docs/CLEARANCE_CRITERIA.md.
+    """
+    if not return_conditions:
+        return False
+    try:
+        conditions = json.loads(return_conditions)
+
+        # Check if action has been taken (replaced, repaired, or waiver)
+        if isinstance(conditions, dict):
+            # New format with action field
+            if conditions.get('action') in ('replaced', 'repaired', 'waiver'):
+                return False  # This item has been handled, so it's okay
+
+            # Check for old 'replaced' flag for backwards compatibility
+            if conditions.get('replaced'):
+                return False
+
+            # Check individual condition values for damaged/lost
+            for condition in conditions.values():
+                if isinstance(condition, str) and condition.lower() in ('damaged', 'lost'):
+                    return True  # Damaged/lost item not yet handled
+        elif isinstance(conditions, str) and conditions.lower() in ('damaged', 'lost'):
+            return True  # Damaged/lost item not handled
+    except (json.JSONDecodeError, TypeError):
+        # If we can't parse conditions, check if it contains damaged/lost keywords
+        conditions_str = str(return_conditions).lower()
+        if 'damaged' in conditions_str or 'lost' in conditions_str:
+            # Check if it also contains our action keywords
+            if 'replaced' not in conditions_str and 'repaired' not in conditions_str and 'waiver' not in conditions_str:
+                return True
+    return False
+
+
+def _midnight_utc():
+    # An item is overdue when still issued and expected_return.date() < today (UTC),
+    # i.e. expected_return is before midnight today
+    today = datetime.now(UTC).date()
+    return datetime(today.year, today.month, today.day)
+
+
+def _id_filters(column, requested):
+    if requested is None:
+        yield column.isnot(None)
+    else:
+        for start in range(0, len(requested), _CHUNK_SIZE):
+            yield column.in_(requested[start:start + _CHUNK_SIZE])
+
+
+def _status(overdue_count, outstanding_count, unresolved_damage_count):
+    if overdue_count:
+        return 'Overdue'
+    if outstanding_count or unresolved_damage_count:
+        return 'Pending'
+    return 'Cleared'
+
+
+def compute_clearance(recipient_ids=None, recipient_type='student'):
+    """
+    Evaluate the clearance criteria from the issued equipment records.
+
+    ``recipient_ids`` is an iterable of student IDs / staff payroll numbers,
+    or None for every recipient of that type with equipment on record.
+    Returns ``{recipient_id: {...}}`` for the recipients that have equipment
+    on record, with ``status``, ``item_count``, ``outstanding_count``,
+    ``overdue_count``, ``unresolved_damage_count`` and ``next_due`` (the
+    earliest expected return of an issued item that is not overdue yet).
+
+    Damage/loss comes from the issue's return lines; issues without any
+    (free-text conditions, or rows not backfilled yet) fall back to
+    ``conditions_block_clearance()`` on return_conditions. Uses one aggregate query
+    plus one query for those, whatever the number of recipients.
+    """
+    column = _recipient_column(recipient_type)
+    requested = None if recipient_ids is None else list(dict.fromkeys(recipient_ids))
+    if requested is not None and not requested:
+        return {}
+
+    midnight = _midnight_utc()
+    issued = IssuedEquipment.status == 'Issued'
+    overdue = case(
+        (issued & IssuedEquipment.expected_return.isnot(None) & (IssuedEquipment.expected_return < midnight), 1),
+        else_=0,
+    )
+    outstanding = case((IssuedEquipment.status == 'Returned', 0), else_=1)
+    upcoming = case((issued & (IssuedEquipment.expected_return >= midnight), IssuedEquipment.expected_return))
+    damaged = case((unresolved_damage_filter(), 1), else_=0)
+
+    results = {}
+    for condition in _id_filters(column, requested):
+        rows = db.session.query(
+            column, func.count(IssuedEquipment.id), func.sum(overdue), func.sum(outstanding), func.min(upcoming),
+            func.sum(damaged),
+        ).filter(condition).group_by(column)
+        for recipient_id, item_count, overdue_count, outstanding_count, next_due, damaged_count in rows:
+            results[recipient_id] = {
+                'item_count': item_count,
+                'outstanding_count': int(outstanding_count or 0),
+                'overdue_count': int(overdue_count or 0),
+                'unresolved_damage_count': int(damaged_count or 0),
+                'next_due': next_due,
+            }
+
+    # Issues without return lines: only conditions mentioning damaged/lost can block
+    lowered = func.lower(IssuedEquipment.return_conditions)
+    has_lines = exists().where(ReturnLine.issue_id == IssuedEquipment.id)
+    for condition in _id_filters(column, list(results)):
+        rows = db.session.query(column, IssuedEquipment.return_conditions).filter(
+            condition, ~has_lines, or_(lowered.like('%damaged%'), lowered.like('%lost%')),
+        )
+        for recipient_id, return_conditions in rows:
+            if conditions_block_clearance(return_conditions):
+                results[recipient_id]['unresolved_damage_count'] += 1
+
+    for result in results.values():
+        result['status'] = _status(result['overdue_count'], result['outstanding_count'],
+                                   result['unresolved_damage_count'])
+    return results
+
+
+def get_clearance_statuses(recipient_ids=None, recipient_type='student'):
+    """
+    Return ``{recipient_id: 'Cleared' | 'Pending' | 'Overdue'}`` for many recipients at once.
+
+    ``recipient_ids`` is an iterable of student IDs / staff payroll numbers,
+    or None for every recipient of that type with equipment on record;
+    requested recipients with nothing issued are 'Cleared'.
+
+    Reads the ``recipient_clearance`` projection (see
+    Utils/clearance_projection.py), a primary key lookup per recipient. An
+    issued item whose due date passed since the projection was last
+    refreshed shows up through ``next_due``, so the result is current even
+    before the nightly overdue job has run. Requested recipients missing
+    from the projection are evaluated with ``compute_clearance()``.
+
+    Statuses of requested recipients are cached per version of the
+    recipient's equipment records (see Utils/clearance_cache.py).
+    """
+    requested = None if recipient_ids is None else list(dict.fromkeys(recipient_ids))
+    if requested is None:
+        return _load_statuses(None, recipient_type)
+    if not requested:
+        return {}
+    from Utils.clearance_cache import cached_statuses
+    return cached_statuses(requested, recipient_type, lambda missing: _load_statuses(missing, recipient_type))
+
+
+def _load_statuses(requested, recipient_type):
+    from models import RecipientClearance
+    midnight = _midnight_utc()
+    statuses = {}
+    for condition in _id_filters(RecipientClearance.recipient_id, requested):
+        rows = db.session.query(
+            RecipientClearance.recipient_id, RecipientClearance.status, RecipientClearance.next_due
+        ).filter(RecipientClearance.recipient_type == recipient_type, condition)
+        if requested is None:
+            rows = rows.filter(RecipientClearance.item_count > 0)
+        for recipient_id, status, next_due in rows:
+            statuses[recipient_id] = 'Overdue' if next_due is not None and next_due < midnight else status
+
+    if requested is not None:
+        missing = [recipient_id for recipient_id in requested if recipient_id not in statuses]
+        if missing:
+            for recipient_id, result in compute_clearance(missing, recipient_type).items():
+                statuses[recipient_id] = result['status']
+            for recipient_id in missing:
+                statuses.setdefault(recipient_id, 'Cleared')  # No items issued = cleared
+    return statuses
+
+
 def get_clearance_status(recipient_id, recipient_type='student'):
     """
     Calculate clearance status dynamically based on comprehensive criteria.
@@ -24,60 +210,4 @@ def get_clearance_status(recipient_id, recipient_type='student'):
 
     Returns: 'Cleared', 'Pending', or 'Overdue'
     """
-    from app import db
-    if recipient_type == 'student':
-        items = IssuedEquipment.query.filter_by(student_id=recipient_id).all()
-    else:
-        items = IssuedEquipment.query.filter_by(staff_payroll=recipient_id).all()
-
-    if not items:
-        return 'Cleared'  # No items issued = cleared
-
-    # Check for overdue items (past expected return date and still issued)
-    today = datetime.now(UTC).date()
-    overdue_items = [item for item in items
-                    if item.status == 'Issued' and
-                    item.expected_return and
-                    item.expected_return.date() < today]
-
-    if overdue_items:
-        return 'Overdue'
-
-    # Check if all items are returned
-    all_returned = all(item.status == 'Returned' for item in items)
-    if not all_returned:
-        return 'Pending'  # Some items still issued
-
-    # All items are returned - now check return conditions
-    # If any item has damaged/lost conditions that haven't been handled (replaced/repaired/waiver), clearance is pending
-    for item in items:
-        if item.return_conditions:
-            try:
-                conditions = json.loads(item.return_conditions)
-                
-                # Check if action has been taken (replaced, repaired, or waiver)
-                if isinstance(conditions, dict):
-                    # New format with action field
-                    if conditions.get('action') in ('replaced', 'repaired', 'waiver'):
-                        continue  # This item has been handled, so it's okay
-                    
-                    # Check for old 'replaced' flag for backwards compatibility
-                    if conditions.get('replaced'):
-                        continue
-                    
-                    # Check individual condition values for damaged/lost
-                    for condition in conditions.values():
-                        if isinstance(condition, str) and condition.lower() in ('damaged', 'lost'):
-                            return 'Pending'  # Damaged/lost item not yet handled
-                elif isinstance(conditions, str) and conditions.lower() in ('damaged', 'lost'):
-                    return 'Pending'  # Damaged/lost item not handled
-            except (json.JSONDecodeError, TypeError):
-                # If we can't parse conditions, check if it contains damaged/lost keywords
-                conditions_str = str(item.return_conditions).lower()
-                if 'damaged' in conditions_str or 'lost' in conditions_str:
-                    # Check if it also contains our action keywords
-                    if 'replaced' not in conditions_str and 'repaired' not in conditions_str and 'waiver' not in conditions_str:
-                        return 'Pending'
-
-    # All items returned and all conditions are good or handled
-    return 'Cleared'
+    return get_clearance_statuses([recipient_id], recipient_type)[recipient_id]
@@ -0,0 +1,175 @@
+"""
+Materialized clearance status: the ``recipient_clearance`` projection.
+
+Clearance only changes when equipment is issued, returned, cleared
+(replaced/repaired/waived) or rolled back, so instead of re-evaluating
+every recipient's items on each lookup, ``recipient_clearance`` stores one
+row per student/staff recipient with the status and the counts behind it.
+
+- Session hooks note every recipient whose ``IssuedEquipment`` rows or
+  return lines were inserted, changed or deleted, and refresh those
+  recipients' rows just before the transaction commits. Every
+  issue/return/clearance/rollback path in both blueprints therefore updates
+  the projection in its own transaction, without code in each route.
+- Refreshes for set-based statements the ORM can't see (``Query.update``,
+  Core ``UPDATE``) are queued with ``mark_recipients()``.
+- Overdue depends on the date as well as the data: ``next_due`` holds the
+  next due date of each recipient, and ``refresh_overdue()`` (run nightly
+  by scripts/refresh_clearance.py) refreshes the recipients it has passed.
+  Lookups already treat a passed ``next_due`` as Overdue, so they are
+  correct between runs.
+
+Recipients whose rows changed are listed in ``session.info[CHANGED_KEY]``
+until the commit, when Utils/clearance_cache.py bumps their version stamps.
+"""
+from datetime import datetime
+
+from sqlalchemy import event, inspect, tuple_
+
+from extensions import db
+from models import IssuedEquipment, RecipientClearance, ReturnLine
+from Utils.clearance_integration import _CHUNK_SIZE, _midnight_utc, compute_clearance
+
+_PENDING_KEY = 'clearance_projection_pending'
+CHANGED_KEY = 'clearance_projection_changed'
+_RECIPIENT_COLUMNS = (('student_id', 'student'), ('staff_payroll', 'staff'))
+_FIELDS = ('status', 'item_count', 'outstanding_count', 'overdue_count', 'unresolved_damage_count', 'next_due')
+
+_listeners_installed = False
+
+
+def _recipients_of(item):
+    keys = set()
+    state = inspect(item)
+    for attribute, recipient_type in _RECIPIENT_COLUMNS:
+        # Current value (loads it if expired) plus any value it was changed from
+        for value in (getattr(item, attribute), *(state.attrs[attribute].history.deleted or ())):
+            if value:
+                keys.add((recipient_type, value))
+    return keys
+
+
+def mark_recipients(keys, session=None):
+    """Queue ``(recipient_type, recipient_id)`` pairs to refresh when the transaction commits."""
+    session = session or db.session()
+    session.info.setdefault(_PENDING_KEY, set()).update(keys)
+
+
+def has_pending_changes(session=None):
+    """True when ``session`` has flushed or queued equipment changes not committed yet."""
+    session = session or db.session()
+    return bool(session.info.get(_PENDING_KEY))
+
+
+def _track_changes(session, flush_context, instances):
+    changed = set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, IssuedEquipment):
+            changed.add(obj)
+        elif isinstance(obj, ReturnLine):
+            # Returning or settling damage on a line changes its issue's recipient
+            item = obj.issue or (session.get(IssuedEquipment, obj.issue_id) if obj.issue_id else None)
+            if item is not None:
+                changed.add(item)
+    if changed:
+        pending = session.info.setdefault(_PENDING_KEY, set())
+        for item in changed:
+            pending |= _recipients_of(item)
+
+
+def _refresh_pending(session):
+    session.flush()
+    keys = session.info.pop(_PENDING_KEY, None)
+    if keys:
+        refresh_recipients(keys)
+
+
+def _discard_pending(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+def install_listeners():
+    global _listeners_installed
+    if _listeners_installed:
+        return
+    event.listen(db.session, 'before_flush', _track_changes)
+    event.listen(db.session, 'before_commit', _refresh_pending)
+    event.listen(db.session, 'after_rollback', _discard_pending)
+    _listeners_installed = True
+
+
+def init_app(app):
+    """Keep ``recipient_clearance`` in step with ``issued_equipment`` for ``app``'s sessions."""
+    install_listeners()
+
+
+def refresh_recipients(keys):
+    """Recompute the projection rows of ``(recipient_type, recipient_id)`` pairs in the current transaction.
+
+    Returns the number of rows whose values changed.
+    """
+    by_type = {}
+    for recipient_type, recipient_id in keys:
+        by_type.setdefault(recipient_type, []).append(recipient_id)
+
+    changed = 0
+    now = datetime.utcnow()
+    changed_keys = db.session().info.setdefault(CHANGED_KEY, set())
+    for recipient_type, recipient_ids in by_type.items():
+        results = compute_clearance(recipient_ids, recipient_type)
+        existing = {}
+        for start in range(0, len(recipient_ids), _CHUNK_SIZE):
+            chunk = [(recipient_type, recipient_id) for recipient_id in recipient_ids[start:start + _CHUNK_SIZE]]
+            rows = RecipientClearance.query.filter(
+                tuple_(RecipientClearance.recipient_type, RecipientClearance.recipient_id).in_(chunk)
+            )
+            existing.update({row.recipient_id: row for row in rows})
+
+        for recipient_id in recipient_ids:
+            # Recipients with no items left are Cleared with zero counts
+            values = results.get(recipient_id) or {
+                'status': 'Cleared', 'item_count': 0, 'outstanding_count': 0, 'overdue_count': 0,
+                'unresolved_damage_count': 0, 'next_due': None,
+            }
+            row = existing.get(recipient_id)
+            if row is None:
+                if not values['item_count']:
+                    continue
+                row = RecipientClearance(recipient_type=recipient_type, recipient_id=recipient_id)
+                db.session.add(row)
+            elif all(getattr(row, field) == values[field] for field in _FIELDS):
+                continue
+            for field in _FIELDS:
+                setattr(row, field, values[field])
+            row.last_changed = now
+            changed_keys.add((recipient_type, recipient_id))
+            changed += 1
+    return changed
+
+
+def refresh_overdue():
+    """Refresh every recipient whose next due date has passed, flipping them to Overdue. Commits.
+
+    Returns the number of recipients refreshed.
+    """
+    keys = db.session.query(RecipientClearance.recipient_type, RecipientClearance.recipient_id).filter(
+        RecipientClearance.next_due < _midnight_utc()
+    ).all()
+    refresh_recipients([tuple(key) for key in keys])
+    db.session.commit()
+    return len(keys)
+
+
+def rebuild_projection():
+    """Recompute ``recipient_clearance`` for every recipient from the issued equipment records. Commits.
+
+    Returns the number of rows that changed.
+    """
+    keys = set()
+    for attribute, recipient_type in _RECIPIENT_COLUMNS:
+        column = getattr(IssuedEquipment, attribute)
+        keys.update((recipient_type, value) for (value,) in db.session.query(column).filter(column.isnot(None)).distinct())
+    keys.update(tuple(key) for key in db.session.query(RecipientClearance.recipient_type, RecipientClearance.recipient_id))
+    changed = refresh_recipients(keys)
+    db.session.commit()
+    return changed
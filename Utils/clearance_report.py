@@ -0,0 +1,229 @@
+"""
+Data loading for the clearance reports.
+
+A clearance report lists student/staff recipients with equipment on record:
+name, the storekeeper and campus of their most recent issue, and clearance
+status. Recipients are read a page at a time from the ``recipient_clearance``
+projection (see Utils/clearance_projection.py), so every filter runs in the
+database and each request costs two queries of bounded size:
+
+- the page: projection rows in primary key order (``recipient_type``,
+  ``recipient_id``), continued with an opaque keyset cursor. The status
+  filter uses the indexed ``status``/``next_due`` columns (a passed
+  ``next_due`` reads as Overdue, as in ``get_clearance_statuses()``). Each
+  row's latest issue is a correlated ``ORDER BY date_issued DESC LIMIT 1``
+  probe on the per-recipient issue index, restricted by the issuer, campus
+  and date filters, and run for the page rows only. Names, issuer and
+  campus are joined to the page rows only;
+- the summary counts: one ``GROUP BY`` status over the same filters.
+
+With an issuer, campus or date filter, both keep only recipients with a
+matching issue through a semi-join (``IN``) on the filtered issues, which
+are read once, instead of probing every projection row.
+"""
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import and_, case, func, or_, select, tuple_
+
+from extensions import db
+from models import IssuedEquipment, RecipientClearance, SatelliteCampus, Staff, StoreKeeper, Student
+from Utils.clearance_integration import _midnight_utc
+from Utils.pagination import KeysetPage, decode_key_cursor, encode_key_cursor
+
+REPORT_STATUSES = ('Cleared', 'Pending', 'Overdue')
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 200
+
+
+def _parse_date(value):
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+def parse_filters(args):
+    """Report filters from request args (``student_id``, ``status``, ``campus``, ``issuer``, ``date_from``, ``date_to``).
+
+    Unknown statuses and malformed campus ids or dates are ignored.
+    """
+    status = args.get('status', '').strip()
+    return {
+        # student_id is kept for backward compatibility; it matches student and staff IDs
+        'search': args.get('student_id', '').strip() or None,
+        'status': status if status in REPORT_STATUSES else None,
+        'campus_id': args.get('campus', type=int),
+        'issued_by': args.get('issuer', '').strip() or None,
+        'date_from': _parse_date(args.get('date_from')),
+        'date_to': _parse_date(args.get('date_to')),
+    }
+
+
+def filter_args(filters):
+    """Query string arguments that reproduce ``filters`` (for pagination links)."""
+    args = {
+        'student_id': filters.get('search'),
+        'status': filters.get('status'),
+        'campus': filters.get('campus_id'),
+        'issuer': filters.get('issued_by'),
+        'date_from': filters['date_from'].isoformat() if filters.get('date_from') else None,
+        'date_to': filters['date_to'].isoformat() if filters.get('date_to') else None,
+    }
+    return {key: value for key, value in args.items() if value}
+
+
+def _issue_conditions(filters):
+    conditions = []
+    if filters.get('issued_by'):
+        conditions.append(IssuedEquipment.issued_by == filters['issued_by'])
+    if filters.get('campus_id'):
+        campus_keepers = select(StoreKeeper.payroll_number).where(StoreKeeper.campus_id == filters['campus_id'])
+        conditions.append(IssuedEquipment.issued_by.in_(campus_keepers))
+    if filters.get('date_from'):
+        conditions.append(IssuedEquipment.date_issued >= datetime.combine(filters['date_from'], time.min))
+    if filters.get('date_to'):
+        conditions.append(IssuedEquipment.date_issued < datetime.combine(filters['date_to'] + timedelta(days=1), time.min))
+    return conditions
+
+
+def _latest_issue_id(issue_conditions):
+    """Correlated id of the recipient's latest issue matching ``issue_conditions``."""
+    def latest(column):
+        return (
+            select(IssuedEquipment.id)
+            .where(column == RecipientClearance.recipient_id, *issue_conditions)
+            .order_by(IssuedEquipment.date_issued.desc(), IssuedEquipment.id.desc())
+            .limit(1)
+            .correlate(RecipientClearance)
+            .scalar_subquery()
+        )
+    return case(
+        (RecipientClearance.recipient_type == 'student', latest(IssuedEquipment.student_id)),
+        else_=latest(IssuedEquipment.staff_payroll),
+    )
+
+
+def _has_issue(issue_conditions):
+    """Semi-join: the recipient has at least one issue matching ``issue_conditions``."""
+    def recipients(column):
+        return select(column).where(column.isnot(None), *issue_conditions)
+    return or_(
+        and_(RecipientClearance.recipient_type == 'student',
+             RecipientClearance.recipient_id.in_(recipients(IssuedEquipment.student_id))),
+        and_(RecipientClearance.recipient_type == 'staff',
+             RecipientClearance.recipient_id.in_(recipients(IssuedEquipment.staff_payroll))),
+    )
+
+
+def _status_condition(status, midnight):
+    overdue = RecipientClearance.next_due < midnight
+    if status == 'Overdue':
+        return or_(RecipientClearance.status == 'Overdue', overdue)
+    return and_(RecipientClearance.status == status,
+                or_(RecipientClearance.next_due.is_(None), RecipientClearance.next_due >= midnight))
+
+
+def _base(filters, midnight):
+    """(effective status, latest issue id, WHERE conditions) shared by the page and the counts."""
+    issue_conditions = _issue_conditions(filters)
+    latest_id = _latest_issue_id(issue_conditions)
+    status = case((RecipientClearance.next_due < midnight, 'Overdue'), else_=RecipientClearance.status)
+    conditions = [RecipientClearance.item_count > 0]
+    if filters.get('search'):
+        conditions.append(RecipientClearance.recipient_id.ilike(f"%{filters['search']}%"))
+    if issue_conditions:
+        conditions.append(_has_issue(issue_conditions))
+    return status, latest_id, conditions
+
+
+def _row(row):
+    return {
+        'recipient_id': row.recipient_id,
+        'recipient_type': row.recipient_type,
+        'name': row.name or 'Unknown',
+        'type': 'Student' if row.recipient_type == 'student' else 'Staff',
+        # Resolve issued_by to the storekeeper's name when it is a payroll number
+        'issued_by': row.issuer_name or row.issued_by or '',
+        'campus': row.campus or '',
+        'date_issued': row.date_issued,
+        'status': row.status,
+    }
+
+
+def load_clearance_page(filters, per_page=DEFAULT_PER_PAGE, after=None, before=None):
+    """Return a ``KeysetPage`` of report row dicts matching ``filters`` (see ``parse_filters``).
+
+    ``after``/``before`` are the ``next_cursor``/``prev_cursor`` of a previous
+    page; ``per_page`` is capped at ``MAX_PER_PAGE``.
+    """
+    per_page = min(max(per_page, 1), MAX_PER_PAGE)
+    midnight = _midnight_utc()
+    status, latest_id, conditions = _base(filters, midnight)
+    if filters.get('status'):
+        conditions.append(_status_condition(filters['status'], midnight))
+
+    key = tuple_(RecipientClearance.recipient_type, RecipientClearance.recipient_id)
+    after_pos = decode_key_cursor(after)
+    before_pos = decode_key_cursor(before)
+    backwards = before_pos is not None
+    if backwards:
+        conditions.append(key < before_pos)
+    elif after_pos is not None:
+        conditions.append(key > after_pos)
+    order = (RecipientClearance.recipient_type, RecipientClearance.recipient_id)
+    page = (
+        select(RecipientClearance.recipient_type, RecipientClearance.recipient_id,
+               status.label('status'), latest_id.label('issue_id'))
+        .where(*conditions)
+        .order_by(*(column.desc() if backwards else column.asc() for column in order))
+        .limit(per_page + 1)
+        .subquery('page')
+    )
+    query = (
+        select(
+            page.c.recipient_type,
+            page.c.recipient_id,
+            page.c.status,
+            func.coalesce(Student.name, Staff.name).label('name'),
+            IssuedEquipment.issued_by,
+            IssuedEquipment.date_issued,
+            StoreKeeper.full_name.label('issuer_name'),
+            SatelliteCampus.name.label('campus'),
+        )
+        .select_from(page)
+        .outerjoin(IssuedEquipment, IssuedEquipment.id == page.c.issue_id)
+        .outerjoin(Student, and_(page.c.recipient_type == 'student', Student.id == page.c.recipient_id))
+        .outerjoin(Staff, and_(page.c.recipient_type == 'staff', Staff.payroll_number == page.c.recipient_id))
+        .outerjoin(StoreKeeper, StoreKeeper.payroll_number == IssuedEquipment.issued_by)
+        .outerjoin(SatelliteCampus, SatelliteCampus.id == StoreKeeper.campus_id)
+    )
+    rows = sorted((_row(row) for row in db.session.execute(query)),
+                  key=lambda row: (row['recipient_type'], row['recipient_id']), reverse=backwards)
+
+    more = len(rows) > per_page
+    items = rows[:per_page]
+    if backwards:
+        items.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = after_pos is not None, more
+
+    next_cursor = prev_cursor = None
+    if items:
+        if has_next:
+            next_cursor = encode_key_cursor(items[-1]['recipient_type'], items[-1]['recipient_id'])
+        if has_prev:
+            prev_cursor = encode_key_cursor(items[0]['recipient_type'], items[0]['recipient_id'])
+    return KeysetPage(items, per_page, next_cursor=next_cursor, prev_cursor=prev_cursor)
+
+
+def status_counts(filters):
+    """Summary card counts per status for everything matching ``filters`` except the status filter."""
+    status, _, conditions = _base(filters, _midnight_utc())
+    rows = db.session.execute(
+        select(status.label('status'), func.count()).where(*conditions).group_by(status)
+    ).all()
+    counts = {'Cleared': 0, 'Pending': 0, 'Overdue': 0}
+    counts.update({row.status: row[1] for row in rows})
+    counts['Total'] = sum(counts.values())
+    return counts
@@ -0,0 +1,164 @@
+"""
+Issued counters on ``Equipment``: ``issued_count`` (issued records still
+out) and ``issued_units`` (the units they hold).
+
+``Equipment.available_quantity`` used to count the equipment's Issued rows
+each time it was read, so inventory pages ran a COUNT per row. The counters
+are now kept on the equipment row instead:
+
+- session hooks look at every ``IssuedEquipment`` row inserted, changed
+  (status, quantity, equipment) or deleted in a flush and apply the
+  difference to its equipment as a relative ``UPDATE ... SET issued_count =
+  issued_count + n``, in the same transaction. Every issue/return path in
+  both blueprints is covered without code in each route, and concurrent
+  transactions can't overwrite each other's counts;
+- ``reconcile_counters()`` (scripts/reconcile_equipment_counters.py)
+  recomputes them from ``issued_equipment``, e.g. after raw SQL imports.
+"""
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.orm.util import identity_key
+
+from extensions import db
+from models import Equipment, IssuedEquipment
+from Utils.clearance_integration import _CHUNK_SIZE
+
+_DELTAS_KEY = 'equipment_counter_deltas'
+_CHANGED_KEY = 'equipment_counters_changed'
+_TRACKED = ('status', 'quantity', 'equipment_id')
+
+_listeners_installed = False
+
+
+def _issued(status, quantity, equipment_id):
+    """``(equipment_id, count, units)`` a row with these values adds to the counters, or None."""
+    if status != 'Issued' or equipment_id is None:
+        return None
+    return equipment_id, 1, quantity or 0
+
+
+def _old_values(item):
+    state = inspect(item)
+    values = []
+    for attribute in _TRACKED:
+        history = state.attrs[attribute].history
+        values.append(history.deleted[0] if history.deleted else getattr(item, attribute))
+    return values
+
+
+def _add(deltas, counted, sign):
+    if counted is not None:
+        equipment_id, count, units = counted
+        total = deltas.setdefault(equipment_id, [0, 0])
+        total[0] += sign * count
+        total[1] += sign * units
+
+
+def _track_deleted(session, flush_context, instances):
+    # Deleted rows are read before the flush removes them
+    deltas = session.info.setdefault(_DELTAS_KEY, {})
+    for obj in session.deleted:
+        if isinstance(obj, IssuedEquipment):
+            _add(deltas, _issued(*_old_values(obj)), -1)
+
+
+def _apply_deltas(session, flush_context):
+    deltas = session.info.pop(_DELTAS_KEY, {})
+    for obj in session.new:
+        if isinstance(obj, IssuedEquipment):
+            _add(deltas, _issued(obj.status, obj.quantity, obj.equipment_id), 1)
+    for obj in session.dirty:
+        if isinstance(obj, IssuedEquipment) and session.is_modified(obj):
+            _add(deltas, _issued(*_old_values(obj)), -1)
+            _add(deltas, _issued(obj.status, obj.quantity, obj.equipment_id), 1)
+
+    table = Equipment.__table__
+    connection = session.connection()
+    changed = []
+    for equipment_id, (count, units) in deltas.items():
+        if count or units:
+            connection.execute(table.update().where(table.c.id == equipment_id).values(
+                issued_count=table.c.issued_count + count,
+                issued_units=table.c.issued_units + units,
+            ))
+            changed.append(equipment_id)
+    if changed:
+        session.info.setdefault(_CHANGED_KEY, []).extend(changed)
+
+
+def _expire_changed(session, flush_context):
+    # Loaded Equipment objects re-read their counters after the relative UPDATE
+    for equipment_id in session.info.pop(_CHANGED_KEY, ()):
+        equipment = session.identity_map.get(identity_key(Equipment, equipment_id))
+        if equipment is not None:
+            session.expire(equipment, ['issued_count', 'issued_units'])
+
+
+def _discard_deltas(session):
+    session.info.pop(_DELTAS_KEY, None)
+    session.info.pop(_CHANGED_KEY, None)
+
+
+def _load_old_value(target, value, oldvalue, initiator):
+    # Registering the listener with active_history is what matters; nothing to do here
+    pass
+
+
+def install_listeners():
+    global _listeners_installed
+    if _listeners_installed:
+        return
+    # active_history loads the previous value when an expired attribute is set,
+    # so the flush always knows what a changed row used to count for
+    for attribute in _TRACKED:
+        event.listen(getattr(IssuedEquipment, attribute), 'set', _load_old_value, active_history=True)
+    event.listen(db.session, 'before_flush', _track_deleted)
+    event.listen(db.session, 'after_flush', _apply_deltas)
+    event.listen(db.session, 'after_flush_postexec', _expire_changed)
+    event.listen(db.session, 'after_rollback', _discard_deltas)
+    _listeners_installed = True
+
+
+def init_app(app):
+    """Keep ``Equipment.issued_count``/``issued_units`` in step with issued equipment for ``app``'s sessions."""
+    install_listeners()
+
+
+def issued_totals():
+    """``{equipment_id: (count, units)}`` of issued records still out, computed from ``issued_equipment``."""
+    rows = db.session.query(
+        IssuedEquipment.equipment_id, func.count(IssuedEquipment.id), func.coalesce(func.sum(IssuedEquipment.quantity), 0)
+    ).filter(IssuedEquipment.status == 'Issued', IssuedEquipment.equipment_id.isnot(None)).group_by(
+        IssuedEquipment.equipment_id
+    )
+    return {equipment_id: (count, int(units)) for equipment_id, count, units in rows}
+
+
+def reconcile_counters(fix=True):
+    """Compare every equipment's counters with ``issued_equipment``; with ``fix``, correct them and commit.
+
+    Returns ``[(equipment_id, name, (stored count, units), (actual count, units))]`` of the
+    equipment that was off.
+    """
+    actual = issued_totals()
+    mismatched = []
+    for equipment_id, name, count, units in db.session.query(
+        Equipment.id, Equipment.name, Equipment.issued_count, Equipment.issued_units
+    ).order_by(Equipment.id):
+        expected = actual.get(equipment_id, (0, 0))
+        if (count, units) != expected:
+            mismatched.append((equipment_id, name, (count, units), expected))
+
+    if fix and mismatched:
+        # Recount in the UPDATE itself rather than writing the numbers read above,
+        # so issues made since then are not lost
+        table = Equipment.__table__
+        issued = IssuedEquipment.__table__
+        still_out = (issued.c.equipment_id == table.c.id) & (issued.c.status == 'Issued')
+        ids = [equipment_id for equipment_id, _, _, _ in mismatched]
+        for start in range(0, len(ids), _CHUNK_SIZE):
+            db.session.execute(table.update().where(table.c.id.in_(ids[start:start + _CHUNK_SIZE])).values(
+                issued_count=select(func.count()).where(still_out).scalar_subquery(),
+                issued_units=select(func.coalesce(func.sum(issued.c.quantity), 0)).where(still_out).scalar_subquery(),
+            ))
+        db.session.commit()
+    return mismatched
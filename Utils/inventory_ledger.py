@@ -0,0 +1,222 @@
+"""
+Inventory history: the ``inventory_movements`` ledger and ``inventory_snapshots``.
+
+``Equipment.quantity``, ``damaged_count`` and ``lost_count`` are changed in
+place (issues and distributions take units out, returns and replacements put
+them back, uploads add them), so the table only ever says what we hold now.
+Every change is also appended to ``inventory_movements`` as a row of deltas:
+
+- session hooks compare each ``Equipment`` row inserted, changed or deleted
+  in a flush with its previous values and insert the differences in the same
+  transaction, so every route is covered without code in each of them. The
+  movement's ``kind`` comes from what else the flush holds for that
+  equipment: a new issue, distribution or return line, a restored return
+  line, otherwise a receipt (new equipment or more units), an adjustment or
+  a removal;
+- Core UPDATEs bypass the hooks and call ``record_movements()`` themselves
+  (batch replacements in ``Utils/clearance_batch.py``).
+
+``take_snapshot()`` (scripts/snapshot_inventory.py, nightly) stores every
+equipment's stock at a point in time, and ``as_of(at)`` starts from the
+latest snapshot before ``at`` and only adds the movements since, so a
+historical report reads one day of movements however long the history is.
+The migration seeds one ``opening`` movement per equipment; history starts
+there.
+"""
+from datetime import datetime, time
+
+from flask import has_request_context
+from flask_login import current_user
+from sqlalchemy import event, func, inspect
+
+from extensions import db
+from models import CampusDistribution, Equipment, InventoryMovement, InventorySnapshot, IssuedEquipment, ReturnLine
+from Utils.clearance_integration import _CHUNK_SIZE
+
+_REMOVED_KEY = 'inventory_removed'
+_TRACKED = ('quantity', 'damaged_count', 'lost_count')
+
+_listeners_installed = False
+
+
+def _actor():
+    """Username (or payroll number) of the logged-in user, if the change comes from a request."""
+    if not has_request_context() or not getattr(current_user, 'is_authenticated', False):
+        return None
+    return getattr(current_user, 'username', None) or getattr(current_user, 'payroll_number', None)
+
+
+def _movement(equipment_id, kind, quantity=0, damaged=0, lost=0, **refs):
+    return dict(equipment_id=equipment_id, kind=kind, quantity_delta=quantity, damaged_delta=damaged,
+                lost_delta=lost, issue_id=refs.get('issue_id'), distribution_id=refs.get('distribution_id'))
+
+
+def record_movements(movements, session=None):
+    """Append ``movements`` to the ledger in the current transaction.
+
+    Each movement is a dict with ``equipment_id``, ``kind`` and any of the
+    ``*_delta``, ``issue_id`` and ``distribution_id`` columns.
+    """
+    if not movements:
+        return
+    session = session or db.session
+    actor = _actor()
+    now = datetime.utcnow()
+    defaults = {'occurred_at': now, 'actor': actor, 'quantity_delta': 0, 'damaged_delta': 0, 'lost_delta': 0,
+                'issue_id': None, 'distribution_id': None}
+    session.connection().execute(InventoryMovement.__table__.insert(), [
+        {**defaults, **movement} for movement in movements
+    ])
+
+
+def _old_values(equipment):
+    state = inspect(equipment)
+    values = []
+    for attribute in _TRACKED:
+        history = state.attrs[attribute].history
+        values.append((history.deleted[0] if history.deleted else getattr(equipment, attribute)) or 0)
+    return values
+
+
+def _track_removed(session, flush_context, instances):
+    # Deleted rows are read before the flush removes them
+    removed = session.info.setdefault(_REMOVED_KEY, [])
+    for obj in session.deleted:
+        if isinstance(obj, Equipment):
+            quantity, damaged, lost = (getattr(obj, attribute) or 0 for attribute in _TRACKED)
+            removed.append(_movement(obj.id, 'removal', -quantity, -damaged, -lost))
+
+
+def _causes(session):
+    """``{equipment_id: (kind, refs)}`` of the issues, distributions and returns in this flush."""
+    causes = {}
+    for obj in session.new:
+        if isinstance(obj, IssuedEquipment):
+            causes.setdefault(obj.equipment_id, ('issue', {'issue_id': obj.id}))
+        elif isinstance(obj, CampusDistribution):
+            causes.setdefault(obj.equipment_id, ('distribution', {'distribution_id': obj.id}))
+        elif isinstance(obj, ReturnLine):
+            # Lines are usually created with issue_id only, so look the issue up (an identity map hit)
+            issue = session.get(IssuedEquipment, obj.issue_id)
+            if issue is not None:
+                causes.setdefault(issue.equipment_id, ('return', {'issue_id': issue.id}))
+    for obj in session.dirty:
+        if isinstance(obj, ReturnLine) and obj.resolution and inspect(obj).attrs.resolution.history.added:
+            issue = session.get(IssuedEquipment, obj.issue_id)
+            if issue is not None:
+                causes.setdefault(issue.equipment_id, ('restock', {'issue_id': issue.id}))
+    return causes
+
+
+def _record_changes(session, flush_context):
+    movements = session.info.pop(_REMOVED_KEY, [])
+    changed = [obj for obj in session.new if isinstance(obj, Equipment)]
+    changed += [obj for obj in session.dirty if isinstance(obj, Equipment) and session.is_modified(obj)]
+    if not (movements or changed):
+        return
+
+    causes = _causes(session) if changed else {}
+    for equipment in changed:
+        new = [getattr(equipment, attribute) or 0 for attribute in _TRACKED]
+        if equipment in session.new:
+            movements.append(_movement(equipment.id, 'receipt', *new))
+            continue
+        deltas = [after - before for after, before in zip(new, _old_values(equipment))]
+        if not any(deltas):
+            continue
+        kind, refs = causes.get(equipment.id, (None, {}))
+        if kind is None:
+            kind = 'receipt' if deltas[0] > 0 and not any(deltas[1:]) else 'adjustment'
+        movements.append(_movement(equipment.id, kind, *deltas, **refs))
+    record_movements(movements, session)
+
+
+def _discard_removed(session):
+    session.info.pop(_REMOVED_KEY, None)
+
+
+def _load_old_value(target, value, oldvalue, initiator):
+    # Registering the listener with active_history is what matters; nothing to do here
+    pass
+
+
+def install_listeners():
+    global _listeners_installed
+    if _listeners_installed:
+        return
+    # active_history loads the previous value when an expired attribute is set,
+    # so the flush always knows how much a change moved
+    for attribute in _TRACKED:
+        event.listen(getattr(Equipment, attribute), 'set', _load_old_value, active_history=True)
+    event.listen(db.session, 'before_flush', _track_removed)
+    event.listen(db.session, 'after_flush', _record_changes)
+    event.listen(db.session, 'after_rollback', _discard_removed)
+    _listeners_installed = True
+
+
+def init_app(app):
+    """Record every stock change made through ``app``'s sessions in ``inventory_movements``."""
+    install_listeners()
+
+
+def _for_equipment(query, column, equipment_ids):
+    """Run ``query`` once per chunk of ``equipment_ids`` (or once for all equipment) and chain the rows."""
+    if equipment_ids is None:
+        return list(query)
+    ids = list(equipment_ids)
+    rows = []
+    for start in range(0, len(ids), _CHUNK_SIZE):
+        rows.extend(query.filter(column.in_(ids[start:start + _CHUNK_SIZE])))
+    return rows
+
+
+def latest_snapshot(at):
+    """When the latest snapshot taken at or before ``at`` was taken, or None."""
+    return db.session.query(func.max(InventorySnapshot.taken_at)).filter(InventorySnapshot.taken_at <= at).scalar()
+
+
+def as_of(at, equipment_ids=None):
+    """Stock held at ``at``: ``{equipment_id: {'quantity', 'damaged_count', 'lost_count'}}``.
+
+    Starts from the latest snapshot at or before ``at`` and adds the movements
+    after it up to ``at`` (inclusive). Equipment with no history by then is left out.
+    """
+    totals = {}
+    taken_at = latest_snapshot(at)
+    if taken_at is not None:
+        snapshot = db.session.query(
+            InventorySnapshot.equipment_id, InventorySnapshot.quantity,
+            InventorySnapshot.damaged_count, InventorySnapshot.lost_count,
+        ).filter(InventorySnapshot.taken_at == taken_at)
+        for equipment_id, quantity, damaged, lost in _for_equipment(snapshot, InventorySnapshot.equipment_id, equipment_ids):
+            totals[equipment_id] = {'quantity': quantity, 'damaged_count': damaged, 'lost_count': lost}
+
+    deltas = db.session.query(
+        InventoryMovement.equipment_id, func.sum(InventoryMovement.quantity_delta),
+        func.sum(InventoryMovement.damaged_delta), func.sum(InventoryMovement.lost_delta),
+    ).filter(InventoryMovement.occurred_at <= at)
+    if taken_at is not None:
+        deltas = deltas.filter(InventoryMovement.occurred_at > taken_at)
+    deltas = deltas.group_by(InventoryMovement.equipment_id)
+    for equipment_id, quantity, damaged, lost in _for_equipment(deltas, InventoryMovement.equipment_id, equipment_ids):
+        row = totals.setdefault(equipment_id, {'quantity': 0, 'damaged_count': 0, 'lost_count': 0})
+        row['quantity'] += int(quantity or 0)
+        row['damaged_count'] += int(damaged or 0)
+        row['lost_count'] += int(lost or 0)
+    return totals
+
+
+def take_snapshot(at=None):
+    """Store every equipment's stock at ``at`` (default: the start of today, UTC). Commits.
+
+    Returns the number of rows written, 0 when a snapshot of ``at`` already exists.
+    """
+    if at is None:
+        at = datetime.combine(datetime.utcnow().date(), time.min)
+    if db.session.query(InventorySnapshot.taken_at).filter(InventorySnapshot.taken_at == at).first() is not None:
+        return 0
+    rows = [{'taken_at': at, 'equipment_id': equipment_id, **values} for equipment_id, values in as_of(at).items()]
+    if rows:
+        db.session.execute(InventorySnapshot.__table__.insert(), rows)
+    db.session.commit()
+    return len(rows)
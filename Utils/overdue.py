@@ -0,0 +1,43 @@
+"""
+Due issued equipment: still Issued with an expected return of today or earlier.
+
+"Due" used to be written ``func.date(expected_return) <= today``, which hides
+the column inside a function so no index can serve it, and every issue ever
+recorded was scanned. ``due_filter()`` states the same thing as a range,
+``expected_return < start of tomorrow``, so the partial index
+``ix_issued_equipment_due`` (``expected_return WHERE status = 'Issued'``)
+answers it. That index holds only the equipment currently out, and the
+database keeps it current on every issue and return, so the dashboards read
+a small precomputed set, not the whole table. Recipients flip to Overdue in
+``recipient_clearance`` through the nightly scripts/refresh_clearance.py.
+"""
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import and_, literal_column
+from sqlalchemy.orm import selectinload
+
+from models import IssuedEquipment
+
+# Rendered inline rather than as a bound parameter, so the planner can match the
+# partial index predicate even when it plans a prepared statement before binding
+ISSUED = literal_column("'Issued'")
+
+
+def due_before(today=None):
+    """Start of the day after ``today`` (local date by default): anything expected back before it is due."""
+    today = today or datetime.now().date()
+    return datetime.combine(today + timedelta(days=1), time.min)
+
+
+def due_filter(today=None):
+    """SQL condition: the issue is still out and was due back ``today`` or earlier."""
+    return and_(IssuedEquipment.status == ISSUED, IssuedEquipment.expected_return < due_before(today))
+
+
+def due_issues(*filters, today=None):
+    """Query of due issues matching ``filters``, earliest due first, recipients and equipment loaded with them."""
+    return IssuedEquipment.query.options(
+        selectinload(IssuedEquipment.student),
+        selectinload(IssuedEquipment.staff),
+        selectinload(IssuedEquipment.equipment),
+    ).filter(due_filter(today), *filters).order_by(IssuedEquipment.expected_return.asc())
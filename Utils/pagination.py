@@ -0,0 +1,124 @@
+"""
+Keyset (cursor) pagination over a (timestamp, id) ordering.
+
+OFFSET pagination makes the database walk and discard every earlier row, so
+deep pages get slower and slower. Keyset pagination remembers the last row of
+the page instead and asks for rows strictly "after" it, which an index on
+(..., timestamp, id) answers with a single range scan no matter how deep the
+page is.
+
+Cursors are opaque url-safe strings; ``KeysetPage`` exposes ``next_cursor``
+(older rows) and ``prev_cursor`` (newer rows) for templates and JSON APIs.
+``encode_key_cursor``/``decode_key_cursor`` do the same for string keys such
+as (recipient_type, recipient_id).
+"""
+import base64
+from datetime import datetime
+
+from sqlalchemy import and_, or_, tuple_
+
+from extensions import db
+
+
+def encode_cursor(timestamp, row_id):
+    """Encode a (timestamp, id) position as an opaque url-safe string."""
+    raw = f"{timestamp.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by ``encode_cursor``. Returns None if it is missing or malformed."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        ts, row_id = base64.urlsafe_b64decode(padded.encode()).decode().split('|', 1)
+        return datetime.fromisoformat(ts), int(row_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def encode_key_cursor(*parts):
+    """Encode a position on a string key such as (recipient_type, recipient_id) as an opaque cursor."""
+    raw = '|'.join(str(part) for part in parts)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_key_cursor(cursor, size=2):
+    """Decode a cursor produced by ``encode_key_cursor`` into a ``size``-tuple; None if missing or malformed.
+
+    Only the last part may contain ``|``.
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        parts = tuple(base64.urlsafe_b64decode(padded.encode()).decode().split('|', size - 1))
+    except (ValueError, TypeError):
+        return None
+    return parts if len(parts) == size else None
+
+
+class KeysetPage:
+    """One page of rows plus the cursors to reach its neighbours."""
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def _after(ts_col, id_col, position, older):
+    ts, row_id = position
+    if db.session.get_bind().dialect.name in ('postgresql', 'sqlite'):
+        # Row-value comparison maps straight onto a composite index range scan
+        key = tuple_(ts_col, id_col)
+        return key < (ts, row_id) if older else key > (ts, row_id)
+    if older:
+        return or_(ts_col < ts, and_(ts_col == ts, id_col < row_id))
+    return or_(ts_col > ts, and_(ts_col == ts, id_col > row_id))
+
+
+def keyset_paginate(query, ts_col, id_col, per_page, after=None, before=None):
+    """Return a ``KeysetPage`` of ``query`` ordered newest first by (ts_col, id_col).
+
+    ``after`` continues with rows older than the cursor, ``before`` goes back to
+    rows newer than it; with neither the newest page is returned.
+    """
+    per_page = max(1, per_page)
+    after_pos = decode_cursor(after)
+    before_pos = decode_cursor(before)
+
+    if before_pos is not None:
+        rows = (query.filter(_after(ts_col, id_col, before_pos, older=False))
+                .order_by(ts_col.asc(), id_col.asc())
+                .limit(per_page + 1).all())
+        more_newer = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        has_prev, has_next = more_newer, True
+    else:
+        if after_pos is not None:
+            query = query.filter(_after(ts_col, id_col, after_pos, older=True))
+        rows = query.order_by(ts_col.desc(), id_col.desc()).limit(per_page + 1).all()
+        items = rows[:per_page]
+        has_prev, has_next = after_pos is not None, len(rows) > per_page
+
+    def position(row):
+        return getattr(row, ts_col.key), getattr(row, id_col.key)
+
+    next_cursor = prev_cursor = None
+    if items:
+        if has_next:
+            next_cursor = encode_cursor(*position(items[-1]))
+        if has_prev:
+            prev_cursor = encode_cursor(*position(items[0]))
+    return KeysetPage(items, per_page, next_cursor=next_cursor, prev_cursor=prev_cursor)
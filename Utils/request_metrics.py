@@ -0,0 +1,177 @@
+"""
+Per-request timing and payload instrumentation.
+
+App-level hooks time every request, count the SQL statements it runs and how
+long they took, and record the response status and size. The blueprint access
+logging hooks attach their audit record with ``attach_audit_record()``; it is
+completed with these measurements and handed to the audit sink when the
+request is torn down, so ``AccessLog.duration_ms``, ``status_code``,
+``data_size_bytes``, ``db_time_ms`` and ``sql_count`` are filled in.
+"""
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app, g, has_request_context
+from sqlalchemy import event, func
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import aliased
+
+from extensions import db
+from models import AccessLog, AccessLogDimension
+
+_listeners_installed = False
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start_time')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    if has_request_context():
+        metrics = g.get('_request_metrics')
+        if metrics is not None:
+            metrics['db_time'] += elapsed
+            metrics['sql_count'] += 1
+
+
+def _start_request_metrics():
+    g._request_metrics = {'start': time.perf_counter(), 'db_time': 0.0, 'sql_count': 0}
+
+
+def _record_response(response):
+    metrics = g.get('_request_metrics')
+    if metrics is not None:
+        metrics['status_code'] = response.status_code
+        size = response.content_length
+        if size is None and not response.is_streamed:
+            size = len(response.get_data())
+        metrics['size'] = size
+    return response
+
+
+def _finish_request_metrics(exc):
+    record = g.pop('_audit_record', None)
+    metrics = g.pop('_request_metrics', None)
+    if record is None:
+        return
+    if metrics is not None:
+        record['duration_ms'] = int((time.perf_counter() - metrics['start']) * 1000)
+        record['db_time_ms'] = int(metrics['db_time'] * 1000)
+        record['sql_count'] = metrics['sql_count']
+        record['status_code'] = metrics.get('status_code', 500 if exc else None)
+        record['data_size_bytes'] = metrics.get('size')
+    if exc is not None or (record.get('status_code') or 0) >= 500:
+        record['action_status'] = 'Failure'
+    # The request is over: discard whatever its handler left uncommitted (the
+    # app context teardown would) and give its connection back, so the audit
+    # write, on a session of its own, never waits for a second connection
+    db.session.rollback()
+    try:
+        from Utils.audit_sink import get_audit_sink
+        get_audit_sink().submit(record)
+    except Exception as e:
+        # Don't let logging errors break the app
+        current_app.logger.warning('Access log submit failed: %s', e)
+
+
+def attach_audit_record(record):
+    """Attach an access log record to the current request.
+
+    The record is completed with timing/response data and submitted to the
+    audit sink when the request is torn down.
+    """
+    for key in ('duration_ms', 'db_time_ms', 'sql_count', 'status_code', 'data_size_bytes'):
+        record.setdefault(key, None)
+    g._audit_record = record
+
+
+def annotate_audit_record(**fields):
+    """Set fields (e.g. ``action``, ``record_id``, ``data_changed``) on the current request's audit record, if any."""
+    record = g.get('_audit_record') if has_request_context() else None
+    if record is not None:
+        record.update(fields)
+    return record
+
+
+def init_app(app):
+    """Register the request hooks and the (process-wide) SQL timing listeners."""
+    global _listeners_installed
+    if not _listeners_installed:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _listeners_installed = True
+    app.before_request(_start_request_metrics)
+    app.after_request(_record_response)
+    app.teardown_request(_finish_request_metrics)
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+def endpoint_latency_stats(days=7, limit=50):
+    """Per-endpoint request count and p50/p95/p99 latency (ms) over the last ``days`` days.
+
+    Uses percentile_cont on PostgreSQL; other databases compute the
+    percentiles in Python from the (endpoint, duration_ms) pairs.
+    """
+    since = datetime.utcnow() - timedelta(days=days)
+    base_filter = (AccessLog.timestamp >= since, AccessLog.duration_ms.isnot(None))
+    # Join the interned endpoint names once instead of a subquery per row; rows
+    # written in full keep the name inline and have no endpoint_id
+    dimension = aliased(AccessLogDimension)
+    endpoint = func.coalesce(AccessLog._endpoint, dimension.value)
+
+    def query(*columns):
+        q = db.session.query(endpoint, *columns).outerjoin(dimension, dimension.id == AccessLog.endpoint_id)
+        return q.filter(*base_filter)
+
+    if db.engine.dialect.name == 'postgresql':
+        rows = query(
+            func.count(AccessLog.id),
+            func.percentile_cont(0.5).within_group(AccessLog.duration_ms),
+            func.percentile_cont(0.95).within_group(AccessLog.duration_ms),
+            func.percentile_cont(0.99).within_group(AccessLog.duration_ms),
+            func.avg(AccessLog.db_time_ms),
+            func.avg(AccessLog.sql_count),
+        ).group_by(endpoint).all()
+        stats = [
+            {'endpoint': r[0], 'count': r[1], 'p50': r[2], 'p95': r[3], 'p99': r[4],
+             'avg_db_ms': float(r[5]) if r[5] is not None else None,
+             'avg_sql_count': float(r[6]) if r[6] is not None else None}
+            for r in rows
+        ]
+    else:
+        grouped = {}
+        rows = query(AccessLog.duration_ms, AccessLog.db_time_ms, AccessLog.sql_count).yield_per(1000)
+        for endpoint, duration, db_ms, sql_count in rows:
+            entry = grouped.setdefault(endpoint, {'durations': [], 'db_ms': [], 'sql': []})
+            entry['durations'].append(duration)
+            if db_ms is not None:
+                entry['db_ms'].append(db_ms)
+            if sql_count is not None:
+                entry['sql'].append(sql_count)
+        stats = []
+        for endpoint, entry in grouped.items():
+            durations = sorted(entry['durations'])
+            stats.append({
+                'endpoint': endpoint,
+                'count': len(durations),
+                'p50': _percentile(durations, 0.5),
+                'p95': _percentile(durations, 0.95),
+                'p99': _percentile(durations, 0.99),
+                'avg_db_ms': sum(entry['db_ms']) / len(entry['db_ms']) if entry['db_ms'] else None,
+                'avg_sql_count': sum(entry['sql']) / len(entry['sql']) if entry['sql'] else None,
+            })
+
+    stats.sort(key=lambda s: s['p95'] or 0, reverse=True)
+    return stats[:limit]
@@ -0,0 +1,166 @@
+"""
+Returned equipment as rows: the ``return_lines`` table.
+
+``IssuedEquipment.return_conditions`` is a JSON blob in several shapes:
+
+- ``{serial: condition, ...}`` (bulk serial returns),
+- ``{'conditions': {serial: condition}, 'quantities': {serial: n}}`` (serial returns),
+- ``{'all': condition, 'quantity': n}`` (non-serial returns),
+- ``{'replaced': True}`` and ``{'action': 'replaced'|'repaired'|'waiver', ...}``
+  once damage or loss has been settled, which replaces the conditions.
+
+Every return also writes one ``ReturnLine`` per serial (or one per
+non-serial return) with its quantity and condition, and settling damage sets
+``resolution`` on the damaged/lost lines instead of losing them. Damage and
+loss counts and filters are therefore SQL aggregates over return_lines. The
+blob is still written for the receipts and templates that display it.
+
+Issues returned before return_lines existed are converted by the
+``return_lines`` migration (with a frozen copy of ``parse_return_conditions()``)
+or scripts/backfill_return_lines.py.
+"""
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, exists, func
+
+from extensions import db
+from models import IssuedEquipment, ReturnLine
+
+CONDITIONS = ('Good', 'Damaged', 'Lost')
+DAMAGE_CONDITIONS = ('Damaged', 'Lost')
+RESOLUTIONS = ('replaced', 'repaired', 'waiver')
+
+
+def _condition(value):
+    if isinstance(value, str) and value.strip().capitalize() in CONDITIONS:
+        return value.strip().capitalize()
+    return None
+
+
+def _quantity(value, default=1):
+    try:
+        return max(1, int(value))
+    except (TypeError, ValueError):
+        return default
+
+
+def parse_return_conditions(raw):
+    """Split a return_conditions blob into ``([(serial, quantity, condition)], resolution)``."""
+    if not raw:
+        return [], None
+    try:
+        data = json.loads(raw)
+    except (json.JSONDecodeError, TypeError):
+        # Bare condition words were stored unquoted by older code
+        condition = _condition(raw)
+        return ([(None, 1, condition)] if condition else []), None
+
+    if isinstance(data, str):
+        condition = _condition(data)
+        return ([(None, 1, condition)] if condition else []), None
+    if not isinstance(data, dict):
+        return [], None
+
+    if data.get('action') in RESOLUTIONS:
+        return [], data['action']
+    if data.get('replaced'):
+        return [], 'replaced'
+    if isinstance(data.get('conditions'), dict):
+        quantities = data.get('quantities') or {}
+        lines = []
+        for serial, value in data['conditions'].items():
+            condition = _condition(value)
+            if condition:
+                lines.append((str(serial), _quantity(quantities.get(serial)), condition))
+        return lines, None
+    if 'all' in data:
+        condition = _condition(data['all'])
+        return ([(None, _quantity(data.get('quantity')), condition)] if condition else []), None
+
+    lines = []
+    for serial, value in data.items():
+        condition = _condition(value)
+        if condition:
+            lines.append((str(serial), 1, condition))
+    return lines, None
+
+
+def record_return(issue, conditions, quantities=None, returned_at=None):
+    """Add the lines of one return to ``issue``.
+
+    ``conditions`` maps each returned serial (None for a non-serial return)
+    to its condition; ``quantities`` optionally maps them to a quantity.
+    Runs in the caller's transaction.
+    """
+    returned_at = returned_at or datetime.utcnow()
+    quantities = quantities or {}
+    lines = []
+    for serial, condition in conditions.items():
+        line = ReturnLine(issue_id=issue.id, serial=serial, quantity=_quantity(quantities.get(serial)),
+                          condition=condition, returned_at=returned_at)
+        db.session.add(line)
+        lines.append(line)
+    return lines
+
+
+def unresolved_damage_lines(issue):
+    """Damaged/lost lines of ``issue`` that have not been replaced, repaired or waived."""
+    return [line for line in issue.return_lines
+            if line.condition in DAMAGE_CONDITIONS and line.resolution is None]
+
+
+def resolve_damage(issue, resolution, resolved_at=None):
+    """Settle the unresolved damaged/lost lines of ``issue``; returns the lines changed."""
+    lines = unresolved_damage_lines(issue)
+    resolved_at = resolved_at or datetime.utcnow()
+    for line in lines:
+        line.resolution = resolution
+        line.resolved_at = resolved_at
+    return lines
+
+
+def unresolved_damage_filter():
+    """SQL condition: the issue has damaged/lost lines that are still unresolved."""
+    return exists().where(and_(
+        ReturnLine.issue_id == IssuedEquipment.id,
+        ReturnLine.condition.in_(DAMAGE_CONDITIONS),
+        ReturnLine.resolution.is_(None),
+    ))
+
+
+def condition_totals(*filters):
+    """Return ``{condition: units}`` over return lines of issues matching ``filters``."""
+    query = db.session.query(ReturnLine.condition, func.coalesce(func.sum(ReturnLine.quantity), 0))
+    if filters:
+        query = query.join(IssuedEquipment, IssuedEquipment.id == ReturnLine.issue_id).filter(*filters)
+    totals = {condition: 0 for condition in CONDITIONS}
+    for condition, units in query.group_by(ReturnLine.condition):
+        totals[condition] = int(units)
+    return totals
+
+
+def backfill_return_lines(chunk_size=1000):
+    """Create return lines for issues returned before they existed, committing per chunk.
+
+    Only issues with return_conditions and no lines yet are converted, so it
+    can be re-run safely. Returns the number of issues converted.
+    """
+    converted = 0
+    last_id = 0
+    has_lines = exists().where(ReturnLine.issue_id == IssuedEquipment.id)
+    while True:
+        rows = (db.session.query(IssuedEquipment.id, IssuedEquipment.return_conditions, IssuedEquipment.date_returned)
+                .filter(IssuedEquipment.id > last_id, IssuedEquipment.return_conditions.isnot(None), ~has_lines)
+                .order_by(IssuedEquipment.id)
+                .limit(chunk_size).all())
+        if not rows:
+            return converted
+        for issue_id, raw, date_returned in rows:
+            lines, resolution = parse_return_conditions(raw)
+            for serial, quantity, condition in lines:
+                db.session.add(ReturnLine(issue_id=issue_id, serial=serial, quantity=quantity,
+                                          condition=condition, returned_at=date_returned))
+            converted += 1 if lines else 0
+        db.session.commit()
+        last_id = rows[-1][0]
@@ -0,0 +1,172 @@
+"""
+Serial number registry: the ``serial_registry`` table.
+
+Both issue routes refused serial numbers already used by an earlier issue by
+loading every issue with serials, decoding its ``serial_numbers`` JSON and
+building a set, on every submit. ``serial_registry`` has one row per serial
+ever issued instead, with a unique index on ``serial``, so:
+
+- ``serials_in_use()`` is one index probe per serial, and the index itself
+  rejects a serial two concurrent issues both try to take;
+- ``serial_holder()`` answers "who has serial X" with the same probe.
+
+Session hooks keep the table current in the issue's transaction: a new
+``IssuedEquipment`` registers its serials as ``issued``, a serial
+``ReturnLine`` moves its serial to ``returned``/``damaged``/``lost``, and an
+issue marked Returned without per-serial lines returns its remaining serials.
+Serials issued before the table existed are added by
+``backfill_serial_registry()`` (scripts/backfill_serial_registry.py), in
+small committed batches so it can run while the app is serving. Run it right
+after the migration: until it has finished, serials of older issues are not
+known to ``serials_in_use()``.
+"""
+import json
+from datetime import datetime
+
+from sqlalchemy import event, func, inspect
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from models import IssuedEquipment, ReturnLine, SerialRegistry
+from Utils.clearance_integration import _CHUNK_SIZE
+
+STATE_BY_CONDITION = {'Good': 'returned', 'Damaged': 'damaged', 'Lost': 'lost'}
+
+_listeners_installed = False
+
+
+def issue_serials(issue):
+    """The serial numbers recorded on ``issue``, stripped, without blanks or repeats."""
+    if not issue.serial_numbers:
+        return []
+    try:
+        serials = json.loads(issue.serial_numbers)
+    except (TypeError, ValueError):
+        return []
+    if not isinstance(serials, list):
+        return []
+    return list(dict.fromkeys(str(serial).strip() for serial in serials if serial is not None and str(serial).strip()))
+
+
+def _status_changed_to_returned(issue):
+    history = inspect(issue).attrs.status.history
+    return issue.status == 'Returned' and history.added and 'Returned' not in (history.deleted or ())
+
+
+def _register(session, flush_context):
+    issued, returned, lines = [], [], []
+    for obj in session.new:
+        if isinstance(obj, IssuedEquipment):
+            issued.append(obj)
+        elif isinstance(obj, ReturnLine) and obj.serial:
+            lines.append(obj)
+    for obj in session.dirty:
+        if isinstance(obj, IssuedEquipment) and _status_changed_to_returned(obj):
+            returned.append(obj)
+    if not (issued or returned or lines):
+        return
+
+    table = SerialRegistry.__table__
+    connection = session.connection()
+    now = datetime.utcnow()
+    rows = [{'serial': serial, 'equipment_id': issue.equipment_id, 'current_issue_id': issue.id,
+             'state': 'returned' if issue.status == 'Returned' else 'issued', 'updated_at': now}
+            for issue in issued for serial in issue_serials(issue)]
+    if rows:
+        # The unique index raises IntegrityError for a serial already registered
+        connection.execute(table.insert(), rows)
+    for issue in returned:
+        connection.execute(table.update().where(
+            table.c.current_issue_id == issue.id, table.c.state == 'issued'
+        ).values(state='returned', updated_at=now))
+    # Per-serial lines come last, so a damaged or lost serial keeps that state
+    for line in lines:
+        connection.execute(table.update().where(table.c.serial == line.serial.strip()).values(
+            current_issue_id=line.issue_id, state=STATE_BY_CONDITION.get(line.condition, 'returned'), updated_at=now,
+        ))
+
+
+def install_listeners():
+    global _listeners_installed
+    if _listeners_installed:
+        return
+    event.listen(db.session, 'after_flush', _register)
+    _listeners_installed = True
+
+
+def init_app(app):
+    """Keep ``serial_registry`` in step with issues and returns for ``app``'s sessions."""
+    install_listeners()
+
+
+def serials_in_use(serials):
+    """The serials among ``serials`` that have already been issued, as a set."""
+    serials = list({serial.strip() for serial in serials if serial and serial.strip()})
+    in_use = set()
+    for start in range(0, len(serials), _CHUNK_SIZE):
+        in_use.update(serial for (serial,) in db.session.query(SerialRegistry.serial).filter(
+            SerialRegistry.serial.in_(serials[start:start + _CHUNK_SIZE])))
+    return in_use
+
+
+def serial_holder(serial):
+    """The registry row of ``serial`` (its equipment, state and current issue), or None."""
+    return SerialRegistry.query.filter_by(serial=serial.strip()).first()
+
+
+def backfill_serial_registry(batch_size=500, after_id=0, progress=None):
+    """Register the serials of issues recorded before ``serial_registry`` existed.
+
+    Walks ``issued_equipment`` by id in batches of ``batch_size`` after
+    ``after_id``, committing each batch, and calls ``progress(last_id)`` after
+    each. Serials already registered are left alone unless this issue is newer
+    than the one they point at. Safe to re-run. Returns the number of rows written.
+    """
+    table = SerialRegistry.__table__
+    written = 0
+    while True:
+        issues = IssuedEquipment.query.filter(
+            IssuedEquipment.id > after_id, IssuedEquipment.serial_numbers.isnot(None)
+        ).order_by(IssuedEquipment.id).limit(batch_size).all()
+        if not issues:
+            return written
+
+        states = {}
+        lines = ReturnLine.query.filter(
+            ReturnLine.issue_id.in_([issue.id for issue in issues]), ReturnLine.serial.isnot(None)
+        ).order_by(ReturnLine.returned_at, ReturnLine.id)
+        for line in lines:
+            states[(line.issue_id, line.serial.strip())] = STATE_BY_CONDITION.get(line.condition, 'returned')
+
+        rows = {}
+        for issue in issues:
+            for serial in issue_serials(issue):
+                state = states.get((issue.id, serial)) or ('returned' if issue.status == 'Returned' else 'issued')
+                rows[serial] = {'equipment_id': issue.equipment_id, 'current_issue_id': issue.id, 'state': state}
+        existing = {}
+        serials = list(rows)
+        for start in range(0, len(serials), _CHUNK_SIZE):
+            existing.update(db.session.query(SerialRegistry.serial, SerialRegistry.current_issue_id).filter(
+                SerialRegistry.serial.in_(serials[start:start + _CHUNK_SIZE])))
+        now = datetime.utcnow()
+        batch_written = 0
+        try:
+            for serial, row in rows.items():
+                if serial not in existing:
+                    db.session.execute(table.insert().values(serial=serial, updated_at=now, **row))
+                    batch_written += 1
+                elif (existing[serial] or 0) < row['current_issue_id']:
+                    db.session.execute(table.update().where(
+                        table.c.serial == serial, func.coalesce(table.c.current_issue_id, 0) < row['current_issue_id']
+                    ).values(updated_at=now, **row))
+                    batch_written += 1
+            db.session.commit()
+        except IntegrityError:
+            # A new issue registered one of these serials meanwhile: redo the batch
+            db.session.rollback()
+            continue
+        written += batch_written
+
+        after_id = issues[-1].id
+        if progress:
+            progress(after_id)
@@ -0,0 +1,120 @@
+"""
+Taking units out of stock without overselling.
+
+The issue and distribution routes used to read ``Equipment.quantity`` (or a
+campus's availability), check it in Python and write back
+``quantity - n``. Two requests issuing the last units at the same moment
+both passed the check, and one of the writes was lost. Stock is now taken
+with single conditional statements, so the database does the check and the
+write as one step on a locked row:
+
+- ``take_equipment_units()``:
+  ``UPDATE equipment SET quantity = quantity - :n WHERE id = :id AND quantity >= :n``;
+- ``Utils.campus_stock.claim_campus_units()``:
+  ``UPDATE campus_stock SET issued_out = issued_out + :n WHERE ... AND distributed - issued_out >= :n``.
+
+No row matched means not enough stock: ``InsufficientStock`` is raised with
+what was available. Units coming back (returns, receipts, edits) are added
+the same way with ``put_equipment_units()`` / ``return_equipment_units()``:
+``SET quantity = quantity + :n`` rather than writing a loaded value plus
+``n`` back, which would undo a take committed in between. Transactions take campus rows before equipment rows, and
+``commit_with_retry()`` re-runs the whole unit of work when the database
+still reports a deadlock or lock timeout (``OperationalError``).
+"""
+import random
+import time
+
+from sqlalchemy import case, func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm.util import identity_key
+
+from extensions import db
+from models import Equipment
+from Utils.inventory_ledger import record_movements
+
+RETRY_ATTEMPTS = 5
+_RETRY_BACKOFF = 0.05
+
+
+class InsufficientStock(Exception):
+    """Fewer than ``requested`` units were left; ``available`` is what there was."""
+
+    def __init__(self, available, requested):
+        super().__init__(f'Not enough items available. Available: {available}, Requested: {requested}')
+        self.available = available
+        self.requested = requested
+
+
+def take_equipment_units(equipment_id, units, kind, check=True, **refs):
+    """Take ``units`` off the equipment's ``quantity`` in one statement and record the movement.
+
+    With ``check`` the UPDATE only applies while at least ``units`` are left,
+    otherwise ``InsufficientStock`` is raised. ``kind`` and ``refs``
+    (``issue_id``/``distribution_id``) go to the inventory ledger.
+    """
+    table = Equipment.__table__
+    quantity = func.coalesce(table.c.quantity, 0)
+    statement = table.update().where(table.c.id == equipment_id).values(quantity=quantity - units)
+    if check:
+        statement = statement.where(quantity >= units)
+    if db.session.execute(statement).rowcount == 0:
+        available = db.session.query(Equipment.quantity).filter(Equipment.id == equipment_id).scalar()
+        raise InsufficientStock(available or 0, units)
+
+    _expire_loaded(equipment_id, ['quantity'])
+    record_movements([{'equipment_id': equipment_id, 'kind': kind, 'quantity_delta': -units, **refs}])
+
+
+def put_equipment_units(equipment_id, kind, quantity=0, damaged=0, lost=0, **refs):
+    """Add to the equipment's ``quantity``, ``damaged_count`` and ``lost_count`` in one statement and record the movement.
+
+    The deltas are applied relative to what the row holds when the UPDATE
+    runs; a negative ``quantity`` stops at zero. ``kind`` and ``refs`` go to
+    the inventory ledger.
+    """
+    if not (quantity or damaged or lost):
+        return
+    table = Equipment.__table__
+    new_quantity = func.coalesce(table.c.quantity, 0) + quantity
+    db.session.execute(table.update().where(table.c.id == equipment_id).values(
+        quantity=case((new_quantity < 0, 0), else_=new_quantity),
+        damaged_count=func.coalesce(table.c.damaged_count, 0) + damaged,
+        lost_count=func.coalesce(table.c.lost_count, 0) + lost,
+    ))
+    _expire_loaded(equipment_id, ['quantity', 'damaged_count', 'lost_count'])
+    record_movements([{'equipment_id': equipment_id, 'kind': kind, 'quantity_delta': quantity,
+                       'damaged_delta': damaged, 'lost_delta': lost, **refs}])
+
+
+def return_equipment_units(equipment_id, good=0, damaged=0, lost=0, **refs):
+    """Put returned units back: ``good`` ones into stock, the others into the damaged and lost counts."""
+    put_equipment_units(equipment_id, 'return', good, damaged, lost, **refs)
+
+
+def _expire_loaded(equipment_id, attributes):
+    # A loaded Equipment re-reads these after the Core UPDATE instead of writing stale values back
+    equipment = db.session.identity_map.get(identity_key(Equipment, equipment_id))
+    if equipment is not None:
+        db.session.expire(equipment, attributes)
+
+
+def commit_with_retry(work, attempts=RETRY_ATTEMPTS):
+    """Run ``work()`` and commit, as one transaction; returns what ``work`` returned.
+
+    Lock conflicts (deadlocks, lock timeouts, a busy SQLite file) roll back and
+    run ``work`` again, up to ``attempts`` times, after a short random pause.
+    Any other exception, ``InsufficientStock`` included, rolls back and propagates.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            result = work()
+            db.session.commit()
+            return result
+        except OperationalError:
+            db.session.rollback()
+            if attempt == attempts:
+                raise
+            time.sleep(random.uniform(0, _RETRY_BACKOFF * attempt))
+        except Exception:
+            db.session.rollback()
+            raise
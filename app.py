@@ -41,6 +41,30 @@ def create_app(test_config=None):
     login_manager.init_app(app)
     migrate.init_app(app, db)
 
+    # Audit log sink used by the blueprint access logging hooks
+    from Utils import audit_sink, request_metrics
+    audit_sink.init_app(app)
+    # Request timing/SQL/response-size instrumentation for access logs
+    request_metrics.init_app(app)
+    # Keep the recipient_clearance projection in step with issued equipment
+    from Utils import clearance_projection
+    clearance_projection.init_app(app)
+    # Keep the issued counters on equipment in step with issued equipment
+    from Utils import equipment_counters
+    equipment_counters.init_app(app)
+    # Keep the per-campus stock ledger in step with distributions, issues and returns
+    from Utils import campus_stock
+    campus_stock.init_app(app)
+    # Append every stock change to the inventory movement ledger
+    from Utils import inventory_ledger
+    inventory_ledger.init_app(app)
+    # Register issued serial numbers and track their returns
+    from Utils import serial_registry
+    serial_registry.init_app(app)
+    # Version-stamped cache of clearance statuses
+    from Utils import clearance_cache
+    clearance_cache.init_app(app)
+
     # Register blueprints
     from routes.admin_routes import admin_bp
     from routes.auth_routes import auth_bp
@@ -0,0 +1,27 @@
+"""Record retention prunes in the access log chain
+
+Revision ID: access_log_batch_pruned
+Revises: serial_registry
+Create Date: 2026-10-18 00:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'access_log_batch_pruned'
+down_revision = 'serial_registry'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Batches deleted by earlier prunes are gone; the oldest remaining one anchors the chain
+    with op.batch_alter_table('access_log_batches') as batch_op:
+        batch_op.add_column(sa.Column('pruned_batch_ids', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('access_log_batches') as batch_op:
+        batch_op.drop_column('pruned_batch_ids')
@@ -0,0 +1,45 @@
+"""Add Merkle-sealed access_log_batches and link access_logs to them
+
+Revision ID: access_log_batches
+Revises: access_log_audit_mode
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'access_log_batches'
+down_revision = 'access_log_audit_mode'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'access_log_batches',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('log_count', sa.Integer(), nullable=False),
+        sa.Column('merkle_root', sa.String(length=64), nullable=False),
+        sa.Column('prev_hash', sa.String(length=64), nullable=True),
+        sa.Column('batch_hash', sa.String(length=64), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('batch_hash'),
+    )
+    # Rows written before this revision stay unsealed (batch_id NULL)
+    with op.batch_alter_table('access_logs') as batch_op:
+        batch_op.add_column(sa.Column('batch_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('batch_seq', sa.Integer(), nullable=True))
+        batch_op.create_index('ix_access_logs_batch_id', ['batch_id'])
+        batch_op.create_foreign_key('fk_access_logs_batch_id', 'access_log_batches', ['batch_id'], ['id'])
+
+
+def downgrade():
+    with op.batch_alter_table('access_logs') as batch_op:
+        batch_op.drop_constraint('fk_access_logs_batch_id', type_='foreignkey')
+        batch_op.drop_index('ix_access_logs_batch_id')
+        batch_op.drop_column('batch_seq')
+        batch_op.drop_column('batch_id')
+    op.drop_table('access_log_batches')
@@ -0,0 +1,53 @@
+"""Add access_log_dimensions lookup table for compact access log storage
+
+Revision ID: access_log_dimensions
+Revises: access_log_batches
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'access_log_dimensions'
+down_revision = 'access_log_batches'
+branch_labels = None
+depends_on = None
+
+DIMENSION_FIELDS = ('user_agent', 'endpoint', 'module', 'server_hostname', 'app_name', 'protocol')
+
+
+def upgrade():
+    op.create_table(
+        'access_log_dimensions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=20), nullable=False),
+        sa.Column('value_hash', sa.String(length=40), nullable=False),
+        sa.Column('value', sa.Text(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('kind', 'value_hash', name='uq_access_log_dimensions_kind_value'),
+    )
+    with op.batch_alter_table('access_logs') as batch_op:
+        for field in DIMENSION_FIELDS:
+            batch_op.add_column(sa.Column(f'{field}_id', sa.Integer(), nullable=True))
+            batch_op.create_foreign_key(f'fk_access_logs_{field}_id', 'access_log_dimensions', [f'{field}_id'], ['id'])
+        # Compact rows keep these NULL and point at the dimension instead
+        batch_op.alter_column('app_name', existing_type=sa.String(length=100), nullable=True)
+        batch_op.alter_column('protocol', existing_type=sa.String(length=10), nullable=True)
+
+
+def downgrade():
+    # Expand compact rows back into the text columns before dropping the ids
+    for field in DIMENSION_FIELDS:
+        op.execute(
+            f"UPDATE access_logs SET {field} = (SELECT value FROM access_log_dimensions d "
+            f"WHERE d.id = access_logs.{field}_id) WHERE {field} IS NULL AND {field}_id IS NOT NULL"
+        )
+    with op.batch_alter_table('access_logs') as batch_op:
+        batch_op.alter_column('protocol', existing_type=sa.String(length=10), nullable=False)
+        batch_op.alter_column('app_name', existing_type=sa.String(length=100), nullable=False)
+        for field in reversed(DIMENSION_FIELDS):
+            batch_op.drop_constraint(f'fk_access_logs_{field}_id', type_='foreignkey')
+            batch_op.drop_column(f'{field}_id')
+    op.drop_table('access_log_dimensions')
@@ -0,0 +1,27 @@
+"""Add composite indexes for keyset pagination of access_logs
+
+Revision ID: access_log_keyset_indexes
+Revises: access_log_summaries
+Create Date: 2026-10-17 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'access_log_keyset_indexes'
+down_revision = 'access_log_summaries'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # (user_id, timestamp, id) serves the per-user audit trail, (timestamp, id) the global API feed
+    op.create_index('ix_access_logs_user_id_timestamp_id', 'access_logs', ['user_id', 'timestamp', 'id'])
+    op.create_index('ix_access_logs_timestamp_id', 'access_logs', ['timestamp', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_access_logs_timestamp_id', table_name='access_logs')
+    op.drop_index('ix_access_logs_user_id_timestamp_id', table_name='access_logs')
@@ -0,0 +1,67 @@
+"""Fill access_logs.search_index and add full-text search indexes
+
+Revision ID: access_log_search
+Revises: access_log_keyset_indexes
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'access_log_search'
+down_revision = 'access_log_keyset_indexes'
+branch_labels = None
+depends_on = None
+
+SEARCH_FIELDS = ('action', 'endpoint', 'username', 'full_name', 'ip_address', 'user_agent')
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    # Backfill the search document for rows written before it was maintained
+    if dialect == 'mysql':
+        document = 'CONCAT_WS(\' \', {})'.format(', '.join(SEARCH_FIELDS))
+    else:
+        document = "TRIM({})".format(" || ' ' || ".join(f"COALESCE({f}, '')" for f in SEARCH_FIELDS))
+    op.execute(f"UPDATE access_logs SET search_index = {document} WHERE search_index IS NULL")
+
+    if dialect == 'postgresql':
+        op.execute(
+            "CREATE INDEX IF NOT EXISTS ix_access_logs_search_tsv ON access_logs "
+            "USING gin (to_tsvector('simple', coalesce(search_index, '')))"
+        )
+    elif dialect == 'sqlite':
+        # External-content FTS5 table kept in step by triggers (same DDL as Utils/audit_search.py)
+        op.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS access_logs_fts USING fts5("
+            "search_index, content='access_logs', content_rowid='id')"
+        )
+        op.execute(
+            "CREATE TRIGGER IF NOT EXISTS access_logs_fts_ai AFTER INSERT ON access_logs BEGIN "
+            "INSERT INTO access_logs_fts(rowid, search_index) VALUES (new.id, new.search_index); END"
+        )
+        op.execute(
+            "CREATE TRIGGER IF NOT EXISTS access_logs_fts_ad AFTER DELETE ON access_logs BEGIN "
+            "INSERT INTO access_logs_fts(access_logs_fts, rowid, search_index) "
+            "VALUES ('delete', old.id, old.search_index); END"
+        )
+        op.execute(
+            "CREATE TRIGGER IF NOT EXISTS access_logs_fts_au AFTER UPDATE OF search_index ON access_logs BEGIN "
+            "INSERT INTO access_logs_fts(access_logs_fts, rowid, search_index) "
+            "VALUES ('delete', old.id, old.search_index); "
+            "INSERT INTO access_logs_fts(rowid, search_index) VALUES (new.id, new.search_index); END"
+        )
+        op.execute("INSERT INTO access_logs_fts(access_logs_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_access_logs_search_tsv')
+    elif dialect == 'sqlite':
+        for suffix in ('ai', 'ad', 'au'):
+            op.execute(f'DROP TRIGGER IF EXISTS access_logs_fts_{suffix}')
+        op.execute('DROP TABLE IF EXISTS access_logs_fts')
@@ -0,0 +1,55 @@
+"""Add per-user access_log_summaries rollup
+
+Revision ID: access_log_summaries
+Revises: access_log_request_metrics
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'access_log_summaries'
+down_revision = 'access_log_request_metrics'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'access_log_summaries',
+        sa.Column('user_type', sa.String(length=20), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(length=120), nullable=False),
+        sa.Column('full_name', sa.String(length=120), nullable=True),
+        sa.Column('log_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('first_seen', sa.DateTime(), nullable=True),
+        sa.Column('last_seen', sa.DateTime(), nullable=True),
+        sa.Column('last_action', sa.String(length=200), nullable=True),
+        sa.PrimaryKeyConstraint('user_type', 'user_id'),
+    )
+    op.create_index('ix_access_log_summaries_last_seen', 'access_log_summaries', ['last_seen'])
+
+    # Backfill from the existing logs
+    op.execute("""
+        INSERT INTO access_log_summaries
+            (user_type, user_id, username, full_name, log_count, first_seen, last_seen)
+        SELECT user_type, user_id, MAX(username), MAX(full_name), COUNT(id), MIN(timestamp), MAX(timestamp)
+        FROM access_logs
+        GROUP BY user_type, user_id
+    """)
+    op.execute("""
+        UPDATE access_log_summaries SET last_action = (
+            SELECT l.action FROM access_logs l
+            WHERE l.user_type = access_log_summaries.user_type
+              AND l.user_id = access_log_summaries.user_id
+            ORDER BY l.timestamp DESC, l.id DESC
+            LIMIT 1
+        )
+    """)
+
+
+def downgrade():
+    op.drop_index('ix_access_log_summaries_last_seen', table_name='access_log_summaries')
+    op.drop_table('access_log_summaries')
@@ -0,0 +1,27 @@
+"""Add hit_count and audit_mode to access_logs for tiered audit logging
+
+Revision ID: access_log_audit_mode
+Revises: access_log_partitions
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'access_log_audit_mode'
+down_revision = 'access_log_partitions'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows are one full log per request
+    op.add_column('access_logs', sa.Column('hit_count', sa.Integer(), nullable=False, server_default='1'))
+    op.add_column('access_logs', sa.Column('audit_mode', sa.String(length=10), nullable=False, server_default='full'))
+
+
+def downgrade():
+    op.drop_column('access_logs', 'audit_mode')
+    op.drop_column('access_logs', 'hit_count')
@@ -0,0 +1,47 @@
+"""Keep bulk clearance checks in the database
+
+Revision ID: bulk_clearance_jobs
+Revises: access_log_batch_pruned
+Create Date: 2026-10-18 01:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'bulk_clearance_jobs'
+down_revision = 'access_log_batch_pruned'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'bulk_clearance_jobs',
+        sa.Column('id', sa.String(length=32), nullable=False),
+        sa.Column('recipient_type', sa.String(length=10), nullable=False, server_default='student'),
+        sa.Column('created_by', sa.String(length=120), nullable=True),
+        sa.Column('total', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('processed', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('state', sa.String(length=10), nullable=False, server_default='queued'),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_bulk_clearance_jobs_created_at', 'bulk_clearance_jobs', ['created_at'])
+    op.create_table(
+        'bulk_clearance_chunks',
+        sa.Column('job_id', sa.String(length=32), nullable=False),
+        sa.Column('seq', sa.Integer(), nullable=False),
+        sa.Column('data', sa.Text(), nullable=False),
+        sa.ForeignKeyConstraint(['job_id'], ['bulk_clearance_jobs.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('job_id', 'seq'),
+    )
+
+
+def downgrade():
+    op.drop_table('bulk_clearance_chunks')
+    op.drop_index('ix_bulk_clearance_jobs_created_at', table_name='bulk_clearance_jobs')
+    op.drop_table('bulk_clearance_jobs')
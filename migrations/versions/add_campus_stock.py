@@ -0,0 +1,67 @@
+"""Add campus_stock ledger of distributed, issued and returned units per campus
+
+Revision ID: campus_stock
+Revises: equipment_issued_counters
+Create Date: 2026-10-17 23:45:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'campus_stock'
+down_revision = 'equipment_issued_counters'
+branch_labels = None
+depends_on = None
+
+
+def _units(condition):
+    return f"""COALESCE((SELECT SUM(r.quantity) FROM return_lines r
+                         JOIN issued_equipment i ON i.id = r.issue_id
+                         JOIN storekeepers s ON s.payroll_number = i.issued_by
+                         WHERE s.campus_id = campus_stock.campus_id
+                           AND i.equipment_id = campus_stock.equipment_id
+                           AND r.condition = '{condition}'), 0)"""
+
+
+def upgrade():
+    op.create_table(
+        'campus_stock',
+        sa.Column('campus_id', sa.Integer(), nullable=False),
+        sa.Column('equipment_id', sa.Integer(), nullable=False),
+        sa.Column('distributed', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('issued_out', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('returned_good', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('damaged', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('lost', sa.Integer(), nullable=False, server_default='0'),
+        sa.ForeignKeyConstraint(['campus_id'], ['satellite_campuses.id']),
+        sa.ForeignKeyConstraint(['equipment_id'], ['equipment.id']),
+        sa.PrimaryKeyConstraint('campus_id', 'equipment_id'),
+    )
+
+    # Backfill: one row per equipment distributed to a campus, then the units its
+    # storekeepers have out and got back. Issues of equipment never distributed to
+    # the issuer's campus are picked up by scripts/rebuild_campus_stock.py.
+    op.execute("""
+        INSERT INTO campus_stock (campus_id, equipment_id, distributed)
+        SELECT campus_id, equipment_id, SUM(quantity) FROM campus_distributions
+        GROUP BY campus_id, equipment_id
+    """)
+    op.execute(f"""
+        UPDATE campus_stock SET
+            issued_out = COALESCE((SELECT SUM(i.quantity - COALESCE((SELECT SUM(r.quantity) FROM return_lines r
+                                                                     WHERE r.issue_id = i.id AND r.serial IS NOT NULL), 0))
+                                   FROM issued_equipment i
+                                   JOIN storekeepers s ON s.payroll_number = i.issued_by
+                                   WHERE s.campus_id = campus_stock.campus_id
+                                     AND i.equipment_id = campus_stock.equipment_id
+                                     AND i.status IN ('Issued', 'Partial Return')), 0),
+            returned_good = {_units('Good')},
+            damaged = {_units('Damaged')},
+            lost = {_units('Lost')}
+    """)
+
+
+def downgrade():
+    op.drop_table('campus_stock')
@@ -0,0 +1,27 @@
+"""Add per-recipient issue indexes for the paginated clearance report
+
+Revision ID: clearance_report_indexes
+Revises: return_lines
+Create Date: 2026-10-17 22:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'clearance_report_indexes'
+down_revision = 'return_lines'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Latest issue of one recipient is a single index probe: (recipient, date_issued, id) descending
+    op.create_index('ix_issued_equipment_student_id_date_issued', 'issued_equipment', ['student_id', 'date_issued', 'id'])
+    op.create_index('ix_issued_equipment_staff_payroll_date_issued', 'issued_equipment', ['staff_payroll', 'date_issued', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_issued_equipment_staff_payroll_date_issued', table_name='issued_equipment')
+    op.drop_index('ix_issued_equipment_student_id_date_issued', table_name='issued_equipment')
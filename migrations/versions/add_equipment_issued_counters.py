@@ -0,0 +1,37 @@
+"""Add issued_count and issued_units counters to equipment
+
+Revision ID: equipment_issued_counters
+Revises: issued_equipment_due_index
+Create Date: 2026-10-17 23:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'equipment_issued_counters'
+down_revision = 'issued_equipment_due_index'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('equipment', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('issued_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('issued_units', sa.Integer(), nullable=False, server_default='0'))
+
+    # Backfill from the issued records still out
+    op.execute("""
+        UPDATE equipment SET
+            issued_count = (SELECT COUNT(*) FROM issued_equipment i
+                            WHERE i.equipment_id = equipment.id AND i.status = 'Issued'),
+            issued_units = (SELECT COALESCE(SUM(i.quantity), 0) FROM issued_equipment i
+                            WHERE i.equipment_id = equipment.id AND i.status = 'Issued')
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('equipment', schema=None) as batch_op:
+        batch_op.drop_column('issued_units')
+        batch_op.drop_column('issued_count')
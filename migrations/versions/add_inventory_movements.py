@@ -0,0 +1,59 @@
+"""Add inventory_movements ledger and inventory_snapshots
+
+Revision ID: inventory_movements
+Revises: campus_stock
+Create Date: 2026-10-17 23:50:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'inventory_movements'
+down_revision = 'campus_stock'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'inventory_movements',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('equipment_id', sa.Integer(), nullable=False),
+        sa.Column('occurred_at', sa.DateTime(), nullable=False),
+        sa.Column('kind', sa.String(length=20), nullable=False),
+        sa.Column('quantity_delta', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('damaged_delta', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('lost_delta', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('issue_id', sa.Integer(), nullable=True),
+        sa.Column('distribution_id', sa.Integer(), nullable=True),
+        sa.Column('actor', sa.String(length=120), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_inventory_movements_occurred_at', 'inventory_movements', ['occurred_at'])
+    op.create_index('ix_inventory_movements_equipment_id_occurred_at', 'inventory_movements',
+                    ['equipment_id', 'occurred_at'])
+    op.create_table(
+        'inventory_snapshots',
+        sa.Column('taken_at', sa.DateTime(), nullable=False),
+        sa.Column('equipment_id', sa.Integer(), nullable=False),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+        sa.Column('damaged_count', sa.Integer(), nullable=False),
+        sa.Column('lost_count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('taken_at', 'equipment_id'),
+    )
+
+    # History starts here: one opening movement per equipment with what it holds now
+    op.execute("""
+        INSERT INTO inventory_movements (equipment_id, occurred_at, kind, quantity_delta, damaged_delta, lost_delta)
+        SELECT id, CURRENT_TIMESTAMP, 'opening', COALESCE(quantity, 0), COALESCE(damaged_count, 0), COALESCE(lost_count, 0)
+        FROM equipment
+    """)
+
+
+def downgrade():
+    op.drop_table('inventory_snapshots')
+    op.drop_index('ix_inventory_movements_equipment_id_occurred_at', table_name='inventory_movements')
+    op.drop_index('ix_inventory_movements_occurred_at', table_name='inventory_movements')
+    op.drop_table('inventory_movements')
@@ -0,0 +1,26 @@
+"""Add partial index on expected_return of issued equipment still out
+
+Revision ID: issued_equipment_due_index
+Revises: clearance_report_indexes
+Create Date: 2026-10-17 23:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'issued_equipment_due_index'
+down_revision = 'clearance_report_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Only rows with status 'Issued' are indexed, so the due/overdue lookup reads just the equipment currently out
+    op.create_index('ix_issued_equipment_due', 'issued_equipment', ['expected_return'],
+                    postgresql_where=sa.text("status = 'Issued'"), sqlite_where=sa.text("status = 'Issued'"))
+
+
+def downgrade():
+    op.drop_index('ix_issued_equipment_due', table_name='issued_equipment')
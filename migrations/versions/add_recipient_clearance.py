@@ -0,0 +1,114 @@
+"""Add recipient_clearance status projection
+
+Revision ID: recipient_clearance
+Revises: access_log_enrichment
+Create Date: 2026-10-17 20:00:00.000000
+
+"""
+import json
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'recipient_clearance'
+down_revision = 'access_log_enrichment'
+branch_labels = None
+depends_on = None
+
+
+def _conditions_block_clearance(return_conditions):
+    # Frozen copy of Utils.clearance_integration.conditions_block_clearance as of
+    # this revision, so the backfill doesn't change when the app code does
+    if not return_conditions:
+        return False
+    try:
+        conditions = json.loads(return_conditions)
+        if isinstance(conditions, dict):
+            if conditions.get('action') in ('replaced', 'repaired', 'waiver'):
+                return False
+            if conditions.get('replaced'):
+                return False
+            for condition in conditions.values():
+                if isinstance(condition, str) and condition.lower() in ('damaged', 'lost'):
+                    return True
+        elif isinstance(conditions, str) and conditions.lower() in ('damaged', 'lost'):
+            return True
+    except (json.JSONDecodeError, TypeError):
+        conditions_str = str(return_conditions).lower()
+        if 'damaged' in conditions_str or 'lost' in conditions_str:
+            if 'replaced' not in conditions_str and 'repaired' not in conditions_str and 'waiver' not in conditions_str:
+                return True
+    return False
+
+
+def upgrade():
+    op.create_table(
+        'recipient_clearance',
+        sa.Column('recipient_type', sa.String(length=10), nullable=False),
+        sa.Column('recipient_id', sa.String(length=20), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False, server_default='Cleared'),
+        sa.Column('item_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('outstanding_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('overdue_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('unresolved_damage_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('next_due', sa.DateTime(), nullable=True),
+        sa.Column('last_changed', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('recipient_type', 'recipient_id'),
+    )
+    op.create_index('ix_recipient_clearance_status', 'recipient_clearance', ['status'])
+    op.create_index('ix_recipient_clearance_next_due', 'recipient_clearance', ['next_due'])
+
+    # Backfill with the same rules as Utils.clearance_integration.compute_clearance
+    today = datetime.utcnow().date()
+    midnight = datetime(today.year, today.month, today.day)
+    rows = {}
+    result = op.get_bind().execute(sa.text(
+        'SELECT student_id, staff_payroll, status, expected_return, return_conditions FROM issued_equipment'
+    ))
+    for student_id, staff_payroll, status, expected_return, return_conditions in result:
+        key = ('student', student_id) if student_id else (('staff', staff_payroll) if staff_payroll else None)
+        if key is None:
+            continue
+        row = rows.setdefault(key, {'item_count': 0, 'outstanding_count': 0, 'overdue_count': 0,
+                                    'unresolved_damage_count': 0, 'next_due': None})
+        if isinstance(expected_return, str):
+            expected_return = datetime.fromisoformat(expected_return)
+        row['item_count'] += 1
+        if status != 'Returned':
+            row['outstanding_count'] += 1
+        if status == 'Issued' and expected_return is not None:
+            if expected_return < midnight:
+                row['overdue_count'] += 1
+            elif row['next_due'] is None or expected_return < row['next_due']:
+                row['next_due'] = expected_return
+        if _conditions_block_clearance(return_conditions):
+            row['unresolved_damage_count'] += 1
+
+    table = sa.table(
+        'recipient_clearance',
+        sa.column('recipient_type'), sa.column('recipient_id'), sa.column('status'), sa.column('item_count'),
+        sa.column('outstanding_count'), sa.column('overdue_count'), sa.column('unresolved_damage_count'),
+        sa.column('next_due'), sa.column('last_changed'),
+    )
+    records = []
+    now = datetime.utcnow()
+    for (recipient_type, recipient_id), row in rows.items():
+        if row['overdue_count']:
+            status = 'Overdue'
+        elif row['outstanding_count'] or row['unresolved_damage_count']:
+            status = 'Pending'
+        else:
+            status = 'Cleared'
+        records.append(dict(row, recipient_type=recipient_type, recipient_id=recipient_id,
+                            status=status, last_changed=now))
+    if records:
+        op.bulk_insert(table, records)
+
+
+def downgrade():
+    op.drop_index('ix_recipient_clearance_next_due', table_name='recipient_clearance')
+    op.drop_index('ix_recipient_clearance_status', table_name='recipient_clearance')
+    op.drop_table('recipient_clearance')
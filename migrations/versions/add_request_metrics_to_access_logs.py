@@ -0,0 +1,27 @@
+"""Add per-request SQL metrics to access_logs
+
+Revision ID: access_log_request_metrics
+Revises: 285be9df0a73
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'access_log_request_metrics'
+down_revision = '285be9df0a73'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # duration_ms, status_code and data_size_bytes already exist; add DB time and statement count
+    op.add_column('access_logs', sa.Column('db_time_ms', sa.Integer(), nullable=True))
+    op.add_column('access_logs', sa.Column('sql_count', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('access_logs', 'sql_count')
+    op.drop_column('access_logs', 'db_time_ms')
@@ -0,0 +1,194 @@
+"""Add return_lines normalizing issued_equipment.return_conditions
+
+Revision ID: return_lines
+Revises: recipient_clearance
+Create Date: 2026-10-17 21:00:00.000000
+
+"""
+import json
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'return_lines'
+down_revision = 'recipient_clearance'
+branch_labels = None
+depends_on = None
+
+CHUNK_SIZE = 1000
+
+# Frozen copy of the parsing in Utils/return_lines.py as of this revision, so
+# the backfill doesn't change when the app code does
+CONDITIONS = ('Good', 'Damaged', 'Lost')
+RESOLUTIONS = ('replaced', 'repaired', 'waiver')
+
+
+def _condition(value):
+    if isinstance(value, str) and value.strip().capitalize() in CONDITIONS:
+        return value.strip().capitalize()
+    return None
+
+
+def _quantity(value, default=1):
+    try:
+        return max(1, int(value))
+    except (TypeError, ValueError):
+        return default
+
+
+def parse_return_conditions(raw):
+    """Split a return_conditions blob into ``([(serial, quantity, condition)], resolution)``."""
+    if not raw:
+        return [], None
+    try:
+        data = json.loads(raw)
+    except (json.JSONDecodeError, TypeError):
+        condition = _condition(raw)
+        return ([(None, 1, condition)] if condition else []), None
+
+    if isinstance(data, str):
+        condition = _condition(data)
+        return ([(None, 1, condition)] if condition else []), None
+    if not isinstance(data, dict):
+        return [], None
+
+    if data.get('action') in RESOLUTIONS:
+        return [], data['action']
+    if data.get('replaced'):
+        return [], 'replaced'
+    if isinstance(data.get('conditions'), dict):
+        quantities = data.get('quantities') or {}
+        lines = []
+        for serial, value in data['conditions'].items():
+            condition = _condition(value)
+            if condition:
+                lines.append((str(serial), _quantity(quantities.get(serial)), condition))
+        return lines, None
+    if 'all' in data:
+        condition = _condition(data['all'])
+        return ([(None, _quantity(data.get('quantity')), condition)] if condition else []), None
+
+    lines = []
+    for serial, value in data.items():
+        condition = _condition(value)
+        if condition:
+            lines.append((str(serial), 1, condition))
+    return lines, None
+
+
+def _conditions_block_clearance(raw):
+    # Frozen copy of the rule for issues without return lines (free text and
+    # legacy blobs), as in Utils.clearance_integration.conditions_block_clearance
+    if not raw:
+        return False
+    try:
+        data = json.loads(raw)
+    except (json.JSONDecodeError, TypeError):
+        text = str(raw).lower()
+        return (('damaged' in text or 'lost' in text)
+                and not any(word in text for word in ('replaced', 'repaired', 'waiver')))
+    if isinstance(data, dict):
+        if data.get('action') in RESOLUTIONS or data.get('replaced'):
+            return False
+        return any(isinstance(value, str) and value.lower() in ('damaged', 'lost') for value in data.values())
+    return isinstance(data, str) and data.lower() in ('damaged', 'lost')
+
+
+def _refresh_damage_counts(bind, recipients):
+    """Recount unresolved damage and restatus the given ``(type, id)`` recipients.
+
+    Issues with return lines block while they have an unresolved Damaged/Lost
+    line; issues without lines keep the free-text rule. Overdue and outstanding
+    counts don't change here, so they are taken from the stored row.
+    """
+    now = datetime.utcnow()
+    for recipient_type, column in (('student', 'student_id'), ('staff', 'staff_payroll')):
+        ids = sorted(recipient_id for kind, recipient_id in recipients if kind == recipient_type)
+        for start in range(0, len(ids), 500):
+            counts = dict.fromkeys(ids[start:start + 500], 0)
+            rows = bind.execute(sa.text(
+                f'SELECT {column}, return_conditions, '
+                '  EXISTS (SELECT 1 FROM return_lines r WHERE r.issue_id = issued_equipment.id), '
+                '  EXISTS (SELECT 1 FROM return_lines r WHERE r.issue_id = issued_equipment.id '
+                "          AND r.condition IN ('Damaged', 'Lost') AND r.resolution IS NULL) "
+                f'FROM issued_equipment WHERE {column} IN :ids'
+            ).bindparams(sa.bindparam('ids', expanding=True)), {'ids': list(counts)})
+            for recipient_id, raw, has_lines, damaged in rows:
+                if damaged if has_lines else _conditions_block_clearance(raw):
+                    counts[recipient_id] += 1
+            bind.execute(sa.text(
+                'UPDATE recipient_clearance SET unresolved_damage_count = :count, '
+                "  status = CASE WHEN overdue_count > 0 THEN 'Overdue' "
+                "                WHEN outstanding_count > 0 OR :count > 0 THEN 'Pending' ELSE 'Cleared' END, "
+                '  last_changed = :now '
+                'WHERE recipient_type = :type AND recipient_id = :id AND unresolved_damage_count != :count'
+            ), [{'count': count, 'now': now, 'type': recipient_type, 'id': recipient_id}
+                for recipient_id, count in counts.items()])
+
+
+def upgrade():
+    op.create_table(
+        'return_lines',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('issue_id', sa.Integer(), nullable=False),
+        sa.Column('serial', sa.String(length=100), nullable=True),
+        sa.Column('quantity', sa.Integer(), nullable=False, server_default='1'),
+        sa.Column('condition', sa.String(length=20), nullable=False),
+        sa.Column('resolution', sa.String(length=20), nullable=True),
+        sa.Column('returned_at', sa.DateTime(), nullable=True),
+        sa.Column('resolved_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['issue_id'], ['issued_equipment.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_return_lines_issue_id', 'return_lines', ['issue_id'])
+    op.create_index('ix_return_lines_condition_resolution', 'return_lines', ['condition', 'resolution'])
+
+    # Online backfill: walk issued_equipment in id order, one short transaction per chunk,
+    # so returns keep being recorded while it runs. Issues that already have lines (returns
+    # recorded since the app started writing them) are skipped. Already settled issues
+    # ({'replaced': true} / {'action': ...}) no longer say what was damaged and get no lines.
+    #
+    # Damage is read from the lines from now on, which changes one rule: serial returns
+    # stored as {"conditions": {...}, "quantities": {...}} used to never block clearance
+    # and now block while a unit is Damaged/Lost. recipient_clearance was filled under
+    # the old rule, so the owners of backfilled issues are recounted chunk by chunk.
+    lines = sa.table(
+        'return_lines',
+        sa.column('issue_id'), sa.column('serial'), sa.column('quantity'),
+        sa.column('condition'), sa.column('returned_at'),
+    )
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        last_id = 0
+        while True:
+            rows = bind.execute(sa.text(
+                'SELECT id, return_conditions, date_returned, student_id, staff_payroll FROM issued_equipment '
+                'WHERE id > :last_id AND return_conditions IS NOT NULL '
+                '  AND NOT EXISTS (SELECT 1 FROM return_lines WHERE return_lines.issue_id = issued_equipment.id) '
+                'ORDER BY id LIMIT :limit'
+            ), {'last_id': last_id, 'limit': CHUNK_SIZE}).fetchall()
+            if not rows:
+                break
+            records = []
+            recipients = set()
+            for issue_id, raw, date_returned, student_id, staff_payroll in rows:
+                parsed = parse_return_conditions(raw)[0]
+                for serial, quantity, condition in parsed:
+                    records.append({'issue_id': issue_id, 'serial': serial, 'quantity': quantity,
+                                    'condition': condition, 'returned_at': date_returned})
+                if parsed and (student_id or staff_payroll):
+                    recipients.add(('student', student_id) if student_id else ('staff', staff_payroll))
+            if records:
+                bind.execute(lines.insert(), records)
+            if recipients:
+                _refresh_damage_counts(bind, recipients)
+            last_id = rows[-1][0]
+
+
+def downgrade():
+    op.drop_index('ix_return_lines_condition_resolution', table_name='return_lines')
+    op.drop_index('ix_return_lines_issue_id', table_name='return_lines')
+    op.drop_table('return_lines')
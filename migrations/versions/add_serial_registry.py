@@ -0,0 +1,41 @@
+"""Add serial_registry of issued serial numbers
+
+Revision ID: serial_registry
+Revises: inventory_movements
+Create Date: 2026-10-17 23:55:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'serial_registry'
+down_revision = 'inventory_movements'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled by scripts/backfill_serial_registry.py, which runs in batches while
+    # the app serves; new issues register their serials from this revision on
+    op.create_table(
+        'serial_registry',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('serial', sa.String(length=100), nullable=False),
+        sa.Column('equipment_id', sa.Integer(), nullable=True),
+        sa.Column('current_issue_id', sa.Integer(), nullable=True),
+        sa.Column('state', sa.String(length=20), nullable=False, server_default='issued'),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['equipment_id'], ['equipment.id']),
+        sa.ForeignKeyConstraint(['current_issue_id'], ['issued_equipment.id'], ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_serial_registry_serial', 'serial_registry', ['serial'], unique=True)
+    op.create_index('ix_serial_registry_current_issue_id', 'serial_registry', ['current_issue_id'])
+
+
+def downgrade():
+    op.drop_index('ix_serial_registry_current_issue_id', table_name='serial_registry')
+    op.drop_index('ix_serial_registry_serial', table_name='serial_registry')
+    op.drop_table('serial_registry')
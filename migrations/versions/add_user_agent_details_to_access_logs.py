@@ -0,0 +1,29 @@
+"""Add parsed user agent columns to access_logs
+
+Revision ID: access_log_enrichment
+Revises: access_log_dimensions
+Create Date: 2026-10-17 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'access_log_enrichment'
+down_revision = 'access_log_dimensions'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # geolocation already exists; it is now filled by the enrichment stage
+    op.add_column('access_logs', sa.Column('browser', sa.String(length=50), nullable=True))
+    op.add_column('access_logs', sa.Column('os_name', sa.String(length=50), nullable=True))
+    op.add_column('access_logs', sa.Column('device_type', sa.String(length=20), nullable=True))
+
+
+def downgrade():
+    op.drop_column('access_logs', 'device_type')
+    op.drop_column('access_logs', 'os_name')
+    op.drop_column('access_logs', 'browser')
@@ -0,0 +1,84 @@
+"""Partition access_logs by month on PostgreSQL
+
+Revision ID: access_log_partitions
+Revises: access_log_search
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'access_log_partitions'
+down_revision = 'access_log_search'
+branch_labels = None
+depends_on = None
+
+# Partitions are created this many months past the current one; the prune
+# script keeps creating them ahead of time (see Utils/audit_retention.py)
+MONTHS_AHEAD = 3
+
+INDEXES = (
+    "CREATE INDEX ix_access_logs_user_id_timestamp_id ON access_logs (user_id, timestamp, id)",
+    "CREATE INDEX ix_access_logs_timestamp_id ON access_logs (timestamp, id)",
+    "CREATE INDEX ix_access_logs_search_tsv ON access_logs "
+    "USING gin (to_tsvector('simple', coalesce(search_index, '')))",
+)
+
+
+def _add_months(value, months):
+    index = value.year * 12 + (value.month - 1) + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def upgrade():
+    bind = op.get_bind()
+    # SQLite/MySQL have no declarative partitioning; months are emulated as index ranges
+    if bind.dialect.name != 'postgresql':
+        return
+
+    op.execute("ALTER TABLE access_logs RENAME TO access_logs_unpartitioned")
+    op.execute(
+        "CREATE TABLE access_logs (LIKE access_logs_unpartitioned INCLUDING DEFAULTS) "
+        "PARTITION BY RANGE (timestamp)"
+    )
+    # A partitioned table's primary key must include the partition key
+    op.execute("ALTER TABLE access_logs ADD PRIMARY KEY (id, timestamp)")
+
+    oldest = bind.execute(sa.text("SELECT MIN(timestamp) FROM access_logs_unpartitioned")).scalar()
+    now = datetime.utcnow()
+    start = datetime((oldest or now).year, (oldest or now).month, 1)
+    last = _add_months(now, MONTHS_AHEAD)
+    while start <= last:
+        end = _add_months(start, 1)
+        op.execute(
+            f"CREATE TABLE access_logs_y{start.year:04d}m{start.month:02d} PARTITION OF access_logs "
+            f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+        )
+        start = end
+    op.execute("CREATE TABLE access_logs_default PARTITION OF access_logs DEFAULT")
+
+    op.execute("INSERT INTO access_logs SELECT * FROM access_logs_unpartitioned")
+    # Keep the id sequence when the old table goes away
+    op.execute("ALTER SEQUENCE access_logs_id_seq OWNED BY access_logs.id")
+    op.execute("DROP TABLE access_logs_unpartitioned")
+    for statement in INDEXES:
+        op.execute(statement)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute("ALTER TABLE access_logs RENAME TO access_logs_partitioned")
+    op.execute("CREATE TABLE access_logs (LIKE access_logs_partitioned INCLUDING DEFAULTS)")
+    op.execute("ALTER TABLE access_logs ADD PRIMARY KEY (id)")
+    op.execute("INSERT INTO access_logs SELECT * FROM access_logs_partitioned")
+    op.execute("ALTER SEQUENCE access_logs_id_seq OWNED BY access_logs.id")
+    # Dropping the parent drops every monthly partition with it
+    op.execute("DROP TABLE access_logs_partitioned CASCADE")
+    for statement in INDEXES:
+        op.execute(statement)
@@ -1,6 +1,10 @@
 from extensions import db
+from flask import has_app_context
 from flask_login import UserMixin
 from datetime import datetime
+from sqlalchemy import func, or_, select
+from sqlalchemy.ext.hybrid import Comparator, hybrid_property
+from sqlalchemy.sql import operators
 
 class Admin(UserMixin, db.Model):
     __tablename__ = 'admins'
@@ -43,6 +47,9 @@ class Equipment(db.Model):
     # Track damaged and lost items separately from available quantity
     damaged_count = db.Column(db.Integer, default=0, nullable=False)
     lost_count = db.Column(db.Integer, default=0, nullable=False)
+    # Issued records still out and the units they hold, kept by Utils/equipment_counters.py
+    issued_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    issued_units = db.Column(db.Integer, default=0, server_default='0', nullable=False)
     date_received = db.Column(db.DateTime, default=datetime.utcnow)
     # Admin-controlled active flag: when false the equipment is disabled and cannot be issued
     is_active = db.Column(db.Boolean, default=True, nullable=False)
@@ -52,12 +59,7 @@ class Equipment(db.Model):
     @property
     def available_quantity(self):
         """Calculate available quantity as total minus issued, damaged and lost."""
-        try:
-            issued_count = self.issued_items.filter_by(status='Issued').count()
-        except Exception:
-            # In some contexts (e.g., when object is not attached to session), fallback
-            issued_count = 0
-        return (self.quantity or 0) - issued_count - (self.damaged_count or 0) - (self.lost_count or 0)
+        return (self.quantity or 0) - (self.issued_count or 0) - (self.damaged_count or 0) - (self.lost_count or 0)
 
 class IssuedEquipment(db.Model):
     __tablename__ = 'issued_equipment'
@@ -86,6 +88,64 @@ class IssuedEquipment(db.Model):
     # Relationship to access equipment details easily (e.g., issue.equipment.name)
     equipment = db.relationship('Equipment', backref=db.backref('issued_items', lazy='dynamic'))
 
+    # Per-recipient (date_issued, id) indexes find a recipient's latest issue with one probe
+    __table_args__ = (
+        db.Index('ix_issued_equipment_student_id_date_issued', 'student_id', 'date_issued', 'id'),
+        db.Index('ix_issued_equipment_staff_payroll_date_issued', 'staff_payroll', 'date_issued', 'id'),
+        # Only equipment currently out, by due date: the due/overdue set (see Utils/overdue.py)
+        db.Index('ix_issued_equipment_due', 'expected_return',
+                 postgresql_where=db.text("status = 'Issued'"), sqlite_where=db.text("status = 'Issued'")),
+    )
+
+    @property
+    def return_condition(self):
+        """Worst condition any unit of this issue was returned in (Lost, Damaged, Good), or None."""
+        conditions = {line.condition for line in self.return_lines}
+        for condition in ('Lost', 'Damaged', 'Good'):
+            if condition in conditions:
+                return condition
+        return None
+
+
+class ReturnLine(db.Model):
+    """One returned serial (or quantity of a non-serial item) and the condition it came back in."""
+    __tablename__ = 'return_lines'
+    id = db.Column(db.Integer, primary_key=True)
+    issue_id = db.Column(db.Integer, db.ForeignKey('issued_equipment.id', ondelete='CASCADE'), nullable=False, index=True)
+    serial = db.Column(db.String(100), nullable=True)  # None for non-serial returns
+    quantity = db.Column(db.Integer, nullable=False, default=1)
+    condition = db.Column(db.String(20), nullable=False)  # Good, Damaged, Lost
+    # How damage/loss was settled: replaced, repaired, waiver (None while unresolved)
+    resolution = db.Column(db.String(20), nullable=True)
+    returned_at = db.Column(db.DateTime, default=datetime.utcnow)
+    resolved_at = db.Column(db.DateTime, nullable=True)
+
+    issue = db.relationship('IssuedEquipment', backref=db.backref('return_lines', lazy='select', cascade='all, delete-orphan'))
+
+    __table_args__ = (
+        db.Index('ix_return_lines_condition_resolution', 'condition', 'resolution'),
+    )
+
+
+class SerialRegistry(db.Model):
+    """Every serial number ever issued, with the issue that has (or last had) it."""
+    __tablename__ = 'serial_registry'
+    id = db.Column(db.Integer, primary_key=True)
+    serial = db.Column(db.String(100), nullable=False)
+    equipment_id = db.Column(db.Integer, db.ForeignKey('equipment.id'), nullable=True)
+    current_issue_id = db.Column(db.Integer, db.ForeignKey('issued_equipment.id', ondelete='SET NULL'), nullable=True, index=True)
+    # issued, returned, damaged, lost (see Utils/serial_registry.py)
+    state = db.Column(db.String(20), nullable=False, default='issued')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    issue = db.relationship('IssuedEquipment')
+    equipment = db.relationship('Equipment')
+
+    __table_args__ = (
+        db.Index('ix_serial_registry_serial', 'serial', unique=True),
+    )
+
+
 class Clearance(db.Model):
     __tablename__ = 'clearance'
     id = db.Column(db.Integer, primary_key=True)
@@ -94,6 +154,21 @@ class Clearance(db.Model):
     last_updated = db.Column(db.DateTime, default=datetime.utcnow)
 
 
+class RecipientClearance(db.Model):
+    """Clearance status per student/staff recipient, kept current by Utils/clearance_projection.py."""
+    __tablename__ = 'recipient_clearance'
+    recipient_type = db.Column(db.String(10), primary_key=True)  # 'student' or 'staff'
+    recipient_id = db.Column(db.String(20), primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='Cleared', index=True)
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+    outstanding_count = db.Column(db.Integer, nullable=False, default=0)
+    overdue_count = db.Column(db.Integer, nullable=False, default=0)
+    unresolved_damage_count = db.Column(db.Integer, nullable=False, default=0)
+    # Earliest expected return of an issued item that is not overdue yet
+    next_due = db.Column(db.DateTime, nullable=True, index=True)
+    last_changed = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 class StoreKeeper(UserMixin, db.Model):
     __tablename__ = 'storekeepers'
     id = db.Column(db.Integer, primary_key=True)
@@ -151,6 +226,129 @@ class CampusDistribution(db.Model):
     equipment = db.relationship('Equipment', backref='campus_distributions')
 
 
+class CampusStock(db.Model):
+    """Stock of one equipment at one campus, kept current by Utils/campus_stock.py."""
+    __tablename__ = 'campus_stock'
+    campus_id = db.Column(db.Integer, db.ForeignKey('satellite_campuses.id'), primary_key=True)
+    equipment_id = db.Column(db.Integer, db.ForeignKey('equipment.id'), primary_key=True)
+    distributed = db.Column(db.Integer, default=0, server_default='0', nullable=False)  # units distributed to the campus
+    issued_out = db.Column(db.Integer, default=0, server_default='0', nullable=False)  # units issued by its storekeepers, not returned yet
+    # Units returned to the campus in each condition, all time
+    returned_good = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    damaged = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    lost = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+
+    equipment = db.relationship('Equipment')
+
+    @property
+    def available(self):
+        """Units the campus can still issue."""
+        return (self.distributed or 0) - (self.issued_out or 0)
+
+
+# Append-only history of stock changes, written by Utils/inventory_ledger.py
+class InventoryMovement(db.Model):
+    __tablename__ = 'inventory_movements'
+    id = db.Column(db.Integer, primary_key=True)
+    # Not a foreign key: history outlives deleted equipment
+    equipment_id = db.Column(db.Integer, nullable=False)
+    occurred_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    # opening, receipt, issue, return, distribution, restock, adjustment, removal
+    kind = db.Column(db.String(20), nullable=False)
+    quantity_delta = db.Column(db.Integer, nullable=False, default=0)
+    damaged_delta = db.Column(db.Integer, nullable=False, default=0)
+    lost_delta = db.Column(db.Integer, nullable=False, default=0)
+    issue_id = db.Column(db.Integer, nullable=True)
+    distribution_id = db.Column(db.Integer, nullable=True)
+    actor = db.Column(db.String(120), nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_inventory_movements_equipment_id_occurred_at', 'equipment_id', 'occurred_at'),
+    )
+
+
+# Stock of every equipment at a point in time, so as-of queries only replay the movements since
+class InventorySnapshot(db.Model):
+    __tablename__ = 'inventory_snapshots'
+    taken_at = db.Column(db.DateTime, primary_key=True)
+    equipment_id = db.Column(db.Integer, primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False)
+    damaged_count = db.Column(db.Integer, nullable=False)
+    lost_count = db.Column(db.Integer, nullable=False)
+
+
+# Interned low-cardinality access log strings (user agents, endpoints, hosts, ...)
+class AccessLogDimension(db.Model):
+    __tablename__ = 'access_log_dimensions'
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # AccessLog column the value belongs to
+    value_hash = db.Column(db.String(40), nullable=False)  # sha1 of value, keeps the unique index small
+    value = db.Column(db.Text, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'value_hash', name='uq_access_log_dimensions_kind_value'),
+    )
+
+
+class _InternedComparator(Comparator):
+    """Class-level ``AccessLog.<interned>``: either storage form, whatever the current setting.
+
+    Selecting, grouping or ordering reads ``coalesce(inline, dimension value)``.
+    Equality and ``in_`` with literal values resolve them to dimension ids
+    through the cache instead and compare the two columns directly.
+    """
+
+    def __init__(self, cls, name):
+        self.inline = getattr(cls, '_' + name)
+        self.ref = getattr(cls, name + '_id')
+        self.kind = name
+        dimension = AccessLogDimension.__table__
+        interned = select(dimension.c.value).where(dimension.c.id == self.ref).scalar_subquery()
+        super().__init__(func.coalesce(self.inline, interned))
+
+    def _either(self, values):
+        if not has_app_context():
+            return None
+        from Utils.audit_dimensions import dimension_ids
+        ids = list(dimension_ids(self.kind, values).values())
+        inline = self.inline.in_(values) if len(values) != 1 else self.inline == values[0]
+        if not ids:
+            return inline
+        return or_(inline, self.ref.in_(ids) if len(ids) != 1 else self.ref == ids[0])
+
+    def operate(self, op, *other, **kwargs):
+        clause = None
+        if op is operators.eq and isinstance(other[0], str):
+            clause = self._either([other[0]])
+        elif op is operators.in_op and isinstance(other[0], (list, tuple, set)) \
+                and other[0] and all(isinstance(value, str) for value in other[0]):
+            clause = self._either(list(other[0]))
+        if clause is not None:
+            return clause
+        return op(self.expression, *other, **kwargs)
+
+    def reverse_operate(self, op, other, **kwargs):
+        return op(other, self.expression, **kwargs)
+
+
+def _interned(name):
+    """AccessLog attribute backed by an inline column or, when that is NULL, an interned dimension id"""
+    inline = '_' + name
+    ref = name + '_id'
+
+    def fget(self):
+        value = getattr(self, inline)
+        if value is None and getattr(self, ref) is not None:
+            from Utils.audit_dimensions import dimension_value
+            value = dimension_value(getattr(self, ref))
+        return value
+
+    def fset(self, value):
+        setattr(self, inline, value)
+
+    return hybrid_property(fget, fset).comparator(lambda cls: _InternedComparator(cls, name))
+
+
 class AccessLog(db.Model):
     __tablename__ = 'access_logs'
     id = db.Column(db.Integer, primary_key=True)  # 10. AUDIT TRAIL: Unique log entry ID
@@ -165,12 +363,17 @@ class AccessLog(db.Model):
 
     # 3. SOURCE INFORMATION
     ip_address = db.Column(db.String(45), nullable=True)  # IP Address
-    user_agent = db.Column(db.Text, nullable=True)  # Browser type, version, OS, Device type
+    _user_agent = db.Column('user_agent', db.Text, nullable=True)  # Browser type, version, OS, Device type
+    user_agent_id = db.Column(db.Integer, db.ForeignKey('access_log_dimensions.id'), nullable=True)
     geolocation = db.Column(db.String(255), nullable=True)  # Geolocation (optional)
+    browser = db.Column(db.String(50), nullable=True)  # Parsed from user agent, e.g. 'Chrome 130'
+    os_name = db.Column(db.String(50), nullable=True)  # Parsed from user agent, e.g. 'Windows 10/11'
+    device_type = db.Column(db.String(20), nullable=True)  # desktop / mobile / tablet / bot / script
 
     # 4. ACTION PERFORMED
     action = db.Column(db.String(200), nullable=False)  # Event type & description
-    endpoint = db.Column(db.String(255), nullable=True)  # Resource accessed (page URL)
+    _endpoint = db.Column('endpoint', db.String(255), nullable=True)  # Resource accessed (page URL)
+    endpoint_id = db.Column(db.Integer, db.ForeignKey('access_log_dimensions.id'), nullable=True)
     method = db.Column(db.String(10), nullable=False, default='GET')  # HTTP method
     status_code = db.Column(db.Integer, nullable=True)  # HTTP status code
     action_status = db.Column(db.String(20), default='Success', nullable=False)  # Success/Failure
@@ -182,10 +385,14 @@ class AccessLog(db.Model):
     mfa_used = db.Column(db.Boolean, default=False, nullable=False)  # MFA status
 
     # 6. SYSTEM/APPLICATION DETAILS
-    app_name = db.Column(db.String(100), default='SportEquipmentSystem', nullable=False)  # Application name
-    module = db.Column(db.String(100), nullable=True)  # Module/section accessed
-    server_hostname = db.Column(db.String(255), nullable=True)  # Server/hostname
-    protocol = db.Column(db.String(10), default='HTTP', nullable=False)  # Protocol used
+    _app_name = db.Column('app_name', db.String(100), default='SportEquipmentSystem', nullable=True)  # Application name
+    app_name_id = db.Column(db.Integer, db.ForeignKey('access_log_dimensions.id'), nullable=True)
+    _module = db.Column('module', db.String(100), nullable=True)  # Module/section accessed
+    module_id = db.Column(db.Integer, db.ForeignKey('access_log_dimensions.id'), nullable=True)
+    _server_hostname = db.Column('server_hostname', db.String(255), nullable=True)  # Server/hostname
+    server_hostname_id = db.Column(db.Integer, db.ForeignKey('access_log_dimensions.id'), nullable=True)
+    _protocol = db.Column('protocol', db.String(10), default='HTTP', nullable=True)  # Protocol used
+    protocol_id = db.Column(db.Integer, db.ForeignKey('access_log_dimensions.id'), nullable=True)
 
     # 7. DATA MODIFICATION TRACKING
     data_changed = db.Column(db.Text, nullable=True)  # Before/after values
@@ -201,20 +408,56 @@ class AccessLog(db.Model):
     # 9. ADDITIONAL METADATA
     duration_ms = db.Column(db.Integer, nullable=True)  # Duration in milliseconds
     data_size_bytes = db.Column(db.Integer, nullable=True)  # Size of data transferred
+    db_time_ms = db.Column(db.Integer, nullable=True)  # Time spent in SQL during the request
+    sql_count = db.Column(db.Integer, nullable=True)  # Number of SQL statements executed
+    hit_count = db.Column(db.Integer, default=1, nullable=False)  # Requests covered by this row (coalesced logging)
+    audit_mode = db.Column(db.String(10), default='full', nullable=False)  # full / sampled / coalesced
     referrer_url = db.Column(db.String(500), nullable=True)  # Referrer URL
 
     # 10. AUDIT TRAIL REQUIREMENTS - Tamper-proof, searchable, secure
     is_tamper_proof = db.Column(db.Boolean, default=True, nullable=False)
+    batch_id = db.Column(db.Integer, db.ForeignKey('access_log_batches.id'), nullable=True, index=True)  # Sealed batch (Merkle leaf of)
+    batch_seq = db.Column(db.Integer, nullable=True)  # Leaf position within the batch
     search_index = db.Column(db.Text, nullable=True)  # For enhanced searchability
 
+    # In compact storage mode these strings are stored as ids into access_log_dimensions;
+    # reads (instances and query expressions) see the same values either way
+    user_agent = _interned('user_agent')
+    endpoint = _interned('endpoint')
+    app_name = _interned('app_name')
+    module = _interned('module')
+    server_hostname = _interned('server_hostname')
+    protocol = _interned('protocol')
+
+    # Composite indexes backing keyset pagination: per-user trail and global trail
+    __table_args__ = (
+        db.Index('ix_access_logs_user_id_timestamp_id', 'user_id', 'timestamp', 'id'),
+        db.Index('ix_access_logs_timestamp_id', 'timestamp', 'id'),
+    )
+
     def __repr__(self):
         return f'<AccessLog {self.username} - {self.action} at {self.timestamp}>'
 
+    # Columns covered by log_hash. The id is assigned by the database on insert, so it
+    # is not part of the hash; the row's place is fixed by its batch and batch_seq instead.
+    HASHED_FIELDS = ('user_id', 'user_type', 'username', 'timestamp', 'action', 'endpoint', 'method',
+                     'ip_address', 'status_code', 'action_status', 'hit_count', 'session_id')
+
+    @classmethod
+    def compute_log_hash(cls, values):
+        """Integrity hash of a row given as a mapping of column values"""
+        import hashlib
+        parts = []
+        for field in cls.HASHED_FIELDS:
+            value = values.get(field)
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            parts.append('' if value is None else str(value))
+        return hashlib.sha256('\x1f'.join(parts).encode()).hexdigest()
+
     def generate_log_hash(self):
         """Generate integrity hash for tamper-proof logging"""
-        import hashlib
-        log_data = f"{self.id}{self.user_id}{self.username}{self.timestamp}{self.action}{self.endpoint}"
-        return hashlib.sha256(log_data.encode()).hexdigest()
+        return self.compute_log_hash({field: getattr(self, field) for field in self.HASHED_FIELDS})
 
     def to_dict(self):
         """Convert log entry to dictionary for JSON serialization"""
@@ -229,6 +472,9 @@ class AccessLog(db.Model):
             'ip_address': self.ip_address,
             'user_agent': self.user_agent,
             'geolocation': self.geolocation,
+            'browser': self.browser,
+            'os_name': self.os_name,
+            'device_type': self.device_type,
             'action': self.action,
             'endpoint': self.endpoint,
             'method': self.method,
@@ -251,10 +497,41 @@ class AccessLog(db.Model):
             'retention_days': self.retention_days,
             'duration_ms': self.duration_ms,
             'data_size_bytes': self.data_size_bytes,
+            'db_time_ms': self.db_time_ms,
+            'sql_count': self.sql_count,
+            'hit_count': self.hit_count,
+            'audit_mode': self.audit_mode,
             'referrer_url': self.referrer_url,
             'is_tamper_proof': self.is_tamper_proof
         }
 
+# Sealed batch of access logs: Merkle root over the batch's log hashes, chained to the previous batch
+class AccessLogBatch(db.Model):
+    __tablename__ = 'access_log_batches'
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    log_count = db.Column(db.Integer, nullable=False)
+    merkle_root = db.Column(db.String(64), nullable=False)
+    prev_hash = db.Column(db.String(64), nullable=True)  # batch_hash of the previous batch
+    batch_hash = db.Column(db.String(64), nullable=False, unique=True)
+    pruned_batch_ids = db.Column(db.Text, nullable=True)  # prune record: JSON ids of the batches it emptied
+
+    def __repr__(self):
+        return f'<AccessLogBatch {self.id} ({self.log_count} logs)>'
+
+
+# Per-user rollup of access_logs, maintained as log batches are written
+class AccessLogSummary(db.Model):
+    __tablename__ = 'access_log_summaries'
+    user_type = db.Column(db.String(20), primary_key=True)
+    user_id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(120), nullable=False)
+    full_name = db.Column(db.String(120), nullable=True)
+    log_count = db.Column(db.Integer, default=0, nullable=False)
+    first_seen = db.Column(db.DateTime, nullable=True)
+    last_seen = db.Column(db.DateTime, nullable=True, index=True)
+    last_action = db.Column(db.String(200), nullable=True)
+
 class Notification(db.Model):
     __tablename__ = 'notifications'
     id = db.Column(db.Integer, primary_key=True)
@@ -264,3 +541,42 @@ class Notification(db.Model):
     url = db.Column(db.String(500), nullable=True)
     is_read = db.Column(db.Boolean, default=False, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+# Bulk clearance checks (Utils/bulk_clearance.py): state and result live in the
+# database so any worker can report progress and serve the download
+class BulkClearanceJob(db.Model):
+    __tablename__ = 'bulk_clearance_jobs'
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex, used in URLs
+    recipient_type = db.Column(db.String(10), nullable=False, default='student')
+    created_by = db.Column(db.String(120), nullable=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    state = db.Column(db.String(10), nullable=False, default='queued')  # queued, running, done, failed
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    @property
+    def percent(self):
+        return int(self.processed * 100 / self.total) if self.total else 100
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'recipient_type': self.recipient_type,
+            'total': self.total,
+            'processed': self.processed,
+            'percent': self.percent,
+            'state': self.state,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class BulkClearanceChunk(db.Model):
+    __tablename__ = 'bulk_clearance_chunks'
+    job_id = db.Column(db.String(32), db.ForeignKey('bulk_clearance_jobs.id', ondelete='CASCADE'), primary_key=True)
+    seq = db.Column(db.Integer, primary_key=True)  # order in the result CSV
+    data = db.Column(db.Text, nullable=False)  # CSV text of one batch
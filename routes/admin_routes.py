@@ -1,17 +1,34 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, Response, jsonify, session, abort, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, Response, jsonify, session, abort, current_app, stream_with_context
 from flask_login import login_required, current_user
 from extensions import db
-from models import Admin, StoreKeeper, Equipment, IssuedEquipment, Clearance, Student, Staff, SatelliteCampus, EquipmentCategory, CampusDistribution, AccessLog
-from datetime import datetime, UTC, timedelta
+from models import Admin, StoreKeeper, Equipment, IssuedEquipment, Clearance, Student, Staff, SatelliteCampus, EquipmentCategory, CampusDistribution, AccessLog, AccessLogBatch, AccessLogSummary, ReturnLine
+from datetime import datetime, UTC, time, timedelta
 import os
 from werkzeug.utils import secure_filename
 import uuid
 from Utils.clearance_integration import get_clearance_status
+from Utils.clearance_batch import BATCH_ACTIONS, apply_clearance_action, merge_summaries
+from Utils.bulk_clearance import get_bulk_check, read_recipient_ids, recent_bulk_checks, start_bulk_check, stream_bulk_check
+from Utils.bulk_issue import BulkIssueError, issue_lines, parse_expected_return, parse_lines, parse_recipient
+from Utils.inventory_ledger import as_of
+from Utils.clearance_report import DEFAULT_PER_PAGE, filter_args, load_clearance_page, parse_filters, status_counts
+from Utils.audit_search import search_access_logs
+from Utils.audit_sink import build_access_record
+from Utils.overdue import due_issues
+from Utils.pagination import decode_cursor, decode_key_cursor, keyset_paginate
+from Utils.serial_registry import serial_holder, serials_in_use
+from Utils.stock import (
+    InsufficientStock, commit_with_retry, put_equipment_units, return_equipment_units, take_equipment_units,
+)
+from Utils.return_lines import condition_totals, record_return, unresolved_damage_filter, unresolved_damage_lines
+from Utils.request_metrics import annotate_audit_record, attach_audit_record
 import csv
 import io
 import re
 import json
 from sqlalchemy import distinct, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 from werkzeug.utils import secure_filename
 
 # Optional PDF parsing support
@@ -35,77 +52,18 @@ def _require_admin():
         from flask import redirect, url_for
         return redirect(url_for('storekeeper.dashboard'))
     
-    # Log access for audit trail
+    # Log access for audit trail (completed with timing data and queued at request teardown)
     try:
-        from flask import session
-        import socket
-
-        # Get user full name
-        full_name = getattr(current_user, 'username', 'Unknown')  # Admin uses username as display name
-
-        # Get session ID
-        session_id = session.get('session_id', session.sid if hasattr(session, 'sid') else None)
-
-        # Parse User Agent for device/browser info
-        user_agent = request.headers.get('User-Agent', '')
-
-        # Get server hostname
-        server_hostname = socket.gethostname()
-
-        # Determine protocol
-        protocol = 'HTTPS' if request.is_secure else 'HTTP'
-
-        # Get referrer URL
-        referrer_url = request.referrer
-
-        # Create comprehensive log entry
-        log = AccessLog(
-            # 1. USER IDENTIFICATION
-            user_id=current_user.id,
+        record = build_access_record(
             user_type='admin',
+            user_id=current_user.id,
             username=current_user.username,
-            full_name=full_name,
-
-            # 2. TIMESTAMP
-            timezone='UTC',
-
-            # 3. SOURCE INFORMATION
-            ip_address=request.remote_addr,
-            user_agent=user_agent,
-
-            # 4. ACTION PERFORMED
-            action=f"Accessed {request.endpoint or 'unknown'}",
-            endpoint=request.endpoint,
-            method=request.method,
-            action_status='Success',
-
-            # 5. AUTHENTICATION DETAILS
-            auth_method='password',
-            session_id=session_id,
-            mfa_used=False,
-
-            # 6. SYSTEM/APPLICATION DETAILS
-            app_name='SportEquipmentSystem',
-            module=request.endpoint.split('.')[-1] if request.endpoint else 'unknown',
-            server_hostname=server_hostname,
-            protocol=protocol,
-
-            # 9. ADDITIONAL METADATA
-            referrer_url=referrer_url,
-
-            # 10. AUDIT TRAIL
-            is_tamper_proof=True
+            full_name=getattr(current_user, 'username', 'Unknown'),  # Admin uses username as display name
         )
-
-        # Generate integrity hash
-        log.log_hash = log.generate_log_hash()
-
-        db.session.add(log)
-        db.session.commit()
+        attach_audit_record(record)
     except Exception as e:
         # Don't let logging errors break the app
-        db.session.rollback()
-        pass
+        current_app.logger.warning('Admin access logging failed: %s', e)
 
 @admin_bp.route('/dashboard')
 @login_required
@@ -114,29 +72,26 @@ def dashboard():
     total_satellite_campuses = SatelliteCampus.query.filter_by(is_active=True).count()
 
     # Calculate cleared students dynamically
-    from Utils.clearance_integration import get_clearance_status
-    students = Student.query.all()
-    total_cleared = sum(1 for student in students if get_clearance_status(student.id) == 'Cleared')
+    # Every student without outstanding/unresolved equipment counts as cleared, so one
+    # bulk pass over students with equipment on record covers the rest
+    from Utils.clearance_integration import get_clearance_statuses
+    not_cleared = [sid for sid, status in get_clearance_statuses(recipient_type='student').items() if status != 'Cleared']
+    total_cleared = Student.query.count()
+    for start in range(0, len(not_cleared), 900):
+        total_cleared -= Student.query.filter(Student.id.in_(not_cleared[start:start + 900])).count()
 
     # Additional overview statistics
     total_returned = IssuedEquipment.query.filter(IssuedEquipment.status == 'Returned').count()
-    returned_good = IssuedEquipment.query.filter(
-        IssuedEquipment.status == 'Returned',
-        IssuedEquipment.return_conditions == 'Good'
-    ).count()
+    # Units returned per condition, from the return lines
+    returned_by_condition = condition_totals()
+    returned_good = returned_by_condition['Good']
 
     # Distribution metrics (satellite campus distributions)
     total_distributions_count = CampusDistribution.query.count()
     # Sum of quantities distributed to campuses
     total_distributed_quantity = db.session.query(func.coalesce(func.sum(CampusDistribution.quantity), 0)).scalar()
-    returned_damaged = IssuedEquipment.query.filter(
-        IssuedEquipment.status == 'Returned',
-        IssuedEquipment.return_conditions == 'Damaged'
-    ).count()
-    returned_lost = IssuedEquipment.query.filter(
-        IssuedEquipment.status == 'Returned',
-        IssuedEquipment.return_conditions == 'Lost'
-    ).count()
+    returned_damaged = returned_by_condition['Damaged']
+    returned_lost = returned_by_condition['Lost']
 
     # Total recipients (students + staff)
     total_students = Student.query.count()
@@ -144,14 +99,7 @@ def dashboard():
     total_recipients = total_students + total_staff
 
     # Find due issued items (due date is today or earlier and still Issued)
-    today = datetime.now().date()
-    due_items_q = IssuedEquipment.query.filter(
-        IssuedEquipment.status == 'Issued',
-        IssuedEquipment.expected_return != None,
-        func.date(IssuedEquipment.expected_return) <= today
-    ).order_by(IssuedEquipment.expected_return.asc())
-
-    due_items = due_items_q.all()
+    due_items = due_issues().all()
 
     # Build flat list of all due items with recipient details
     all_due_items = []
@@ -231,8 +179,7 @@ def equipment():
 
         existing_exact = Equipment.query.filter_by(category_code=category_code.upper(), name=name).first()
         if existing_exact:
-            existing_exact.quantity = (existing_exact.quantity or 0) + qty
-            db.session.add(existing_exact)
+            put_equipment_units(existing_exact.id, 'receipt', qty)
             db.session.commit()
             flash(f'Existing equipment "{name}" updated. Quantity increased by {qty}.', 'success')
         else:
@@ -338,8 +285,7 @@ def equipment_upload():
             # If any equipment with the same category_code exists, update it
             existing_by_code = Equipment.query.filter_by(category_code=category_code).first()
             if existing_by_code:
-                existing_by_code.quantity = (existing_by_code.quantity or 0) + max(0, qty)
-                db.session.add(existing_by_code)
+                put_equipment_units(existing_by_code.id, 'receipt', max(0, qty))
                 updated += 1
             else:
                 new_item = Equipment(
@@ -566,8 +512,7 @@ def equipment_upload():
         # If any equipment with the same category_code exists, update it instead of creating new
         existing_by_code = Equipment.query.filter_by(category_code=category_code).first()
         if existing_by_code:
-            existing_by_code.quantity = (existing_by_code.quantity or 0) + max(0, qty)
-            db.session.add(existing_by_code)
+            put_equipment_units(existing_by_code.id, 'receipt', max(0, qty))
             updated += 1
         else:
             new_item = Equipment(
@@ -654,7 +599,9 @@ def equipment_edit(equipment_id):
     eq.name = name
     eq.category = category
     eq.category_code = category_code
-    eq.quantity = quantity
+    # Move the quantity by the change the admin made, keeping issues committed meanwhile
+    change = quantity - (eq.quantity or 0)
+    put_equipment_units(eq.id, 'receipt' if change > 0 else 'adjustment', change)
 
     # Optional fields: condition and is_active
     cond = request.form.get('condition')
@@ -710,100 +657,145 @@ def equipment_delete(equipment_id):
 @admin_bp.route('/clearance-report')
 @login_required
 def clearance_report():
-    """Show all issued equipment for students for clearance purposes, or for staff"""
+    """Show clearance status of student and staff recipients, a page at a time, with status/campus/issuer/date filters"""
     # Explicit admin-only guard: return 403 for non-admins
     if not (current_user.is_authenticated and isinstance(current_user, Admin)):
         abort(403)
-    # Get recipient ID filter from query string
-    recipient_id = request.args.get('student_id', '').strip()  # keep student_id for backward compatibility, but treat as recipient_id
+    filters = parse_filters(request.args)
+    per_page = request.args.get('per_page', DEFAULT_PER_PAGE, type=int)
+    # Filters and pagination run in the database: one page query plus one count query
+    page = load_clearance_page(filters, per_page, after=request.args.get('after'), before=request.args.get('before'))
 
-    # Base query
-    query = IssuedEquipment.query
+    return render_template('clearance_report.html',
+                           student_id=filters['search'] or '',
+                           is_pdf=False,
+                           rows=page.items,
+                           page=page,
+                           clearance_counts=status_counts(filters),
+                           filters=filters,
+                           filter_args=filter_args(filters),
+                           campuses=SatelliteCampus.query.order_by(SatelliteCampus.name).all(),
+                           storekeepers=StoreKeeper.query.order_by(StoreKeeper.full_name).all())
 
-    # Apply recipient ID filter if provided
-    if recipient_id:
-        query = query.filter(
-            db.or_(
-                IssuedEquipment.student_id.ilike(f"%{recipient_id}%"),
-                IssuedEquipment.staff_payroll.ilike(f"%{recipient_id}%")
-            )
-        )
 
-    # Get all issued equipment (both current and returned)
-    issued_items = query.order_by(IssuedEquipment.date_issued.desc()).all()
-
-    # Check if this is for a student or staff
-    is_student = any(it.student for it in issued_items)
-    is_staff = any(it.staff for it in issued_items)
-
-    # Calculate clearance status counts directly from database
-    clearance_counts = {'Cleared': 0, 'Pending': 0, 'Overdue': 0, 'Total': 0}
-    status_map = {}
-    recipient_info = {}  # Store recipient name and type for display
-
-    # Get unique recipient IDs (both students and staff) from the filtered results
-    recipient_ids = set()
-    for it in issued_items:
-        if it.student_id:
-            recipient_ids.add(('student', it.student_id))
-        elif it.staff_payroll:
-            recipient_ids.add(('staff', it.staff_payroll))
-
-    clearance_counts['Total'] = len(recipient_ids)
-
-    from Utils.clearance_integration import get_clearance_status
-    for recipient_type, recipient_id in recipient_ids:
-        status = get_clearance_status(recipient_id, recipient_type)
-        status_map[recipient_id] = status
-        clearance_counts[status] = clearance_counts.get(status, 0) + 1
-
-        # Build recipient info for display, include issuing storekeeper and campus
-        recipient_name = 'Unknown'
-        issued_by_display = ''
-        campus_name = ''
-
-        # Get representative (most recent) issued record for this recipient
-        rep_issue = IssuedEquipment.query.filter(
-            db.or_(IssuedEquipment.student_id == recipient_id, IssuedEquipment.staff_payroll == recipient_id)
-        ).order_by(IssuedEquipment.date_issued.desc()).first()
-
-        if rep_issue:
-            issued_by_display = rep_issue.issued_by or ''
-            # Try to resolve issued_by to a StoreKeeper (payroll_number)
-            sk = None
-            try:
-                sk = StoreKeeper.query.filter_by(payroll_number=issued_by_display).first()
-            except Exception:
-                sk = None
-            if sk:
-                issued_by_display = sk.full_name
-                campus_name = sk.campus.name if sk.campus else ''
-
-        if recipient_type == 'student':
-            student = Student.query.get(recipient_id)
-            if student:
-                recipient_name = student.name
-        else:  # staff
-            staff = Staff.query.get(recipient_id)
-            if staff:
-                recipient_name = staff.name
+@admin_bp.route('/api/clearance_report')
+@login_required
+def api_clearance_report():
+    """Return one page of the clearance report as JSON, with the same filters as the HTML report.
 
-        recipient_info[recipient_id] = {
-            'name': recipient_name,
-            'type': 'Student' if recipient_type == 'student' else 'Staff',
-            'issued_by': issued_by_display,
-            'campus': campus_name
-        }
+    Pass the returned ``next_cursor`` back as ``after`` (or ``prev_cursor`` as ``before``) for the neighbouring page.
+    """
+    if not (current_user.is_authenticated and isinstance(current_user, Admin)):
+        abort(403)
+    after = request.args.get('after')
+    before = request.args.get('before')
+    if (after and decode_key_cursor(after) is None) or (before and decode_key_cursor(before) is None):
+        return jsonify(error='Invalid cursor'), 400
+    filters = parse_filters(request.args)
+    per_page = request.args.get('per_page', DEFAULT_PER_PAGE, type=int)
+    page = load_clearance_page(filters, per_page, after=after, before=before)
+    recipients = [
+        dict(row, date_issued=row['date_issued'].isoformat() if row['date_issued'] else None)
+        for row in page.items
+    ]
+    return jsonify(recipients=recipients, counts=status_counts(filters),
+                   next_cursor=page.next_cursor, prev_cursor=page.prev_cursor)
+
+
+@admin_bp.route('/clearance/bulk-check', methods=['GET', 'POST'])
+@login_required
+def bulk_clearance():
+    """Upload a CSV of student IDs / payroll numbers and check their clearance in the background."""
+    if not (current_user.is_authenticated and isinstance(current_user, Admin)):
+        abort(403)
+    if request.method == 'POST':
+        file = request.files.get('csv_file')
+        if not file or not file.filename:
+            flash('No file uploaded.', 'danger')
+            return redirect(url_for('admin.bulk_clearance'))
+        recipient_type = 'staff' if request.form.get('recipient_type') == 'staff' else 'student'
+        try:
+            recipient_ids = read_recipient_ids(io.TextIOWrapper(file.stream, encoding='utf-8-sig', errors='replace'))
+        except csv.Error as e:
+            flash('Could not read CSV: ' + str(e), 'danger')
+            return redirect(url_for('admin.bulk_clearance'))
+        if not recipient_ids:
+            flash('The uploaded file contains no recipient IDs.', 'warning')
+            return redirect(url_for('admin.bulk_clearance'))
+        start_bulk_check(current_app._get_current_object(), recipient_ids, recipient_type, created_by=current_user.username)
+        flash(f'Checking clearance for {len(recipient_ids)} recipients. The result will be available below.', 'info')
+        return redirect(url_for('admin.bulk_clearance'))
+    return render_template('bulk_clearance.html', jobs=recent_bulk_checks())
+
+
+@admin_bp.route('/api/clearance/bulk-check/<job_id>')
+@login_required
+def api_bulk_clearance_job(job_id):
+    """Return the progress of a bulk clearance check."""
+    if not (current_user.is_authenticated and isinstance(current_user, Admin)):
+        abort(403)
+    job = get_bulk_check(job_id)
+    if job is None:
+        return jsonify(error='Unknown job'), 404
+    return jsonify(job.to_dict())
 
-    return render_template('clearance_report.html',
-                           issued_items=issued_items,
-                           student_id=recipient_id,
-                           is_pdf=False,
-                           clearance_status_map=status_map,
-                           clearance_counts=clearance_counts,
-                           recipient_info=recipient_info,
-                           is_student=is_student,
-                           is_staff=is_staff)
+
+@admin_bp.route('/clearance/bulk-check/<job_id>/download')
+@login_required
+def bulk_clearance_download(job_id):
+    """Stream the result CSV of a finished bulk clearance check."""
+    if not (current_user.is_authenticated and isinstance(current_user, Admin)):
+        abort(403)
+    job = get_bulk_check(job_id)
+    if job is None or job.state != 'done':
+        abort(404)
+    filename = f"clearance_check_{job.created_at:%Y%m%d_%H%M}.csv"
+    return Response(stream_with_context(stream_bulk_check(job.id)), mimetype='text/csv',
+                    headers={"Content-Disposition": f"attachment;filename={filename}"})
+
+
+def _audit_clearance_batch(summary):
+    """Record a clearance batch on the request's audit log entry: one entry however many items it touched."""
+    annotate_audit_record(
+        action=f"Clearance {summary['action']}: {summary['applied']} item(s), {summary['recipients']} recipient(s)",
+        record_id=f"{summary['applied']} items",
+        data_changed=json.dumps(summary),
+    )
+
+
+@admin_bp.route('/api/clearance/batch', methods=['POST'])
+@login_required
+def api_clearance_batch():
+    """Apply a clearance action to many issued items in one transaction.
+
+    JSON body: ``action`` (replaced, repaired, waiver or rollback), ``issue_ids``
+    and/or ``recipient_ids`` (all items of those students/staff), optional
+    ``note`` for rollbacks. Returns a summary of what was applied.
+    """
+    if not (current_user.is_authenticated and isinstance(current_user, Admin)):
+        abort(403)
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    if action not in BATCH_ACTIONS:
+        return jsonify(error=f"action must be one of: {', '.join(BATCH_ACTIONS)}"), 400
+    try:
+        issue_ids = [int(issue_id) for issue_id in data.get('issue_ids') or []]
+    except (TypeError, ValueError):
+        return jsonify(error='issue_ids must be integers'), 400
+    recipient_ids = [str(recipient_id).strip() for recipient_id in data.get('recipient_ids') or [] if str(recipient_id).strip()]
+    if not issue_ids and not recipient_ids:
+        return jsonify(error='Pass issue_ids and/or recipient_ids'), 400
+
+    try:
+        summary = apply_clearance_action(action, issue_ids=issue_ids, recipient_ids=recipient_ids,
+                                         actor=current_user.username, note=(data.get('note') or '').strip())
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception('Clearance batch failed')
+        return jsonify(error='Error applying clearance action: ' + str(e)), 500
+    _audit_clearance_batch(summary)
+    return jsonify(summary)
 
 
 @admin_bp.route('/clearance/<path:recipient_id>/items', methods=['GET', 'POST'])
@@ -823,39 +815,16 @@ def clearance_manage_items(recipient_id):
         flash('Missing recipient identifier.', 'danger')
         return redirect(url_for('admin.clearance_report'))
 
-    # Get all returned items for this recipient (both student and staff)
-    all_items = IssuedEquipment.query.filter(
+    # Returned items for this recipient (both student and staff) with damaged/lost units not yet settled
+    damaged_lost_items = IssuedEquipment.query.filter(
         IssuedEquipment.status == 'Returned',
         db.or_(
             IssuedEquipment.student_id == recipient_id,
             IssuedEquipment.staff_payroll == recipient_id
-        )
+        ),
+        unresolved_damage_filter()
     ).order_by(IssuedEquipment.date_returned.desc()).all()
 
-    # Filter to only damaged/lost items (not marked as replaced)
-    damaged_lost_items = []
-    for item in all_items:
-        if item.return_conditions:
-            try:
-                conditions = json.loads(item.return_conditions)
-                # Skip if already marked as replaced
-                if isinstance(conditions, dict) and conditions.get('replaced'):
-                    continue
-                # Check if any condition is damaged or lost
-                has_damage = False
-                if isinstance(conditions, dict):
-                    for cond in conditions.values():
-                        if isinstance(cond, str) and cond.lower() in ('damaged', 'lost'):
-                            has_damage = True
-                            break
-                elif isinstance(conditions, str) and conditions.lower() in ('damaged', 'lost'):
-                    has_damage = True
-                
-                if has_damage:
-                    damaged_lost_items.append(item)
-            except (json.JSONDecodeError, TypeError):
-                pass
-
     # Get recipient info
     recipient_name = 'Unknown'
     recipient_type = 'Student'
@@ -876,47 +845,26 @@ def clearance_manage_items(recipient_id):
                              recipient_type=recipient_type,
                              items=damaged_lost_items)
 
-    # POST: apply actions to items
+    # POST: apply actions to items, one set-based batch per action
+    selected = {'replaced': [], 'repaired': [], 'waiver': []}
+    for item in damaged_lost_items:
+        action = request.form.get(f'action_{item.id}', '').strip()
+        if action in selected:
+            selected[action].append(item.id)
+
     processed_items = []
     action_counts = {'replaced': 0, 'repaired': 0, 'waiver': 0}
-    
-    for item in damaged_lost_items:
-        action_key = f'action_{item.id}'
-        action = request.form.get(action_key, '').strip()
-        
-        if not action:
-            continue
-        
-        if action not in ('replaced', 'repaired', 'waiver'):
-            continue
-        
-        try:
-            equipment = db.session.get(Equipment, item.equipment_id)
-        except Exception:
-            equipment = None
-        
-        # For 'replaced' action: adjust equipment counts (reverse damaged/lost increments)
-        # For 'repaired' and 'waiver': keep inventory as is (no adjustment needed)
-        if action == 'replaced' and equipment:
-            conditions = json.loads(item.return_conditions or '{}')
-            for cond in conditions.values():
-                if isinstance(cond, str) and cond.lower() == 'damaged':
-                    equipment.damaged_count = max(0, (equipment.damaged_count or 0) - 1)
-                    equipment.quantity = (equipment.quantity or 0) + 1
-                elif isinstance(cond, str) and cond.lower() == 'lost':
-                    equipment.lost_count = max(0, (equipment.lost_count or 0) - 1)
-                    equipment.quantity = (equipment.quantity or 0) + 1
-            db.session.add(equipment)
-        
-        # Store the action taken in return_conditions
-        item.return_conditions = json.dumps({
-            'action': action,
-            'action_date': datetime.now(UTC).isoformat(),
-            'action_by': current_user.username if current_user else 'System'
-        })
-        db.session.add(item)
-        processed_items.append(str(item.id))
-        action_counts[action] += 1
+    actor = current_user.username if current_user else 'System'
+    summaries = []
+    for action, issue_ids in selected.items():
+        if issue_ids:
+            summary = apply_clearance_action(action, issue_ids=issue_ids, actor=actor)
+            summaries.append(summary)
+            processed_items.extend(str(issue_id) for issue_id in summary['issue_ids'])
+            action_counts[action] += summary['applied']
+    if summaries:
+        # One audit entry per request: record every action's items, not just the last batch's
+        _audit_clearance_batch(merge_summaries(summaries))
 
     if processed_items:
         try:
@@ -967,29 +915,14 @@ def clearance_manage(student_id):
 
     # POST: attempt to clear
     # First, handle any replacements submitted for damaged/lost items
+    # Replacement restocks the damaged/lost units and settles them, for all ticked items at once
     replaced_ids = []
-    for it in items:
-        form_key = f'replaced_{it.id}'
-        if request.form.get(form_key):
-            try:
-                equipment = db.session.get(Equipment, it.equipment_id)
-            except Exception:
-                equipment = None
-            # Adjust equipment counts: reverse damaged/lost increments and add back to quantity
-            if equipment:
-                conditions = json.loads(it.return_conditions or '{}')
-                for cond in conditions.values():
-                    if cond.lower() == 'damaged':
-                        equipment.damaged_count = max(0, (equipment.damaged_count or 0) - 1)
-                        equipment.quantity = (equipment.quantity or 0) + 1
-                    elif cond.lower() == 'lost':
-                        equipment.lost_count = max(0, (equipment.lost_count or 0) - 1)
-                        equipment.quantity = (equipment.quantity or 0) + 1
-                db.session.add(equipment)
-            # Mark the issue's return condition as Replaced
-            it.return_conditions = json.dumps({'replaced': True})
-            db.session.add(it)
-            replaced_ids.append(str(it.id))
+    ticked = [it.id for it in items if request.form.get(f'replaced_{it.id}')]
+    if ticked:
+        summary = apply_clearance_action('replaced', issue_ids=ticked,
+                                         actor=current_user.username if current_user else 'System')
+        _audit_clearance_batch(summary)
+        replaced_ids = [str(issue_id) for issue_id in summary['issue_ids']]
 
     if replaced_ids:
         try:
@@ -1022,7 +955,7 @@ def clearance_manage(student_id):
         return redirect(url_for('admin.clearance_report', student_id=student_id))
 
     # All items are returned - check their return conditions
-    bad = [it for it in items if any(c.lower() in ('damaged', 'lost') for c in json.loads(it.return_conditions or '{}').values())]
+    bad = [it for it in items if unresolved_damage_lines(it)]
     if bad:
         clearance.status = 'Pending'
         clearance.last_updated = datetime.now(UTC)
@@ -1074,43 +1007,26 @@ def clearance_rollback(recipient_id):
         flash('No items selected for rollback review.', 'warning')
         return redirect(url_for('admin.clearance_report', student_id=recipient_id))
 
-    marked = []
-    notified_storekeepers = set()
+    # Only this recipient's returned items can be rolled back from their page
+    returned_ids = {it.id for it in returned_items}
+    issue_ids = []
     for sid in selected:
         try:
-            it = IssuedEquipment.query.get(int(sid))
-        except Exception:
-            it = None
-        if not it:
+            if int(sid) in returned_ids:
+                issue_ids.append(int(sid))
+        except ValueError:
             continue
-        # Mark item as needing review
-        it.damage_clearance_status = 'Needs Review'
-        note_prefix = f"[Admin Rollback] {admin_note}" if admin_note else '[Admin Rollback] Marked for review'
-        it.damage_clearance_notes = (it.damage_clearance_notes or '') + '\n' + note_prefix
-        db.session.add(it)
-        marked.append(str(it.id))
-
-        # Collect storekeeper to notify (if we can resolve issued_by)
-        try:
-            sk = StoreKeeper.query.filter_by(payroll_number=it.issued_by).first()
-            if sk:
-                notified_storekeepers.add(sk.id)
-        except Exception:
-            pass
-
-    # Update clearance record to Pending
-    try:
+    summary = apply_clearance_action('rollback', issue_ids=issue_ids, note=admin_note)
+    _audit_clearance_batch(summary)
+    marked = summary['issue_ids']
+    if student and not marked:
+        # The batch moved the clearance record to Pending; do so even when no selected item applied
         clearance = Clearance.query.filter_by(student_id=recipient_id).first()
         if clearance:
             clearance.status = 'Pending'
             clearance.last_updated = datetime.now(UTC)
-            db.session.add(clearance)
         else:
-            if student:
-                c = Clearance(student_id=recipient_id, status='Pending', last_updated=datetime.now(UTC))
-                db.session.add(c)
-    except Exception:
-        pass
+            db.session.add(Clearance(student_id=recipient_id, status='Pending', last_updated=datetime.now(UTC)))
 
     try:
         db.session.commit()
@@ -1146,29 +1062,14 @@ def clearance_manage_staff(staff_payroll):
 
     # POST: attempt to clear
     # First, handle any replacements submitted for damaged/lost items
+    # Replacement restocks the damaged/lost units and settles them, for all ticked items at once
     replaced_ids = []
-    for it in items:
-        form_key = f'replaced_{it.id}'
-        if request.form.get(form_key):
-            try:
-                equipment = db.session.get(Equipment, it.equipment_id)
-            except Exception:
-                equipment = None
-            # Adjust equipment counts: reverse damaged/lost increments and add back to quantity
-            if equipment:
-                conditions = json.loads(it.return_conditions or '{}')
-                for cond in conditions.values():
-                    if cond.lower() == 'damaged':
-                        equipment.damaged_count = max(0, (equipment.damaged_count or 0) - 1)
-                        equipment.quantity = (equipment.quantity or 0) + 1
-                    elif cond.lower() == 'lost':
-                        equipment.lost_count = max(0, (equipment.lost_count or 0) - 1)
-                        equipment.quantity = (equipment.quantity or 0) + 1
-                db.session.add(equipment)
-            # Mark the issue's return condition as Replaced
-            it.return_conditions = json.dumps({'replaced': True})
-            db.session.add(it)
-            replaced_ids.append(str(it.id))
+    ticked = [it.id for it in items if request.form.get(f'replaced_{it.id}')]
+    if ticked:
+        summary = apply_clearance_action('replaced', issue_ids=ticked,
+                                         actor=current_user.username if current_user else 'System')
+        _audit_clearance_batch(summary)
+        replaced_ids = [str(issue_id) for issue_id in summary['issue_ids']]
 
     if replaced_ids:
         try:
@@ -1191,7 +1092,7 @@ def clearance_manage_staff(staff_payroll):
         return redirect(url_for('admin.clearance_report', student_id=staff_payroll))
 
     # All items are returned - check their return conditions
-    bad = [it for it in items if any(c.lower() in ('damaged', 'lost') for c in json.loads(it.return_conditions or '{}').values())]
+    bad = [it for it in items if unresolved_damage_lines(it)]
     if bad:
         flash('Some returned items are Damaged or Lost. Clearance remains Pending.', 'warning')
         return redirect(url_for('admin.clearance_report', student_id=staff_payroll))
@@ -1219,7 +1120,13 @@ def clearance_report_print():
             )
         )
 
-    issued_items = query.order_by(IssuedEquipment.date_issued.desc()).all()
+    # Load recipients, equipment and return lines with the items instead of one query per row
+    issued_items = query.options(
+        selectinload(IssuedEquipment.student),
+        selectinload(IssuedEquipment.staff),
+        selectinload(IssuedEquipment.equipment),
+        selectinload(IssuedEquipment.return_lines),
+    ).order_by(IssuedEquipment.date_issued.desc()).all()
     # Derive recipient name from the returned items when available
     recipient_name = ''
     if issued_items:
@@ -1273,7 +1180,12 @@ def clearance_report_export():
             )
         )
 
-    issued_items = query.order_by(IssuedEquipment.date_issued.desc()).all()
+    issued_items = query.options(
+        selectinload(IssuedEquipment.student),
+        selectinload(IssuedEquipment.staff),
+        selectinload(IssuedEquipment.equipment),
+        selectinload(IssuedEquipment.return_lines),
+    ).order_by(IssuedEquipment.date_issued.desc()).all()
 
     # Create CSV
     import csv
@@ -1312,16 +1224,12 @@ def clearance_due_details(recipient_id):
         abort(403)
     
     # Get due items for this recipient (could be student or staff)
-    today = datetime.now().date()
-    due_items = IssuedEquipment.query.filter(
+    due_items = due_issues(
         db.or_(
             IssuedEquipment.student_id == recipient_id,
             IssuedEquipment.staff_payroll == recipient_id
-        ),
-        IssuedEquipment.status == 'Issued',
-        IssuedEquipment.expected_return != None,
-        func.date(IssuedEquipment.expected_return) <= today
-    ).order_by(IssuedEquipment.expected_return.asc()).all()
+        )
+    ).all()
     
     # Determine recipient type and name
     recipient_name = ''
@@ -1335,15 +1243,18 @@ def clearance_due_details(recipient_id):
             recipient_name = first_item.staff.name
             recipient_type = 'Staff'
     
-    # Get issuer info
+    # Get issuer info: all issuers in one query per user type
+    issuers = {item.issued_by for item in due_items if item.issued_by}
+    admins = {a.username: a for a in Admin.query.filter(Admin.username.in_(issuers))} if issuers else {}
+    storekeepers = {k.payroll_number: k for k in StoreKeeper.query.filter(StoreKeeper.payroll_number.in_(issuers))} if issuers else {}
     issuer_info = {}
     for item in due_items:
         if item.issued_by:
-            admin = Admin.query.filter_by(username=item.issued_by).first()
+            admin = admins.get(item.issued_by)
             if admin:
                 issuer_info[item.id] = {'name': admin.username, 'email': admin.email, 'id': admin.id}
             else:
-                storekeeper = StoreKeeper.query.filter_by(payroll_number=item.issued_by).first()
+                storekeeper = storekeepers.get(item.issued_by)
                 if storekeeper:
                     issuer_info[item.id] = {'name': storekeeper.full_name, 'email': storekeeper.email, 'id': storekeeper.id}
                 else:
@@ -1379,18 +1290,10 @@ def issue():
     confirm_unreturned = request.form.get('confirm_unreturned') == 'true'
     
     # Validate serial number uniqueness across database
-    if serial_numbers:
-        existing_serials = set()
-        for issue in IssuedEquipment.query.filter(IssuedEquipment.serial_numbers.isnot(None)):
-            try:
-                serials = json.loads(issue.serial_numbers)
-                existing_serials.update(serials)
-            except:
-                pass  # Skip invalid JSON
-        for sn in serial_numbers:
-            if sn.strip() and sn.strip() in existing_serials:
-                flash(f'Serial number "{sn.strip()}" is already in use. Please use a different serial number.', 'danger')
-                return redirect(url_for('admin.issue'))
+    in_use = serials_in_use(serial_numbers)
+    if in_use:
+        flash(f'Serial number "{sorted(in_use)[0]}" is already in use. Please use a different serial number.', 'danger')
+        return redirect(url_for('admin.issue'))
 
     # Validation
     if person_type == 'student':
@@ -1467,68 +1370,113 @@ def issue():
     if expected_return.date() < today_date:
         flash('Expected return date cannot be in the past. Please select today or a future date.', 'danger')
         return redirect(url_for('admin.issue'))
-    # Create the issued equipment record
-    # First, ensure Student or Staff record exists
-    if person_type == 'student':
-        student = Student.query.filter_by(id=student_id).first()
-        if not student:
-            student = Student(
-                id=student_id,
-                name=student_name,
-                email=student_email,
-                phone=student_phone
-            )
-            db.session.add(student)
-        else:
-            # Update existing student info if changed
-            student.name = student_name
-            student.email = student_email
-            student.phone = student_phone
-            db.session.add(student)
+    # Create the issued equipment record and take its units in one transaction.
+    # The units are taken with a conditional UPDATE, so two concurrent issues of
+    # the last units can't both succeed.
+    equipment_id = eq.id
+
+    def record_issue():
+        # First, ensure Student or Staff record exists
+        if person_type == 'student':
+            student = Student.query.filter_by(id=student_id).first()
+            if not student:
+                student = Student(
+                    id=student_id,
+                    name=student_name,
+                    email=student_email,
+                    phone=student_phone
+                )
+                db.session.add(student)
+            else:
+                # Update existing student info if changed
+                student.name = student_name
+                student.email = student_email
+                student.phone = student_phone
+                db.session.add(student)
         
-        issue = IssuedEquipment(
-            student_id=student_id,
-            equipment_id=eq.id, 
-            quantity=qty,
-            expected_return=expected_return,
-            serial_numbers=json.dumps(serial_numbers) if serial_numbers else None
-        )
-    else:  # staff
-        staff = Staff.query.filter_by(payroll_number=staff_payroll).first()
-        if not staff:
-            staff = Staff(
-                payroll_number=staff_payroll,
-                name=staff_name,
-                email=staff_email
+            issue = IssuedEquipment(
+                student_id=student_id,
+                equipment_id=equipment_id,
+                quantity=qty,
+                expected_return=expected_return,
+                serial_numbers=json.dumps(serial_numbers) if serial_numbers else None
             )
-            db.session.add(staff)
-        else:
-            # Update existing staff info if changed
-            staff.name = staff_name
-            staff.email = staff_email
-            db.session.add(staff)
+        else:  # staff
+            staff = Staff.query.filter_by(payroll_number=staff_payroll).first()
+            if not staff:
+                staff = Staff(
+                    payroll_number=staff_payroll,
+                    name=staff_name,
+                    email=staff_email
+                )
+                db.session.add(staff)
+            else:
+                # Update existing staff info if changed
+                staff.name = staff_name
+                staff.email = staff_email
+                db.session.add(staff)
         
-        issue = IssuedEquipment(
-            student_id=None,
-            staff_payroll=staff_payroll,
-            equipment_id=eq.id, 
-            quantity=qty,
-            expected_return=expected_return,
-            serial_numbers=json.dumps(serial_numbers) if serial_numbers else None
-        )
-    # record which user performed the issuance
+            issue = IssuedEquipment(
+                student_id=None,
+                staff_payroll=staff_payroll,
+                equipment_id=equipment_id,
+                quantity=qty,
+                expected_return=expected_return,
+                serial_numbers=json.dumps(serial_numbers) if serial_numbers else None
+            )
+        # record which user performed the issuance
+        try:
+            issue.issued_by = current_user.username
+        except Exception:
+            issue.issued_by = None
+        db.session.add(issue)
+        db.session.flush()
+        take_equipment_units(equipment_id, qty, 'issue', issue_id=issue.id)
+
     try:
-        issue.issued_by = current_user.username
-    except Exception:
-        issue.issued_by = None
-    db.session.add(issue)
-    eq.quantity = eq.quantity - qty
-    db.session.commit()
+        commit_with_retry(record_issue)
+    except InsufficientStock as e:
+        flash(f'Not enough items available. Available: {e.available}', 'danger')
+        return redirect(url_for('admin.issue'))
+    except IntegrityError:
+        # Another issue took one of the serials since the check above
+        in_use = serials_in_use(serial_numbers)
+        if not in_use:
+            raise
+        flash(f'Serial number "{sorted(in_use)[0]}" is already in use. Please use a different serial number.', 'danger')
+        return redirect(url_for('admin.issue'))
     flash('Equipment issued successfully.', 'success')
     # Redirect to combined receipt for this recipient
     recipient_id = student_id if person_type == 'student' else staff_payroll
     return redirect(url_for('admin.issue_receipt', recipient_id=recipient_id))
 
+@admin_bp.route('/api/issue/bulk', methods=['POST'])
+@login_required
+def api_issue_bulk():
+    """Issue many equipment lines to one recipient in one transaction.
+
+    JSON body: the recipient fields of the issue form (``person_type`` and
+    ``student_*`` or ``staff_*``), ``expected_return`` (YYYY-MM-DD), optional
+    ``confirm_unreturned`` and ``lines``: ``[{"equipment_id", "quantity",
+    "serial_numbers"}]``. Returns the new issue ids and the combined receipt.
+    """
+    if not (current_user.is_authenticated and isinstance(current_user, Admin)):
+        abort(403)
+    data = request.get_json(silent=True) or {}
+    try:
+        person_type, fields = parse_recipient(data)
+        lines = parse_lines(data.get('lines'))
+        expected_return = parse_expected_return(data.get('expected_return'))
+        issue_ids = issue_lines(person_type, fields, lines, expected_return, issued_by=current_user.username,
+                                confirm_unreturned=data.get('confirm_unreturned') is True)
+    except BulkIssueError as e:
+        return jsonify(errors=e.errors), e.status
+
+    recipient_id = fields['student_id'] if person_type == 'student' else fields['staff_payroll']
+    return jsonify(recipient_id=recipient_id, issue_ids=issue_ids,
+                   receipt_url=url_for('admin.issue_receipt', recipient_id=recipient_id)), 201
+
+
 @admin_bp.route('/issue-receipt/<int:issue_id>')
 @admin_bp.route('/issue-receipt/recipient/<path:recipient_id>')
 @login_required
@@ -1690,6 +1638,7 @@ def return_item(issue_id):
             'conditions': existing_conditions,
             'quantities': {k: v for k, v in existing_quantities.items()}
         })
+        record_return(issue, new_conditions, new_quantities)
 
         # Determine status based on return completeness
         if len(existing_conditions) >= len(serials):
@@ -1737,6 +1686,7 @@ def return_item(issue_id):
             return_qty = qty_to_return
         
         issue.return_conditions = json.dumps({'all': condition, 'quantity': return_qty})
+        record_return(issue, {None: condition}, {None: return_qty})
 
         if condition == 'Good':
             good_count = qty_to_return
@@ -1751,9 +1701,7 @@ def return_item(issue_id):
             damaged_count = 0
             lost_count = qty_to_return
 
-    equipment.quantity += good_count
-    equipment.damaged_count += damaged_count
-    equipment.lost_count += lost_count
+    return_equipment_units(equipment.id, good_count, damaged_count, lost_count, issue_id=issue.id)
 
     try:
         db.session.commit()
@@ -1919,7 +1867,35 @@ def access_logs():
     user_type_filter = request.args.get('user_type', '', type=str)  # Filter by 'admin', 'storekeeper', or ''
     action_filter = request.args.get('action', '', type=str)  # Search in action description
     selected_user_id = request.args.get('user_id', type=int)
-    
+    search_query = request.args.get('q', '', type=str).strip()  # Full-text search over the log documents
+
+    # Ranked full-text search (compliance investigations)
+    if search_query:
+        date_from = request.args.get('date_from', '', type=str)
+        date_to = request.args.get('date_to', '', type=str)
+        try:
+            start = datetime.strptime(date_from, '%Y-%m-%d') if date_from else None
+            end = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1) if date_to else None
+        except ValueError:
+            flash('Invalid date. Use YYYY-MM-DD.', 'danger')
+            return redirect(url_for('admin.access_logs', q=search_query))
+        results, has_next = search_access_logs(
+            search_query, user_type=user_type_filter or None, user_id=selected_user_id,
+            date_from=start, date_to=end, page=page, per_page=per_page
+        )
+        return render_template(
+            'access_logs.html',
+            search_query=search_query,
+            search_results=results,
+            search_has_next=has_next,
+            page=page,
+            date_from=date_from,
+            date_to=date_to,
+            user_type_filter=user_type_filter,
+            action_filter=action_filter,
+            per_page=per_page
+        )
+
     # If a specific user_id is provided, show detailed, paginated logs for that user
     if selected_user_id:
         query = AccessLog.query.filter_by(user_id=selected_user_id)
@@ -1928,7 +1904,11 @@ def access_logs():
         if action_filter:
             query = query.filter(AccessLog.action.ilike(f"%{action_filter}%"))
 
-        logs = query.order_by(AccessLog.timestamp.desc()).paginate(page=page, per_page=per_page, error_out=False)
+        # Cursor pagination keeps deep pages as cheap as the first one
+        logs = keyset_paginate(
+            query, AccessLog.timestamp, AccessLog.id, per_page,
+            after=request.args.get('after'), before=request.args.get('before')
+        )
 
         # Prepare a small selected_user dict for template header
         selected_user = None
@@ -1953,33 +1933,29 @@ def access_logs():
             selected_user=selected_user
         )
 
-    # Otherwise, present an aggregated per-user summary (group by user)
-    try:
+    # Otherwise, present the per-user summary, paginated in the database
+    if action_filter:
+        # Action search needs the raw logs: group only the matching rows
         rows = db.session.query(
             AccessLog.user_type,
             AccessLog.user_id,
-            AccessLog.username,
-            AccessLog.full_name,
+            func.max(AccessLog.username).label('username'),
+            func.max(AccessLog.full_name).label('full_name'),
             func.count(AccessLog.id).label('log_count'),
-            func.max(AccessLog.timestamp).label('last_seen'),
-            func.max(AccessLog.action).label('last_action')
-        )
+            func.max(AccessLog.timestamp).label('last_seen')
+        ).filter(AccessLog.action.ilike(f"%{action_filter}%"))
         if user_type_filter:
             rows = rows.filter(AccessLog.user_type == user_type_filter)
-        if action_filter:
-            rows = rows.filter(AccessLog.action.ilike(f"%{action_filter}%"))
-
-        rows = rows.group_by(AccessLog.user_type, AccessLog.user_id, AccessLog.username, AccessLog.full_name)
-        rows = rows.order_by(func.max(AccessLog.timestamp).desc())
-        summary_list = rows.all()
-    except Exception:
-        summary_list = []
-
-    # Simple pagination for the aggregated list
-    total = len(summary_list)
-    start = (page - 1) * per_page
-    end = start + per_page
-    page_items = summary_list[start:end]
+        rows = rows.group_by(AccessLog.user_type, AccessLog.user_id)
+        total = rows.order_by(None).count()
+        page_items = rows.order_by(func.max(AccessLog.timestamp).desc()).offset((page - 1) * per_page).limit(per_page).all()
+    else:
+        # Read the incrementally maintained rollup instead of scanning access_logs
+        rows = AccessLogSummary.query
+        if user_type_filter:
+            rows = rows.filter(AccessLogSummary.user_type == user_type_filter)
+        total = rows.count()
+        page_items = rows.order_by(AccessLogSummary.last_seen.desc()).offset((page - 1) * per_page).limit(per_page).all()
 
     # Build a lightweight pagination dict for template consumption
     pages = (total + per_page - 1) // per_page if per_page else 1
@@ -1989,9 +1965,9 @@ def access_logs():
         'page': page,
         'per_page': per_page,
         'pages': pages,
-        'pages_list': list(range(1, pages + 1)),
+        'pages_list': list(range(max(1, page - 5), min(pages, page + 5) + 1)),
         'has_prev': page > 1,
-        'has_next': end < total
+        'has_next': page * per_page < total
     }
 
     return render_template(
@@ -2007,8 +1983,10 @@ def access_logs():
 def clear_access_logs():
     """Clear all access logs from the database"""
     try:
-        # Delete all access logs
+        # Delete all access logs with their sealed batches and per-user rollup
         deleted_count = AccessLog.query.delete()
+        AccessLogBatch.query.delete()
+        AccessLogSummary.query.delete()
         db.session.commit()
         
         flash(f'Successfully cleared {deleted_count} access logs from the audit trail.', 'success')
@@ -2101,27 +2079,61 @@ def api_inventory_top():
 
     labels = [f"{i.name} ({i.category_code})" for i in items]
     available = [i.available_quantity for i in items]
-    issued = [i.issued_items.filter_by(status='Issued').count() for i in items]
+    issued = [i.issued_count for i in items]
     damaged = [i.damaged_count for i in items]
     lost = [i.lost_count for i in items]
 
     return jsonify(labels=labels, available=available, issued=issued, damaged=damaged, lost=lost)
 
 
-@admin_bp.route('/api/return_conditions')
+@admin_bp.route('/api/inventory_as_of')
 @login_required
-def api_return_conditions():
-    """Return counts of returned items grouped by return_condition."""
-    rows = db.session.query(IssuedEquipment.return_conditions, func.count(IssuedEquipment.id)).\
-        filter(IssuedEquipment.status == 'Returned').group_by(IssuedEquipment.return_conditions).all()
+def api_inventory_as_of():
+    """Return every equipment's quantity/damaged/lost counts at the end of ``date`` (YYYY-MM-DD) as JSON."""
+    if not (current_user.is_authenticated and isinstance(current_user, Admin)):
+        abort(403)
+    try:
+        day = datetime.strptime(request.args.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify(error='date must be YYYY-MM-DD'), 400
 
-    labels = []
-    data = []
-    for cond, cnt in rows:
-        labels.append(cond or 'Unknown')
-        data.append(cnt)
+    stock = as_of(datetime.combine(day, time.max))
+    # Equipment deleted since keeps its history, without a name
+    names = dict(db.session.query(Equipment.id, Equipment.name))
+    items = [{'equipment_id': equipment_id, 'name': names.get(equipment_id), **values}
+             for equipment_id, values in sorted(stock.items())]
+    return jsonify(date=day.isoformat(), items=items)
 
-    return jsonify(labels=labels, data=data)
+
+@admin_bp.route('/api/serials/<path:serial>')
+@login_required
+def api_serial_holder(serial):
+    """Return who has (or last had) a serial number, its equipment and its state as JSON."""
+    if not (current_user.is_authenticated and isinstance(current_user, Admin)):
+        abort(403)
+    entry = serial_holder(serial)
+    if entry is None:
+        return jsonify(error='Serial number not registered'), 404
+    issue = entry.issue
+    return jsonify(
+        serial=entry.serial,
+        state=entry.state,
+        equipment_id=entry.equipment_id,
+        equipment=entry.equipment.name if entry.equipment else None,
+        issue_id=entry.current_issue_id,
+        student_id=issue.student_id if issue else None,
+        staff_payroll=issue.staff_payroll if issue else None,
+        date_issued=issue.date_issued.isoformat() if issue and issue.date_issued else None,
+        issued_by=issue.issued_by if issue else None,
+    )
+
+
+@admin_bp.route('/api/return_conditions')
+@login_required
+def api_return_conditions():
+    """Return counts of returned units grouped by return condition."""
+    totals = condition_totals()
+    return jsonify(labels=list(totals), data=list(totals.values()))
 
 
 @admin_bp.route('/api/issues_timeseries')
@@ -2160,6 +2172,45 @@ def api_issues_timeseries():
 
     return jsonify(labels=labels, issued=issued_data, returned=returned_data)
 
+@admin_bp.route('/api/endpoint_latency')
+@login_required
+def api_endpoint_latency():
+    """Return per-endpoint request counts and p50/p95/p99 latency from the access logs."""
+    try:
+        days = int(request.args.get('days', 7))
+    except ValueError:
+        days = 7
+    from Utils.request_metrics import endpoint_latency_stats
+    return jsonify(endpoints=endpoint_latency_stats(days=days))
+
+@admin_bp.route('/api/audit_logs')
+@login_required
+def api_audit_logs():
+    """Return access log entries newest first, paginated with an opaque cursor.
+
+    Pass the returned ``next_cursor`` back as ``cursor`` to fetch older entries.
+    """
+    if not (current_user.is_authenticated and isinstance(current_user, Admin)):
+        abort(403)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 500)
+    cursor = request.args.get('cursor')
+    if cursor and decode_cursor(cursor) is None:
+        return jsonify(error='Invalid cursor'), 400
+
+    query = AccessLog.query
+    user_id = request.args.get('user_id', type=int)
+    if user_id is not None:
+        query = query.filter(AccessLog.user_id == user_id)
+    user_type = request.args.get('user_type')
+    if user_type:
+        query = query.filter(AccessLog.user_type == user_type)
+    action = request.args.get('action')
+    if action:
+        query = query.filter(AccessLog.action.ilike(f"%{action}%"))
+
+    page = keyset_paginate(query, AccessLog.timestamp, AccessLog.id, limit, after=cursor)
+    return jsonify(logs=[log.to_dict() for log in page.items], next_cursor=page.next_cursor)
+
 @admin_bp.route('/issued-equipments-report')
 @login_required
 def issued_equipments_report():
@@ -2183,7 +2234,7 @@ def issued_equipments_report():
     
     # Filter by condition if selected
     if condition and condition != 'All':
-        base_q = base_q.filter_by(return_conditions=condition)
+        base_q = base_q.filter(IssuedEquipment.return_lines.any(ReturnLine.condition == condition))
     
     # Filter by campus if selected
     all_items = base_q.order_by(IssuedEquipment.date_issued.desc()).all()
@@ -2302,7 +2353,7 @@ def equipment_report():
                         item.category_code,
                         item.quantity,
                         item.available_quantity,
-                        item.issued_items.filter_by(status='Issued').count(),
+                        item.issued_count,
                         item.damaged_count,
                         item.lost_count,
                     ])
@@ -2314,7 +2365,7 @@ def equipment_report():
                         item.category_code,
                         item.quantity,
                         item.available_quantity,
-                        item.issued_items.filter_by(status='Issued').count(),
+                        item.issued_count,
                         item.damaged_count,
                         item.lost_count,
                     ])
@@ -2327,10 +2378,6 @@ def equipment_report():
             fname = 'equipment_inventory.xls'
         return Response(output.getvalue(), mimetype=mimetype, headers={"Content-Disposition": f"attachment;filename={fname}"})
 
-    # Calculate issued count for each equipment
-    for equipment in equipments:
-        equipment.issued_count = equipment.issued_items.filter_by(status='Issued').count()
-
     return render_template('equipment_report.html',
                          equipments=equipments,
                          search_name=search_name,
@@ -2419,7 +2466,7 @@ def distribute_to_campus():
         except Exception as e:
             flash(f'Warning: Could not save document - {str(e)}', 'warning')
     
-    try:
+    def record_distribution():
         # Create distribution record
         distribution = CampusDistribution(
             campus_id=campus_id,
@@ -2432,15 +2479,18 @@ def distribute_to_campus():
             document_path=document_path
         )
         db.session.add(distribution)
-        
-        # Update equipment quantity
-        equipment.quantity -= quantity
-        db.session.add(equipment)
-        
-        db.session.commit()
+        db.session.flush()
+
+        # Update equipment quantity, unless a concurrent request took the units first
+        take_equipment_units(equipment_id, quantity, 'distribution', distribution_id=distribution.id)
+
+    try:
+        commit_with_retry(record_distribution)
         flash(f'Successfully distributed {quantity} units of {equipment.name} to {campus.name}.', 'success')
         if document_path:
             flash('Supporting document uploaded successfully.', 'info')
+    except InsufficientStock as e:
+        flash(f'Insufficient quantity. Available: {e.available}, Requested: {quantity}', 'danger')
     except Exception as e:
         db.session.rollback()
         flash(f'Error during distribution: {str(e)}', 'danger')
@@ -2714,20 +2764,9 @@ def escalated_damage():
         storekeeper = StoreKeeper.query.filter_by(payroll_number=item.issued_by).first()
         item._storekeeper_name = storekeeper.full_name if storekeeper else item.issued_by
         
-        # Parse damage items
-        damage_list = []
-        if item.return_conditions:
-            try:
-                conditions = json.loads(item.return_conditions)
-                for serial, condition in conditions.items():
-                    if condition in ('Damaged', 'Lost'):
-                        damage_list.append({
-                            'serial': serial,
-                            'condition': condition
-                        })
-            except:
-                pass
-        item._damage_list = damage_list
+        # Damaged/lost units still awaiting settlement
+        item._damage_list = [{'serial': line.serial or 'all', 'condition': line.condition}
+                             for line in unresolved_damage_lines(item)]
     
     return render_template('escalated_damage.html', escalated_items=escalated_items)
 
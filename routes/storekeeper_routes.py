@@ -3,8 +3,17 @@ from flask_login import login_required, current_user
 from models import StoreKeeper, Equipment, IssuedEquipment, CampusDistribution, Student, Staff, Notification, AccessLog
 from extensions import db
 from datetime import datetime, UTC
-from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from Utils.bulk_issue import BulkIssueError, issue_lines, parse_expected_return, parse_lines, parse_recipient
+from Utils.campus_stock import campus_stock, claim_campus_units, distributed_equipment_ids, stock_of
+from Utils.clearance_report import DEFAULT_PER_PAGE, filter_args, load_clearance_page, parse_filters, status_counts
+from Utils.overdue import due_issues
+from Utils.return_lines import condition_totals, record_return, unresolved_damage_filter, unresolved_damage_lines
+from Utils.serial_registry import serials_in_use
+from Utils.stock import InsufficientStock, commit_with_retry, return_equipment_units, take_equipment_units
 from Utils.student_checks import has_unreturned_items
+from Utils.audit_sink import build_access_record
+from Utils.request_metrics import attach_audit_record
 import json
 
 storekeeper_bp = Blueprint('storekeeper', __name__, url_prefix='/storekeeper')
@@ -16,57 +25,19 @@ def clearance_report():
     # Only allow storekeepers
     if not (current_user.is_authenticated and isinstance(current_user, StoreKeeper)):
         abort(403)
-    recipient_id = request.args.get('student_id', '').strip()
-    query = IssuedEquipment.query.filter_by(issued_by=current_user.payroll_number)
-    if recipient_id:
-        query = query.filter(
-            db.or_(
-                IssuedEquipment.student_id.ilike(f"%{recipient_id}%"),
-                IssuedEquipment.staff_payroll.ilike(f"%{recipient_id}%")
-            )
-        )
-    issued_items = query.order_by(IssuedEquipment.date_issued.desc()).all()
-    clearance_counts = {'Cleared': 0, 'Pending': 0, 'Overdue': 0, 'Total': 0}
-    status_map = {}
-    recipient_info = {}
-    recipient_ids = set()
-    for it in issued_items:
-        if it.student_id:
-            recipient_ids.add(('student', it.student_id))
-        elif it.staff_payroll:
-            recipient_ids.add(('staff', it.staff_payroll))
-    clearance_counts['Total'] = len(recipient_ids)
-    from Utils.clearance_integration import get_clearance_status
-    for recipient_type, rid in recipient_ids:
-        status = get_clearance_status(rid, recipient_type)
-        status_map[rid] = status
-        clearance_counts[status] = clearance_counts.get(status, 0) + 1
-        recipient_name = 'Unknown'
-        issued_by_display = current_user.full_name or current_user.payroll_number
-        campus_name = current_user.campus.name if hasattr(current_user, 'campus') and current_user.campus else ''
-        if recipient_type == 'student':
-            student = Student.query.get(rid)
-            if student:
-                recipient_name = student.name
-        else:
-            staff = Staff.query.get(rid)
-            if staff:
-                recipient_name = staff.name
-        recipient_info[rid] = {
-            'name': recipient_name,
-            'type': 'Student' if recipient_type == 'student' else 'Staff',
-            'issued_by': issued_by_display,
-            'campus': campus_name
-        }
+    filters = parse_filters(request.args)
+    # Latest issue by this storekeeper per recipient, so issuer and campus are this storekeeper's
+    filters.update(issued_by=current_user.payroll_number, campus_id=None)
+    per_page = request.args.get('per_page', DEFAULT_PER_PAGE, type=int)
+    page = load_clearance_page(filters, per_page, after=request.args.get('after'), before=request.args.get('before'))
     return render_template('clearance_report.html',
-                           issued_items=issued_items,
-                           student_id=recipient_id,
+                           student_id=filters['search'] or '',
                            is_pdf=False,
-                           clearance_status_map=status_map,
-                           clearance_counts=clearance_counts,
-                           recipient_info=recipient_info,
-                           is_student=any(it.student for it in issued_items),
-                           is_staff=any(it.staff for it in issued_items))
+                           rows=page.items,
+                           page=page,
+                           clearance_counts=status_counts(filters),
+                           filters=filters,
+                           filter_args=filter_args(filters))
 
 # Receipts page: search and list all receipts for a student or staff
 @storekeeper_bp.route('/receipts', methods=['GET'])
@@ -123,27 +94,16 @@ def receipts():
     return render_template('storekeeper_receipts.html', receipts=receipts)
 
 
-def aggregate_distributions(campus_id):
-    """
-    Aggregate multiple distributions of the same equipment to the same campus.
-    Groups by equipment_id and sums quantities.
-    Returns a dict: {equipment_id: {'quantity': total_qty, 'equipment': Equipment, 'category_code': code, 'category_name': name}}
-    """
-    distributions = CampusDistribution.query.filter_by(campus_id=campus_id).all()
-    aggregated = {}
-    
-    for dist in distributions:
-        eq_id = dist.equipment_id
-        if eq_id not in aggregated:
-            aggregated[eq_id] = {
-                'quantity': 0,
-                'equipment': dist.equipment,
-                'category_code': dist.category_code,
-                'category_name': dist.category_name
-            }
-        aggregated[eq_id]['quantity'] += dist.quantity
-    
-    return aggregated
+def issuable_equipment(campus_id):
+    """Active equipment the campus still has units of, as options for the issue form."""
+    stock = campus_stock(campus_id, active_only=True)
+    return sorted(({
+        'id': row.equipment_id,
+        'name': row.equipment.name,
+        'available': row.available,
+        'distributed': row.distributed,
+        'issued': row.issued_out
+    } for row in stock if row.available > 0), key=lambda x: x['name'])
 
 @storekeeper_bp.before_request
 def _require_storekeeper():
@@ -154,109 +114,28 @@ def _require_storekeeper():
         # if an admin is logged in, send them to admin dashboard
         return redirect(url_for('admin.dashboard'))
     
-    # Log access for audit trail
+    # Log access for audit trail (completed with timing data and queued at request teardown)
     try:
-        from flask import session
-        import socket
-
-        # Get user full name
-        full_name = getattr(current_user, 'full_name', 'Unknown')
-
-        # Get session ID
-        session_id = session.get('session_id', session.sid if hasattr(session, 'sid') else None)
-
-        # Parse User Agent for device/browser info
-        user_agent = request.headers.get('User-Agent', '')
-
-        # Get server hostname
-        server_hostname = socket.gethostname()
-
-        # Determine protocol
-        protocol = 'HTTPS' if request.is_secure else 'HTTP'
-
-        # Get referrer URL
-        referrer_url = request.referrer
-
-        # Create comprehensive log entry
-        log = AccessLog(
-            # 1. USER IDENTIFICATION
-            user_id=current_user.id,
+        record = build_access_record(
             user_type='storekeeper',
+            user_id=current_user.id,
             username=current_user.payroll_number,
-            full_name=full_name,
-
-            # 2. TIMESTAMP
-            timezone='UTC',
-
-            # 3. SOURCE INFORMATION
-            ip_address=request.remote_addr,
-            user_agent=user_agent,
-
-            # 4. ACTION PERFORMED
-            action=f"Accessed {request.endpoint or 'unknown'}",
-            endpoint=request.endpoint,
-            method=request.method,
-            action_status='Success',
-
-            # 5. AUTHENTICATION DETAILS
-            auth_method='password',
-            session_id=session_id,
-            mfa_used=False,
-
-            # 6. SYSTEM/APPLICATION DETAILS
-            app_name='SportEquipmentSystem',
-            module=request.endpoint.split('.')[-1] if request.endpoint else 'unknown',
-            server_hostname=server_hostname,
-            protocol=protocol,
-
-            # 9. ADDITIONAL METADATA
-            referrer_url=referrer_url,
-
-            # 10. AUDIT TRAIL
-            is_tamper_proof=True
+            full_name=getattr(current_user, 'full_name', 'Unknown'),
         )
-
-        # Generate integrity hash
-        log.log_hash = log.generate_log_hash()
-
-        db.session.add(log)
-        db.session.commit()
-        print(f"✓ Storekeeper access logged: {current_user.payroll_number} -> {request.endpoint}")
+        attach_audit_record(record)
     except Exception as e:
         # Don't break the request if logging fails
         print(f"✗ Storekeeper logging error: {str(e)}")
-        db.session.rollback()
 
 @storekeeper_bp.route('/dashboard')
 @login_required
 def dashboard():
-    # Get aggregated equipment distributed to this storekeeper's campus
-    aggregated = aggregate_distributions(current_user.campus_id)
-    
-    # Build a dict of equipment_id -> distributed_quantity
-    distributed_qty = {eq_id: data['quantity'] for eq_id, data in aggregated.items()}
-    equipment_ids = list(distributed_qty.keys())
-    
-    if equipment_ids:
-        campus_equipment = Equipment.query.filter(Equipment.id.in_(equipment_ids)).all()
-        total_equipment = len(campus_equipment)
-        total_active = sum(1 for eq in campus_equipment if eq.is_active)
-        
-        # Calculate low stock based on distributed quantities minus issued
-        low_stock = []
-        for eq in campus_equipment:
-            issued_count = IssuedEquipment.query.filter_by(
-                equipment_id=eq.id,
-                issued_by=current_user.payroll_number,
-                status='Issued'
-            ).with_entities(func.sum(IssuedEquipment.quantity)).scalar() or 0
-            available = distributed_qty[eq.id] - issued_count
-            if available <= 5:
-                low_stock.append((eq, available, distributed_qty[eq.id]))
-    else:
-        total_equipment = 0
-        total_active = 0
-        low_stock = []
+    # Equipment distributed to this storekeeper's campus, with what is left of it
+    stock = campus_stock(current_user.campus_id)
+    equipment_ids = [row.equipment_id for row in stock]
+    total_equipment = len(stock)
+    total_active = sum(1 for row in stock if row.equipment.is_active)
+    low_stock = [(row.equipment, row.available, row.distributed) for row in stock if row.available <= 5]
     
     # Get issued items for this storekeeper
     # Build issued query scoped to equipment IDs if any distributed to this campus
@@ -270,37 +149,21 @@ def dashboard():
     
     low_stock = sorted(low_stock, key=lambda x: x[1])
     
-    today = datetime.now().date()
-    due_q = IssuedEquipment.query.filter(
-        IssuedEquipment.issued_by == current_user.payroll_number,
-        IssuedEquipment.status == 'Issued',
-        IssuedEquipment.expected_return != None,
-        func.date(IssuedEquipment.expected_return) <= today
-    )
+    due_q = due_issues(IssuedEquipment.issued_by == current_user.payroll_number)
     if equipment_ids:
         due_q = due_q.filter(IssuedEquipment.equipment_id.in_(equipment_ids))
-    due_items = due_q.order_by(IssuedEquipment.expected_return.asc()).all()
+    due_items = due_q.all()
     
-    # Count damaged and lost items from return_conditions
-    returned_items = IssuedEquipment.query.filter(
+    # Count damaged and lost units from the return lines
+    returned_filters = [
         IssuedEquipment.issued_by == current_user.payroll_number,
         IssuedEquipment.status.in_(['Returned', 'Partial Return']),
-        IssuedEquipment.return_conditions.isnot(None)
-    )
+    ]
     if equipment_ids:
-        returned_items = returned_items.filter(IssuedEquipment.equipment_id.in_(equipment_ids))
-    returned_items = returned_items.all()
-    
-    total_damaged = 0
-    total_lost = 0
-    for item in returned_items:
-        if item.return_conditions:
-            try:
-                conditions = json.loads(item.return_conditions)
-                total_damaged += sum(1 for c in conditions.values() if c == 'Damaged')
-                total_lost += sum(1 for c in conditions.values() if c == 'Lost')
-            except:
-                pass
+        returned_filters.append(IssuedEquipment.equipment_id.in_(equipment_ids))
+    returned_by_condition = condition_totals(*returned_filters)
+    total_damaged = returned_by_condition['Damaged']
+    total_lost = returned_by_condition['Lost']
     
     return render_template('storekeeper_dashboard.html',
                            total_equipment=total_equipment,
@@ -317,31 +180,13 @@ def dashboard():
 @storekeeper_bp.route('/equipment')
 @login_required
 def equipment():
-    # Get aggregated equipment distributed to this storekeeper's campus only
-    aggregated = aggregate_distributions(current_user.campus_id)
-    
-    # Build equipment list with available quantities
-    equipment_list = []
-    for eq_id, dist_data in aggregated.items():
-        eq = dist_data['equipment']
-        if eq:
-            # Calculate how much has been issued by this storekeeper
-            issued_count = IssuedEquipment.query.filter_by(
-                equipment_id=eq.id,
-                issued_by=current_user.payroll_number,
-                status='Issued'
-            ).with_entities(func.sum(IssuedEquipment.quantity)).scalar() or 0
-            
-            available = dist_data['quantity'] - issued_count
-            equipment_list.append({
-                'equipment': eq,
-                'distributed_quantity': dist_data['quantity'],
-                'issued_quantity': issued_count,
-                'available_quantity': available
-            })
-    
-    # Sort by category and name
-    equipment_list = sorted(equipment_list, key=lambda x: (x['equipment'].category, x['equipment'].name))
+    # Equipment distributed to this storekeeper's campus only, by category and name
+    equipment_list = [{
+        'equipment': row.equipment,
+        'distributed_quantity': row.distributed,
+        'issued_quantity': row.issued_out,
+        'available_quantity': row.available
+    } for row in campus_stock(current_user.campus_id)]
     
     return render_template('storekeeper_equipment.html', equipment=equipment_list)
 
@@ -500,15 +345,13 @@ def return_equipment():
                         issue.status = 'Returned'
                         issue.date_returned = datetime.now(UTC)
                 
+                record_return(issue, conditions)
+
                 # Update equipment counts based on conditions
-                equipment = Equipment.query.get_or_404(issue.equipment_id)
                 good_count = sum(1 for c in conditions.values() if c == 'Good')
                 damaged_count = sum(1 for c in conditions.values() if c == 'Damaged')
                 lost_count = sum(1 for c in conditions.values() if c == 'Lost')
-                
-                equipment.quantity += good_count
-                equipment.damaged_count += damaged_count
-                equipment.lost_count += lost_count
+                return_equipment_units(issue.equipment_id, good_count, damaged_count, lost_count, issue_id=issue.id)
                 
                 successful_returns += 1
                 
@@ -607,9 +450,8 @@ def return_equipment():
         return render_template('return_equipment.html', display_items=display_items, show_detail=True, return_recipient_id=return_recipient_id)
     
     # GET: Show all issued equipment from this storekeeper's campus - grouped by recipient
-    # Get aggregated equipment distributed to this storekeeper's campus only
-    aggregated = aggregate_distributions(current_user.campus_id)
-    campus_equipment_ids = list(aggregated.keys())
+    # Equipment distributed to this storekeeper's campus only
+    campus_equipment_ids = distributed_equipment_ids(current_user.campus_id)
     
     # Get all issued equipment for this campus
     issued_query = IssuedEquipment.query.filter(
@@ -770,6 +612,7 @@ def return_item(issue_id):
             'conditions': existing_conditions,
             'quantities': {k: v for k, v in existing_quantities.items()}
         })
+        record_return(issue, new_conditions, new_quantities)
 
         # Determine status based on return completeness
         if len(existing_conditions) >= len(serials):
@@ -817,6 +660,7 @@ def return_item(issue_id):
             return_qty = qty_to_return
         
         issue.return_conditions = json.dumps({'all': condition, 'quantity': return_qty})
+        record_return(issue, {None: condition}, {None: return_qty})
 
         if condition == 'Good':
             good_count = qty_to_return
@@ -831,9 +675,7 @@ def return_item(issue_id):
             damaged_count = 0
             lost_count = qty_to_return
 
-    equipment.quantity += good_count
-    equipment.damaged_count += damaged_count
-    equipment.lost_count += lost_count
+    return_equipment_units(equipment.id, good_count, damaged_count, lost_count, issue_id=issue.id)
 
     try:
         db.session.commit()
@@ -854,32 +696,8 @@ def return_item(issue_id):
 @login_required
 def issue():
     if request.method == 'GET':
-        # Get aggregated equipment distributed to this storekeeper's campus only
-        aggregated = aggregate_distributions(current_user.campus_id)
-        
-        # Build equipment list with available quantities
-        equipment = []
-        for eq_id, dist_data in aggregated.items():
-            eq = dist_data['equipment']
-            if eq and eq.is_active:
-                # Calculate how much has been issued by this storekeeper
-                issued_count = IssuedEquipment.query.filter_by(
-                    equipment_id=eq.id,
-                    issued_by=current_user.payroll_number,
-                    status='Issued'
-                ).with_entities(func.sum(IssuedEquipment.quantity)).scalar() or 0
-                
-                available = dist_data['quantity'] - issued_count
-                if available > 0:  # Only show equipment with available quantity
-                    equipment.append({
-                        'id': eq.id,
-                        'name': eq.name,
-                        'available': available,
-                        'distributed': dist_data['quantity'],
-                        'issued': issued_count
-                    })
-        
-        equipment = sorted(equipment, key=lambda x: x['name'])
+        # Equipment distributed to this storekeeper's campus with units left to issue
+        equipment = issuable_equipment(current_user.campus_id)
         issued = IssuedEquipment.query.filter_by(issued_by=current_user.payroll_number).order_by(IssuedEquipment.date_issued.desc()).all()
         return render_template('issue.html', equipment=equipment, issued=issued)
 
@@ -898,18 +716,10 @@ def issue():
     confirm_unreturned = request.form.get('confirm_unreturned') == 'true'
     
     # Validate serial number uniqueness across database
-    if serial_numbers:
-        existing_serials = set()
-        for issue in IssuedEquipment.query.filter(IssuedEquipment.serial_numbers.isnot(None)):
-            try:
-                serials = json.loads(issue.serial_numbers)
-                existing_serials.update(serials)
-            except:
-                pass  # Skip invalid JSON
-        for sn in serial_numbers:
-            if sn.strip() and sn.strip() in existing_serials:
-                flash(f'Serial number "{sn.strip()}" is already in use. Please use a different serial number.', 'danger')
-                return redirect(url_for('storekeeper.issue'))
+    in_use = serials_in_use(serial_numbers)
+    if in_use:
+        flash(f'Serial number "{sorted(in_use)[0]}" is already in use. Please use a different serial number.', 'danger')
+        return redirect(url_for('storekeeper.issue'))
 
     if person_type == 'student':
         if not student_id or not student_name or not student_email or not student_phone:
@@ -935,26 +745,7 @@ def issue():
                 elif item.equipment and getattr(item.equipment, 'serial_number', None):
                     serials = [item.equipment.serial_number]
                 item.serials = serials
-            equipment = []
-            aggregated = aggregate_distributions(current_user.campus_id)
-            for eq_id, dist_data in aggregated.items():
-                eq = dist_data['equipment']
-                if eq and eq.is_active:
-                    issued_count = IssuedEquipment.query.filter_by(
-                        equipment_id=eq.id,
-                        issued_by=current_user.payroll_number,
-                        status='Issued'
-                    ).with_entities(func.sum(IssuedEquipment.quantity)).scalar() or 0
-                    available = dist_data['quantity'] - issued_count
-                    if available > 0:
-                        equipment.append({
-                            'id': eq.id,
-                            'name': eq.name,
-                            'available': available,
-                            'distributed': dist_data['quantity'],
-                            'issued': issued_count
-                        })
-            equipment = sorted(equipment, key=lambda x: x['name'])
+            equipment = issuable_equipment(current_user.campus_id)
             # Persist all original form data for modal confirmation
             original_form = request.form.to_dict(flat=False)
             return render_template('issue.html',
@@ -986,31 +777,15 @@ def issue():
         flash('Selected equipment not found.', 'danger')
         return redirect(url_for('storekeeper.issue'))
     
-    # Get aggregated distributions for this campus
-    aggregated = aggregate_distributions(current_user.campus_id)
-    
-    try:
-        equipment_id_int = int(equipment_id)
-    except Exception:
-        flash('Invalid equipment selection.', 'danger')
-        return redirect(url_for('storekeeper.issue'))
-
-    if equipment_id_int not in aggregated:
+    # What this campus has left of the equipment
+    stock = stock_of(current_user.campus_id, eq.id)
+    if stock is None:
         flash('This equipment is not distributed to your campus.', 'danger')
         return redirect(url_for('storekeeper.issue'))
 
-    dist_data = aggregated[equipment_id_int]
-    
-    # Calculate how much has been issued already
-    issued_count = IssuedEquipment.query.filter_by(
-        equipment_id=equipment_id_int,
-        issued_by=current_user.payroll_number,
-        status='Issued'
-    ).with_entities(func.sum(IssuedEquipment.quantity)).scalar() or 0
-    
-    available = dist_data['quantity'] - issued_count
+    available = stock.available
     if available < qty:
-        flash(f'Not enough items available. Distributed: {dist_data["quantity"]}, Already issued: {issued_count}, Available: {available}', 'danger')
+        flash(f'Not enough items available. Distributed: {stock.distributed}, Already issued: {stock.issued_out}, Available: {available}', 'danger')
         return redirect(url_for('storekeeper.issue'))
     expected_return = None
     if expected_return_str:
@@ -1023,69 +798,112 @@ def issue():
         if expected_return.date() < today_date:
             flash('Expected return date cannot be in the past. Please select today or a future date.', 'danger')
             return redirect(url_for('storekeeper.issue'))
-    # Create or update Student/Staff record as needed, then create IssuedEquipment
-    if person_type == 'student':
-        student = Student.query.filter_by(id=student_id).first()
-        if not student:
-            student = Student(
-                id=student_id,
-                name=student_name,
-                email=student_email,
-                phone=student_phone
+    # Claim the units from the campus stock, record the recipient and the issue and
+    # take the units off the equipment in one transaction. The claim is a
+    # conditional UPDATE, so two storekeepers issuing the last units at the same
+    # moment can't both succeed.
+    campus_id, equipment_id = current_user.campus_id, eq.id
+
+    def record_issue():
+        claim_campus_units(campus_id, equipment_id, qty)
+        # Create or update Student/Staff record as needed, then create IssuedEquipment
+        if person_type == 'student':
+            student = Student.query.filter_by(id=student_id).first()
+            if not student:
+                student = Student(
+                    id=student_id,
+                    name=student_name,
+                    email=student_email,
+                    phone=student_phone
+                )
+                db.session.add(student)
+            else:
+                student.name = student_name
+                student.email = student_email
+                student.phone = student_phone
+                db.session.add(student)
+
+            issue = IssuedEquipment(
+                student_id=student_id,
+                equipment_id=equipment_id,
+                quantity=qty,
+                expected_return=expected_return,
+                serial_numbers=json.dumps(serial_numbers) if serial_numbers else None
             )
-            db.session.add(student)
         else:
-            student.name = student_name
-            student.email = student_email
-            student.phone = student_phone
-            db.session.add(student)
-
-        issue = IssuedEquipment(
-            student_id=student_id,
-            equipment_id=eq.id,
-            quantity=qty,
-            expected_return=expected_return,
-            serial_numbers=json.dumps(serial_numbers) if serial_numbers else None
-        )
-    else:
-        staff = Staff.query.filter_by(payroll_number=staff_payroll).first()
-        if not staff:
-            staff = Staff(
-                payroll_number=staff_payroll,
-                name=staff_name,
-                email=staff_email
+            staff = Staff.query.filter_by(payroll_number=staff_payroll).first()
+            if not staff:
+                staff = Staff(
+                    payroll_number=staff_payroll,
+                    name=staff_name,
+                    email=staff_email
+                )
+                db.session.add(staff)
+            else:
+                staff.name = staff_name
+                staff.email = staff_email
+                db.session.add(staff)
+
+            issue = IssuedEquipment(
+                student_id=None,
+                staff_payroll=staff_payroll,
+                equipment_id=equipment_id,
+                quantity=qty,
+                expected_return=expected_return,
+                serial_numbers=json.dumps(serial_numbers) if serial_numbers else None
             )
-            db.session.add(staff)
-        else:
-            staff.name = staff_name
-            staff.email = staff_email
-            db.session.add(staff)
-
-        issue = IssuedEquipment(
-            student_id=None,
-            staff_payroll=staff_payroll,
-            equipment_id=eq.id,
-            quantity=qty,
-            expected_return=expected_return,
-            serial_numbers=json.dumps(serial_numbers) if serial_numbers else None
-        )
-
-    # record who issued this item (storekeeper payroll_number)
-    try:
-        issue.issued_by = getattr(current_user, 'payroll_number', None) or getattr(current_user, 'full_name', None)
-    except Exception:
-        issue.issued_by = None
 
+        # record who issued this item (storekeeper payroll_number)
+        try:
+            issue.issued_by = getattr(current_user, 'payroll_number', None) or getattr(current_user, 'full_name', None)
+        except Exception:
+            issue.issued_by = None
+        db.session.add(issue)
+        db.session.flush()
+        take_equipment_units(equipment_id, qty, 'issue', check=False, issue_id=issue.id)
 
-    db.session.add(issue)
-    eq.quantity = eq.quantity - qty
-    db.session.commit()
+    try:
+        commit_with_retry(record_issue)
+    except InsufficientStock as e:
+        flash(f'Not enough items available. Available: {e.available}', 'danger')
+        return redirect(url_for('storekeeper.issue'))
+    except IntegrityError:
+        # Another issue took one of the serials since the check above
+        in_use = serials_in_use(serial_numbers)
+        if not in_use:
+            raise
+        flash(f'Serial number "{sorted(in_use)[0]}" is already in use. Please use a different serial number.', 'danger')
+        return redirect(url_for('storekeeper.issue'))
     flash('Equipment issued successfully.', 'success')
     # Redirect to combined receipt for this recipient
     recipient_id = student_id if person_type == 'student' else staff_payroll
     return redirect(url_for('storekeeper.issue_receipt', recipient_id=recipient_id))
 
 
+@storekeeper_bp.route('/api/issue/bulk', methods=['POST'])
+@login_required
+def api_issue_bulk():
+    """Issue many equipment lines from this campus's stock to one recipient in one transaction.
+
+    Takes the same JSON body as the admin bulk issue API; ``expected_return``
+    is optional, as on the issue form.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        person_type, fields = parse_recipient(data)
+        lines = parse_lines(data.get('lines'))
+        expected_return = parse_expected_return(data.get('expected_return'), required=False)
+        issue_ids = issue_lines(person_type, fields, lines, expected_return, issued_by=current_user.payroll_number,
+                                campus_id=current_user.campus_id,
+                                confirm_unreturned=data.get('confirm_unreturned') is True)
+    except BulkIssueError as e:
+        return jsonify(errors=e.errors), e.status
+
+    recipient_id = fields['student_id'] if person_type == 'student' else fields['staff_payroll']
+    return jsonify(recipient_id=recipient_id, issue_ids=issue_ids,
+                   receipt_url=url_for('storekeeper.issue_receipt', recipient_id=recipient_id)), 201
+
+
 # --- Equipment Issue Receipt Route ---
 @storekeeper_bp.route('/issue-receipt/<int:issue_id>')
 @storekeeper_bp.route('/issue-receipt/recipient/<path:recipient_id>')
@@ -1271,71 +1089,52 @@ def change_password():
 def damage_clearance():
     """View damaged/lost equipment awaiting clearance"""
     # Get all returned equipment with Damaged or Lost conditions from this storekeeper's campus
-    aggregated = aggregate_distributions(current_user.campus_id)
-    campus_equipment_ids = list(aggregated.keys())
+    campus_equipment_ids = distributed_equipment_ids(current_user.campus_id)
     
-    # Get all returned items with damaged or lost conditions
+    # Returned items with damaged/lost units not yet settled, except those escalated to admin
+    # (storekeeper shouldn't act on them)
     returned_query = IssuedEquipment.query.filter(
         IssuedEquipment.status.in_(['Returned', 'Partial Return']),
-        IssuedEquipment.return_conditions.isnot(None)
+        unresolved_damage_filter(),
+        db.or_(IssuedEquipment.damage_clearance_status.is_(None), IssuedEquipment.damage_clearance_status != 'Escalated')
     )
     if campus_equipment_ids:
         returned_query = returned_query.filter(IssuedEquipment.equipment_id.in_(campus_equipment_ids))
-    
-    returned_items = returned_query.order_by(IssuedEquipment.date_returned.desc()).all()
-    
-    # Filter to only items with Damaged or Lost conditions
-    damage_items = []
-    for item in returned_items:
-        if item.return_conditions:
-            try:
-                conditions = json.loads(item.return_conditions)
-                has_damage = any(c in ('Damaged', 'Lost') for c in conditions.values())
-                if has_damage:
-                    # Extract damaged/lost items
-                    damage_list = []
-                    for serial, condition in conditions.items():
-                        if condition in ('Damaged', 'Lost'):
-                            damage_list.append({
-                                'serial': serial,
-                                'condition': condition
-                            })
-
-                    # Skip items that have been escalated to admin (storekeeper shouldn't act on them)
-                    if item.damage_clearance_status == 'Escalated':
-                        continue
 
-                    # Parse any admin notes or attached document path from damage_clearance_notes
-                    admin_notes = item.damage_clearance_notes or ''
-                    doc_path = None
-                    if admin_notes:
-                        try:
-                            # Look for a line containing 'Attached document:' and extract the path
-                            parts = [l.strip() for l in admin_notes.splitlines() if l.strip()]
-                            remaining_lines = []
-                            for line in parts:
-                                if 'Attached document:' in line:
-                                    # everything after the colon is the stored path
-                                    doc_path = line.split('Attached document:', 1)[1].strip()
-                                else:
-                                    remaining_lines.append(line)
-                            admin_text = '\n'.join(remaining_lines)
-                        except Exception:
-                            admin_text = admin_notes
+    damage_items = returned_query.order_by(IssuedEquipment.date_returned.desc()).all()
+    for item in damage_items:
+        # Extract damaged/lost units
+        damage_list = [{'serial': line.serial or 'all', 'condition': line.condition}
+                       for line in unresolved_damage_lines(item)]
+
+        # Parse any admin notes or attached document path from damage_clearance_notes
+        admin_notes = item.damage_clearance_notes or ''
+        doc_path = None
+        if admin_notes:
+            try:
+                # Look for a line containing 'Attached document:' and extract the path
+                parts = [l.strip() for l in admin_notes.splitlines() if l.strip()]
+                remaining_lines = []
+                for line in parts:
+                    if 'Attached document:' in line:
+                        # everything after the colon is the stored path
+                        doc_path = line.split('Attached document:', 1)[1].strip()
                     else:
-                        admin_text = ''
-
-                    item._admin_notes = admin_text
-                    item._document_path = doc_path
-                    item._damage_list = damage_list
-                    item._recipient_name = item.student.name if item.student else (item.staff.name if item.staff else 'Unknown')
-                    item._recipient_type = 'Student' if item.student else 'Staff'
-                    # Flag needs-review items for highlighting
-                    item._needs_review = (item.damage_clearance_status == 'Needs Review')
-                    damage_items.append(item)
-            except:
-                pass
-    
+                        remaining_lines.append(line)
+                admin_text = '\n'.join(remaining_lines)
+            except Exception:
+                admin_text = admin_notes
+        else:
+            admin_text = ''
+
+        item._admin_notes = admin_text
+        item._document_path = doc_path
+        item._damage_list = damage_list
+        item._recipient_name = item.student.name if item.student else (item.staff.name if item.staff else 'Unknown')
+        item._recipient_type = 'Student' if item.student else 'Staff'
+        # Flag needs-review items for highlighting
+        item._needs_review = (item.damage_clearance_status == 'Needs Review')
+
     # Sort so 'Needs Review' items appear first
     damage_items = sorted(damage_items, key=lambda it: (not getattr(it, '_needs_review', False), it.date_returned or datetime.now()))
     return render_template('damage_clearance.html', damage_items=damage_items)
@@ -0,0 +1,23 @@
+import os, sys
+# ensure project root is on sys.path so imports like `app` and `extensions` work
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from Utils.clearance_projection import rebuild_projection
+from Utils.return_lines import backfill_return_lines
+
+# Creates return_lines for issues whose return_conditions were recorded without
+# them (e.g. imported with raw SQL). Safe to re-run: issues that already have
+# lines are skipped. Clearance statuses are recomputed afterwards.
+app = create_app()
+
+with app.app_context():
+    try:
+        converted = backfill_return_lines()
+        print(f'Created return lines for {converted} issues.')
+        if converted:
+            changed = rebuild_projection()
+            print(f'Recomputed clearance: {changed} recipients changed.')
+    except Exception as e:
+        print('Error while backfilling return lines:', e)
+        sys.exit(1)
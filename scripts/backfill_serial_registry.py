@@ -0,0 +1,27 @@
+import argparse
+import os, sys
+# ensure project root is on sys.path so imports like `app` and `extensions` work
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from Utils.serial_registry import backfill_serial_registry
+
+# Registers the serial numbers of issues recorded before serial_registry existed.
+# Runs in small committed batches, so it can run while the app is serving; run it
+# right after the migration. Safe to re-run, and --after resumes from the last
+# issue id printed if it was interrupted.
+parser = argparse.ArgumentParser(description='Backfill serial_registry from issued equipment.')
+parser.add_argument('--batch-size', type=int, default=500, help='issues per committed batch')
+parser.add_argument('--after', type=int, default=0, help='start after this issue id')
+args = parser.parse_args()
+
+app = create_app()
+
+with app.app_context():
+    try:
+        written = backfill_serial_registry(batch_size=args.batch_size, after_id=args.after,
+                                           progress=lambda last_id: print(f'Done up to issue {last_id}.'))
+        print(f'Registered {written} serial numbers.')
+    except Exception as e:
+        print('Error while backfilling serial registry:', e)
+        sys.exit(1)
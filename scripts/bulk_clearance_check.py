@@ -0,0 +1,39 @@
+import argparse
+import csv
+import os, sys
+# ensure project root is on sys.path so imports like `app` and `extensions` work
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from Utils.bulk_clearance import BATCH_SIZE, check_recipients, read_recipient_ids
+
+# Bulk clearance check, e.g. for the registry's list of graduating students:
+#   python scripts/bulk_clearance_check.py graduands.csv -o clearance.csv
+# The input is one ID per row or a column headed student_id / recipient_id /
+# payroll_number. Rows are written as each batch completes; progress goes to stderr.
+parser = argparse.ArgumentParser(description='Check clearance for a CSV list of student IDs or staff payroll numbers.')
+parser.add_argument('input', help='CSV file of recipient IDs')
+parser.add_argument('-o', '--output', help='result CSV file (default: stdout)')
+parser.add_argument('--type', dest='recipient_type', choices=('student', 'staff'), default='student')
+parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help=f'recipients per batch (default {BATCH_SIZE})')
+args = parser.parse_args()
+
+app = create_app()
+
+with app.app_context():
+    try:
+        with open(args.input, newline='', encoding='utf-8-sig') as handle:
+            recipient_ids = read_recipient_ids(handle)
+        output = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+        try:
+            def progress(done, total):
+                print(f'Checked {done}/{total} recipients', file=sys.stderr)
+
+            check_recipients(recipient_ids, csv.writer(output), args.recipient_type,
+                             batch_size=max(1, args.batch_size), progress=progress)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+    except Exception as e:
+        print('Error while checking clearance:', e, file=sys.stderr)
+        sys.exit(1)
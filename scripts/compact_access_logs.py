@@ -0,0 +1,18 @@
+import os, sys
+# ensure project root is on sys.path so imports like `app` and `extensions` work
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from Utils.audit_dimensions import compact_existing
+
+# Converts access logs written in full into compact storage (dimension ids).
+# Run once after enabling AUDIT_COMPACT_STORAGE; it is safe to re-run.
+app = create_app()
+
+with app.app_context():
+    try:
+        converted = compact_existing()
+        print(f'Compacted {converted} access log rows.')
+    except Exception as e:
+        print('Error while compacting access logs:', e)
+        sys.exit(1)
@@ -0,0 +1,39 @@
+import argparse
+import os, sys
+# ensure project root is on sys.path so imports like `app` and `extensions` work
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from Utils.audit_retention import ensure_partitions, prune_expired
+
+# Enforces AccessLog.retention_days by dropping whole expired months of logs
+# (PostgreSQL partitions, or index ranges elsewhere) and creates the
+# partitions for the coming months. Run it nightly, e.g.:
+#   python scripts/prune_access_logs.py --archive-dir /var/backups/access_logs
+parser = argparse.ArgumentParser(description='Drop access log months past their retention period.')
+parser.add_argument('--archive-dir', help='export each month to <dir>/<partition>.jsonl.gz before dropping it')
+parser.add_argument('--dry-run', action='store_true', help='only list the months that would be dropped')
+parser.add_argument('--months-ahead', type=int, default=3, help='partitions to create past the current month')
+args = parser.parse_args()
+
+app = create_app()
+
+with app.app_context():
+    try:
+        if not args.dry_run:
+            for name in ensure_partitions(months_ahead=args.months_ahead):
+                print(f'Created partition {name}')
+
+        pruned = prune_expired(archive_dir=args.archive_dir, dry_run=args.dry_run)
+        if not pruned:
+            print('No expired access log partitions.')
+        for entry in pruned:
+            if args.dry_run:
+                print(f"Would drop {entry['partition']}")
+            elif entry['archive']:
+                print(f"Archived {entry['rows']} logs to {entry['archive']} and dropped {entry['partition']}")
+            else:
+                print(f"Dropped {entry['partition']}")
+    except Exception as e:
+        print('Error while pruning access logs:', e)
+        sys.exit(1)
@@ -0,0 +1,20 @@
+import os, sys
+# ensure project root is on sys.path so imports like `app` and `extensions` work
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from Utils.audit_summary import rebuild_access_summaries
+
+# Recomputes access_log_summaries from access_logs. The rollup is kept up to
+# date as logs are written and as retention pruning drops them; run this
+# periodically (e.g. nightly cron) or after bulk deletes/imports to correct
+# any drift.
+app = create_app()
+
+with app.app_context():
+    try:
+        users = rebuild_access_summaries()
+        print(f'Rebuilt access log summary for {users} users.')
+    except Exception as e:
+        print('Error while rebuilding access log summary:', e)
+        sys.exit(1)
@@ -0,0 +1,19 @@
+import os, sys
+# ensure project root is on sys.path so imports like `app` and `extensions` work
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from Utils.campus_stock import rebuild_campus_stock
+
+# Recompute the campus_stock ledger from campus distributions, storekeeper issues
+# and return lines, e.g. after importing or editing those records with raw SQL or
+# after moving a storekeeper to another campus.
+app = create_app()
+
+with app.app_context():
+    try:
+        changed = rebuild_campus_stock()
+        print(f'Rebuilt campus stock: {changed} rows changed.')
+    except Exception as e:
+        print('Error while rebuilding campus stock:', e)
+        sys.exit(1)
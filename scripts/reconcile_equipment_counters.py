@@ -0,0 +1,30 @@
+import argparse
+import os, sys
+# ensure project root is on sys.path so imports like `app` and `extensions` work
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from Utils.equipment_counters import reconcile_counters
+
+# Recompute Equipment.issued_count/issued_units from the issued equipment records,
+# e.g. after importing or editing issue records with raw SQL. --check only lists
+# the equipment whose counters are off (exit status 1 when there are any).
+parser = argparse.ArgumentParser(description='Reconcile the issued counters on equipment.')
+parser.add_argument('--check', action='store_true', help='report mismatches without correcting them')
+args = parser.parse_args()
+
+app = create_app()
+
+with app.app_context():
+    try:
+        mismatched = reconcile_counters(fix=not args.check)
+    except Exception as e:
+        print('Error while reconciling equipment counters:', e)
+        sys.exit(1)
+
+    for equipment_id, name, stored, actual in mismatched:
+        print(f'{equipment_id} {name}: stored {stored[0]} issued / {stored[1]} units, actual {actual[0]} / {actual[1]}')
+    if args.check:
+        print(f'{len(mismatched)} equipment with counters out of step.')
+        sys.exit(1 if mismatched else 0)
+    print(f'Corrected counters of {len(mismatched)} equipment.')
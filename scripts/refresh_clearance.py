@@ -0,0 +1,30 @@
+import argparse
+import os, sys
+# ensure project root is on sys.path so imports like `app` and `extensions` work
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from Utils.clearance_projection import rebuild_projection, refresh_overdue
+
+# Nightly clearance job: moves recipients whose equipment became due since the
+# last run to Overdue in recipient_clearance. Run it shortly after midnight UTC:
+#   5 0 * * * python scripts/refresh_clearance.py
+# --rebuild recomputes the whole projection, e.g. after importing issue records
+# with raw SQL.
+parser = argparse.ArgumentParser(description='Refresh the recipient_clearance projection.')
+parser.add_argument('--rebuild', action='store_true', help='recompute every recipient, not just newly overdue ones')
+args = parser.parse_args()
+
+app = create_app()
+
+with app.app_context():
+    try:
+        if args.rebuild:
+            changed = rebuild_projection()
+            print(f'Rebuilt recipient clearance: {changed} recipients changed.')
+        else:
+            refreshed = refresh_overdue()
+            print(f'Refreshed {refreshed} recipients with equipment past due.')
+    except Exception as e:
+        print('Error while refreshing recipient clearance:', e)
+        sys.exit(1)
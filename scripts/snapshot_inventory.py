@@ -0,0 +1,28 @@
+import argparse
+from datetime import datetime
+import os, sys
+# ensure project root is on sys.path so imports like `app` and `extensions` work
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from Utils.inventory_ledger import take_snapshot
+
+# Nightly inventory snapshot: stores every equipment's stock at the start of the
+# day (UTC) from the inventory_movements ledger, so as-of queries only replay the
+# movements since. Run it shortly after midnight UTC:
+#   10 0 * * * python scripts/snapshot_inventory.py
+# --at YYYY-MM-DD snapshots the start of another day, e.g. to seed past months.
+parser = argparse.ArgumentParser(description='Snapshot stock levels from the inventory movement ledger.')
+parser.add_argument('--at', help='day to snapshot (YYYY-MM-DD), default today')
+args = parser.parse_args()
+
+app = create_app()
+
+with app.app_context():
+    try:
+        at = datetime.strptime(args.at, '%Y-%m-%d') if args.at else None
+        written = take_snapshot(at)
+        print(f'Snapshot written for {written} equipment.' if written else 'Snapshot already taken.')
+    except Exception as e:
+        print('Error while taking inventory snapshot:', e)
+        sys.exit(1)
@@ -0,0 +1,36 @@
+import argparse
+import json
+import os, sys
+# ensure project root is on sys.path so imports like `app` and `extensions` work
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from Utils.audit_integrity import prove_entry, verify_chain, verify_proof
+
+# Checks the tamper-evident access log chain in one streaming pass, or prints
+# a Merkle inclusion proof for a single log entry:
+#   python scripts/verify_access_logs.py
+#   python scripts/verify_access_logs.py --prove 12345
+parser = argparse.ArgumentParser(description='Verify the sealed access log batches.')
+parser.add_argument('--prove', type=int, metavar='LOG_ID', help='print an inclusion proof for one log entry')
+args = parser.parse_args()
+
+app = create_app()
+
+with app.app_context():
+    if args.prove is not None:
+        proof = prove_entry(args.prove)
+        if proof is None:
+            print(f'Log {args.prove} does not exist or was written before logs were sealed.')
+            sys.exit(1)
+        print(json.dumps(proof, indent=2))
+        sys.exit(0 if verify_proof(proof) else 1)
+
+    problems = 0
+    for problem in verify_chain():
+        problems += 1
+        print(problem)
+    if problems:
+        print(f'{problems} integrity problem(s) found.')
+        sys.exit(1)
+    print('Access log chain verified.')
@@ -1,7 +1,12 @@
+from contextlib import contextmanager
+from datetime import datetime
+
 import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from app import create_app
 from extensions import db
-from models import Admin, Equipment
+from models import Admin, Equipment, IssuedEquipment, ReturnLine, SatelliteCampus, Staff, StoreKeeper, Student
 from werkzeug.security import generate_password_hash
 
 
@@ -26,3 +31,81 @@ def client(app):
 
 def login(client, username='admin', password='admin123'):
     return client.post('/login', data={'username': username, 'password': password}, follow_redirects=True)
+
+
+@pytest.fixture
+def sql_statements():
+    """``with sql_statements() as statements:`` collects the SQL every engine runs inside the block"""
+    @contextmanager
+    def record():
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(Engine, 'before_cursor_execute', count)
+        try:
+            yield statements
+        finally:
+            event.remove(Engine, 'before_cursor_execute', count)
+    return record
+
+
+@pytest.fixture
+def add_issue():
+    """Factory adding an issue of the Football to a student (or ``staff=True`` staff member), creating them if needed.
+
+    ``lines`` are ``(condition, quantity)`` return lines; other keyword
+    arguments are IssuedEquipment columns. Flushes, does not commit.
+    """
+    def add(recipient_id, staff=False, name=None, lines=(), **fields):
+        if staff:
+            if db.session.get(Staff, recipient_id) is None:
+                db.session.add(Staff(payroll_number=recipient_id, name=name or recipient_id,
+                                     email=f'{recipient_id.lower()}@example.com'))
+            fields['staff_payroll'] = recipient_id
+        else:
+            if db.session.get(Student, recipient_id) is None:
+                db.session.add(Student(id=recipient_id, name=name or recipient_id,
+                                       email=f'{recipient_id.lower()}@example.com'))
+            fields['student_id'] = recipient_id
+        fields.setdefault('equipment_id', 1)
+        fields.setdefault('quantity', 1)
+        issue = IssuedEquipment(**fields)
+        db.session.add(issue)
+        db.session.flush()
+        db.session.add_all(ReturnLine(issue_id=issue.id, quantity=quantity, condition=condition)
+                           for condition, quantity in lines)
+        return issue
+    return add
+
+
+@pytest.fixture
+def campus_keeper(app):
+    """Campus 'North' and its approved storekeeper K1 (password keeper123); returns the campus id"""
+    with app.app_context():
+        campus = SatelliteCampus(name='North', code='N1')
+        db.session.add(campus)
+        db.session.flush()
+        db.session.add(StoreKeeper(payroll_number='K1', full_name='Kim Keeper', email='kim@example.com',
+                                   password_hash=generate_password_hash('keeper123'), campus_id=campus.id,
+                                   is_approved=True))
+        db.session.commit()
+        return campus.id
+
+
+@pytest.fixture
+def access_record():
+    """Factory of access log records as the audit sink writes them; keyword arguments override fields"""
+    def record(n, **fields):
+        return dict({
+            'user_id': 1,
+            'user_type': 'admin',
+            'username': 'admin',
+            'full_name': 'admin',
+            'timestamp': datetime.utcnow(),
+            'action': f'Accessed test {n}',
+            'endpoint': 'admin.test',
+            'method': 'GET',
+        }, **fields)
+    return record
@@ -0,0 +1,60 @@
+from extensions import db
+from models import AccessLog, AccessLogDimension
+from Utils.audit_dimensions import compact_existing
+from Utils.audit_integrity import verify_chain
+from Utils.audit_sink import write_access_logs
+from Utils.request_metrics import endpoint_latency_stats
+
+
+# The interned fields a request log carries besides the endpoint
+REQUEST = {'module': 'test', 'user_agent': 'Mozilla/5.0 (X11; Linux x86_64) Firefox/130.0', 'server_hostname': 'web-1'}
+
+
+def test_compact_storage_keeps_the_same_view(app, access_record):
+    app.config['AUDIT_COMPACT_STORAGE'] = True
+    with app.app_context():
+        write_access_logs([access_record(n, **REQUEST) for n in range(4)])
+        write_access_logs([access_record(4, **dict(REQUEST, user_agent='curl/8.0'))])
+
+        # Text columns are empty on disk, values live once in the dimension table
+        raw = db.session.execute(db.select(AccessLog.__table__.c.endpoint, AccessLog.__table__.c.user_agent)).all()
+        assert set(raw) == {(None, None)}
+        assert AccessLogDimension.query.filter_by(kind='user_agent').count() == 2
+        assert AccessLogDimension.query.filter_by(kind='endpoint').count() == 1
+
+        log = AccessLog.query.filter_by(endpoint='admin.test', action='Accessed test 4').one()
+        data = log.to_dict()
+        assert data['user_agent'] == 'curl/8.0'
+        assert (data['endpoint'], data['module'], data['server_hostname']) == ('admin.test', 'test', 'web-1')
+        assert (data['app_name'], data['protocol']) == ('SportEquipmentSystem', 'HTTP')
+        assert list(verify_chain()) == []
+
+
+def test_existing_rows_can_be_compacted(app, access_record):
+    with app.app_context():
+        write_access_logs([access_record(n, **REQUEST) for n in range(3)])
+        before = [log.to_dict() for log in AccessLog.query.order_by(AccessLog.id)]
+
+        assert compact_existing(chunk_size=2) == 3
+        db.session.expire_all()
+        assert db.session.execute(db.select(AccessLog.__table__.c.user_agent)).scalars().all() == [None] * 3
+        assert [log.to_dict() for log in AccessLog.query.order_by(AccessLog.id)] == before
+
+
+def test_endpoint_filters_see_both_forms_without_a_subquery(app, access_record):
+    with app.app_context():
+        app.config['AUDIT_COMPACT_STORAGE'] = True
+        write_access_logs([access_record(n, duration_ms=10 * (n + 1), **REQUEST) for n in range(3)])
+        app.config['AUDIT_COMPACT_STORAGE'] = False
+        write_access_logs([access_record(3, duration_ms=40, **REQUEST)])
+        write_access_logs([access_record(4, endpoint='admin.other', **REQUEST)])
+
+        # The setting being off again changes nothing for compacted rows
+        query = AccessLog.query.filter(AccessLog.endpoint == 'admin.test')
+        assert 'SELECT access_log_dimensions' not in str(query.statement)
+        assert query.count() == 4
+        assert AccessLog.query.filter_by(endpoint='admin.test', action='Accessed test 0').count() == 1
+        assert AccessLog.query.filter(AccessLog.endpoint.in_(['admin.test', 'admin.other'])).count() == 5
+        assert AccessLog.query.filter(AccessLog.endpoint == 'admin.unknown').count() == 0
+        assert AccessLog.query.filter(AccessLog.endpoint.like('admin.t%')).count() == 4
+        assert [(row['endpoint'], row['count']) for row in endpoint_latency_stats()] == [('admin.test', 4)]
@@ -0,0 +1,60 @@
+from datetime import datetime
+
+from models import AccessLog
+from Utils.audit_enrichment import GeoIPResolver, parse_user_agent
+from Utils.audit_sink import write_access_logs
+
+CHROME_WINDOWS = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                  '(KHTML, like Gecko) Chrome/130.0.0.0 Safari/537.36')
+SAFARI_IPHONE = ('Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 '
+                 '(KHTML, like Gecko) Version/17.5 Mobile/15E148 Safari/604.1')
+
+
+class _Reader:
+    """Stands in for a maxminddb reader: a dict of IP -> record."""
+
+    def __init__(self, data):
+        self.data = data
+        self.calls = 0
+
+    def get(self, ip):
+        self.calls += 1
+        return self.data.get(ip)
+
+
+def test_parse_user_agent():
+    assert parse_user_agent(CHROME_WINDOWS) == {'browser': 'Chrome 130', 'os_name': 'Windows 10/11', 'device_type': 'desktop'}
+    assert parse_user_agent(SAFARI_IPHONE) == {'browser': 'Safari 17', 'os_name': 'iOS 17', 'device_type': 'mobile'}
+    assert parse_user_agent('curl/8.4.0')['device_type'] == 'script'
+    assert parse_user_agent('')['browser'] is None
+
+
+def test_geoip_resolver_caches_lookups():
+    reader = _Reader({'41.90.1.1': {'city': {'names': {'en': 'Nairobi'}}, 'country': {'names': {'en': 'Kenya'}}}})
+    resolver = GeoIPResolver(reader)
+    assert resolver.lookup('41.90.1.1') == 'Nairobi, Kenya'
+    assert resolver.lookup('41.90.1.1') == 'Nairobi, Kenya'
+    assert reader.calls == 1
+    assert resolver.lookup('192.168.1.4') == 'Private network'
+    assert resolver.lookup('127.0.0.1') == 'Localhost'
+    assert resolver.lookup('not-an-ip') is None
+
+
+def test_records_are_enriched_when_written(app):
+    with app.app_context():
+        app.extensions['geoip_resolver'] = GeoIPResolver(
+            _Reader({'41.90.1.1': {'country': {'names': {'en': 'Kenya'}}}})
+        )
+        write_access_logs([{
+            'user_id': 1,
+            'user_type': 'admin',
+            'username': 'admin',
+            'timestamp': datetime.utcnow(),
+            'action': 'Accessed admin.dashboard',
+            'endpoint': 'admin.dashboard',
+            'method': 'GET',
+            'ip_address': '41.90.1.1',
+            'user_agent': SAFARI_IPHONE,
+        }])
+        log = AccessLog.query.one().to_dict()
+        assert (log['geolocation'], log['browser'], log['device_type']) == ('Kenya', 'Safari 17', 'mobile')
@@ -0,0 +1,41 @@
+from extensions import db
+from models import AccessLog, AccessLogBatch
+from Utils.audit_integrity import merkle_levels, merkle_root, prove_entry, verify_chain, verify_proof
+from Utils.audit_sink import write_access_logs
+
+
+def test_streaming_root_matches_level_by_level_tree():
+    hashes = [f'{n:064x}' for n in range(1, 12)]
+    for size in range(1, len(hashes) + 1):
+        assert merkle_root(hashes[:size]) == merkle_levels(hashes[:size])[-1][0].hex()
+
+
+def test_batches_are_chained_and_verify(app, access_record):
+    with app.app_context():
+        write_access_logs([access_record(n) for n in range(5)])
+        write_access_logs([access_record(n) for n in range(5, 8)])
+
+        first, second = AccessLogBatch.query.order_by(AccessLogBatch.id).all()
+        assert (first.log_count, second.log_count) == (5, 3)
+        assert second.prev_hash == first.batch_hash
+        assert list(verify_chain()) == []
+
+        for log in AccessLog.query.all():
+            proof = prove_entry(log.id)
+            assert verify_proof(proof)
+            assert len(proof['path']) <= 3
+
+
+def test_verifier_detects_edited_and_deleted_rows(app, access_record):
+    with app.app_context():
+        write_access_logs([access_record(n) for n in range(4)])
+        logs = AccessLog.query.order_by(AccessLog.batch_seq).all()
+
+        logs[1].action = 'Accessed something else'
+        db.session.commit()
+        assert any('contents do not match' in p for p in verify_chain())
+        assert not verify_proof(prove_entry(logs[1].id), log_hash=logs[1].generate_log_hash())
+
+        db.session.delete(logs[1])
+        db.session.commit()
+        assert any('3 of 4 logs present' in p for p in verify_chain())
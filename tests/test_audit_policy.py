@@ -0,0 +1,65 @@
+from datetime import datetime
+
+from models import AccessLog
+from tests.conftest import login
+from Utils.audit_policy import AuditPolicy
+
+
+def _record(endpoint, method='GET', user_id=1):
+    return {
+        'user_id': user_id,
+        'user_type': 'admin',
+        'username': 'admin',
+        'full_name': 'admin',
+        'timestamp': datetime.utcnow(),
+        'action': f'Accessed {endpoint}',
+        'endpoint': endpoint,
+        'method': method,
+        'action_status': 'Success',
+    }
+
+
+def test_policy_rules_and_mutation_override():
+    policy = AuditPolicy(rules={'admin': 'sample', 'admin.api_issues_timeseries': 'coalesce'})
+    assert policy.mode_for(_record('admin.api_issues_timeseries')) == 'coalesce'
+    assert policy.mode_for(_record('admin.dashboard')) == 'sample'
+    assert policy.mode_for(_record('storekeeper.dashboard')) == 'full'
+    # Writes and failures are always kept in full
+    assert policy.mode_for(_record('admin.api_issues_timeseries', method='POST')) == 'full'
+    failed = dict(_record('admin.dashboard'), action_status='Failure')
+    assert policy.mode_for(failed) == 'full'
+
+
+def test_coalesced_hits_collapse_into_one_row_per_window():
+    policy = AuditPolicy(rules={'admin.api_issues_timeseries': 'coalesce'}, coalesce_window=60)
+    for second in range(5):
+        assert policy.admit(_record('admin.api_issues_timeseries'), now=second) == []
+    # Another user gets their own window
+    assert policy.admit(_record('admin.api_issues_timeseries', user_id=2), now=10) == []
+
+    closed = policy.admit(_record('admin.api_issues_timeseries'), now=61)
+    assert [(r['user_id'], r['hit_count'], r['audit_mode']) for r in closed] == [(1, 5, 'coalesced')]
+    assert [r['hit_count'] for r in policy.drain(force=True)] == [1, 1]
+
+
+def test_sampling_keeps_the_configured_fraction():
+    keep_all = AuditPolicy(default='sample', sample_rate=1.0)
+    kept = keep_all.admit(_record('admin.dashboard'))
+    assert [r['audit_mode'] for r in kept] == ['sampled']
+    assert AuditPolicy(default='sample', sample_rate=0.0).admit(_record('admin.dashboard')) == []
+
+
+def test_chart_polls_are_coalesced_by_the_sink(app, client):
+    login(client)
+    for _ in range(3):
+        client.get('/admin/api/issues_timeseries')
+    client.get('/admin/dashboard')
+
+    with app.app_context():
+        assert AccessLog.query.filter_by(endpoint='admin.api_issues_timeseries').count() == 0
+        app.extensions['audit_sink'].close()
+        row = AccessLog.query.filter_by(endpoint='admin.api_issues_timeseries').one()
+        assert row.hit_count == 3
+        assert row.audit_mode == 'coalesced'
+        dashboard = AccessLog.query.filter_by(endpoint='admin.dashboard').all()
+        assert dashboard and {log.audit_mode for log in dashboard} == {'full'}
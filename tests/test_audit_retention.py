@@ -0,0 +1,183 @@
+import gzip
+import json
+from datetime import datetime
+
+from extensions import db
+from models import AccessLog, AccessLogBatch, AccessLogSummary
+from Utils import audit_retention
+from Utils.audit_integrity import verify_chain
+from Utils.audit_retention import ensure_partitions, list_partitions, prune_expired
+from Utils.audit_sink import write_access_logs
+from Utils.audit_summary import rebuild_access_summaries
+
+
+def _log(timestamp, retention_days=365):
+    return {
+        'user_id': 1,
+        'user_type': 'admin',
+        'username': 'admin',
+        'full_name': 'admin',
+        'timestamp': timestamp,
+        'action': f'Accessed at {timestamp:%Y-%m-%d}',
+        'endpoint': 'admin.test',
+        'method': 'GET',
+        'retention_days': retention_days,
+    }
+
+
+def test_prune_drops_only_fully_expired_months(app, tmp_path):
+    now = datetime(2026, 10, 17)
+    with app.app_context():
+        write_access_logs([
+            _log(datetime(2025, 1, 5)),
+            _log(datetime(2025, 1, 20)),
+            # Same month, but one row must be kept for two years
+            _log(datetime(2025, 6, 3)),
+            _log(datetime(2025, 6, 4), retention_days=730),
+            _log(datetime(2026, 10, 1)),
+        ])
+        assert [p.name for p in list_partitions()] == [
+            'access_logs_y2025m01', 'access_logs_y2025m06', 'access_logs_y2026m10'
+        ]
+
+        pruned = prune_expired(archive_dir=str(tmp_path), now=now)
+        assert [p['partition'] for p in pruned] == ['access_logs_y2025m01']
+        assert pruned[0]['rows'] == 2
+
+        remaining = {log.timestamp.month for log in AccessLog.query.all()}
+        assert remaining == {6, 10}
+
+    with gzip.open(pruned[0]['archive'], 'rt', encoding='utf-8') as fh:
+        archived = [json.loads(line) for line in fh]
+    assert [row['action'] for row in archived] == ['Accessed at 2025-01-05', 'Accessed at 2025-01-20']
+
+
+def test_prune_dry_run_keeps_rows(app):
+    with app.app_context():
+        write_access_logs([_log(datetime(2020, 3, 1))])
+        pruned = prune_expired(dry_run=True)
+        assert [p['partition'] for p in pruned] == ['access_logs_y2020m03']
+        assert AccessLog.query.count() == 1
+
+
+def test_chain_verifies_after_pruning_a_month(app):
+    with app.app_context():
+        # One write straddling a month boundary, then a later batch
+        write_access_logs([_log(datetime(2025, 1, 31, 23, 59)), _log(datetime(2025, 2, 1, 0, 1))])
+        write_access_logs([_log(datetime(2025, 1, 31, 23, 59, 30))])
+        write_access_logs([_log(datetime(2026, 2, 10))])
+        assert [batch.log_count for batch in AccessLogBatch.query.order_by(AccessLogBatch.id)] == [1, 1, 1, 1]
+
+        pruned = prune_expired(now=datetime(2026, 2, 15))
+        assert [p['partition'] for p in pruned] == ['access_logs_y2025m01']
+        assert AccessLog.query.count() == 2
+        # Emptied batches keep their place; a prune record sealed after them lists them
+        record = AccessLogBatch.query.order_by(AccessLogBatch.id.desc()).first()
+        assert (record.id, record.log_count, json.loads(record.pruned_batch_ids)) == (5, 0, [1, 3])
+        assert list(verify_chain()) == []
+
+
+def test_pruning_never_covers_logs_deleted_by_hand(app):
+    with app.app_context():
+        write_access_logs([_log(datetime(2025, 1, 10))])
+        write_access_logs([_log(datetime(2026, 2, 10))])
+        AccessLog.query.filter(AccessLog.batch_id == 2).delete()
+        db.session.commit()
+
+        assert [p['partition'] for p in prune_expired(now=datetime(2026, 2, 15))] == ['access_logs_y2025m01']
+        assert list(verify_chain()) == ['batch 2: 0 of 1 logs present']
+
+        # A prune record edited to cover the deleted batch no longer matches its root
+        record = db.session.get(AccessLogBatch, 3)
+        record.pruned_batch_ids = json.dumps([1, 2])
+        db.session.commit()
+        assert list(verify_chain()) == [
+            'batch 1: 0 of 1 logs present',
+            'batch 2: 0 of 1 logs present',
+            'batch 3: prune record does not match the batches it lists',
+        ]
+
+
+
+def test_pruning_takes_dropped_logs_out_of_the_rollup(app, monkeypatch):
+    with app.app_context():
+        write_access_logs([
+            _log(datetime(2025, 1, 5)),
+            _log(datetime(2025, 1, 20)),
+            dict(_log(datetime(2025, 1, 25)), user_id=2, username='sk', user_type='storekeeper'),
+            _log(datetime(2026, 10, 1)),
+        ])
+
+        def rebuild():
+            raise AssertionError('prune rebuilt the whole rollup')
+
+        monkeypatch.setattr('Utils.audit_summary.rebuild_access_summaries', rebuild)
+        assert [p['partition'] for p in prune_expired(now=datetime(2026, 10, 17))] == ['access_logs_y2025m01']
+
+        def rollup():
+            return [(s.user_type, s.user_id, s.log_count, s.first_seen, s.last_seen, s.last_action)
+                    for s in AccessLogSummary.query.order_by(AccessLogSummary.user_type)]
+
+        pruned = rollup()
+        assert pruned == [('admin', 1, 1, datetime(2026, 10, 1), datetime(2026, 10, 1), 'Accessed at 2026-10-01')]
+        monkeypatch.undo()
+        rebuild_access_summaries()
+        assert rollup() == pruned
+
+
+class _Result:
+    def __init__(self, value):
+        self.value = value
+
+    def scalar(self):
+        return self.value
+
+    def scalars(self):
+        return iter(self.value)
+
+
+def test_late_partition_moves_rows_out_of_the_default_partition(app, monkeypatch):
+    """PostgreSQL path, checked on the statements it issues"""
+    statements = []
+
+    def execute(statement, params=None):
+        sql = str(statement)
+        statements.append(sql)
+        # The default partition exists and holds rows of November only
+        stranded = sql.startswith('SELECT 1 FROM access_logs_default') and params['start'].month == 11
+        return _Result(True if 'to_regclass' in sql or stranded else None)
+
+    monkeypatch.setattr(audit_retention, 'is_partitioned', lambda: True)
+    monkeypatch.setattr(audit_retention, 'list_partitions', lambda: [audit_retention.Partition(datetime(2026, 10, 1))])
+    with app.app_context():
+        monkeypatch.setattr(db.session, 'execute', execute)
+        assert ensure_partitions(months_ahead=1, now=datetime(2026, 10, 17)) == ['access_logs_y2026m11']
+
+    assert [sql.split(' WHERE')[0] for sql in statements[2:]] == [
+        'ALTER TABLE access_logs DETACH PARTITION access_logs_default',
+        "CREATE TABLE IF NOT EXISTS access_logs_y2026m11 PARTITION OF access_logs "
+        "FOR VALUES FROM ('2026-11-01') TO ('2026-12-01')",
+        'INSERT INTO access_logs SELECT * FROM access_logs_default',
+        'DELETE FROM access_logs_default',
+        'ALTER TABLE access_logs ATTACH PARTITION access_logs_default DEFAULT',
+    ]
+
+
+def test_months_in_the_default_partition_are_pruned_as_ranges(app, monkeypatch):
+    """PostgreSQL path: months without a child table are listed from the default partition"""
+    def execute(statement, params=None):
+        sql = str(statement)
+        if 'pg_inherits' in sql:
+            return _Result(['access_logs_y2026m10', 'access_logs_default'])
+        if 'date_trunc' in sql:
+            return _Result([datetime(2024, 12, 1)])
+        return _Result(True)
+
+    monkeypatch.setattr(audit_retention, 'is_partitioned', lambda: True)
+    with app.app_context():
+        monkeypatch.setattr(db.session, 'execute', execute)
+        partitions = list_partitions()
+    assert [(p.name, p.start, p.native) for p in partitions] == [
+        ('access_logs_default_y2024m12', datetime(2024, 12, 1), False),
+        ('access_logs_y2026m10', datetime(2026, 10, 1), True),
+    ]
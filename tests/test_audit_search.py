@@ -0,0 +1,26 @@
+from tests.conftest import login
+from Utils.audit_search import search_access_logs
+from Utils.audit_sink import write_access_logs
+
+
+def test_full_text_search_ranks_and_highlights(app, client, access_record):
+    with app.app_context():
+        records = [access_record(n) for n in range(3)]
+        records[1]['ip_address'] = '10.20.30.40'
+        records[1]['user_agent'] = 'Mozilla/5.0 <script>Firefox</script>'
+        write_access_logs(records)
+
+        results, has_next = search_access_logs('firefox 10.20.30.40')
+        assert [r['log'].action for r in results] == ['Accessed test 1']
+        assert not has_next
+        snippet = str(results[0]['snippet'])
+        assert '<mark>Firefox</mark>' in snippet
+        assert '<script>' not in snippet
+
+        # FTS syntax in user input is treated as plain text
+        assert search_access_logs('"test* OR') == ([], False)
+
+    login(client)
+    rv = client.get('/admin/access_logs?q=firefox')
+    assert rv.status_code == 200
+    assert b'<mark>Firefox</mark>' in rv.data
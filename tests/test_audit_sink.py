@@ -0,0 +1,98 @@
+import pytest
+
+from extensions import db
+from models import AccessLog, Student
+from tests.conftest import login
+from Utils import audit_sink
+from Utils.audit_sink import AuditSink, BufferedAuditSink, build_access_record
+from Utils.request_metrics import _finish_request_metrics, _start_request_metrics, attach_audit_record
+
+
+def test_admin_page_view_is_logged(app, client):
+    """With the TESTING sync sink the access log row exists as soon as the request ends"""
+    login(client)
+    client.get('/admin/dashboard')
+
+    with app.app_context():
+        log = AccessLog.query.filter_by(endpoint='admin.dashboard').first()
+        assert log is not None
+        assert log.user_type == 'admin'
+        assert log.server_hostname
+        assert log.log_hash
+
+
+def test_buffered_sink_writes_in_batches_and_flushes_on_close(app, access_record):
+    sink = BufferedAuditSink(app, batch_size=3, flush_interval=60, max_queue=100)
+    for n in range(7):
+        sink.submit(access_record(n))
+
+    # Two full batches are written without waiting for the flush interval
+    sink.flush(timeout=5)
+    sink.close()
+
+    with app.app_context():
+        assert AccessLog.query.filter(AccessLog.endpoint == 'admin.test').count() == 7
+
+
+def test_buffered_sink_drop_policy_counts_dropped_records(app, monkeypatch, access_record):
+    sink = BufferedAuditSink(app, batch_size=100, flush_interval=60, max_queue=1, backpressure='drop')
+    # Keep the writer thread from starting so the queue stays full
+    monkeypatch.setattr(sink, '_ensure_worker', lambda: None)
+    sink.submit(access_record(0))
+    sink.submit(access_record(1))
+    assert sink.dropped == 1
+
+
+def test_buffered_sink_flush_times_out_on_a_full_queue(app, monkeypatch, access_record):
+    sink = BufferedAuditSink(app, batch_size=100, flush_interval=60, max_queue=1, backpressure='drop')
+    # A writer that never drains the queue
+    monkeypatch.setattr(sink, '_ensure_worker', lambda: None)
+    sink._thread = type('Alive', (), {'is_alive': lambda self: True})()
+    sink.submit(access_record(0))
+    sink.flush(timeout=0.1)
+    assert sink._queue.qsize() == 1
+
+
+def test_sink_base_requires_submit_and_one_exit_handler(app, monkeypatch):
+    with pytest.raises(TypeError):
+        AuditSink(app)
+
+    registered = []
+    monkeypatch.setattr(audit_sink, '_atexit_registered', False)
+    monkeypatch.setattr(audit_sink.atexit, 'register', registered.append)
+    first = audit_sink.init_app(app)
+    second = audit_sink.init_app(app)
+    assert registered == [audit_sink._close_open_sinks]
+    assert first not in audit_sink._open_sinks and second in audit_sink._open_sinks
+
+
+def test_access_log_records_request_metrics(app, client):
+    login(client)
+    client.get('/admin/reports')
+
+    with app.app_context():
+        log = AccessLog.query.filter_by(endpoint='admin.reports').first()
+        assert log.status_code == 200
+        assert log.duration_ms is not None
+        assert log.data_size_bytes > 0
+        assert log.sql_count > 0
+
+    rv = client.get('/admin/api/endpoint_latency')
+    endpoints = {row['endpoint'] for row in rv.get_json()['endpoints']}
+    assert 'admin.reports' in endpoints
+
+
+@pytest.mark.parametrize('exc', [RuntimeError('handler failed'), None])
+def test_teardown_audit_write_never_commits_request_session(app, exc):
+    with app.test_request_context('/admin/dashboard'):
+        _start_request_metrics()
+        attach_audit_record(build_access_record('admin', 1, 'admin', 'admin'))
+        # Left uncommitted by the handler
+        db.session.add(Student(id='S1', name='Sam', email='sam@example.com', phone='0712345678'))
+        _finish_request_metrics(exc)
+
+    with app.app_context():
+        assert AccessLog.query.count() == 1
+        assert AccessLog.query.one().action_status == ('Failure' if exc else 'Success')
+        assert db.session.get(Student, 'S1') is None
+
@@ -0,0 +1,21 @@
+from models import AccessLog, AccessLogSummary
+from tests.conftest import login
+from Utils.audit_summary import rebuild_access_summaries
+
+
+def test_access_summary_tracks_writes_and_rebuild(app, client):
+    login(client)
+    client.get('/admin/dashboard')
+    client.get('/admin/reports')
+
+    with app.app_context():
+        logged = AccessLog.query.filter_by(user_type='admin').count()
+        summary = AccessLogSummary.query.filter_by(user_type='admin').one()
+        assert summary.log_count == logged
+        assert summary.last_action == 'Accessed admin.reports'
+
+        assert rebuild_access_summaries() == 1
+        assert AccessLogSummary.query.filter_by(user_type='admin').one().log_count == logged
+
+    rv = client.get('/admin/access_logs')
+    assert rv.status_code == 200
@@ -0,0 +1,82 @@
+import csv
+import io
+from datetime import datetime, timedelta
+
+from extensions import db
+from models import BulkClearanceChunk, BulkClearanceJob
+from Utils.bulk_clearance import CSV_HEADER, check_recipients, read_recipient_ids
+from tests.conftest import login
+
+
+def _seed(add_issue):
+    now = datetime.utcnow()
+    add_issue('G1', name='Ada', status='Returned')
+    add_issue('G2', name='Ben', status='Issued', expected_return=now - timedelta(days=3))
+    add_issue('G3', name='Cy', quantity=2, status='Returned', lines=[('Lost', 2)])
+    db.session.commit()
+
+
+def _check(ids, batch_size=2):
+    output = io.StringIO()
+    check_recipients(ids, csv.writer(output), batch_size=batch_size)
+    return list(csv.DictReader(io.StringIO(output.getvalue())))
+
+
+def test_read_recipient_ids():
+    assert read_recipient_ids(['G1', 'G2', '', 'G1', ' G3 ']) == ['G1', 'G2', 'G3']
+    assert read_recipient_ids(['name,Student_ID', 'Ada,G1', 'Ben,G2']) == ['G1', 'G2']
+
+
+def test_check_rows_and_queries_per_batch(app, add_issue, sql_statements):
+    with app.app_context():
+        _seed(add_issue)
+        rows = {row['recipient_id']: row for row in _check(['G1', 'G2', 'G3', 'G9'])}
+        assert (rows['G1']['name'], rows['G1']['status'], rows['G1']['note']) == ('Ada', 'Cleared', '')
+        assert (rows['G2']['status'], rows['G2']['overdue_count']) == ('Overdue', '1')
+        assert rows['G2']['overdue_items'].startswith('Football x1 (due ')
+        assert (rows['G3']['status'], rows['G3']['unresolved_damage_count'], rows['G3']['damaged_items']) == (
+            'Pending', '1', 'Football x2')
+        assert (rows['G9']['status'], rows['G9']['note']) == ('Cleared', 'No such student')
+
+        with sql_statements() as one_batch:
+            _check(['G1', 'G2', 'G3', 'G9'], batch_size=4)
+        with sql_statements() as statements:
+            _check([f'X{i}' for i in range(500)] + ['G1', 'G2', 'G3'], batch_size=1000)
+        assert len(statements) == len(one_batch)
+
+
+class _InlineThread:
+    """Runs the job on start(): the test database is a single connection shared by all threads"""
+
+    def __init__(self, target, args, **kwargs):
+        self.target, self.args = target, args
+
+    def start(self):
+        self.target(*self.args)
+
+
+def test_upload_runs_job_and_streams_csv(app, client, add_issue, monkeypatch):
+    monkeypatch.setattr('Utils.bulk_clearance.threading.Thread', _InlineThread)
+    with app.app_context():
+        _seed(add_issue)
+    login(client)
+    rv = client.post('/admin/clearance/bulk-check', data={
+        'recipient_type': 'student',
+        'csv_file': (io.BytesIO(b'student_id\nG1\nG2\nG3\n'), 'graduands.csv'),
+    }, content_type='multipart/form-data', follow_redirects=True)
+    assert rv.status_code == 200 and b'Checking clearance for 3 recipients' in rv.data
+
+    with app.app_context():
+        job_id = BulkClearanceJob.query.one().id
+    # Progress and result are read from the database, as another worker would
+    rv = client.get(f'/admin/api/clearance/bulk-check/{job_id}')
+    assert (rv.json['state'], rv.json['processed'], rv.json['percent']) == ('done', 3, 100)
+    with app.app_context():
+        assert BulkClearanceChunk.query.filter_by(job_id=job_id).count() == 1
+
+    rv = client.get(f'/admin/clearance/bulk-check/{job_id}/download')
+    assert rv.status_code == 200 and rv.mimetype == 'text/csv'
+    rows = list(csv.reader(io.StringIO(rv.get_data(as_text=True))))
+    assert rows[0] == CSV_HEADER
+    assert [(row[0], row[2]) for row in rows[1:]] == [('G1', 'Cleared'), ('G2', 'Overdue'), ('G3', 'Pending')]
+    assert client.get('/admin/api/clearance/bulk-check/nope').status_code == 404
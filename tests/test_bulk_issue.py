@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+
+from extensions import db
+from models import CampusStock, Equipment, IssuedEquipment, SatelliteCampus, SerialRegistry, StoreKeeper
+from tests.conftest import login
+
+EXPECTED_RETURN = (datetime.utcnow() + timedelta(days=7)).strftime('%Y-%m-%d')
+
+
+def _add_equipment():
+    added = [Equipment(name=name, category='Ball', category_code=code, quantity=quantity, serial_number=f'SN-{code}')
+             for code, name, quantity in (('BB001', 'Basketball', 4), ('NT001', 'Net', 2))]
+    db.session.add_all(added)
+    db.session.commit()
+    return [equipment.id for equipment in added]
+
+
+def _kit(lines, **recipient):
+    return {
+        'person_type': 'staff', 'staff_payroll': 'P1', 'staff_name': 'Captain', 'staff_email': 'cap@example.com',
+        'expected_return': EXPECTED_RETURN, 'lines': lines, **recipient,
+    }
+
+
+def _quantities():
+    db.session.expire_all()
+    return [equipment.quantity for equipment in Equipment.query.order_by(Equipment.id)]
+
+
+def test_admin_bulk_issue_writes_all_lines_at_once(app, client):
+    with app.app_context():
+        basketball, net = _add_equipment()
+    login(client)
+    flushed = []
+
+    def count(session, flush_context):
+        issues = sum(isinstance(obj, IssuedEquipment) for obj in session.new)
+        if issues:
+            flushed.append(issues)
+
+    event.listen(db.session, 'after_flush', count)
+    try:
+        rv = client.post('/admin/api/issue/bulk', json=_kit([
+            {'equipment_id': 1, 'quantity': 2, 'serial_numbers': ['FB-1', 'FB-2']},
+            {'equipment_id': basketball, 'quantity': 3},
+            {'equipment_id': net, 'quantity': 1},
+        ]))
+    finally:
+        event.remove(db.session, 'after_flush', count)
+
+    assert rv.status_code == 201
+    body = rv.get_json()
+    assert len(body['issue_ids']) == 3 and body['recipient_id'] == 'P1'
+    # Every line is inserted by the same flush
+    assert flushed == [3]
+    with app.app_context():
+        assert _quantities() == [3, 1, 1]
+        assert {issue.issued_by for issue in IssuedEquipment.query} == {'admin'}
+        assert {row.serial for row in SerialRegistry.query} == {'FB-1', 'FB-2'}
+
+    receipt = client.get(body['receipt_url'])
+    assert receipt.status_code == 200
+    assert all(name in receipt.data for name in (b'Football', b'Basketball', b'Net'))
+
+
+def test_bulk_issue_reports_every_problem_and_writes_nothing(app, client):
+    with app.app_context():
+        basketball, net = _add_equipment()
+    login(client)
+    assert client.post('/admin/api/issue/bulk', json=_kit([
+        {'equipment_id': 1, 'quantity': 1, 'serial_numbers': ['FB-1']},
+    ])).status_code == 201
+
+    rv = client.post('/admin/api/issue/bulk', json=_kit([
+        {'equipment_id': basketball, 'quantity': 3},
+        {'equipment_id': basketball, 'quantity': 2},
+        {'equipment_id': net, 'quantity': 1, 'serial_numbers': ['FB-1']},
+        {'equipment_id': 999, 'quantity': 1},
+    ], staff_payroll='P2', staff_email='p2@example.com'))
+    assert rv.status_code == 409
+    assert rv.get_json()['errors'] == [
+        'Not enough Basketball available. Available: 4, Requested: 5',
+        'Equipment 999 not found.',
+        'Serial numbers already in use: FB-1',
+    ]
+    with app.app_context():
+        assert _quantities() == [4, 4, 2]
+        assert IssuedEquipment.query.count() == 1
+
+    rv = client.post('/admin/api/issue/bulk', json=_kit([{'equipment_id': 1, 'quantity': 0}]))
+    assert rv.status_code == 400
+
+
+def test_storekeeper_bulk_issue_uses_campus_stock(app, client):
+    with app.app_context():
+        basketball, _ = _add_equipment()
+        campus = SatelliteCampus(name='North', code='N1')
+        db.session.add(campus)
+        db.session.flush()
+        db.session.add(StoreKeeper(payroll_number='K1', full_name='Kim Keeper', email='kim@example.com',
+                                   password_hash=generate_password_hash('keeper123'), campus_id=campus.id,
+                                   is_approved=True))
+        db.session.commit()
+        campus_id = campus.id
+    login(client)
+    for equipment_id in (1, basketball):
+        client.post('/admin/distribute-to-campus', data={
+            'campus_id': str(campus_id), 'category_code': 'FB001', 'category_name': 'Ball',
+            'equipment_id': str(equipment_id), 'quantity': '2',
+        })
+
+    keeper = app.test_client()
+    login(keeper, 'K1', 'keeper123')
+    lines = [{'equipment_id': 1, 'quantity': 2}, {'equipment_id': basketball, 'quantity': 1}]
+    rv = keeper.post('/storekeeper/api/issue/bulk', json=_kit(lines, expected_return=None))
+    assert rv.status_code == 201
+    assert '/storekeeper/issue-receipt/' in rv.get_json()['receipt_url']
+    with app.app_context():
+        assert [(row.equipment_id, row.issued_out) for row in CampusStock.query.order_by(CampusStock.equipment_id)] == [
+            (1, 2), (basketball, 1)]
+
+    rv = keeper.post('/storekeeper/api/issue/bulk', json=_kit(lines, staff_payroll='P2', staff_email='p2@example.com'))
+    assert rv.status_code == 409
+    assert rv.get_json()['errors'] == ['Not enough Football available. Available: 0, Requested: 2']
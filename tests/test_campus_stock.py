@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+
+from extensions import db
+from models import CampusStock, IssuedEquipment
+from Utils.campus_stock import rebuild_campus_stock
+from tests.conftest import login
+
+
+def _stock(campus_id):
+    db.session.expire_all()
+    row = db.session.get(CampusStock, (campus_id, 1))
+    return row.distributed, row.issued_out, row.returned_good, row.damaged, row.lost
+
+
+def _issue(client, quantity):
+    return client.post('/storekeeper/issue', data={
+        'person_type': 'staff',
+        'staff_payroll': 'P1',
+        'staff_name': 'Pat',
+        'staff_email': 'pat@example.com',
+        'equipment_id': '1',
+        'quantity': str(quantity),
+        'expected_return': (datetime.utcnow() + timedelta(days=7)).strftime('%Y-%m-%d'),
+    }, follow_redirects=True)
+
+
+def test_distribution_issue_and_return_update_ledger(app, client, campus_keeper, sql_statements):
+    campus_id = campus_keeper
+    login(client)
+    for quantity in (4, 1):
+        rv = client.post('/admin/distribute-to-campus', data={
+            'campus_id': str(campus_id), 'category_code': 'FB001', 'category_name': 'Ball',
+            'equipment_id': '1', 'quantity': str(quantity),
+        }, follow_redirects=True)
+        assert b'Successfully distributed' in rv.data
+    with app.app_context():
+        assert _stock(campus_id) == (5, 0, 0, 0, 0)
+
+    keeper = app.test_client()
+    login(keeper, 'K1', 'keeper123')
+    assert b'Equipment issued successfully' in _issue(keeper, 3).data
+    with app.app_context():
+        assert _stock(campus_id) == (5, 3, 0, 0, 0)
+        issue_id = IssuedEquipment.query.filter_by(staff_payroll='P1').one().id
+    assert b'Not enough items available' in _issue(keeper, 3).data
+
+    keeper.post(f'/storekeeper/return/{issue_id}', data={'condition': 'Good', 'quantity_all': '1'})
+    with app.app_context():
+        assert _stock(campus_id) == (5, 2, 1, 0, 0)
+    keeper.post(f'/storekeeper/return/{issue_id}', data={'condition': 'Damaged', 'quantity_all': '2'})
+    with app.app_context():
+        assert _stock(campus_id) == (5, 0, 1, 2, 0)
+        # The ledger agrees with the records it was built from
+        assert rebuild_campus_stock() == 0
+
+    # Campus pages read the ledger once instead of summing issues per equipment
+    with sql_statements() as statements:
+        rv = keeper.get('/storekeeper/equipment')
+        assert rv.status_code == 200 and b'Football' in rv.data
+        assert keeper.get('/storekeeper/issue').status_code == 200
+    statements = [statement.lower() for statement in statements]
+    assert sum('from campus_stock' in statement for statement in statements) == 2
+    assert not any('campus_distributions' in statement or 'sum(issued_equipment.quantity)' in statement
+                   for statement in statements)
+
+
+def test_rebuild_recomputes_ledger(app, campus_keeper):
+    campus_id = campus_keeper
+    with app.app_context():
+        db.session.add(CampusStock(campus_id=campus_id, equipment_id=1, distributed=9, issued_out=4))
+        db.session.add(IssuedEquipment(staff_payroll='P1', equipment_id=1, quantity=2, status='Issued', issued_by='K1'))
+        db.session.commit()
+        # The issue was added through the session, so the ledger already counts it
+        assert _stock(campus_id) == (9, 6, 0, 0, 0)
+
+        assert rebuild_campus_stock() == 1
+        # Nothing was distributed, so the rebuilt row only has the issue
+        assert _stock(campus_id) == (0, 2, 0, 0, 0)
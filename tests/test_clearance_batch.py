@@ -0,0 +1,103 @@
+import json
+
+from extensions import db
+from models import AccessLog, Clearance, Equipment, IssuedEquipment, ReturnLine
+from Utils.clearance_batch import apply_clearance_action
+from Utils.clearance_integration import get_clearance_status
+from tests.conftest import login
+
+
+def _seed(add_issue, students=5):
+    issue_ids = []
+    for i in range(students):
+        item = add_issue(f'B{i}', name=f'Bea {i}', quantity=3, status='Returned',
+                         lines=[('Damaged', 1), ('Lost', 1), ('Good', 1)])
+        issue_ids.append(item.id)
+    add_issue('PB1', staff=True, name='Bo', status='Issued')
+    equipment = db.session.get(Equipment, 1)
+    equipment.damaged_count, equipment.lost_count = students, students
+    db.session.commit()
+    return issue_ids
+
+
+def test_replaced_restocks_with_statements_independent_of_item_count(app, add_issue, sql_statements):
+    with app.app_context():
+        issue_ids = _seed(add_issue, 6)
+        assert get_clearance_status('B0') == 'Pending'
+
+        with sql_statements() as few:
+            summary = apply_clearance_action('replaced', issue_ids=issue_ids[:2] + [999], actor='admin')
+        assert (summary['applied'], summary['skipped'], summary['recipients']) == (2, 1, 2)
+        assert summary['restocked_units'] == {'Damaged': 2, 'Lost': 2}
+        with sql_statements() as many:
+            summary = apply_clearance_action('replaced', issue_ids=issue_ids[2:], actor='admin')
+        assert summary['applied'] == 4 and len(many) == len(few)
+        db.session.commit()
+
+        equipment = db.session.get(Equipment, 1)
+        assert (equipment.quantity, equipment.damaged_count, equipment.lost_count) == (17, 0, 0)
+        assert ReturnLine.query.filter(ReturnLine.condition != 'Good', ReturnLine.resolution.is_(None)).count() == 0
+        assert json.loads(db.session.get(IssuedEquipment, issue_ids[0]).return_conditions)['action'] == 'replaced'
+        assert [get_clearance_status(f'B{i}') for i in range(6)] == ['Cleared'] * 6
+
+        # Already resolved items are skipped, not resolved twice
+        summary = apply_clearance_action('waiver', issue_ids=issue_ids)
+        assert (summary['applied'], summary['skipped']) == (0, 6)
+
+
+def test_rollback_marks_items_for_review_and_clearance_pending(app, add_issue):
+    with app.app_context():
+        _seed(add_issue, 3)
+        db.session.add(Clearance(student_id='B0', status='Cleared'))
+        db.session.commit()
+
+        summary = apply_clearance_action('rollback', recipient_ids=['B0', 'B1', 'PB1'], note='Recount')
+        db.session.commit()
+        # PB1's only item is still issued, so there is nothing to roll back for them
+        assert (summary['applied'], summary['student_ids'], summary['staff_payrolls']) == (2, ['B0', 'B1'], [])
+        items = IssuedEquipment.query.filter(IssuedEquipment.student_id.in_(['B0', 'B1'])).all()
+        assert {item.damage_clearance_status for item in items} == {'Needs Review'}
+        assert all(item.damage_clearance_notes.endswith('[Admin Rollback] Recount') for item in items)
+        assert {c.student_id: c.status for c in Clearance.query} == {'B0': 'Pending', 'B1': 'Pending'}
+
+
+def test_batch_endpoint_writes_one_audit_entry(app, client, add_issue):
+    with app.app_context():
+        _seed(add_issue, 4)
+    login(client)
+    rv = client.post('/admin/api/clearance/batch', json={'action': 'waiver', 'recipient_ids': ['B0', 'B1', 'B2', 'B3']})
+    assert rv.status_code == 200
+    assert (rv.json['applied'], rv.json['recipients'], rv.json['restocked_units']) == (4, 4, {'Damaged': 0, 'Lost': 0})
+
+    with app.app_context():
+        assert [get_clearance_status(f'B{i}') for i in range(4)] == ['Cleared'] * 4
+        # waivers write nothing back to stock
+        assert db.session.get(Equipment, 1).quantity == 5
+        log = AccessLog.query.filter(AccessLog.action.like('Clearance waiver:%')).one()
+        assert log.action == 'Clearance waiver: 4 item(s), 4 recipient(s)'
+        assert json.loads(log.data_changed)['student_ids'] == ['B0', 'B1', 'B2', 'B3']
+
+    assert client.post('/admin/api/clearance/batch', json={'action': 'delete', 'issue_ids': [1]}).status_code == 400
+    assert client.post('/admin/api/clearance/batch', json={'action': 'waiver'}).status_code == 400
+
+
+
+def test_manage_items_audits_every_action_of_the_request(app, client, add_issue):
+    with app.app_context():
+        _seed(add_issue, 1)
+        for _ in range(2):
+            add_issue('B0', status='Returned', lines=[('Damaged', 1)])
+        db.session.commit()
+        issue_ids = [item.id for item in IssuedEquipment.query.filter_by(student_id='B0').order_by(IssuedEquipment.id)]
+    login(client)
+    form = dict(zip((f'action_{issue_id}' for issue_id in issue_ids), ('replaced', 'repaired', 'waiver')))
+    assert client.post('/admin/clearance/B0/items', data=form).status_code == 302
+
+    with app.app_context():
+        assert get_clearance_status('B0') == 'Cleared'
+        log = AccessLog.query.filter(AccessLog.action.like('Clearance %')).one()
+        assert log.action == 'Clearance replaced+repaired+waiver: 3 item(s), 1 recipient(s)'
+        summary = json.loads(log.data_changed)
+        assert summary['actions'] == {'replaced': 1, 'repaired': 1, 'waiver': 1}
+        assert summary['issue_ids'] == issue_ids
+        assert summary['restocked_units'] == {'Damaged': 1, 'Lost': 1}
@@ -0,0 +1,134 @@
+import pytest
+from app import create_app
+from extensions import db
+from models import Equipment, IssuedEquipment, Student
+from Utils.clearance_cache import ClearanceCache, SharedTier
+from Utils.clearance_integration import get_clearance_status
+
+
+class _Store:
+    """Just enough of the Redis client API for SharedTier, shared by the caches of two 'processes'."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return False
+        self.data[key] = str(value).encode()
+        return True
+
+    def incr(self, key):
+        self.data[key] = str(int(self.data.get(key, 0)) + 1).encode()
+
+    def pipeline(self, transaction=True):
+        return _Pipeline(self)
+
+
+class _Pipeline:
+    def __init__(self, store):
+        self.store, self.calls = store, []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+    def execute(self):
+        return [getattr(self.store, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+
+@pytest.fixture
+def cached_app():
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:'})
+    store = _Store()
+    app.extensions['clearance_cache'] = ClearanceCache(SharedTier(store), shared=SharedTier(store))
+    with app.app_context():
+        db.create_all()
+        db.session.add(Equipment(name='Football', category='Ball', category_code='FB001', quantity=5, serial_number='SN001'))
+        db.session.add(Student(id='C1', name='Cleo', email='c1@example.com'))
+        db.session.add(IssuedEquipment(student_id='C1', equipment_id=1, quantity=1, status='Issued'))
+        db.session.commit()
+    yield app
+
+
+def _status_and_queries(sql_statements, recipient_id='C1'):
+    with sql_statements() as statements:
+        status = get_clearance_status(recipient_id)
+    return status, len(statements)
+
+
+def _return_item():
+    IssuedEquipment.query.filter_by(student_id='C1').one().status = 'Returned'
+    db.session.commit()
+
+
+def test_cache_serves_unchanged_recipients_without_queries(cached_app, sql_statements):
+    with cached_app.app_context():
+        status, queries = _status_and_queries(sql_statements)
+        assert status == 'Pending' and queries > 0
+    with cached_app.app_context():
+        assert _status_and_queries(sql_statements) == ('Pending', 0)
+
+        # A committed return bumps the recipient's version
+        _return_item()
+        status, queries = _status_and_queries(sql_statements)
+        assert status == 'Cleared' and queries > 0
+        assert _status_and_queries(sql_statements) == ('Cleared', 0)
+
+
+def test_uncommitted_changes_are_not_cached(cached_app, sql_statements):
+    with cached_app.app_context():
+        IssuedEquipment.query.filter_by(student_id='C1').one().status = 'Returned'
+        db.session.flush()
+        db.session.rollback()
+        status, queries = _status_and_queries(sql_statements)
+        assert status == 'Pending' and queries > 0
+
+        db.session.add(IssuedEquipment(student_id='C2', equipment_id=1, quantity=1, status='Issued'))
+        assert get_clearance_status('C2') == 'Pending'
+        db.session.rollback()
+        assert get_clearance_status('C2') == 'Cleared'
+
+
+def test_request_memo_without_cross_request_cache(app, sql_statements):
+    with app.test_request_context():
+        db.session.add(IssuedEquipment(student_id='C3', equipment_id=1, quantity=1, status='Issued'))
+        db.session.commit()
+        status, queries = _status_and_queries(sql_statements, 'C3')
+        assert status == 'Pending' and queries > 0
+        assert _status_and_queries(sql_statements, 'C3') == ('Pending', 0)
+
+        # A commit in the same request drops the memo for the recipients it changed
+        IssuedEquipment.query.filter_by(student_id='C3').one().status = 'Returned'
+        db.session.commit()
+        assert get_clearance_status('C3') == 'Cleared'
+    with app.test_request_context():
+        assert _status_and_queries(sql_statements, 'C3')[1] > 0
+
+
+def test_shared_tier_invalidates_other_processes(cached_app, sql_statements):
+    store = _Store()
+    first = ClearanceCache(SharedTier(store), shared=SharedTier(store))
+    second = ClearanceCache(SharedTier(store), shared=SharedTier(store))
+    with cached_app.app_context():
+        cached_app.extensions['clearance_cache'] = first
+        assert _status_and_queries(sql_statements)[0] == 'Pending'
+        cached_app.extensions['clearance_cache'] = second
+        assert _status_and_queries(sql_statements) == ('Pending', 0)
+
+        # The write happens in the first process; the second sees the new version
+        cached_app.extensions['clearance_cache'] = first
+        _return_item()
+        cached_app.extensions['clearance_cache'] = second
+        status, queries = _status_and_queries(sql_statements)
+        assert status == 'Cleared' and queries > 0
+
+
+def test_process_local_stamps_are_refused():
+    with pytest.raises(ValueError):
+        create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:', 'CLEARANCE_CACHE': 'local'})
@@ -0,0 +1,111 @@
+import json
+from datetime import datetime, timedelta
+
+from extensions import db
+from models import IssuedEquipment, RecipientClearance, Student
+from Utils.clearance_integration import compute_clearance, get_clearance_status
+from Utils.clearance_projection import mark_recipients, rebuild_projection, refresh_overdue
+from Utils.return_lines import resolve_damage
+from tests.conftest import login
+
+
+def _row(recipient_id, recipient_type='student'):
+    db.session.expire_all()
+    return db.session.get(RecipientClearance, (recipient_type, recipient_id))
+
+
+def test_issue_and_return_update_projection(app, client):
+    login(client)
+    rv = client.post('/admin/issue', data={
+        'person_type': 'student',
+        'student_id': 'S700',
+        'student_name': 'Grace',
+        'student_email': 'grace@example.com',
+        'student_phone': '0712345678',
+        'equipment_id': '1',
+        'quantity': '1',
+        'expected_return': (datetime.utcnow() + timedelta(days=7)).strftime('%Y-%m-%d'),
+    }, follow_redirects=True)
+    assert b'Equipment issued successfully' in rv.data
+
+    with app.app_context():
+        row = _row('S700')
+        assert (row.status, row.item_count, row.outstanding_count, row.overdue_count) == ('Pending', 1, 1, 0)
+        assert row.next_due is not None
+        issue_id = IssuedEquipment.query.filter_by(student_id='S700').first().id
+
+    rv = client.post(f'/admin/return/{issue_id}', data={'condition': 'Damaged'}, follow_redirects=True)
+    assert b'returned successfully' in rv.data
+    with app.app_context():
+        row = _row('S700')
+        assert (row.status, row.outstanding_count, row.unresolved_damage_count) == ('Pending', 0, 1)
+        assert row.next_due is None
+
+        # Clearance action: damage handled
+        item = db.session.get(IssuedEquipment, issue_id)
+        resolve_damage(item, 'repaired')
+        item.return_conditions = json.dumps({'action': 'repaired'})
+        db.session.commit()
+        row = _row('S700')
+        assert (row.status, row.unresolved_damage_count) == ('Cleared', 0)
+
+
+def test_rolled_back_transaction_leaves_projection_alone(app):
+    with app.app_context():
+        db.session.add(Student(id='S701', name='Hal', email='hal@example.com'))
+        db.session.commit()
+        db.session.add(IssuedEquipment(student_id='S701', equipment_id=1, quantity=1))
+        db.session.flush()
+        db.session.rollback()
+        assert _row('S701') is None
+
+        db.session.add(IssuedEquipment(student_id='S701', equipment_id=1, quantity=1))
+        db.session.commit()
+        assert _row('S701').status == 'Pending'
+
+
+def test_overdue_flips_nightly_and_reads_are_current_before(app):
+    with app.app_context():
+        item = IssuedEquipment(student_id='S702', equipment_id=1, quantity=1,
+                               expected_return=datetime.utcnow() + timedelta(days=2))
+        db.session.add(item)
+        db.session.commit()
+        assert _row('S702').status == 'Pending'
+
+        # The due date passes without any write to the recipient's items
+        table = IssuedEquipment.__table__
+        past = datetime.utcnow() - timedelta(days=2)
+        db.session.execute(table.update().where(table.c.id == item.id).values(expected_return=past))
+        db.session.execute(RecipientClearance.__table__.update().values(next_due=past))
+        db.session.commit()
+        assert _row('S702').status == 'Pending'
+        assert get_clearance_status('S702') == 'Overdue'
+
+        assert refresh_overdue() == 1
+        row = _row('S702')
+        assert (row.status, row.overdue_count, row.next_due) == ('Overdue', 1, None)
+        assert refresh_overdue() == 0
+
+
+def test_set_based_updates_and_rebuild(app):
+    with app.app_context():
+        db.session.add_all([
+            IssuedEquipment(student_id='S703', equipment_id=1, quantity=1),
+            IssuedEquipment(staff_payroll='P703', equipment_id=1, quantity=1),
+        ])
+        db.session.commit()
+
+        IssuedEquipment.query.filter_by(student_id='S703').update({'status': 'Returned'})
+        mark_recipients([('student', 'S703')])
+        db.session.commit()
+        assert _row('S703').status == 'Cleared'
+
+        IssuedEquipment.query.filter_by(staff_payroll='P703').update({'status': 'Returned'})
+        db.session.commit()
+        assert _row('P703', 'staff').status == 'Pending'
+        assert rebuild_projection() == 1
+        assert _row('P703', 'staff').status == 'Cleared'
+
+        live = compute_clearance(['S703'])['S703']
+        row = _row('S703')
+        assert all(getattr(row, field) == value for field, value in live.items())
@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta
+
+from extensions import db
+from models import IssuedEquipment, RecipientClearance, ReturnLine
+from Utils.clearance_report import load_clearance_page, status_counts
+from tests.conftest import login
+
+
+def _seed(add_issue, students):
+    add_issue('P1', staff=True, name='Pat', status='Returned', issued_by='admin')
+    now = datetime.utcnow()
+    for i in range(students):
+        sid = f'S{i:03d}'
+        # An older issue by admin, then the latest one by the storekeeper
+        add_issue(sid, name=f'Student {i}', status='Returned', issued_by='admin', date_issued=now - timedelta(days=10))
+        add_issue(sid, status='Issued', issued_by='K1', date_issued=now, expected_return=now + timedelta(days=5))
+    db.session.commit()
+
+
+def _filters(**overrides):
+    filters = {'search': None, 'status': None, 'campus_id': None, 'issued_by': None, 'date_from': None, 'date_to': None}
+    filters.update(overrides)
+    return filters
+
+
+def test_report_page_rows_and_fixed_query_count(app, campus_keeper, add_issue, sql_statements):
+    with app.app_context():
+        _seed(add_issue, 30)
+        with sql_statements() as statements:
+            page = load_clearance_page(_filters(), per_page=10)
+        assert len(statements) == 1
+        first = page.items[0]
+        assert (first['recipient_id'], first['name'], first['type'], first['issued_by'], first['campus'], first['status']) == (
+            'P1', 'Pat', 'Staff', 'admin', '', 'Cleared')
+        assert [row['recipient_id'] for row in page.items[1:]] == [f'S{i:03d}' for i in range(9)]
+        student = page.items[8]
+        assert (student['name'], student['issued_by'], student['campus'], student['status']) == (
+            'Student 7', 'Kim Keeper', 'North', 'Pending')
+        with sql_statements() as statements:
+            counts = status_counts(_filters())
+        assert len(statements) == 1
+        assert counts == {'Cleared': 1, 'Pending': 30, 'Overdue': 0, 'Total': 31}
+
+        # Walk forward to the end, then back one page
+        seen = [row['recipient_id'] for row in page.items]
+        while page.has_next:
+            page = load_clearance_page(_filters(), per_page=10, after=page.next_cursor)
+            seen += [row['recipient_id'] for row in page.items]
+        assert seen == ['P1'] + [f'S{i:03d}' for i in range(30)]
+        assert not page.has_next and page.has_prev
+        back = load_clearance_page(_filters(), per_page=10, before=page.prev_cursor)
+        assert [row['recipient_id'] for row in back.items] == seen[20:30]
+
+
+def test_report_filters_run_in_the_database(app, campus_keeper, add_issue, sql_statements):
+    campus_id = campus_keeper
+    with app.app_context():
+        _seed(add_issue, 12)
+
+        def ids(**overrides):
+            return [row['recipient_id'] for row in load_clearance_page(_filters(**overrides), per_page=100).items]
+
+        assert ids(search='S01') == ['S010', 'S011']
+        assert ids(status='Cleared') == ['P1']
+        assert len(ids(status='Pending')) == 12
+        assert ids(status='Overdue') == []
+        assert ids(issued_by='K1') == [f'S{i:03d}' for i in range(12)]
+        assert ids(campus_id=campus_id) == [f'S{i:03d}' for i in range(12)]
+        assert ids(campus_id=campus_id + 1) == []
+        # Recipients issued equipment 10 days ago: the staff issue and the students' older issues
+        ten_days_ago = (datetime.utcnow() - timedelta(days=10)).date()
+        rows = load_clearance_page(_filters(date_from=ten_days_ago, date_to=ten_days_ago), per_page=100).items
+        assert len(rows) == 12 and all(row['issued_by'] == 'admin' for row in rows if row['type'] == 'Student')
+        assert status_counts(_filters(issued_by='K1', status='Cleared')) == {
+            'Cleared': 0, 'Pending': 12, 'Overdue': 0, 'Total': 12}
+        # Filtered counts semi-join the matching issues instead of a latest-issue probe per recipient
+        with sql_statements() as statements:
+            counts = status_counts(_filters(campus_id=campus_id))
+        assert counts['Total'] == 12
+        assert len(statements) == 1 and 'LIMIT' not in statements[0] and ' IN (SELECT' in statements[0]
+
+        # A passed next_due reads as Overdue before the nightly refresh
+        db.session.execute(RecipientClearance.__table__.update()
+                           .where(RecipientClearance.recipient_id == 'S003')
+                           .values(next_due=datetime.utcnow() - timedelta(days=2)))
+        db.session.commit()
+        assert ids(status='Overdue') == ['S003']
+        assert 'S003' not in ids(status='Pending')
+        assert status_counts(_filters())['Overdue'] == 1
+
+
+def test_report_pages_render(app, client, campus_keeper, add_issue):
+    with app.app_context():
+        _seed(add_issue, 3)
+        issue = IssuedEquipment.query.filter_by(student_id='S000', status='Returned').first()
+        db.session.add(ReturnLine(issue_id=issue.id, quantity=1, condition='Damaged'))
+        db.session.commit()
+        assert db.session.get(IssuedEquipment, issue.id).return_condition == 'Damaged'
+    login(client)
+    rv = client.get('/admin/clearance-report')
+    assert rv.status_code == 200 and b'Student 1' in rv.data
+    rv = client.get('/admin/clearance-report?status=Cleared&issuer=K1&date_from=2000-01-01')
+    assert rv.status_code == 200 and b'No Recipients Found' in rv.data
+    rv = client.get('/admin/api/clearance_report?per_page=2')
+    assert [row['recipient_id'] for row in rv.json['recipients']] == ['P1', 'S000']
+    assert rv.json['counts']['Total'] == 4 and rv.json['prev_cursor'] is None
+    rv = client.get(f"/admin/api/clearance_report?per_page=2&after={rv.json['next_cursor']}")
+    assert [row['recipient_id'] for row in rv.json['recipients']] == ['S001', 'S002']
+    assert rv.json['next_cursor'] is None
+    assert client.get('/admin/api/clearance_report?after=%25%25').status_code == 400
+    assert client.get('/admin/clearance-report/print').status_code == 200
+    rv = client.get('/admin/clearance-report/export')
+    assert rv.status_code == 200 and b'Damaged' in rv.data
+
+
+def test_storekeeper_report_is_limited_to_own_issues(app, client, campus_keeper, add_issue):
+    with app.app_context():
+        _seed(add_issue, 2)
+    login(client, 'K1', 'keeper123')
+    rv = client.get('/storekeeper/clearance-report?issuer=admin')
+    assert rv.status_code == 200
+    assert b'Student 1' in rv.data and b'Pat' not in rv.data
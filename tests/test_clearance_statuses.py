@@ -0,0 +1,94 @@
+import json
+from datetime import datetime, timedelta
+
+from extensions import db
+from models import Student
+from Utils.clearance_integration import compute_clearance, get_clearance_status, get_clearance_statuses
+from tests.conftest import login
+
+# recipient id -> list of (status, days until expected return, return_conditions)
+CASES = {
+    'S-NONE': [],
+    'S-OVERDUE': [('Issued', -3, None), ('Returned', -10, 'Lost')],
+    'S-DUE-TODAY': [('Issued', 0, None)],
+    'S-ISSUED': [('Issued', 5, None)],
+    'S-NULL-STATUS': [(None, 5, None)],
+    'S-GOOD': [('Returned', -10, json.dumps({'condition': 'Good'})), ('Returned', -10, None)],
+    'S-DAMAGED': [('Returned', -10, json.dumps({'condition': 'Damaged'}))],
+    'S-LOST-STRING': [('Returned', -10, json.dumps('lost'))],
+    'S-REPAIRED': [('Returned', -10, json.dumps({'condition': 'Damaged', 'action': 'repaired'}))],
+    'S-REPLACED-FLAG': [('Returned', -10, json.dumps({'condition': 'Lost', 'replaced': True}))],
+    'S-NESTED': [('Returned', -10, json.dumps({'details': {'condition': 'Damaged'}}))],
+    'S-RAW-DAMAGED': [('Returned', -10, 'Damaged')],
+    'S-RAW-WAIVED': [('Returned', -10, 'Lost - waiver granted')],
+    'S-OVERDUE-RETURNED': [('Returned', -10, json.dumps({'condition': 'Good'}))],
+}
+
+EXPECTED = {
+    'S-NONE': 'Cleared',
+    'S-OVERDUE': 'Overdue',
+    'S-DUE-TODAY': 'Pending',
+    'S-ISSUED': 'Pending',
+    'S-NULL-STATUS': 'Pending',
+    'S-GOOD': 'Cleared',
+    'S-DAMAGED': 'Pending',
+    'S-LOST-STRING': 'Pending',
+    'S-REPAIRED': 'Cleared',
+    'S-REPLACED-FLAG': 'Cleared',
+    'S-NESTED': 'Cleared',
+    'S-RAW-DAMAGED': 'Pending',
+    'S-RAW-WAIVED': 'Cleared',
+    'S-OVERDUE-RETURNED': 'Cleared',
+}
+
+
+def _seed(add_issue):
+    now = datetime.utcnow()
+    db.session.add(Student(id='S-NONE', name='S-NONE', email='s-none@example.com'))
+    for sid, items in CASES.items():
+        for status, days, conditions in items:
+            add_issue(sid, status=status, expected_return=now + timedelta(days=days), return_conditions=conditions)
+    add_issue('P-1', staff=True, name='Pat', status='Returned', return_conditions='Damaged')
+    db.session.commit()
+
+
+def test_bulk_statuses_follow_clearance_criteria(app, add_issue):
+    with app.app_context():
+        _seed(add_issue)
+        assert get_clearance_statuses(list(CASES)) == EXPECTED
+        for sid, expected in EXPECTED.items():
+            assert get_clearance_status(sid) == expected
+
+        # None evaluates everyone with equipment on record
+        everyone = get_clearance_statuses()
+        assert 'S-NONE' not in everyone
+        assert everyone == {sid: s for sid, s in EXPECTED.items() if CASES[sid]}
+
+        # Recipient types are kept apart
+        assert get_clearance_statuses(['P-1'], 'staff') == {'P-1': 'Pending'}
+        assert get_clearance_statuses(['P-1']) == {'P-1': 'Cleared'}
+        assert get_clearance_statuses([]) == {}
+
+
+def test_bulk_statuses_use_a_fixed_number_of_queries(app, add_issue, sql_statements):
+    with app.app_context():
+        _seed(add_issue)
+        with sql_statements() as statements:
+            compute_clearance(list(CASES))
+        assert len(statements) == 2
+        # Served from the recipient_clearance projection
+        projected = [sid for sid in CASES if CASES[sid]]
+        with sql_statements() as statements:
+            get_clearance_statuses(projected)
+        assert len(statements) == 1
+
+
+def test_dashboard_and_report_use_bulk_statuses(app, client, add_issue):
+    with app.app_context():
+        _seed(add_issue)
+    login(client)
+    rv = client.get('/admin/dashboard')
+    assert rv.status_code == 200
+    rv = client.get('/admin/clearance-report')
+    assert rv.status_code == 200
+    assert b'S-RAW-DAMAGED' in rv.data
@@ -0,0 +1,158 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.exc import OperationalError
+from werkzeug.security import generate_password_hash
+
+from app import create_app
+from extensions import db
+from models import Admin, CampusDistribution, CampusStock, Equipment, IssuedEquipment, SatelliteCampus, StoreKeeper
+from Utils.campus_stock import rebuild_campus_stock
+from Utils.stock import commit_with_retry
+
+REQUESTS = 200
+
+
+@pytest.fixture
+def file_app(tmp_path):
+    # Threads need their own connections, which an in-memory database can't give them
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'stock.db'}",
+        'SQLALCHEMY_ENGINE_OPTIONS': {'connect_args': {'timeout': 60}, 'pool_size': 20, 'pool_timeout': 120},
+    })
+    with app.app_context():
+        db.create_all()
+        campus = SatelliteCampus(name='North', code='N1')
+        db.session.add_all([
+            Admin(username='admin', email='admin@example.com', password_hash=generate_password_hash('admin123')),
+            Equipment(name='Football', category='Ball', category_code='FB001', quantity=25, serial_number='SN001'),
+            campus,
+        ])
+        db.session.flush()
+        db.session.add(StoreKeeper(payroll_number='K1', full_name='Kim Keeper', email='kim@example.com',
+                                   password_hash=generate_password_hash('keeper123'), campus_id=campus.id,
+                                   is_approved=True))
+        db.session.add(CampusDistribution(campus_id=campus.id, equipment_id=1, category_code='FB001',
+                                          category_name='Ball', quantity=10, distributed_by='admin'))
+        db.session.commit()
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+
+
+def _issue_concurrently(app, user_id, url):
+    """POST ``REQUESTS`` staff issues of one unit at once; returns the redirect targets."""
+    expected_return = (datetime.utcnow() + timedelta(days=7)).strftime('%Y-%m-%d')
+    start = threading.Barrier(REQUESTS)
+    locations = []
+
+    def issue(number):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = user_id
+        start.wait()
+        rv = client.post(url, data={
+            'person_type': 'staff',
+            'staff_payroll': f'P{number}',
+            'staff_name': f'Staff {number}',
+            'staff_email': f'staff{number}@example.com',
+            'equipment_id': '1',
+            'quantity': '1',
+            'expected_return': expected_return,
+        })
+        locations.append((rv.status_code, rv.headers.get('Location', '')))
+
+    threads = [threading.Thread(target=issue, args=(number,)) for number in range(REQUESTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(status == 302 for status, _ in locations)
+    return [location for _, location in locations]
+
+
+def test_concurrent_admin_issues_never_oversell(file_app):
+    locations = _issue_concurrently(file_app, 'admin-1', '/admin/issue')
+
+    assert sum('/issue-receipt/' in location for location in locations) == 25
+    with file_app.app_context():
+        assert IssuedEquipment.query.count() == 25
+        assert db.session.get(Equipment, 1).quantity == 0
+
+
+def test_concurrent_storekeeper_issues_never_oversell(file_app):
+    locations = _issue_concurrently(file_app, 'storekeeper-1', '/storekeeper/issue')
+
+    assert sum('/issue-receipt/' in location for location in locations) == 10
+    with file_app.app_context():
+        assert IssuedEquipment.query.count() == 10
+        stock = db.session.get(CampusStock, (1, 1))
+        assert (stock.distributed, stock.issued_out) == (10, 10)
+        assert rebuild_campus_stock() == 0
+
+
+def test_concurrent_returns_and_issues_keep_stock_exact(file_app):
+    returns = 20
+    with file_app.app_context():
+        issues = [IssuedEquipment(staff_payroll=f'R{number}', equipment_id=1, quantity=1, status='Issued')
+                  for number in range(returns)]
+        db.session.add_all(issues)
+        db.session.get(Equipment, 1).quantity = 25 - returns
+        db.session.commit()
+        issue_ids = [issue.id for issue in issues]
+
+    expected_return = (datetime.utcnow() + timedelta(days=7)).strftime('%Y-%m-%d')
+    start = threading.Barrier(REQUESTS)
+    statuses = []
+
+    def request(number):
+        client = app_client(file_app)
+        start.wait()
+        if number < returns:
+            rv = client.post(f'/admin/return/{issue_ids[number]}', data={'condition': 'Good'})
+        else:
+            rv = client.post('/admin/issue', data={
+                'person_type': 'staff', 'staff_payroll': f'P{number}', 'staff_name': f'Staff {number}',
+                'staff_email': f'staff{number}@example.com', 'equipment_id': '1', 'quantity': '1',
+                'expected_return': expected_return,
+            })
+        statuses.append(rv.status_code)
+
+    threads = [threading.Thread(target=request, args=(number,)) for number in range(REQUESTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(status == 302 for status in statuses)
+
+    with file_app.app_context():
+        outstanding = IssuedEquipment.query.filter_by(status='Issued').count()
+        # A return writing back a stale quantity would leave more units than were ever bought
+        assert db.session.get(Equipment, 1).quantity + outstanding == 25
+        assert IssuedEquipment.query.filter_by(status='Returned').count() == returns
+
+
+def app_client(app, user_id='admin-1'):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = user_id
+    return client
+
+
+def test_commit_with_retry_reruns_on_lock_conflict(app):
+    calls = []
+
+    def work():
+        calls.append(1)
+        db.session.get(Equipment, 1).quantity += 1
+        if len(calls) < 3:
+            raise OperationalError('UPDATE equipment', {}, Exception('database is locked'))
+        return len(calls)
+
+    with app.app_context():
+        assert commit_with_retry(work) == 3
+        db.session.expire_all()
+        # Only the attempt that committed changed anything
+        assert db.session.get(Equipment, 1).quantity == 6
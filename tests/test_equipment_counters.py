@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from extensions import db
+from models import Equipment, IssuedEquipment
+from Utils.equipment_counters import reconcile_counters
+from tests.conftest import login
+
+
+def _counters(equipment_id=1):
+    db.session.expire_all()
+    equipment = db.session.get(Equipment, equipment_id)
+    return equipment.issued_count, equipment.issued_units
+
+
+def test_issue_and_return_keep_counters(app, client):
+    login(client)
+    rv = client.post('/admin/issue', data={
+        'person_type': 'student',
+        'student_id': 'S800',
+        'student_name': 'Hana',
+        'student_email': 'hana@example.com',
+        'student_phone': '0712345678',
+        'equipment_id': '1',
+        'quantity': '2',
+        'expected_return': (datetime.utcnow() + timedelta(days=7)).strftime('%Y-%m-%d'),
+    }, follow_redirects=True)
+    assert b'Equipment issued successfully' in rv.data
+    with app.app_context():
+        assert _counters() == (1, 2)
+        issue_id = IssuedEquipment.query.filter_by(student_id='S800').one().id
+
+    rv = client.post(f'/admin/return/{issue_id}', data={'condition': 'Good'}, follow_redirects=True)
+    assert b'returned successfully' in rv.data
+    with app.app_context():
+        assert _counters() == (0, 0)
+
+
+def test_orm_changes_apply_deltas(app):
+    with app.app_context():
+        db.session.add_all([
+            IssuedEquipment(student_id='S1', equipment_id=1, quantity=3, status='Issued'),
+            IssuedEquipment(student_id='S2', equipment_id=1, quantity=1, status='Issued'),
+            IssuedEquipment(student_id='S3', equipment_id=1, quantity=4, status='Returned'),
+        ])
+        db.session.commit()
+        assert _counters() == (2, 4)
+        assert db.session.get(Equipment, 1).available_quantity == 5 - 2
+
+        # Attributes expired by the commit are set without being read first
+        first, second = IssuedEquipment.query.filter_by(status='Issued').order_by(IssuedEquipment.id).all()
+        db.session.commit()
+        first.quantity = 1
+        second.status = 'Returned'
+        db.session.commit()
+        assert _counters() == (1, 1)
+
+        db.session.delete(db.session.get(IssuedEquipment, first.id))
+        db.session.flush()
+        # Loaded equipment sees the new counts within the transaction
+        assert db.session.get(Equipment, 1).issued_count == 0
+        db.session.rollback()
+        assert _counters() == (1, 1)
+
+
+def test_reconcile_recounts_from_issued_records(app):
+    with app.app_context():
+        db.session.add(IssuedEquipment(student_id='S1', equipment_id=1, quantity=2, status='Issued'))
+        db.session.commit()
+        db.session.execute(text('UPDATE equipment SET issued_count = 7, issued_units = 0'))
+        db.session.commit()
+
+        assert reconcile_counters(fix=False) == [(1, 'Football', (7, 0), (1, 2))]
+        assert _counters() == (7, 0)
+        assert len(reconcile_counters()) == 1
+        assert _counters() == (1, 2)
+        assert reconcile_counters(fix=False) == []
+
+
+def test_inventory_pages_do_not_query_per_equipment(app, client, sql_statements):
+    login(client)
+
+    def page_queries():
+        with sql_statements() as statements:
+            assert client.get('/admin/equipment-report').status_code == 200
+            assert client.get('/admin/api/inventory_top?top=50').status_code == 200
+        return len(statements)
+
+    with app.app_context():
+        db.session.add(IssuedEquipment(student_id='S1', equipment_id=1, quantity=1, status='Issued'))
+        db.session.commit()
+    one = page_queries()
+    with app.app_context():
+        for i in range(10):
+            equipment = Equipment(name=f'Ball {i}', category='Ball', category_code='FB001', quantity=5, serial_number=f'SNX{i}')
+            db.session.add(equipment)
+            db.session.flush()
+            db.session.add(IssuedEquipment(student_id='S1', equipment_id=equipment.id, quantity=1, status='Issued'))
+        db.session.commit()
+    assert page_queries() == one
@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from extensions import db
+from models import Equipment, InventoryMovement, IssuedEquipment, SatelliteCampus
+from Utils.clearance_batch import apply_clearance_action
+from Utils.inventory_ledger import as_of, take_snapshot
+from tests.conftest import login
+
+
+def _movements():
+    return [(m.kind, m.quantity_delta, m.damaged_delta, m.lost_delta)
+            for m in InventoryMovement.query.order_by(InventoryMovement.id)]
+
+
+def _replayed(equipment_id=1):
+    return tuple(int(total) for total in db.session.query(
+        func.sum(InventoryMovement.quantity_delta), func.sum(InventoryMovement.damaged_delta),
+        func.sum(InventoryMovement.lost_delta),
+    ).filter(InventoryMovement.equipment_id == equipment_id).one())
+
+
+def test_stock_changes_are_recorded(app, client):
+    with app.app_context():
+        db.session.add(SatelliteCampus(name='North', code='N1'))
+        db.session.commit()
+    login(client)
+    rv = client.post('/admin/issue', data={
+        'person_type': 'student',
+        'student_id': 'S900',
+        'student_name': 'Ivy',
+        'student_email': 'ivy@example.com',
+        'student_phone': '0712345678',
+        'equipment_id': '1',
+        'quantity': '2',
+        'expected_return': (datetime.utcnow() + timedelta(days=7)).strftime('%Y-%m-%d'),
+    }, follow_redirects=True)
+    assert b'Equipment issued successfully' in rv.data
+    with app.app_context():
+        issue_id = IssuedEquipment.query.filter_by(student_id='S900').one().id
+    client.post(f'/admin/return/{issue_id}', data={'condition': 'Damaged'}, follow_redirects=True)
+    rv = client.post('/admin/distribute-to-campus', data={
+        'campus_id': '1', 'category_code': 'FB001', 'category_name': 'Ball', 'equipment_id': '1', 'quantity': '1',
+    }, follow_redirects=True)
+    assert b'Successfully distributed' in rv.data
+
+    with app.app_context():
+        apply_clearance_action('replaced', issue_ids=[issue_id], actor='admin')
+        db.session.commit()
+
+        assert _movements() == [
+            ('receipt', 5, 0, 0),
+            ('issue', -2, 0, 0),
+            ('return', 0, 2, 0),
+            ('distribution', -1, 0, 0),
+            ('restock', 2, -2, 0),
+        ]
+        issue, returned = InventoryMovement.query.filter(InventoryMovement.kind.in_(('issue', 'return'))).all()
+        assert issue.issue_id == returned.issue_id == issue_id and issue.actor == 'admin'
+        # Replaying the ledger gives what the equipment row holds
+        equipment = db.session.get(Equipment, 1)
+        assert _replayed() == (equipment.quantity, equipment.damaged_count, equipment.lost_count) == (4, 0, 0)
+
+
+def test_as_of_starts_from_latest_snapshot(app, client):
+    with app.app_context():
+        db.session.query(InventoryMovement).update({'occurred_at': datetime(2026, 3, 1, 10)})
+        db.session.get(Equipment, 1).quantity = 8
+        db.session.commit()
+        db.session.query(InventoryMovement).filter(InventoryMovement.quantity_delta == 3).update(
+            {'occurred_at': datetime(2026, 3, 5, 9)})
+        db.session.commit()
+
+        assert as_of(datetime(2026, 2, 1)) == {}
+        assert as_of(datetime(2026, 3, 2)) == {1: {'quantity': 5, 'damaged_count': 0, 'lost_count': 0}}
+        assert as_of(datetime(2026, 3, 6))[1]['quantity'] == 8
+
+        assert take_snapshot(datetime(2026, 3, 3)) == 1
+        assert take_snapshot(datetime(2026, 3, 3)) == 0
+        # Movements before the snapshot are no longer read
+        db.session.query(InventoryMovement).filter(InventoryMovement.occurred_at <= datetime(2026, 3, 3)).delete()
+        db.session.commit()
+        assert as_of(datetime(2026, 3, 4))[1]['quantity'] == 5
+        assert as_of(datetime(2026, 3, 6))[1]['quantity'] == 8
+        assert as_of(datetime(2026, 3, 6), equipment_ids=[2]) == {}
+
+    login(client)
+    rv = client.get('/admin/api/inventory_as_of?date=2026-03-05')
+    assert rv.get_json()['items'] == [
+        {'equipment_id': 1, 'name': 'Football', 'quantity': 8, 'damaged_count': 0, 'lost_count': 0}
+    ]
+    assert client.get('/admin/api/inventory_as_of?date=March').status_code == 400
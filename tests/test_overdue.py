@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+
+from extensions import db
+from models import IssuedEquipment
+from Utils.overdue import due_filter, due_issues
+from tests.conftest import login
+
+
+def _seed(add_issue):
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    add_issue('D1', name='Dee', status='Issued', expected_return=today - timedelta(days=2))
+    add_issue('D1', status='Issued', expected_return=today + timedelta(hours=18))
+    add_issue('D1', status='Issued', expected_return=today + timedelta(days=1))
+    add_issue('D1', status='Returned', expected_return=today - timedelta(days=5))
+    add_issue('D1', status='Issued', expected_return=None)
+    db.session.commit()
+
+
+def test_due_issues_match_date_comparison(app, add_issue):
+    with app.app_context():
+        _seed(add_issue)
+        today = datetime.now().date()
+        legacy = IssuedEquipment.query.filter(
+            IssuedEquipment.status == 'Issued',
+            IssuedEquipment.expected_return != None,
+            db.func.date(IssuedEquipment.expected_return) <= today
+        ).order_by(IssuedEquipment.expected_return.asc()).all()
+        due = due_issues().all()
+        assert len(due) == 2 and due == legacy
+        assert due[0].student.name == 'Dee' and due[0].equipment.name == 'Football'
+
+
+def test_due_query_uses_partial_index(app):
+    with app.app_context():
+        compiled = db.select(IssuedEquipment.id).where(due_filter()).compile(db.engine)
+        params = tuple(str(compiled.params[name]) for name in compiled.positiontup)
+        plan = db.session.connection().exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), params).all()
+        assert any('ix_issued_equipment_due' in row[-1] for row in plan)
+
+
+def test_due_pages_render(app, client, add_issue):
+    with app.app_context():
+        _seed(add_issue)
+    login(client)
+    assert client.get('/admin/dashboard').status_code == 200
+    rv = client.get('/admin/clearance-due-details/D1')
+    assert rv.status_code == 200 and b'Dee' in rv.data
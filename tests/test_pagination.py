@@ -0,0 +1,36 @@
+from models import AccessLog
+from tests.conftest import login
+from Utils.audit_sink import write_access_logs
+
+
+def test_audit_log_api_cursor_pagination(app, client, access_record):
+    with app.app_context():
+        write_access_logs([access_record(n) for n in range(5)])
+        expected = [log.id for log in AccessLog.query.filter_by(endpoint='admin.test')
+                    .order_by(AccessLog.timestamp.desc(), AccessLog.id.desc())]
+
+    login(client)
+    seen = []
+    cursor = None
+    while True:
+        params = {'user_id': 1, 'action': 'Accessed test', 'limit': 2}
+        if cursor:
+            params['cursor'] = cursor
+        data = client.get('/admin/api/audit_logs', query_string=params).get_json()
+        seen.extend(log['id'] for log in data['logs'])
+        cursor = data['next_cursor']
+        if not cursor:
+            break
+
+    assert seen == expected
+    assert client.get('/admin/api/audit_logs?cursor=bogus').status_code == 400
+
+
+def test_per_user_access_log_view_pages_by_cursor(app, client):
+    login(client)
+    for _ in range(3):
+        client.get('/admin/dashboard')
+
+    rv = client.get('/admin/access_logs?user_id=1&user_type=admin&per_page=2')
+    assert rv.status_code == 200
+    assert b'after=' in rv.data
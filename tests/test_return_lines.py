@@ -0,0 +1,88 @@
+import json
+
+from extensions import db
+from models import IssuedEquipment, RecipientClearance, ReturnLine
+from Utils.clearance_integration import get_clearance_status
+from Utils.return_lines import backfill_return_lines, parse_return_conditions
+from tests.conftest import login
+
+
+def test_parse_return_conditions_shapes():
+    assert parse_return_conditions(json.dumps({'SN1': 'Good', 'SN2': 'damaged'})) == (
+        [('SN1', 1, 'Good'), ('SN2', 1, 'Damaged')], None)
+    assert parse_return_conditions(json.dumps({'conditions': {'SN1': 'Lost'}, 'quantities': {'SN1': 2}})) == (
+        [('SN1', 2, 'Lost')], None)
+    assert parse_return_conditions(json.dumps({'all': 'Damaged', 'quantity': 3})) == ([(None, 3, 'Damaged')], None)
+    assert parse_return_conditions(json.dumps({'replaced': True})) == ([], 'replaced')
+    assert parse_return_conditions(json.dumps({'action': 'waiver', 'action_by': 'admin'})) == ([], 'waiver')
+    assert parse_return_conditions('Lost') == ([(None, 1, 'Lost')], None)
+    assert parse_return_conditions('returned with a scratch') == ([], None)
+    assert parse_return_conditions(None) == ([], None)
+
+
+def _issue(client, student_id, quantity):
+    return client.post('/admin/issue', data={
+        'person_type': 'student',
+        'student_id': student_id,
+        'student_name': 'Ivy',
+        'student_email': f'{student_id.lower()}@example.com',
+        'student_phone': '0712345678',
+        'equipment_id': '1',
+        'quantity': str(quantity),
+        'expected_return': '2099-12-01'
+    }, follow_redirects=True)
+
+
+def test_returns_write_lines_and_counts_are_aggregates(app, client):
+    login(client)
+    assert b'Equipment issued successfully' in _issue(client, 'S800', 3).data
+    with app.app_context():
+        issue_id = IssuedEquipment.query.filter_by(student_id='S800').first().id
+
+    client.post(f'/admin/return/{issue_id}', data={'condition': 'Damaged', 'quantity_all': '1'}, follow_redirects=True)
+    client.post(f'/admin/return/{issue_id}', data={'condition': 'Good'}, follow_redirects=True)
+
+    with app.app_context():
+        lines = ReturnLine.query.filter_by(issue_id=issue_id).order_by(ReturnLine.id).all()
+        assert [(l.serial, l.quantity, l.condition, l.resolution) for l in lines] == [
+            (None, 1, 'Damaged', None), (None, 2, 'Good', None)]
+        # The last blob only says Good, but the damaged unit is still outstanding
+        assert json.loads(db.session.get(IssuedEquipment, issue_id).return_conditions)['all'] == 'Good'
+        assert get_clearance_status('S800') == 'Pending'
+
+    rv = client.get('/admin/api/return_conditions')
+    assert dict(zip(rv.json['labels'], rv.json['data'])) == {'Good': 2, 'Damaged': 1, 'Lost': 0}
+    rv = client.get('/admin/issued-equipments-report?condition=Damaged')
+    assert rv.status_code == 200
+
+    rv = client.get('/admin/clearance/S800/items')
+    assert rv.status_code == 200 and b'Damaged' in rv.data
+    rv = client.get('/admin/clearance/S800/manage')
+    assert rv.status_code == 200 and b'replaced_' in rv.data
+    client.post('/admin/clearance/S800/items', data={f'action_{issue_id}': 'repaired'}, follow_redirects=True)
+    with app.app_context():
+        line = ReturnLine.query.filter_by(issue_id=issue_id, condition='Damaged').one()
+        assert line.resolution == 'repaired' and line.resolved_at is not None
+        assert get_clearance_status('S800') == 'Cleared'
+        assert db.session.get(RecipientClearance, ('student', 'S800')).unresolved_damage_count == 0
+
+
+def test_backfill_converts_legacy_conditions(app):
+    with app.app_context():
+        legacy = [
+            json.dumps({'SN1': 'Damaged', 'SN2': 'Good'}),
+            json.dumps({'all': 'Lost', 'quantity': 2}),
+            json.dumps({'replaced': True}),
+            'free text',
+        ]
+        for i, raw in enumerate(legacy):
+            db.session.add(IssuedEquipment(student_id=f'S9{i}', equipment_id=1, quantity=1,
+                                           status='Returned', return_conditions=raw))
+        db.session.commit()
+        assert ReturnLine.query.count() == 0
+
+        assert backfill_return_lines(chunk_size=2) == 2
+        assert backfill_return_lines() == 0
+        assert sorted((l.serial, l.quantity, l.condition) for l in ReturnLine.query.filter(ReturnLine.serial.isnot(None))) == [
+            ('SN1', 1, 'Damaged'), ('SN2', 1, 'Good')]
+        assert [get_clearance_status(f'S9{i}') for i in range(4)] == ['Pending', 'Pending', 'Cleared', 'Cleared']
@@ -0,0 +1,73 @@
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from extensions import db
+from models import IssuedEquipment, SerialRegistry
+from Utils.serial_registry import backfill_serial_registry, serials_in_use
+from tests.conftest import login
+
+
+def _issue(client, payroll, serials):
+    return client.post('/admin/issue', data={
+        'person_type': 'staff',
+        'staff_payroll': payroll,
+        'staff_name': 'Pat',
+        'staff_email': 'pat@example.com',
+        'equipment_id': '1',
+        'quantity': str(len(serials)),
+        'serial_numbers': serials,
+        'expected_return': (datetime.utcnow() + timedelta(days=7)).strftime('%Y-%m-%d'),
+    }, follow_redirects=True)
+
+
+def _states():
+    db.session.expire_all()
+    return {row.serial: (row.state, row.current_issue_id) for row in SerialRegistry.query}
+
+
+def test_issue_and_return_maintain_registry(app, client, sql_statements):
+    login(client)
+    assert b'Equipment issued successfully' in _issue(client, 'P1', ['BALL-1', ' BALL-2 ']).data
+    with app.app_context():
+        issue_id = IssuedEquipment.query.filter_by(staff_payroll='P1').one().id
+        assert _states() == {'BALL-1': ('issued', issue_id), 'BALL-2': ('issued', issue_id)}
+
+    with sql_statements() as statements:
+        rv = _issue(client, 'P2', ['BALL-3', 'BALL-2'])
+    statements = [statement.lower() for statement in statements]
+    assert b'Serial number &#34;BALL-2&#34; is already in use' in rv.data
+    # The check probes the registry instead of reading every issue's serials
+    assert not any('issued_equipment.serial_numbers is not null' in statement for statement in statements)
+
+    client.post(f'/admin/return/{issue_id}', data={'returned_serials': ['BALL-1'], 'condition_BALL-1': 'Damaged'})
+    with app.app_context():
+        assert _states() == {'BALL-1': ('damaged', issue_id), 'BALL-2': ('issued', issue_id)}
+        assert serials_in_use(['BALL-1', 'BALL-3']) == {'BALL-1'}
+
+    rv = client.get('/admin/api/serials/BALL-2')
+    assert rv.get_json()['staff_payroll'] == 'P1' and rv.get_json()['state'] == 'issued'
+    assert client.get('/admin/api/serials/NOPE').status_code == 404
+
+
+def test_backfill_registers_earlier_issues(app):
+    with app.app_context():
+        # Issues written with raw SQL, as before the registry existed
+        for issue_id, serials, status in ((1, ['A1', 'A2'], 'Returned'), (2, ['B1'], 'Issued'), (3, ['A1'], 'Issued')):
+            db.session.execute(text(
+                "INSERT INTO issued_equipment (id, staff_payroll, equipment_id, quantity, status, serial_numbers) "
+                "VALUES (:id, 'P1', 1, 1, :status, :serials)"
+            ), {'id': issue_id, 'status': status, 'serials': json.dumps(serials)})
+        db.session.execute(text(
+            "INSERT INTO return_lines (issue_id, serial, quantity, condition) VALUES (1, 'A2', 1, 'Lost')"
+        ))
+        db.session.commit()
+        assert _states() == {}
+
+        progress = []
+        assert backfill_serial_registry(batch_size=2, progress=progress.append) == 4
+        assert progress == [2, 3]
+        # A serial issued twice points at its latest issue
+        assert _states() == {'A1': ('issued', 3), 'A2': ('lost', 1), 'B1': ('issued', 2)}
+        assert backfill_serial_registry() == 0